@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Benchmark the vectorized aspect / drainage colouring against the original
+per-pixel loops
+
+Runs both implementations on a synthetic raster (4000x4000 by default),
+checks that the RGBA output is byte-identical and prints the timings.
+
+Usage:
+    python benchmarks/bench_visualize.py [--size 4000] [--repeat 1]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.terrain import colorize_aspect, colorize_drainage  # noqa: E402
+
+
+def legacy_colorize_aspect(aspect_data, valid_mask):
+    """Per-pixel aspect colouring as shipped before vectorization"""
+    aspect_colors = {
+        'flat': [176, 176, 176],
+        'north': [255, 0, 0],
+        'northeast': [255, 166, 0],
+        'east': [255, 255, 0],
+        'southeast': [0, 255, 0],
+        'south': [0, 255, 255],
+        'southwest': [0, 166, 255],
+        'west': [0, 0, 255],
+        'northwest': [255, 0, 255]
+    }
+
+    rgba = np.zeros((aspect_data.shape[0], aspect_data.shape[1], 4), dtype=np.uint8)
+    for i in range(aspect_data.shape[0]):
+        for j in range(aspect_data.shape[1]):
+            if not valid_mask[i, j]:
+                continue
+
+            aspect_val = aspect_data[i, j]
+            if aspect_val < 0 or aspect_val == -9999:
+                color = aspect_colors['flat']
+            elif aspect_val <= 22.5 or aspect_val >= 337.5:
+                color = aspect_colors['north']
+            elif aspect_val <= 67.5:
+                color = aspect_colors['northeast']
+            elif aspect_val <= 112.5:
+                color = aspect_colors['east']
+            elif aspect_val <= 157.5:
+                color = aspect_colors['southeast']
+            elif aspect_val <= 202.5:
+                color = aspect_colors['south']
+            elif aspect_val <= 247.5:
+                color = aspect_colors['southwest']
+            elif aspect_val <= 292.5:
+                color = aspect_colors['west']
+            else:
+                color = aspect_colors['northwest']
+
+            rgba[i, j, 0] = color[0]
+            rgba[i, j, 1] = color[1]
+            rgba[i, j, 2] = color[2]
+            rgba[i, j, 3] = 255
+
+    rgba[~valid_mask, 3] = 0
+    return rgba
+
+
+def legacy_colorize_drainage(drainage_data):
+    """Per-pixel flow accumulation colouring as shipped before vectorization"""
+    rgba = np.zeros((drainage_data.shape[0], drainage_data.shape[1], 4), dtype=np.uint8)
+    valid_mask = ~np.isnan(drainage_data) & (drainage_data > 0)
+
+    if np.any(valid_mask):
+        log_data = np.log1p(drainage_data[valid_mask])
+        log_min = np.min(log_data)
+        log_max = np.max(log_data)
+
+        if log_max > log_min:
+            normalized = (log_data - log_min) / (log_max - log_min)
+            normalized_full = np.zeros_like(drainage_data, dtype=np.float32)
+            normalized_full[valid_mask] = normalized
+
+            for i in range(drainage_data.shape[0]):
+                for j in range(drainage_data.shape[1]):
+                    if valid_mask[i, j]:
+                        val = normalized_full[i, j]
+                        rgba[i, j, 0] = int(255 * (1 - val * 0.7))
+                        rgba[i, j, 1] = int(255 * (1 - val * 0.5))
+                        rgba[i, j, 2] = 255
+                        rgba[i, j, 3] = 255
+                    else:
+                        rgba[i, j, 3] = 0
+        else:
+            rgba[valid_mask, 0] = 77
+            rgba[valid_mask, 1] = 128
+            rgba[valid_mask, 2] = 255
+            rgba[valid_mask, 3] = 255
+
+    return rgba
+
+
+def synthetic_rasters(size, seed=42):
+    """
+    Build aspect and flow accumulation rasters with nodata, flat cells and
+    exact class-boundary values
+
+    Args:
+        size: Raster width and height in pixels
+        seed: Random seed
+
+    Returns:
+        tuple: (aspect array, aspect valid mask, drainage array)
+    """
+    rng = np.random.default_rng(seed)
+
+    aspect = rng.uniform(0, 360, (size, size)).astype(np.float32)
+    aspect[rng.random((size, size)) < 0.05] = -1
+    boundaries = np.array([0, 22.5, 67.5, 112.5, 157.5, 202.5, 247.5, 292.5, 337.5, 360], dtype=np.float32)
+    boundary_cells = rng.random((size, size)) < 0.01
+    aspect[boundary_cells] = rng.choice(boundaries, boundary_cells.sum())
+    aspect[rng.random((size, size)) < 0.05] = np.nan
+    valid_mask = ~np.isnan(aspect)
+
+    drainage = rng.lognormal(mean=2.0, sigma=2.5, size=(size, size)).astype(np.float32)
+    drainage[rng.random((size, size)) < 0.05] = 0
+    drainage[rng.random((size, size)) < 0.05] = np.nan
+
+    return aspect, valid_mask, drainage
+
+
+def time_call(func, *args, repeat=1):
+    """Return (best wall time in seconds, last result)"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark aspect/drainage colouring")
+    parser.add_argument('--size', type=int, default=4000, help="Raster width/height in pixels")
+    parser.add_argument('--repeat', type=int, default=1, help="Repetitions (best time is reported)")
+    args = parser.parse_args()
+
+    print(f"🔍 Building {args.size}x{args.size} synthetic rasters...")
+    aspect, valid_mask, drainage = synthetic_rasters(args.size)
+
+    failures = 0
+
+    for name, legacy, vectorized, inputs in (
+        ('aspect', legacy_colorize_aspect, colorize_aspect, (aspect, valid_mask)),
+        ('drainage', legacy_colorize_drainage, lambda data: colorize_drainage(data)[0], (drainage,)),
+    ):
+        legacy_time, legacy_rgba = time_call(legacy, *inputs, repeat=args.repeat)
+        fast_time, fast_rgba = time_call(vectorized, *inputs, repeat=args.repeat)
+        identical = np.array_equal(legacy_rgba, fast_rgba)
+        failures += not identical
+
+        status = "✅" if identical else "❌"
+        print(f"{status} {name}: loop {legacy_time:.2f}s, vectorized {fast_time:.3f}s "
+              f"({legacy_time / fast_time:.0f}x faster), identical output: {identical}")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
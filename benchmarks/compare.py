@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Compare two benchmark result files
+
+Matches results by (benchmark, scale, size) and reports the ratio of the
+best wall times. A benchmark is a regression when it got slower than the
+threshold ratio, or when it succeeded in the baseline and fails now.
+
+Usage:
+    python benchmarks/compare.py baseline.json current.json [--threshold 1.2]
+"""
+
+import sys
+import json
+import argparse
+from typing import Any, Dict, List, Tuple
+
+
+def load_results(path: str) -> Dict[Tuple[str, str, int], Dict[str, Any]]:
+    """
+    Load a result file from run_benchmarks.py
+
+    Returns:
+        dict: (benchmark, scale, size) -> result
+    """
+    with open(path, 'r') as f:
+        document = json.load(f)
+    return {(result['benchmark'], result['scale'], result['size']): result for result in document['results']}
+
+
+def compare_results(baseline: Dict[Tuple[str, str, int], Dict[str, Any]],
+                    current: Dict[Tuple[str, str, int], Dict[str, Any]],
+                    threshold: float = 1.2) -> List[str]:
+    """
+    Print a comparison table and list the regressions
+
+    Args:
+        baseline: Results of the reference run (see load_results)
+        current: Results of the run being checked
+        threshold: Slowdown ratio above which a benchmark regressed
+
+    Returns:
+        list: One description per regression (empty if none)
+    """
+    regressions = []
+    print(f"{'benchmark':<45} {'scale':<6} {'size':>6} {'baseline':>10} {'current':>10} {'ratio':>7}")
+
+    for key in sorted(set(baseline) & set(current), key=lambda k: (k[1], k[2], k[0])):
+        name, scale, size = key
+        before, after = baseline[key], current[key]
+        label = f"{name:<45} {scale:<6} {size:>6}"
+
+        if before['status'] != 'ok' or after['status'] != 'ok':
+            if before['status'] == 'ok':
+                regressions.append(f"{name} [{scale} {size}] now {after['status']}: {after.get('error', '')}")
+                print(f"❌ {label} {'ok':>10} {after['status']:>10}")
+            else:
+                print(f"   {label} {before['status']:>10} {after['status']:>10}")
+            continue
+
+        ratio = after['best_seconds'] / before['best_seconds'] if before['best_seconds'] > 0 else 1.0
+        marker = "⚠️" if ratio > threshold else ("🚀" if ratio < 1 / threshold else "  ")
+        print(f"{marker} {label} {before['best_seconds']:>9.3f}s {after['best_seconds']:>9.3f}s {ratio:>6.2f}x")
+        if ratio > threshold:
+            regressions.append(f"{name} [{scale} {size}] {ratio:.2f}x slower "
+                               f"({before['best_seconds']:.3f}s -> {after['best_seconds']:.3f}s)")
+
+    for key in sorted(set(baseline) - set(current)):
+        print(f"   {key[0]} [{key[1]} {key[2]}] missing from the current run")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument('baseline', help="Result file of the reference run")
+    parser.add_argument('current', help="Result file of the run to check")
+    parser.add_argument('--threshold', type=float, default=1.2, help="Slowdown ratio reported as a regression")
+    args = parser.parse_args()
+
+    regressions = compare_results(load_results(args.baseline), load_results(args.current), args.threshold)
+    if regressions:
+        print(f"\n❌ {len(regressions)} regression(s):")
+        for regression in regressions:
+            print(f"   {regression}")
+        return 1
+
+    print("\n✅ No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
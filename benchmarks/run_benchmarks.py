@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark suite for the terrain pipeline
+
+Generates synthetic DEMs (fractal terrain at SRTM 30 m and LiDAR 2 m ground
+resolution) and polygons, then times every pipeline stage on them:
+DEMProcessor.process_dem_files, the calculate_* derivatives,
+generate_contours, calculate_terrain_statistics, the visualize_* renderers
+and the vector tile server. No database, S3 bucket or network access is
+needed; the derivative and hydrology caches are redirected to the working
+directory and emptied before every run, so each timing is a cold
+computation.
+
+Each run goes through services.instrumentation, so a result carries the
+wall time of every repetition plus the CPU time (of the calling thread),
+peak RSS growth, bytes read and written and the nested stages of the last
+repetition. Results are written as JSON; pass --baseline to compare against
+an earlier run (see compare.py) and exit non-zero on a regression.
+
+The WhiteboxTools-backed stages (tinted hillshade, geomorphons below the
+block threshold, drainage network) need the WhiteboxTools binary, and
+generate_contours the GDAL bindings or command line tools, and
+calculate_water_accumulation GRASS GIS (it writes to
+/app/data/water_accumulation_temp), as in the Docker image; where they are
+missing those benchmarks are reported as failed.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--sizes 256 1024 2048] [--scales srtm lidar]
+        [--repeat 3] [--only slope contours] [--output results.json]
+        [--baseline previous.json] [--threshold 1.2]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import (  # noqa: E402
+    SCALES, fractal_dem, raster_bounds, synthetic_polygon, write_clipped_dem, write_dem_tiles, write_mbtiles
+)
+from benchmarks.compare import compare_results, load_results  # noqa: E402
+from utils.config import TERRAIN_ENGINE, BLOCK_MIN_PIXELS, RENDER_SCALE  # noqa: E402
+from services.instrumentation import recording, stage  # noqa: E402
+from services import hydrology  # noqa: E402
+from services.derivative_cache import derivative_cache  # noqa: E402
+from services.dem_processor import DEMProcessor  # noqa: E402
+from services.analysis_statistics import calculate_terrain_statistics  # noqa: E402
+from services.raster_visualization import visualize_srtm  # noqa: E402
+from services.water_accumulation import calculate_water_accumulation  # noqa: E402
+from services.terrain import (  # noqa: E402
+    calculate_slopes, calculate_aspect, calculate_gradient_derivatives, calculate_hypsometrically_tinted_hillshade,
+    calculate_geomorphons, calculate_drainage_network, generate_contours, visualize_slope, visualize_aspect,
+    visualize_hillshade, visualize_geomorphons, visualize_drainage_network
+)
+
+logger = logging.getLogger(__name__)
+
+# Layout version of the result file
+RESULTS_VERSION = 1
+
+DEFAULT_SIZES = [256, 1024, 2048]
+DEFAULT_RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# Synthetic MBTiles pyramid: zoom levels 0-12, at most 32x32 tiles per level
+TILE_MAX_ZOOM = 12
+TILE_WINDOW = 32
+
+
+def uncached(func: Callable) -> Callable:
+    """The computation behind a @cached_derivative function"""
+    return getattr(func, '__wrapped__', func)
+
+
+def output_path(ctx: Dict[str, Any], name: str) -> str:
+    """Path of a benchmark output inside the current case's folder"""
+    return os.path.join(ctx['folder'], name)
+
+
+def water_accumulation(ctx: Dict[str, Any]) -> Dict[str, Any]:
+    """calculate_water_accumulation, raising the error it reports in its result"""
+    result = calculate_water_accumulation(ctx['dem'])
+    if result.get('error'):
+        raise RuntimeError(result['error'])
+    return result
+
+
+# Benchmarks in run order: (name, required outputs of earlier benchmarks, function).
+# A function returns a truthy value on success, like the services it times.
+DEM_BENCHMARKS = [
+    ('process_dem_files', (), lambda ctx: DEMProcessor().process_dem_files(
+        ctx['tiles'], ctx['polygon'], output_path(ctx, 'process'), ctx['data_source'])),
+    ('calculate_slopes', (), lambda ctx: uncached(calculate_slopes)(ctx['dem'], output_path(ctx, 'slope.tif'))),
+    ('calculate_aspect', (), lambda ctx: uncached(calculate_aspect)(ctx['dem'], output_path(ctx, 'aspect.tif'))),
+    ('calculate_gradient_derivatives', (), lambda ctx: calculate_gradient_derivatives(
+        ctx['dem'], output_path(ctx, 'gradient_slope.tif'), output_path(ctx, 'gradient_aspect.tif'),
+        output_path(ctx, 'gradient_hillshade.tif'))),
+    ('calculate_hypsometrically_tinted_hillshade', (), lambda ctx: uncached(calculate_hypsometrically_tinted_hillshade)(
+        ctx['dem'], output_path(ctx, 'hillshade.tif'))),
+    ('calculate_geomorphons', (), lambda ctx: uncached(calculate_geomorphons)(
+        ctx['dem'], output_path(ctx, 'geomorphons.tif'))),
+    ('calculate_drainage_network', (), lambda ctx: calculate_drainage_network(
+        ctx['dem'], output_path(ctx, 'drainage.tif'))),
+    ('calculate_water_accumulation', (), water_accumulation),
+    ('generate_contours', (), lambda ctx: generate_contours(
+        ctx['dem'], output_path(ctx, 'contours.geojson'), ctx['contour_interval'])),
+    ('calculate_terrain_statistics', ('slope.tif', 'aspect.tif'), lambda ctx: calculate_terrain_statistics(
+        ctx['dem'], output_path(ctx, 'slope.tif'), output_path(ctx, 'aspect.tif'), ctx['bounds'], ctx['data_source'])),
+    ('visualize_srtm', (), lambda ctx: visualize_srtm(ctx['dem'], ctx['polygon'], ctx['render_options'])),
+    ('visualize_slope', ('slope.tif',), lambda ctx: visualize_slope(
+        output_path(ctx, 'slope.tif'), ctx['polygon'], ctx['render_options'])),
+    ('visualize_aspect', ('aspect.tif',), lambda ctx: visualize_aspect(
+        output_path(ctx, 'aspect.tif'), ctx['polygon'], ctx['render_options'])),
+    ('visualize_hillshade', ('hillshade.tif',), lambda ctx: visualize_hillshade(
+        output_path(ctx, 'hillshade.tif'), ctx['polygon'], ctx['render_options'])),
+    ('visualize_geomorphons', ('geomorphons.tif',), lambda ctx: visualize_geomorphons(
+        output_path(ctx, 'geomorphons.tif'), ctx['polygon'], ctx['render_options'])),
+    ('visualize_drainage_network', ('drainage.tif',), lambda ctx: visualize_drainage_network(
+        output_path(ctx, 'drainage.tif'), ctx['polygon'], ctx['render_options'])),
+]
+
+
+def reset_caches(cache_root: str) -> None:
+    """Point the derivative and hydrology caches at an empty directory"""
+    shutil.rmtree(cache_root, ignore_errors=True)
+    os.makedirs(cache_root, exist_ok=True)
+    derivative_cache.cache_dir = os.path.join(cache_root, 'derivative_cache')
+    hydrology.HYDROLOGY_CACHE_DIR = os.path.join(cache_root, 'hydrology_cache')
+
+
+def run_case(name: str, func: Callable, ctx: Dict[str, Any], repeat: int, cache_root: str) -> Dict[str, Any]:
+    """
+    Time one benchmark on one synthetic input
+
+    Args:
+        name: Benchmark name
+        func: Function called with ctx
+        ctx: Inputs of the case (paths, polygon, options)
+        repeat: Number of timed repetitions
+        cache_root: Cache directory emptied before each repetition
+
+    Returns:
+        dict: Result record as stored in the result file
+    """
+    result = {'benchmark': name, 'scale': ctx['scale'], 'size': ctx['size'], 'status': 'ok'}
+    walls = []
+    top = None
+    nested = []
+
+    for _ in range(repeat):
+        reset_caches(cache_root)
+        try:
+            with recording(f"benchmark {name} {ctx['scale']} {ctx['size']}", ctx['data_source']) as recorder:
+                with stage(name):
+                    outcome = func(ctx)
+        except Exception as e:
+            logger.error(f"Benchmark {name} raised: {str(e)}", exc_info=True)
+            result.update(status='error', error=str(e)[:500])
+            break
+
+        if not outcome:
+            result.update(status='failed', error=f"{name} returned {outcome!r}")
+            break
+
+        records = recorder.stages
+        top = next(record for record in records if record['name'] == name and record['parent'] is None)
+        nested = [record for record in records if record is not top]
+        walls.append(top['wall_seconds'])
+
+    if result['status'] != 'ok':
+        return result
+
+    result.update({
+        'wall_seconds': walls,
+        'best_seconds': min(walls),
+        'median_seconds': statistics.median(walls),
+        'cpu_seconds': top['cpu_seconds'],
+        'peak_rss_delta_mb': top.get('peak_rss_delta_mb'),
+        'bytes_read': top.get('bytes_read'),
+        'bytes_written': top.get('bytes_written'),
+        'stages': [
+            {key: record.get(key) for key in ('name', 'parent', 'wall_seconds', 'cpu_seconds') if key in record}
+            for record in nested
+        ]
+    })
+    return result
+
+
+def prepare_case(scale: str, size: int, workdir: str, seed: int, render_options: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Generate the synthetic inputs of one (scale, size) case
+
+    Returns:
+        dict: Benchmark context with 'tiles' (mosaic inputs), 'dem' (clipped
+        float32 DEM), 'polygon', 'bounds' and the output 'folder'
+    """
+    folder = os.path.join(workdir, f"{scale}_{size}")
+    os.makedirs(folder, exist_ok=True)
+
+    dem = fractal_dem(size, scale, seed)
+    bounds = raster_bounds(size, scale)
+    polygon = synthetic_polygon(bounds, seed, polygon_id=f"benchmark_{scale}_{size}")
+
+    return {
+        'scale': scale,
+        'size': size,
+        'data_source': SCALES[scale]['data_source'],
+        'contour_interval': SCALES[scale]['contour_interval'],
+        'folder': folder,
+        'tiles': write_dem_tiles(dem, scale, os.path.join(folder, 'tiles')),
+        'dem': write_clipped_dem(dem, scale, polygon, os.path.join(folder, 'clipped_dem.tif')),
+        'polygon': polygon,
+        'bounds': bounds,
+        'render_options': render_options
+    }
+
+
+def run_tile_server(workdir: str, requests: int, repeat: int, seed: int) -> Dict[str, Any]:
+    """
+    Time tile requests against TileServer on a synthetic MBTiles file
+
+    Four in five requests hit a stored tile; the rest are missing tiles
+    (204). Requests go through the Flask test client, so routing and
+    response building are included.
+
+    Returns:
+        dict: Result record with per-request mean and p95 latency
+    """
+    from flask import Flask
+    from tile_server import TileServer
+
+    result = {'benchmark': 'tile_server', 'scale': 'tiles', 'size': requests, 'status': 'ok'}
+    try:
+        tiles_dir = os.path.join(workdir, 'tiles')
+        coordinates = write_mbtiles(os.path.join(tiles_dir, 'benchmark.mbtiles'), max_zoom=TILE_MAX_ZOOM,
+                                    window=TILE_WINDOW, seed=seed)
+
+        app = Flask('tile_server_benchmark')
+        TileServer(app, base_path=tiles_dir)
+        client = app.test_client()
+
+        rng = np.random.default_rng(seed)
+        urls = []
+        for i in range(requests):
+            if i % 5 == 4:
+                # Outside the stored window of the deepest zoom level
+                z = TILE_MAX_ZOOM
+                x, y = (int(value) for value in rng.integers(TILE_WINDOW, 1 << z, 2))
+            else:
+                z, x, y = coordinates[int(rng.integers(0, len(coordinates)))]
+            urls.append(f"/api/tiles/benchmark/{z}/{x}/{y}.pbf")
+
+        walls = []
+        latencies = []
+        for _ in range(repeat):
+            latencies = []
+            with recording(f"benchmark tile_server {requests}", 'tiles'):
+                with stage('tile_server') as step:
+                    for url in urls:
+                        start = time.perf_counter()
+                        response = client.get(url)
+                        latencies.append(time.perf_counter() - start)
+                        if response.status_code not in (200, 204):
+                            raise RuntimeError(f"{url} answered {response.status_code}")
+                    step.annotate(requests=len(urls))
+            walls.append(sum(latencies))
+
+        latencies.sort()
+        result.update({
+            'wall_seconds': [round(wall, 3) for wall in walls],
+            'best_seconds': round(min(walls), 3),
+            'median_seconds': round(statistics.median(walls), 3),
+            'mean_request_ms': round(1000 * sum(latencies) / len(latencies), 3),
+            'p95_request_ms': round(1000 * latencies[int(0.95 * (len(latencies) - 1))], 3)
+        })
+    except Exception as e:
+        logger.error(f"Tile server benchmark failed: {str(e)}", exc_info=True)
+        result.update(status='error', error=str(e)[:500])
+    return result
+
+
+def git_revision() -> Optional[str]:
+    """Commit of the working tree, if it is a git checkout"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=10,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def selected(name: str, only: Optional[List[str]]) -> bool:
+    """Whether a benchmark matches the --only filters"""
+    return not only or any(pattern in name for pattern in only)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the terrain pipeline")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="DEM widths/heights in pixels (256 to 8192)")
+    parser.add_argument('--scales', nargs='+', choices=list(SCALES), default=list(SCALES),
+                        help="Synthetic sources to benchmark")
+    parser.add_argument('--repeat', type=int, default=3, help="Repetitions per benchmark (best time is compared)")
+    parser.add_argument('--only', nargs='+', help="Run only benchmarks whose name contains one of these")
+    parser.add_argument('--render-scale', type=int, default=None,
+                        help=f"Render scale for visualize_* (default: RENDER_SCALE={RENDER_SCALE})")
+    parser.add_argument('--tile-requests', type=int, default=2000, help="Requests sent to the tile server (0 skips it)")
+    parser.add_argument('--seed', type=int, default=42, help="Seed of the synthetic data")
+    parser.add_argument('--workdir', help="Directory for synthetic inputs and outputs (default: a temporary one)")
+    parser.add_argument('--output', help="Result file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument('--baseline', help="Earlier result file to compare against")
+    parser.add_argument('--threshold', type=float, default=1.2, help="Slowdown ratio reported as a regression")
+    parser.add_argument('--log-level', default='WARNING', help="Log level of the services under test")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(args.log_level.upper())
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='earthbenders-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    cache_root = os.path.join(workdir, 'caches')
+    render_options = {'scale': args.render_scale} if args.render_scale else None
+
+    results = []
+    try:
+        for scale in args.scales:
+            for size in args.sizes:
+                benchmarks = [(name, needs, func) for name, needs, func in DEM_BENCHMARKS if selected(name, args.only)]
+                if not benchmarks:
+                    continue
+
+                print(f"🔍 Generating {scale} DEM {size}x{size}...")
+                ctx = prepare_case(scale, size, workdir, args.seed, render_options)
+
+                for name, needs, func in benchmarks:
+                    missing = [need for need in needs if not os.path.exists(output_path(ctx, need))]
+                    if missing:
+                        result = {'benchmark': name, 'scale': scale, 'size': size, 'status': 'skipped',
+                                  'error': f"missing inputs: {', '.join(missing)}"}
+                    else:
+                        result = run_case(name, func, ctx, args.repeat, cache_root)
+                    results.append(result)
+
+                    if result['status'] == 'ok':
+                        print(f"✅ {name} [{scale} {size}]: best {result['best_seconds']:.3f}s, "
+                              f"median {result['median_seconds']:.3f}s")
+                    else:
+                        print(f"❌ {name} [{scale} {size}]: {result['status']} ({result.get('error', '')})")
+
+        if args.tile_requests > 0 and selected('tile_server', args.only):
+            result = run_tile_server(workdir, args.tile_requests, args.repeat, args.seed)
+            results.append(result)
+            if result['status'] == 'ok':
+                print(f"✅ tile_server [{args.tile_requests} requests]: mean {result['mean_request_ms']:.2f}ms, "
+                      f"p95 {result['p95_request_ms']:.2f}ms")
+            else:
+                print(f"❌ tile_server: {result['status']} ({result.get('error', '')})")
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    document = {
+        'version': RESULTS_VERSION,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'git_revision': git_revision(),
+        'machine': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'cpu_count': os.cpu_count()
+        },
+        'config': {
+            'terrain_engine': TERRAIN_ENGINE,
+            'block_min_pixels': BLOCK_MIN_PIXELS,
+            'render_scale': args.render_scale or RENDER_SCALE,
+            'sizes': args.sizes,
+            'scales': args.scales,
+            'repeat': args.repeat,
+            'seed': args.seed
+        },
+        'results': results
+    }
+
+    output = args.output or os.path.join(DEFAULT_RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(document, f, indent=2)
+    print(f"📝 Results written to {output}")
+
+    if args.baseline:
+        print(f"\n📊 Comparing with {args.baseline}")
+        regressions = compare_results(load_results(args.baseline), load_results(output), args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s):")
+            for regression in regressions:
+                print(f"   {regression}")
+            return 1
+        print("\n✅ No regressions")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,276 @@
+"""
+Synthetic inputs for the offline benchmarks
+
+Fractal terrain written as GeoTIFF tiles at SRTM (30 m) and LiDAR (2 m)
+ground resolution, a clipped DEM as produced by DEMProcessor, star-shaped
+GeoJSON polygons and an MBTiles file for the vector tile server. Everything
+is generated from a seed, so two benchmark runs see identical data.
+"""
+import os
+import math
+import sqlite3
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+# Ground resolution and value range of each synthetic source. Rasters are
+# written in WGS84 like the DEMs handed to DEMProcessor.
+SCALES = {
+    'srtm': {
+        'data_source': 'srtm',
+        'resolution_m': 30,
+        'relief': (50.0, 1500.0),
+        'dtype': 'int16',
+        'nodata': -32768,
+        'contour_interval': 20
+    },
+    'lidar': {
+        'data_source': 'lidar',
+        'resolution_m': 2,
+        'relief': (100.0, 180.0),
+        'dtype': 'float32',
+        'nodata': None,
+        'contour_interval': 1
+    }
+}
+
+# North-west corner of every synthetic raster (central Portugal)
+ORIGIN = (-8.0, 40.5)
+
+METERS_PER_DEGREE = 111320.0
+
+
+def pixel_size(scale: str) -> Tuple[float, float]:
+    """
+    Pixel width and height in degrees for a synthetic source
+
+    Args:
+        scale: Key of SCALES
+
+    Returns:
+        tuple: (degrees per pixel along x, degrees per pixel along y)
+    """
+    resolution = SCALES[scale]['resolution_m']
+    lat = math.radians(ORIGIN[1])
+    return resolution / (METERS_PER_DEGREE * math.cos(lat)), resolution / METERS_PER_DEGREE
+
+
+def _upsample(grid: np.ndarray, size: int) -> np.ndarray:
+    """Bilinear upsampling of a (n+1)x(n+1) control grid to size x size"""
+    cells = grid.shape[0] - 1
+    t = np.linspace(0, cells, size, dtype=np.float32)
+    i0 = np.minimum(t.astype(np.int32), cells - 1)
+    f = (t - i0).astype(np.float32)
+
+    rows = grid[i0, :] * (1 - f)[:, None] + grid[i0 + 1, :] * f[:, None]
+    return rows[:, i0] * (1 - f)[None, :] + rows[:, i0 + 1] * f[None, :]
+
+
+def fractal_dem(size: int, scale: str = 'srtm', seed: int = 42, roughness: float = 0.55) -> np.ndarray:
+    """
+    Fractal terrain (summed octaves of value noise) with a regional tilt
+
+    Each octave doubles the frequency and scales the amplitude by roughness;
+    the tilt gives flow accumulation a dominant direction, like a real slope.
+
+    Args:
+        size: Raster width and height in pixels
+        scale: Key of SCALES, sets the elevation range
+        seed: Random seed
+        roughness: Amplitude ratio between successive octaves (0-1)
+
+    Returns:
+        np.ndarray: float32 elevations of shape (size, size)
+    """
+    rng = np.random.default_rng(seed)
+    surface = np.zeros((size, size), dtype=np.float32)
+
+    amplitude = 1.0
+    octaves = max(1, int(math.log2(size)) - 1)
+    for octave in range(octaves):
+        cells = 2 ** (octave + 1)
+        grid = rng.standard_normal((cells + 1, cells + 1)).astype(np.float32)
+        surface += np.float32(amplitude) * _upsample(grid, size)
+        amplitude *= roughness
+
+    tilt = np.linspace(0.0, 1.0, size, dtype=np.float32)
+    surface += 0.5 * (tilt[:, None] + tilt[None, :])
+
+    low, high = SCALES[scale]['relief']
+    surface -= surface.min()
+    surface *= np.float32((high - low) / max(float(surface.max()), 1e-6))
+    surface += np.float32(low)
+    return surface
+
+
+def raster_bounds(size: int, scale: str) -> Dict[str, float]:
+    """Bounds (west, south, east, north) of a synthetic raster"""
+    px, py = pixel_size(scale)
+    west, north = ORIGIN
+    return {'west': west, 'south': north - size * py, 'east': west + size * px, 'north': north}
+
+
+def write_dem_tiles(dem: np.ndarray, scale: str, folder: str, tiles_per_side: int = 2) -> List[str]:
+    """
+    Write a DEM as a grid of GeoTIFF tiles, in the source's native dtype
+
+    Args:
+        dem: Elevations from fractal_dem
+        scale: Key of SCALES
+        folder: Output directory
+        tiles_per_side: Tiles along each axis (the mosaic step merges them)
+
+    Returns:
+        list: Paths of the written tiles
+    """
+    import rasterio
+    from rasterio.transform import from_origin
+
+    os.makedirs(folder, exist_ok=True)
+    config = SCALES[scale]
+    px, py = pixel_size(scale)
+    west, north = ORIGIN
+    edges = np.linspace(0, dem.shape[0], tiles_per_side + 1).astype(int)
+
+    data = np.round(dem).astype(np.int16) if config['dtype'] == 'int16' else dem.astype(np.float32)
+
+    paths = []
+    for row in range(tiles_per_side):
+        for col in range(tiles_per_side):
+            r0, r1 = edges[row], edges[row + 1]
+            c0, c1 = edges[col], edges[col + 1]
+            path = os.path.join(folder, f"{scale}_{dem.shape[0]}_{row}_{col}.tif")
+            with rasterio.open(
+                path, 'w', driver='GTiff', height=r1 - r0, width=c1 - c0, count=1,
+                dtype=config['dtype'], crs='EPSG:4326', nodata=config['nodata'],
+                transform=from_origin(west + c0 * px, north - r0 * py, px, py)
+            ) as dst:
+                dst.write(data[r0:r1, c0:c1], 1)
+            paths.append(path)
+    return paths
+
+
+def write_clipped_dem(dem: np.ndarray, scale: str, polygon: Dict[str, Any], path: str) -> str:
+    """
+    Write the DEM masked to a polygon, in the layout of DEMProcessor's
+    clipped_dem.tif (float32, NaN nodata, LZW)
+
+    Args:
+        dem: Elevations from fractal_dem
+        scale: Key of SCALES
+        polygon: GeoJSON Feature from synthetic_polygon
+        path: Output GeoTIFF path
+
+    Returns:
+        str: The output path
+    """
+    import rasterio
+    from rasterio.features import geometry_mask
+    from rasterio.transform import from_origin
+
+    px, py = pixel_size(scale)
+    transform = from_origin(ORIGIN[0], ORIGIN[1], px, py)
+    outside = geometry_mask([polygon['geometry']], out_shape=dem.shape, transform=transform, all_touched=True)
+
+    data = dem.astype(np.float32)
+    data[outside] = np.nan
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with rasterio.open(
+        path, 'w', driver='GTiff', height=dem.shape[0], width=dem.shape[1], count=1,
+        dtype='float32', crs='EPSG:4326', nodata=np.nan, transform=transform, compress='lzw'
+    ) as dst:
+        dst.write(data, 1)
+    return path
+
+
+def synthetic_polygon(bounds: Dict[str, float], seed: int = 42, vertices: int = 48,
+                      coverage: float = 0.8, polygon_id: str = 'benchmark') -> Dict[str, Any]:
+    """
+    Irregular star-shaped polygon centred in the given bounds
+
+    Args:
+        bounds: Dict with 'west', 'south', 'east' and 'north'
+        seed: Random seed
+        vertices: Number of vertices of the ring
+        coverage: Maximum radius as a fraction of half the bounds' size
+        polygon_id: Feature id
+
+    Returns:
+        dict: GeoJSON Feature with a Polygon geometry
+    """
+    rng = np.random.default_rng(seed)
+    cx = (bounds['west'] + bounds['east']) / 2
+    cy = (bounds['south'] + bounds['north']) / 2
+    rx = coverage * (bounds['east'] - bounds['west']) / 2
+    ry = coverage * (bounds['north'] - bounds['south']) / 2
+
+    # Smooth the radius noise so the outline wiggles without self-intersecting
+    noise = rng.uniform(0.6, 1.0, vertices)
+    radius = (noise + np.roll(noise, 1) + np.roll(noise, -1)) / 3
+    angles = np.linspace(0, 2 * math.pi, vertices, endpoint=False)
+
+    ring = [[float(cx + rx * r * math.cos(a)), float(cy + ry * r * math.sin(a))] for r, a in zip(radius, angles)]
+    ring.append(ring[0])
+
+    return {
+        'type': 'Feature',
+        'id': polygon_id,
+        'properties': {'id': polygon_id},
+        'geometry': {'type': 'Polygon', 'coordinates': [ring]}
+    }
+
+
+def write_mbtiles(path: str, max_zoom: int = 12, window: int = 32, tile_bytes: int = 8192,
+                  seed: int = 42) -> List[Tuple[int, int, int]]:
+    """
+    Write an MBTiles file with random tile payloads
+
+    Every zoom level holds up to window x window tiles in its north-west
+    corner; payloads are random bytes of about tile_bytes (like compressed
+    vector tiles, they do not compress further).
+
+    Args:
+        path: Output .mbtiles path
+        max_zoom: Highest zoom level
+        window: Maximum tiles per side and zoom level
+        tile_bytes: Average payload size in bytes
+        seed: Random seed
+
+    Returns:
+        list: (z, x, y) XYZ coordinates of the stored tiles
+    """
+    rng = np.random.default_rng(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+        conn.execute("CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)")
+        conn.execute("CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)")
+        conn.executemany("INSERT INTO metadata (name, value) VALUES (?, ?)", [
+            ('name', os.path.splitext(os.path.basename(path))[0]),
+            ('format', 'pbf'),
+            ('minzoom', '0'),
+            ('maxzoom', str(max_zoom)),
+            ('json', '{"vector_layers": [{"id": "benchmark", "fields": {}}]}')
+        ])
+
+        coordinates = []
+        rows = []
+        for z in range(max_zoom + 1):
+            side = min(2 ** z, window)
+            for x in range(side):
+                for y in range(side):
+                    size = int(rng.integers(tile_bytes // 2, tile_bytes * 3 // 2))
+                    # MBTiles stores TMS rows
+                    rows.append((z, x, (1 << z) - 1 - y, rng.bytes(size)))
+                    coordinates.append((z, x, y))
+        conn.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+    return coordinates
@@ -6,6 +6,7 @@ DEM_CONFIG = {
     'srtm': {
         'cache_dir': '/app/data/srtm/',
         'resolution': 30,  # meters
+        'contour_base_interval': 10,  # meters
         'max_file_size': 100 * 1024 * 1024,  # 100MB
         'expected_crs': 'EPSG:4326',
         'description': 'Shuttle Radar Topography Mission - Global 30m resolution'
@@ -13,6 +14,7 @@ DEM_CONFIG = {
     'lidar': {
         'cache_dir': '/app/data/LidarPt/',
         'resolution': 1,  # meters
+        'contour_base_interval': 1,  # meters
         'max_file_size': 500 * 1024 * 1024,  # 500MB
         'expected_crs': 'EPSG:4326',  # After reprojection
         'source_crs': 'EPSG:3763',  # ETRS89/TM06 before reprojection
@@ -21,6 +23,7 @@ DEM_CONFIG = {
     'usgs-dem': {
         'cache_dir': '/app/data/LidarUSA/',
         'resolution': 10,  # meters
+        'contour_base_interval': 5,  # meters
         'max_file_size': 200 * 1024 * 1024,  # 200MB
         'expected_crs': 'EPSG:4326',  # Requested from ArcGIS API in WGS84
         'api_crs_handling': 'request_wgs84',  # API handles reprojection
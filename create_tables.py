@@ -102,12 +102,45 @@ def create_tables():
         """)
         print("✅ Created users table")
         
+        # Create jobs table (persistent background job queue)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id VARCHAR(255) PRIMARY KEY,
+                kind VARCHAR(50) NOT NULL,
+                payload TEXT,
+                status VARCHAR(20) NOT NULL DEFAULT 'QUEUED',
+                message TEXT,
+                progress INTEGER DEFAULT 0,
+                result TEXT,
+                attempts INTEGER DEFAULT 0,
+                max_attempts INTEGER DEFAULT 3,
+                worker_id VARCHAR(255),
+                available_at DOUBLE PRECISION,
+                heartbeat_at DOUBLE PRECISION,
+                created_at DOUBLE PRECISION,
+                updated_at DOUBLE PRECISION,
+                revision INTEGER DEFAULT 0,
+                dedupe_key VARCHAR(64),
+                cancel_requested INTEGER DEFAULT 0,
+                lane VARCHAR(20) DEFAULT 'bulk',
+                profile_id VARCHAR(64)
+            );
+        """)
+        cursor.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS revision INTEGER DEFAULT 0;")
+        cursor.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS dedupe_key VARCHAR(64);")
+        cursor.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS cancel_requested INTEGER DEFAULT 0;")
+        cursor.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS lane VARCHAR(20) DEFAULT 'bulk';")
+        cursor.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS profile_id VARCHAR(64);")
+        print("✅ Created jobs table")
+        
         # Create indexes for better performance
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_polygons_status ON polygons(status);")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_polygons_user_id ON polygons(user_id);")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_polygons_geometry ON polygons USING GIN (geometry);")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_file_storage_polygon_id ON file_storage(polygon_id);")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_file_storage_file_type ON file_storage(file_type);")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_available ON jobs(status, available_at);")
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_dedupe ON jobs(dedupe_key) WHERE status IN ('QUEUED', 'PROGRESS');")
         print("✅ Created database indexes")
         
         # Commit changes
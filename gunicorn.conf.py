@@ -0,0 +1,29 @@
+"""
+Gunicorn settings
+
+Process flags (bind, workers, threads, timeout) stay on the command line in
+the Dockerfile and Procfile; this file sets up the metrics directory the
+workers share so /metrics aggregates all of them.
+"""
+import os
+import shutil
+
+# Must be set before the workers import prometheus_client
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/earthbenders-metrics')
+
+
+def on_starting(server):
+    """Start from an empty metrics directory (samples of a previous run are stale)"""
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+    server.log.info(f"Prometheus multiprocess metrics in {metrics_dir}")
+
+
+def child_exit(server, worker):
+    """Drop the live gauges of a worker that exited"""
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
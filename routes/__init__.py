@@ -10,6 +10,18 @@ def register_all_routes(app):
     Args:
         app: Flask application instance
     """
+    # Run every request in the priority lane it declares
+    from utils.priority import register_request_lanes
+    register_request_lanes(app)
+    
+    # Time every request and serve Prometheus metrics at /metrics
+    from utils.metrics import register_metrics
+    register_metrics(app)
+    
+    # Profile requests sent with X-Profile: 1 and the admin token
+    from utils.profiling import register_profiling
+    register_profiling(app)
+    
     # Register routes from each module
     core.register_routes(app)
     polygon.register_routes(app)
@@ -50,6 +62,54 @@ def register_all_routes(app):
         logger = logging.getLogger(__name__)
         logger.error(f"Failed to register Water Harvesting routes: {e}")
     
+    # Register Hydrology routes (Blueprint)
+    try:
+        from routes.hydrology import hydrology_bp
+        app.register_blueprint(hydrology_bp)
+        import logging
+        logger = logging.getLogger(__name__)
+        logger.info("Hydrology routes registered successfully")
+    except ImportError as e:
+        import logging
+        logger = logging.getLogger(__name__)
+        logger.error(f"Failed to import Hydrology routes: {e}")
+    except Exception as e:
+        import logging
+        logger = logging.getLogger(__name__)
+        logger.error(f"Failed to register Hydrology routes: {e}")
+    
+    # Register batch analysis routes (Blueprint)
+    try:
+        from routes.batch import batch_bp
+        app.register_blueprint(batch_bp)
+        import logging
+        logger = logging.getLogger(__name__)
+        logger.info("Batch routes registered successfully")
+    except ImportError as e:
+        import logging
+        logger = logging.getLogger(__name__)
+        logger.error(f"Failed to import Batch routes: {e}")
+    except Exception as e:
+        import logging
+        logger = logging.getLogger(__name__)
+        logger.error(f"Failed to register Batch routes: {e}")
+    
+    # Register profile admin routes (Blueprint)
+    try:
+        from routes.profiles import profiles_bp
+        app.register_blueprint(profiles_bp)
+        import logging
+        logger = logging.getLogger(__name__)
+        logger.info("Profile admin routes registered successfully")
+    except ImportError as e:
+        import logging
+        logger = logging.getLogger(__name__)
+        logger.error(f"Failed to import Profile admin routes: {e}")
+    except Exception as e:
+        import logging
+        logger = logging.getLogger(__name__)
+        logger.error(f"Failed to register Profile admin routes: {e}")
+    
     # Log registration
     import logging
     logger = logging.getLogger(__name__)
@@ -0,0 +1,125 @@
+"""
+Routes for batch polygon analysis
+"""
+import logging
+from flask import Blueprint, request
+from utils.cors import jsonify_with_cors
+from utils.priority import current_lane
+
+logger = logging.getLogger(__name__)
+
+# Create blueprint
+batch_bp = Blueprint('batch', __name__, url_prefix='/api/batch')
+
+
+@batch_bp.route('/process', methods=['OPTIONS'])
+@batch_bp.route('/<task_id>', methods=['OPTIONS'])
+def batch_options(task_id=None):
+    """Handle CORS preflight requests for batch endpoints"""
+    return jsonify_with_cors({})
+
+
+@batch_bp.route('/process', methods=['POST'])
+def process_batch():
+    """
+    Queue the terrain analysis of every polygon of a FeatureCollection
+
+    Polygons close to each other share one DEM mosaic and one derivative run;
+    outputs are clipped per polygon into its own session folder.
+
+    Expected request body, either a FeatureCollection or:
+    {
+        "data": FeatureCollection,
+        "data_source": "srtm",
+        "user_id": str (optional),
+        "lane": "bulk" | "interactive" (optional)
+    }
+
+    Features are identified by their 'id' (or properties.id).
+    """
+    try:
+        from services.batch_processor import parse_feature_collection, run_batch_analysis, BATCH_DATA_SOURCES
+
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify_with_cors({'error': 'Missing GeoJSON FeatureCollection'}), 400
+
+        collection = data if data.get('type') == 'FeatureCollection' else data.get('data')
+        data_source = data.get('data_source', 'srtm')
+        if data_source not in BATCH_DATA_SOURCES:
+            return jsonify_with_cors({
+                'error': f"Unsupported data source for batches: {data_source} (expected one of: {', '.join(BATCH_DATA_SOURCES)})"
+            }), 400
+
+        try:
+            features = parse_feature_collection(collection)
+        except ValueError as e:
+            return jsonify_with_cors({'error': str(e)}), 400
+
+        task_id = run_batch_analysis(features, data_source, user_id=data.get('user_id'), lane=current_lane())
+
+        return jsonify_with_cors({
+            'status': 'processing',
+            'task_id': task_id,
+            'data_source': data_source,
+            'lane': current_lane(),
+            'feature_ids': [feature['id'] for feature in features],
+            'message': f'Batch of {len(features)} polygons queued. Use /api/batch/<task_id> to check progress.'
+        }), 202
+
+    except Exception as e:
+        logger.error(f"Error queueing batch analysis: {str(e)}", exc_info=True)
+        return jsonify_with_cors({'error': str(e)}), 500
+
+
+@batch_bp.route('/<task_id>', methods=['GET'])
+def get_batch(task_id):
+    """Get the status of a batch, with status, outputs and statistics per feature"""
+    try:
+        from services.batch_processor import get_batch_status
+
+        status = get_batch_status(task_id)
+        if status is None:
+            return jsonify_with_cors({
+                'status': 'not_found',
+                'task_id': task_id,
+                'message': 'Batch not found or expired'
+            }), 404
+
+        summary = {}
+        for feature in status['features']:
+            summary[feature['status']] = summary.get(feature['status'], 0) + 1
+        status['summary'] = summary
+        return jsonify_with_cors(status)
+
+    except Exception as e:
+        logger.error(f"Error getting batch status: {str(e)}", exc_info=True)
+        return jsonify_with_cors({'error': str(e)}), 500
+
+
+@batch_bp.route('/<task_id>', methods=['DELETE'])
+def cancel_batch(task_id):
+    """Cancel a queued or running batch (polygons already completed are kept)"""
+    try:
+        from services.background_processor import cancel_task
+        from services.batch_processor import get_batch_status
+
+        if get_batch_status(task_id) is None:
+            return jsonify_with_cors({
+                'status': 'not_found',
+                'task_id': task_id,
+                'message': 'Batch not found or expired'
+            }), 404
+
+        outcome = cancel_task(task_id)
+        status = get_batch_status(task_id)
+        if outcome == 'cancelling':
+            status['status'] = 'cancelling'
+            return jsonify_with_cors(status), 202
+        if outcome == 'finished':
+            return jsonify_with_cors(status), 409
+        return jsonify_with_cors(status), 200
+
+    except Exception as e:
+        logger.error(f"Error cancelling batch: {str(e)}", exc_info=True)
+        return jsonify_with_cors({'error': str(e)}), 500
@@ -0,0 +1,81 @@
+"""
+Hydrology API Routes
+Provides on-demand watershed delineation from the cached D8 flow pointer
+"""
+from flask import Blueprint, request
+import logging
+import os
+
+from services.watershed import delineate_watershed, DEFAULT_SNAP_CELLS
+from utils.config import SAVE_DIRECTORY
+from utils.cors import jsonify_with_cors
+from scripts.helpers.dem_file_finder import find_dem_file
+
+logger = logging.getLogger(__name__)
+
+# Create blueprint
+hydrology_bp = Blueprint('hydrology', __name__)
+
+@hydrology_bp.route('/api/hydrology/watershed', methods=['POST'])
+def watershed():
+    """
+    Delineate the catchment upslope of a pour point
+
+    Expected JSON payload:
+    {
+        "polygon_id": "unique_polygon_identifier",
+        "lon": -8.61,
+        "lat": 41.15,
+        "snap_cells": 3  // OPTIONAL - snap radius to the highest flow accumulation
+    }
+
+    Returns:
+    {
+        "status": "success",
+        "watershed": { GeoJSON Feature with area_m2, area_hectares, outlet, ... }
+    }
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify_with_cors({'error': 'No JSON data provided'}), 400
+
+        polygon_id = data.get('polygon_id')
+        if not polygon_id or data.get('lon') is None or data.get('lat') is None:
+            return jsonify_with_cors({'error': 'Missing required parameters: polygon_id, lon and lat'}), 400
+
+        try:
+            lon = float(data['lon'])
+            lat = float(data['lat'])
+            snap_cells = int(data.get('snap_cells', DEFAULT_SNAP_CELLS))
+        except (TypeError, ValueError):
+            return jsonify_with_cors({'error': 'lon and lat must be numbers and snap_cells an integer'}), 400
+
+        polygon_session_folder = os.path.join(SAVE_DIRECTORY, "polygon_sessions", polygon_id)
+        if not os.path.exists(polygon_session_folder):
+            return jsonify_with_cors({'error': f'Polygon session folder not found for ID: {polygon_id}'}), 404
+
+        dem_file = find_dem_file(polygon_session_folder, polygon_id)
+        if not dem_file:
+            return jsonify_with_cors({'error': 'DEM file not found. Please process elevation data first.'}), 404
+
+        logger.info(f"🔍 Delineating watershed for polygon {polygon_id} at ({lon}, {lat})")
+        result = delineate_watershed(dem_file, lon, lat, snap_cells=snap_cells)
+
+        if result is None:
+            return jsonify_with_cors({'error': 'Pour point is outside the processed DEM or hydrology is unavailable'}), 422
+
+        return jsonify_with_cors({
+            'status': 'success',
+            'polygon_id': polygon_id,
+            'watershed': result
+        })
+
+    except Exception as e:
+        logger.error(f"Error delineating watershed: {str(e)}", exc_info=True)
+        return jsonify_with_cors({'error': str(e)}), 500
+
+@hydrology_bp.route('/api/hydrology/watershed', methods=['OPTIONS'])
+def watershed_options():
+    """Handle OPTIONS preflight request for CORS"""
+    return jsonify_with_cors({}), 200
@@ -9,6 +9,7 @@ from flask import Blueprint, request, jsonify
 from utils.cors import jsonify_with_cors
 from shapely.geometry import box
 from shapely.geometry import shape as shapely_shape
+from services.instrumentation import recording, current_recorder, stage
 
 logger = logging.getLogger(__name__)
 
@@ -183,82 +184,88 @@ def process_lidar_terrain():
         logger.info(f"🚀 LIDAR ROUTE CALLED - Processing LiDAR terrain for polygon {polygon_id}")
         logger.info(f"📊 LIDAR Request data: polygon type={polygon_geometry.get('type')}")
         
-        # PHASE 1: LIDAR-specific preparation (CRS conversion and clipping)
-        logger.info("PHASE 1: Starting LIDAR data preparation (merge, reproject, clip)")
-        from services.lidar_processor import process_lidar_dem
+        # Stage timings are stored with the analysis
+        with recording(polygon_id, 'lidar'):
+            # PHASE 1: LIDAR-specific preparation (CRS conversion and clipping)
+            logger.info("PHASE 1: Starting LIDAR data preparation (merge, reproject, clip)")
+            from services.lidar_processor import process_lidar_dem
         
-        clipped_lidar_path = process_lidar_dem(polygon_geometry, polygon_id)
+            clipped_lidar_path = process_lidar_dem(polygon_geometry, polygon_id)
         
-        if not clipped_lidar_path:
-            error_response = jsonify_with_cors({
-                'status': 'error',
-                'message': 'LIDAR preparation failed to produce a clipped DEM file'
-            })
-            return error_response, 500
+            if not clipped_lidar_path:
+                error_response = jsonify_with_cors({
+                    'status': 'error',
+                    'message': 'LIDAR preparation failed to produce a clipped DEM file'
+                })
+                return error_response, 500
             
-        logger.info(f"PHASE 1: LIDAR DEM ready at {clipped_lidar_path}. Proceeding to unified analysis.")
+            logger.info(f"PHASE 1: LIDAR DEM ready at {clipped_lidar_path}. Proceeding to unified analysis.")
         
-        # PHASE 2: Unified analysis & visualization (using proven SRTM logic)
-        logger.info("PHASE 2: Starting unified analysis & visualization (using SRTM logic)")
-        from services.dem_processor import process_dem_files
+            # PHASE 2: Unified analysis & visualization (using proven SRTM logic)
+            logger.info("PHASE 2: Starting unified analysis & visualization (using SRTM logic)")
+            from services.dem_processor import process_dem_files
         
-        # Use unified DEM pipeline with LIDAR file
-        results = process_dem_files(
-            [clipped_lidar_path],  # Pass as list to match DEM function signature
-            polygon_geometry,
-            f"/app/data/polygon_sessions/{polygon_id}",
-            'lidar'  # Specify data source
-        )
+            # Use unified DEM pipeline with LIDAR file
+            results = process_dem_files(
+                [clipped_lidar_path],  # Pass as list to match DEM function signature
+                polygon_geometry,
+                f"/app/data/polygon_sessions/{polygon_id}",
+                'lidar'  # Specify data source
+            )
         
-        if not results or not results.get('image'):
-            error_response = jsonify_with_cors({
-                'status': 'error',
-                'message': 'Unified analysis failed to produce a valid visualization overlay'
-            })
-            return error_response, 500
+            if not results or not results.get('image'):
+                error_response = jsonify_with_cors({
+                    'status': 'error',
+                    'message': 'Unified analysis failed to produce a valid visualization overlay'
+                })
+                return error_response, 500
         
-        # PHASE 3: Calculate statistics and save to database
-        logger.info("PHASE 3: Calculating statistics and saving LIDAR analysis results to database")
-        from services.database import DatabaseService
-        from services.analysis_statistics import calculate_terrain_statistics
-        db_service = DatabaseService()
+            # PHASE 3: Calculate statistics and save to database
+            logger.info("PHASE 3: Calculating statistics and saving LIDAR analysis results to database")
+            from services.database import DatabaseService
+            from services.analysis_statistics import calculate_terrain_statistics
+            db_service = DatabaseService()
         
-        # Calculate statistics for LIDAR data
-        logger.info("Calculating LIDAR terrain statistics...")
-        clipped_dem_path = results.get('clipped_dem_path')
-        logger.info(f"LIDAR file path for statistics: {clipped_dem_path}")
-        logger.info(f"LIDAR file exists: {os.path.exists(clipped_dem_path) if clipped_dem_path else 'No path provided'}")
+            # Calculate statistics for LIDAR data
+            logger.info("Calculating LIDAR terrain statistics...")
+            clipped_dem_path = results.get('clipped_dem_path')
+            logger.info(f"LIDAR file path for statistics: {clipped_dem_path}")
+            logger.info(f"LIDAR file exists: {os.path.exists(clipped_dem_path) if clipped_dem_path else 'No path provided'}")
         
-        statistics = calculate_terrain_statistics(
-            dem_path=clipped_dem_path,
-            slope_path=None,  # LIDAR doesn't have slope/aspect files yet
-            aspect_path=None,
-            bounds=results.get('bounds', {}),
-            data_source='lidar'  # Pass data source for appropriate NoData handling
-        )
-        logger.info(f"LIDAR statistics calculated: {statistics}")
+            with stage('statistics'):
+                statistics = calculate_terrain_statistics(
+                    dem_path=clipped_dem_path,
+                    slope_path=None,  # LIDAR doesn't have slope/aspect files yet
+                    aspect_path=None,
+                    bounds=results.get('bounds', {}),
+                    data_source='lidar'  # Pass data source for appropriate NoData handling
+                )
+            logger.info(f"LIDAR statistics calculated: {statistics}")
         
-        analysis_data = {
-            'dem_path': results.get('clipped_dem_path'),
-            'slope_path': None,
-            'aspect_path': None,
-            'bounds': results.get('bounds'),
-            'data_source': 'lidar',
-            # Save all calculated stats under the dedicated statistics field
-            'statistics': statistics
-        }
+            analysis_data = {
+                'dem_path': results.get('clipped_dem_path'),
+                'slope_path': None,
+                'aspect_path': None,
+                'bounds': results.get('bounds'),
+                'data_source': 'lidar',
+                # Save all calculated stats under the dedicated statistics field
+                'statistics': statistics,
+                'processing_steps': current_recorder().processing_steps()
+            }
         
-        save_result = db_service.save_analysis_results(polygon_id, analysis_data, user_id)
-        if save_result and save_result.get('status') == 'success':
-            logger.info(f"✅ LIDAR analysis results saved successfully for {polygon_id}")
-        else:
-            error_message = save_result.get('message', 'save_analysis_results failed') if save_result else 'save_analysis_results returned None'
-            logger.error(f"❌ CRITICAL: FAILED to save LIDAR analysis results for {polygon_id}: {error_message}")
-            error_response = jsonify_with_cors({
-                'status': 'error',
-                'message': f'Failed to save analysis results: {error_message}'
-            })
-            return error_response, 500
+            with stage('db_save'):
+                save_result = db_service.save_analysis_results(polygon_id, analysis_data, user_id)
+            if save_result and save_result.get('status') == 'success':
+                db_service.update_processing_steps(polygon_id, current_recorder().processing_steps())
+                logger.info(f"✅ LIDAR analysis results saved successfully for {polygon_id}")
+            else:
+                error_message = save_result.get('message', 'save_analysis_results failed') if save_result else 'save_analysis_results returned None'
+                logger.error(f"❌ CRITICAL: FAILED to save LIDAR analysis results for {polygon_id}: {error_message}")
+                error_response = jsonify_with_cors({
+                    'status': 'error',
+                    'message': f'Failed to save analysis results: {error_message}'
+                })
+                return error_response, 500
         
         # Results are already in proven SRTM format - return directly
         response = jsonify_with_cors({
@@ -2,23 +2,28 @@
 Routes for polygon operations (saving, processing)
 """
 import logging
-from flask import request, jsonify
+from flask import request, jsonify, Response, stream_with_context
 import json
 import os
 import shutil # Added for file copying
 import time
 import random
+import threading
 from shapely.geometry import shape
 from shapely.geometry.polygon import Polygon # Explicitly import Polygon
 from datetime import datetime
 
 from services.srtm import get_srtm_data
-from services.dem_processor import process_dem_files
+from services.dem_processor import process_dem_files, gradient_outputs
 from services.terrain import calculate_centroid
 from services.database import DatabaseService  # New import
-from utils.config import SAVE_DIRECTORY
+from utils.config import SAVE_DIRECTORY, SYNC_TIME_BUDGET_SECONDS, STATUS_STREAM_MAX_CONCURRENT
 from utils.file_io import save_geojson
-from utils.cors import jsonify_with_cors
+from utils.cors import jsonify_with_cors, add_cors_headers
+from utils.locks import single_flight
+from utils.cancellation import cancellation_scope, current_token, raise_if_cancelled, track_output, OperationCancelled
+from utils.priority import current_lane
+from services.instrumentation import recording, current_recorder, stage
 from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
@@ -26,6 +31,82 @@ logger = logging.getLogger(__name__)
 # Initialize database service
 db_service = DatabaseService()
 
+# Status streams close after this long (below the gunicorn timeout) and the
+# client reconnects; keepalive comments stop proxies from dropping idle streams
+STATUS_STREAM_MAX_SECONDS = 240
+STATUS_STREAM_KEEPALIVE_SECONDS = 15
+STATUS_STREAM_RETRY_MS = 1000
+# Queued tasks are re-checked this often so their queue position stays current
+STATUS_STREAM_QUEUE_POLL_SECONDS = 2
+# Seconds a client turned away because all stream slots are taken should wait
+STATUS_STREAM_BUSY_RETRY_SECONDS = 5
+
+# Streams open in this worker (each holds one of its request threads)
+_stream_slots = threading.BoundedSemaphore(max(1, STATUS_STREAM_MAX_CONCURRENT))
+
+def _task_status_response(task_id, status, include_result=True):
+    """Map an internal task status to the API response"""
+    if status['status'] in ('QUEUED', 'PROGRESS'):
+        # Queued jobs report as processing, with their place in the queue
+        response = {
+            'status': 'processing',
+            'task_id': task_id,
+            'progress': status.get('progress', 0),
+            'message': status.get('message', 'Processing...'),
+            'lane': status.get('lane')
+        }
+        if status.get('queue_position') is not None:
+            response['queue_position'] = status['queue_position']
+        return response
+    if status['status'] == 'SUCCESS':
+        response = {
+            'status': 'completed',
+            'task_id': task_id,
+            'message': 'Task completed successfully'
+        }
+        if include_result:
+            response['result'] = status.get('results', {})
+        return response
+    if status['status'] == 'FAILURE':
+        return {
+            'status': 'failed',
+            'task_id': task_id,
+            'error': status.get('message', 'Task failed'),
+            'message': 'Task failed'
+        }
+    if status['status'] == 'CANCELLED':
+        return {
+            'status': 'cancelled',
+            'task_id': task_id,
+            'message': status.get('message', 'Task cancelled')
+        }
+    return {
+        'status': status['status'].lower(),
+        'task_id': task_id,
+        'message': status.get('message', f'Task state: {status["status"]}')
+    }
+
+def _result_paths(results):
+    """Collect the output file paths from a task result"""
+    paths = {}
+    if not isinstance(results, dict):
+        return paths
+    for name, entry in (results.get('terrain_results') or {}).items():
+        if isinstance(entry, dict) and entry.get('path'):
+            paths[name] = entry['path']
+    for key, value in (results.get('srtm_results') or {}).items():
+        if key.endswith('_path') and isinstance(value, str):
+            paths[key[:-len('_path')]] = value
+    return paths
+
+def _sse_event(event, data, event_id=None):
+    """Format one Server-Sent Event"""
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
 def register_routes(app):
     """
     Register all polygon-related routes
@@ -126,41 +207,137 @@ def register_routes(app):
                     'message': 'Task not found or expired'
                 }), 404
             
-            # Map internal status to API response
-            if status['status'] == 'PROGRESS':
-                response = {
-                    'status': 'processing',
-                    'task_id': task_id,
-                    'progress': status.get('progress', 0),
-                    'message': status.get('message', 'Processing...')
-                }
-            elif status['status'] == 'SUCCESS':
-                response = {
-                    'status': 'completed',
-                    'task_id': task_id,
-                    'result': status.get('results', {}),
-                    'message': 'Task completed successfully'
-                }
-            elif status['status'] == 'FAILURE':
-                response = {
-                    'status': 'failed',
+            return jsonify_with_cors(_task_status_response(task_id, status)), 200
+            
+        except Exception as e:
+            logger.error(f"Error checking task status: {str(e)}", exc_info=True)
+            return jsonify_with_cors({'error': str(e)}), 500
+
+    @app.route('/status/<task_id>', methods=['DELETE'])
+    def cancel_task(task_id):
+        """
+        Cancel a background task, or a synchronous /process_polygon request
+        that was sent with this task_id
+        
+        Queued tasks are cancelled at once (200); running ones stop their
+        tools, skip their remaining stages and remove partial outputs (202).
+        """
+        try:
+            from services.background_processor import cancel_task as cancel_background_task, get_task_status
+            
+            outcome = cancel_background_task(task_id)
+            if outcome is None:
+                return jsonify_with_cors({
+                    'status': 'not_found',
                     'task_id': task_id,
-                    'error': status.get('message', 'Task failed'),
-                    'message': 'Task failed'
-                }
-            else:
-                response = {
-                    'status': status['status'].lower(),
+                    'message': 'Task not found or expired'
+                }), 404
+            
+            status = get_task_status(task_id)
+            if status is None:
+                # A synchronous request: it answers its own caller once stopped
+                return jsonify_with_cors({
+                    'status': 'cancelling',
                     'task_id': task_id,
-                    'message': status.get('message', f'Task state: {status["status"]}')
-                }
+                    'message': 'Cancellation requested'
+                }), 202
             
+            response = _task_status_response(task_id, status, include_result=False)
+            if outcome == 'cancelling':
+                response['status'] = 'cancelling'
+                return jsonify_with_cors(response), 202
+            if outcome == 'finished':
+                return jsonify_with_cors(response), 409
             return jsonify_with_cors(response), 200
             
         except Exception as e:
-            logger.error(f"Error checking task status: {str(e)}", exc_info=True)
+            logger.error(f"Error cancelling task: {str(e)}", exc_info=True)
             return jsonify_with_cors({'error': str(e)}), 500
 
+    @app.route('/status/<task_id>/stream', methods=['GET'])
+    def stream_task_status(task_id):
+        """
+        Stream the status of a background task as Server-Sent Events
+        
+        A 'progress' event is sent whenever the task's status or queue
+        position changes, and a final 'completed' (with result paths),
+        'failed' or 'cancelled' event closes the stream. Event ids are the
+        task revision, so a reconnecting EventSource (Last-Event-ID) only
+        receives changes it has not seen; a finished task always answers with
+        its final event, even to a client that has already seen its revision.
+        
+        A stream holds a request thread while open, so each worker serves at
+        most STATUS_STREAM_MAX_CONCURRENT of them; beyond that the client gets
+        a 503 with Retry-After and can poll /status/<task_id> instead.
+        """
+        from services.background_processor import get_task_status, wait_for_task_change
+        
+        if not get_task_status(task_id):
+            return jsonify_with_cors({
+                'status': 'not_found',
+                'task_id': task_id,
+                'message': 'Task not found or expired'
+            }), 404
+        
+        try:
+            last_seen = int(request.headers.get('Last-Event-ID', ''))
+        except ValueError:
+            last_seen = None
+        
+        if not _stream_slots.acquire(blocking=False):
+            response = jsonify_with_cors({
+                'status': 'busy',
+                'task_id': task_id,
+                'message': 'Too many open status streams, poll /status/<task_id> or retry later'
+            })
+            response.status_code = 503
+            response.headers['Retry-After'] = str(STATUS_STREAM_BUSY_RETRY_SECONDS)
+            return response
+        
+        def events():
+            revision = last_seen
+            position = None
+            started = time.time()
+            yield f"retry: {STATUS_STREAM_RETRY_MS}\n\n"
+            while True:
+                status = get_task_status(task_id)
+                if status is None:
+                    yield _sse_event('not_found', {'status': 'not_found', 'task_id': task_id})
+                    return
+                
+                # Checked before the revision so a client reconnecting after the
+                # task finished still gets the final event
+                if status['status'] in ('SUCCESS', 'FAILURE', 'CANCELLED'):
+                    response = _task_status_response(task_id, status, include_result=False)
+                    response['result_paths'] = _result_paths(status.get('results'))
+                    yield _sse_event(response['status'], response, status['revision'])
+                    return
+                
+                # Queue position moves as jobs ahead are claimed, without a new revision
+                if status['revision'] != revision or status.get('queue_position') != position:
+                    revision = status['revision']
+                    position = status.get('queue_position')
+                    yield _sse_event('progress', _task_status_response(task_id, status), revision)
+                
+                # Close before the worker timeout; EventSource reconnects on its own
+                if time.time() - started > STATUS_STREAM_MAX_SECONDS:
+                    return
+                
+                timeout = STATUS_STREAM_QUEUE_POLL_SECONDS if status['status'] == 'QUEUED' else STATUS_STREAM_KEEPALIVE_SECONDS
+                if wait_for_task_change(task_id, revision, timeout) == revision:
+                    yield ": keepalive\n\n"
+        
+        try:
+            response = Response(stream_with_context(events()), mimetype='text/event-stream')
+        except Exception:
+            _stream_slots.release()
+            raise
+        # Runs when the server closes the response, whether or not the stream started
+        response.call_on_close(_stream_slots.release)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return add_cors_headers(response)
+
     @app.route('/process_polygon', methods=['POST'])
     def process_polygon():
         try:
@@ -201,7 +378,7 @@ def register_routes(app):
                 from services.background_processor import run_terrain_analysis
                 
                 # Start the background task
-                task_id = run_terrain_analysis(polygon_id, geojson_data, data_source)
+                task_id = run_terrain_analysis(polygon_id, geojson_data, data_source, lane=current_lane())
                 
                 # Return task ID for status checking
                 return jsonify_with_cors({
@@ -209,9 +386,12 @@ def register_routes(app):
                     'task_id': task_id,
                     'polygon_id': polygon_id,
                     'data_source': data_source,
+                    'lane': current_lane(),
                     'message': 'Terrain analysis started. Use /status/<task_id> to check progress.'
                 }), 202
-            else:
+
+            def run_sync():
+                """Synchronous processing; returns (response body, status code)"""
                 # SYNC PROCESSING: Original synchronous processing
                 logger.info(f"Fetching {data_source} data for polygon bounds: {min_lon}, {min_lat}, {max_lon}, {max_lat}")
                 
@@ -219,134 +399,188 @@ def register_routes(app):
                     srtm_files = get_srtm_data(geojson_data)
                     if not srtm_files:
                         db_service.update_polygon_status(polygon_id, 'failed')
-                        return jsonify_with_cors({'error': 'No SRTM data available for this location'}), 500
+                        return {'error': 'No SRTM data available for this location'}, 500
                     
                     # Process SRTM files
                     polygon_session_folder = os.path.join(SAVE_DIRECTORY, "polygon_sessions", polygon_id)
                     os.makedirs(polygon_session_folder, exist_ok=True)
                     processed_data = process_dem_files(srtm_files, geojson_data, polygon_session_folder, 'srtm')
+                    raise_if_cancelled()
                     
                     # Add parallel terrain processing for immediate 3x speed boost
                     if processed_data and 'clipped_dem_path' in processed_data:
+                        # Slope and aspect come from the fused metrics pass on the clipped DEM
+                        precomputed = gradient_outputs(processed_data)
+                        track_output(processed_data['clipped_dem_path'], *precomputed.values())
                         logger.info(f"Starting parallel terrain processing for polygon {polygon_id}")
                         from services.terrain_parallel import process_terrain_parallel
                         
                         # Run all terrain operations in parallel
-                        terrain_results = process_terrain_parallel(
-                            processed_data['clipped_dem_path'], 
-                            polygon_session_folder, 
-                            polygon_id
-                        )
+                        with stage('terrain_pipeline'):
+                            terrain_results = process_terrain_parallel(
+                                processed_data['clipped_dem_path'], 
+                                polygon_session_folder, 
+                                polygon_id,
+                                precomputed=precomputed
+                            )
+                        
+                        raise_if_cancelled()
                         
                         # Add terrain results to processed_data
                         processed_data['terrain_results'] = terrain_results
                         logger.info(f"Parallel terrain processing completed for polygon {polygon_id}")
                 elif data_source == 'lidar':
                     # TODO: Implement synchronous LiDAR processing
-                    return jsonify_with_cors({'error': 'LiDAR processing not yet implemented'}), 501
+                    return {'error': 'LiDAR processing not yet implemented'}, 501
                 else:
-                    return jsonify_with_cors({'error': f'Unknown data source: {data_source}'}), 400
+                    return {'error': f'Unknown data source: {data_source}'}, 400
             
-            if 'error' in processed_data:
-                db_service.update_polygon_status(polygon_id, 'failed')
-                return jsonify_with_cors(processed_data), 500
+                if 'error' in processed_data:
+                    db_service.update_polygon_status(polygon_id, 'failed')
+                    return processed_data, 500
             
-            # 5. Get the final clipped SRTM file path
-            clipped_dem_path = processed_data['clipped_dem_path']
+                # 5. Get the final clipped SRTM file path
+                clipped_dem_path = processed_data['clipped_dem_path']
 
-            # 6. Save the final clipped SRTM data to the polygon session folder
-            srtm_file_path = os.path.join(polygon_session_folder, f"{polygon_id}_srtm.tif")
-            
-            # Copy the clipped SRTM to the named file
-            shutil.copy2(clipped_dem_path, srtm_file_path)
-            logger.info(f"Copied clipped SRTM data to: {srtm_file_path}")
-            
-            # Note: SRTM cache directory should only contain raw, unprocessed SRTM tiles
-            # Clipped files belong in polygon session folders, not in the cache
-            
-            # Add the file path to the response
-            processed_data['srtm_file_path'] = srtm_file_path
-            
-            # Extract user information if provided
-            user_id = data.get('user_id', None)
-            
-            # Calculate statistics for the SRTM data
-            from services.analysis_statistics import calculate_terrain_statistics
-            
-            # Calculate comprehensive statistics
-            logger.info(f"Calculating statistics for SRTM file: {srtm_file_path}")
-            statistics = calculate_terrain_statistics(
-                dem_path=srtm_file_path,
-                slope_path=None,  # No slope data yet
-                aspect_path=None,  # No aspect data yet
-                bounds={
-                    'west': min_lon,
-                    'east': max_lon,
-                    'north': max_lat,
-                    'south': min_lat
-                },
-                data_source='srtm'  # ✅ ADD THIS!
-            )
-            logger.info(f"Calculated statistics: {statistics}")
-            
-            # Save analysis results to database - statistics at root level
-            analysis_data = {
-                'dem_path': srtm_file_path,
-                'slope_path': None,  # Will be set when slope analysis is run
-                'aspect_path': None,  # Will be set when aspect analysis is run
-                'contours_path': None,  # Will be set when contours are generated
-                'bounds': {
-                    'minLon': min_lon,
-                    'minLat': min_lat,
-                    'maxLon': max_lon,
-                    'maxLat': max_lat
-                },
-                'processed_at': datetime.now().isoformat()
-            }
-            
-            # Save statistics under the dedicated statistics field so partial stats persist immediately
-            analysis_data['statistics'] = statistics
-            
-            logger.info(f"Saving analysis results to database for polygon {polygon_id}")
-            save_result = db_service.save_analysis_results(polygon_id, analysis_data, user_id)
-            logger.info(f"Database save result: {save_result}")
-            db_service.update_polygon_status(polygon_id, 'completed')
-            
-            # Save SRTM file metadata to database
-            srtm_file_result = db_service.save_file_metadata(
-                polygon_id=polygon_id,
-                file_name=f"{polygon_id}_srtm.tif",
-                file_path=srtm_file_path,
-                file_type='srtm',
-                user_id=user_id
-            )
-            
-            # Statistics are now calculated above and included in analysis_data
+                # 6. Save the final clipped SRTM data to the polygon session folder
+                srtm_file_path = os.path.join(polygon_session_folder, f"{polygon_id}_srtm.tif")
+            
+                # Copy the clipped SRTM to the named file
+                track_output(srtm_file_path)
+                shutil.copy2(clipped_dem_path, srtm_file_path)
+                logger.info(f"Copied clipped SRTM data to: {srtm_file_path}")
+            
+                # Note: SRTM cache directory should only contain raw, unprocessed SRTM tiles
+                # Clipped files belong in polygon session folders, not in the cache
+            
+                # Add the file path to the response
+                processed_data['srtm_file_path'] = srtm_file_path
+            
+                # Extract user information if provided
+                user_id = data.get('user_id', None)
+            
+                # Calculate statistics for the SRTM data
+                from services.analysis_statistics import calculate_terrain_statistics
+            
+                # Calculate comprehensive statistics
+                logger.info(f"Calculating statistics for SRTM file: {srtm_file_path}")
+                with stage('statistics'):
+                    statistics = calculate_terrain_statistics(
+                        dem_path=srtm_file_path,
+                        slope_path=None,  # No slope data yet
+                        aspect_path=None,  # No aspect data yet
+                        bounds={
+                            'west': min_lon,
+                            'east': max_lon,
+                            'north': max_lat,
+                            'south': min_lat
+                        },
+                        data_source='srtm'  # ✅ ADD THIS!
+                    )
+                logger.info(f"Calculated statistics: {statistics}")
+            
+                # Save analysis results to database - statistics at root level
+                analysis_data = {
+                    'dem_path': srtm_file_path,
+                    'slope_path': None,  # Will be set when slope analysis is run
+                    'aspect_path': None,  # Will be set when aspect analysis is run
+                    'contours_path': None,  # Will be set when contours are generated
+                    'bounds': {
+                        'minLon': min_lon,
+                        'minLat': min_lat,
+                        'maxLon': max_lon,
+                        'maxLat': max_lat
+                    },
+                    'processed_at': datetime.now().isoformat()
+                }
             
-            # Cleanup temporary file from processing
-            if os.path.exists(clipped_dem_path):
-                 os.remove(clipped_dem_path)
-                 logger.debug(f"Removed temp clipped file: {clipped_dem_path}")
+                # Save statistics under the dedicated statistics field so partial stats persist immediately
+                analysis_data['statistics'] = statistics
+                analysis_data['processing_steps'] = current_recorder().processing_steps()
+            
+                logger.info(f"Saving analysis results to database for polygon {polygon_id}")
+                with stage('db_save'):
+                    save_result = db_service.save_analysis_results(polygon_id, analysis_data, user_id)
+                logger.info(f"Database save result: {save_result}")
+                if save_result and save_result.get('status') == 'success':
+                    db_service.update_processing_steps(polygon_id, current_recorder().processing_steps())
+                db_service.update_polygon_status(polygon_id, 'completed')
+            
+                # Save SRTM file metadata to database
+                srtm_file_result = db_service.save_file_metadata(
+                    polygon_id=polygon_id,
+                    file_name=f"{polygon_id}_srtm.tif",
+                    file_path=srtm_file_path,
+                    file_type='srtm',
+                    user_id=user_id
+                )
+            
+                # Statistics are now calculated above and included in analysis_data
+            
+                # Cleanup temporary file from processing
+                if os.path.exists(clipped_dem_path):
+                     os.remove(clipped_dem_path)
+                     logger.debug(f"Removed temp clipped file: {clipped_dem_path}")
 
-            # Return the processed SRTM data in the format expected by the frontend
-            return jsonify_with_cors({
-                'message': 'Polygon processed successfully. SRTM data clipped and saved.',
-                'polygon_id': polygon_id,
-                'srtm_file_path': srtm_file_path,
-                'image': processed_data.get('image', ''),
-                'bounds': {
-                    'west': min_lon,
-                    'east': max_lon,
-                    'north': max_lat,
-                    'south': min_lat
-                },
-                'min_height': processed_data.get('min_height', 0),
-                'max_height': processed_data.get('max_height', 0),
-                'width': processed_data.get('width', 0),
-                'height': processed_data.get('height', 0),
-                'database_status': 'saved',
-                'file_metadata_status': srtm_file_result
-            })
+                # Return the processed SRTM data in the format expected by the frontend
+                return {
+                    'message': 'Polygon processed successfully. SRTM data clipped and saved.',
+                    'polygon_id': polygon_id,
+                    'srtm_file_path': srtm_file_path,
+                    'image': processed_data.get('image', ''),
+                    'bounds': {
+                        'west': min_lon,
+                        'east': max_lon,
+                        'north': max_lat,
+                        'south': min_lat
+                    },
+                    'min_height': processed_data.get('min_height', 0),
+                    'max_height': processed_data.get('max_height', 0),
+                    'width': processed_data.get('width', 0),
+                    'height': processed_data.get('height', 0),
+                    'database_status': 'saved',
+                    'file_metadata_status': srtm_file_result
+                }, 200
+
+            from services.background_processor import analysis_dedupe_key
+            dedupe_key = analysis_dedupe_key(polygon_id, geojson_data, data_source)
+            
+            # The request runs under a time budget and can be cancelled with
+            # DELETE /status/<task_id> when the client sent a task_id. The
+            # budget also covers waiting for an identical run
+            cancel_id = data.get('task_id') or f"sync_{dedupe_key[:16]}"
+            
+            def stopped_response(token):
+                return {
+                    'status': 'failed' if token.timed_out else 'cancelled',
+                    'task_id': cancel_id,
+                    'error': token.reason
+                }, 504 if token.timed_out else 409
+            
+            def run_cancellable():
+                token = current_token()
+                with recording(polygon_id, data_source):
+                    try:
+                        return run_sync()
+                    except Exception:
+                        if not token.cancelled:
+                            raise
+                        removed = token.discard_outputs()
+                        logger.warning(f"🛑 Synchronous processing of {polygon_id} stopped: {token.reason} "
+                                       f"({removed} partial outputs removed)")
+                        db_service.update_polygon_status(polygon_id, 'failed' if token.timed_out else 'cancelled')
+                        return stopped_response(token)
+            
+            # Identical submissions running at the same time (double clicks,
+            # other tabs, other workers) share one run and its response
+            with cancellation_scope(cancel_id, SYNC_TIME_BUDGET_SECONDS) as token:
+                try:
+                    result, status_code = single_flight(f"process_polygon:{dedupe_key}", run_cancellable,
+                                                        share_result=lambda value: value[1] < 400)
+                except OperationCancelled:
+                    logger.warning(f"🛑 Stopped waiting for an identical run of {polygon_id}: {token.reason}")
+                    result, status_code = stopped_response(token)
+            return jsonify_with_cors(result), status_code
 
         except Exception as e:
             logger.error(f"Error processing polygon: {str(e)}", exc_info=True)
@@ -0,0 +1,99 @@
+"""
+Admin routes for request profiles
+
+Every endpoint requires the PROFILE_ADMIN_TOKEN in the X-Admin-Token header
+(never in the query string, which is written to the access logs); without a
+configured token they are disabled.
+"""
+import logging
+from flask import Blueprint, request, send_file
+from utils.cors import jsonify_with_cors, add_cors_headers
+from utils.config import PROFILE_ADMIN_TOKEN
+from utils.profiling import is_admin, list_profiles, get_profile, profile_file_path, delete_profile
+
+logger = logging.getLogger(__name__)
+
+# Create blueprint
+profiles_bp = Blueprint('profiles', __name__, url_prefix='/api/admin/profiles')
+
+# Content types of the files a profile holds
+PROFILE_MIMETYPES = {
+    '.json': 'application/json',
+    '.collapsed': 'text/plain'
+}
+
+
+@profiles_bp.before_request
+def require_admin():
+    """Reject requests without the admin token"""
+    if request.method == 'OPTIONS':
+        return None
+    if not PROFILE_ADMIN_TOKEN:
+        return jsonify_with_cors({'error': 'Profiling is disabled (PROFILE_ADMIN_TOKEN is not set)'}), 404
+    if not is_admin(request):
+        return jsonify_with_cors({'error': 'Invalid or missing admin token'}), 403
+    return None
+
+
+@profiles_bp.route('', methods=['OPTIONS'])
+@profiles_bp.route('/<profile_id>', methods=['OPTIONS'])
+@profiles_bp.route('/<profile_id>/<file_name>', methods=['OPTIONS'])
+def profiles_options(profile_id=None, file_name=None):
+    """Handle CORS preflight requests for profile endpoints"""
+    return jsonify_with_cors({})
+
+
+@profiles_bp.route('', methods=['GET'])
+def get_profiles():
+    """List stored profiles, newest first, with the metadata of each part"""
+    try:
+        profiles = list_profiles()
+        return jsonify_with_cors({'profiles': profiles, 'count': len(profiles)})
+    except Exception as e:
+        logger.error(f"Error listing profiles: {str(e)}", exc_info=True)
+        return jsonify_with_cors({'error': str(e)}), 500
+
+
+@profiles_bp.route('/<profile_id>', methods=['GET'])
+def get_profile_details(profile_id):
+    """Metadata and file names of one profile"""
+    try:
+        profile = get_profile(profile_id)
+        if profile is None:
+            return jsonify_with_cors({'error': f'Profile {profile_id} not found'}), 404
+        return jsonify_with_cors(profile)
+    except Exception as e:
+        logger.error(f"Error getting profile {profile_id}: {str(e)}", exc_info=True)
+        return jsonify_with_cors({'error': str(e)}), 500
+
+
+@profiles_bp.route('/<profile_id>/<file_name>', methods=['GET'])
+def download_profile_file(profile_id, file_name):
+    """
+    Download one file of a profile: '<part>.speedscope.json' (open in
+    speedscope), '<part>.collapsed' (flamegraph.pl input) or '<part>.meta.json'
+    """
+    try:
+        path = profile_file_path(profile_id, file_name)
+        if path is None:
+            return jsonify_with_cors({'error': f'File {file_name} not found in profile {profile_id}'}), 404
+
+        extension = '.collapsed' if file_name.endswith('.collapsed') else '.json'
+        response = send_file(path, mimetype=PROFILE_MIMETYPES[extension], as_attachment=True,
+                             download_name=f"{profile_id}-{file_name}")
+        return add_cors_headers(response)
+    except Exception as e:
+        logger.error(f"Error downloading profile file {profile_id}/{file_name}: {str(e)}", exc_info=True)
+        return jsonify_with_cors({'error': str(e)}), 500
+
+
+@profiles_bp.route('/<profile_id>', methods=['DELETE'])
+def remove_profile(profile_id):
+    """Delete a stored profile"""
+    try:
+        if not delete_profile(profile_id):
+            return jsonify_with_cors({'error': f'Profile {profile_id} not found'}), 404
+        return jsonify_with_cors({'status': 'deleted', 'profile_id': profile_id})
+    except Exception as e:
+        logger.error(f"Error deleting profile {profile_id}: {str(e)}", exc_info=True)
+        return jsonify_with_cors({'error': str(e)}), 500
@@ -9,6 +9,8 @@ from flask import request, jsonify, send_file, abort, Response
 from utils.cors import jsonify_with_cors, add_cors_headers
 from werkzeug.utils import secure_filename
 from services.raster_visualization import process_raster_file, detect_layer_type_from_path
+from services.rendering import get_render_options
+from utils.metrics import upstream_call
 from urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
 import threading
@@ -244,6 +246,12 @@ def register_routes(app):
             if not file_path or not layer_type:
                 return jsonify_with_cors({'error': 'Missing required parameters: file_path and layer_type'}), 400
             
+            # Preview rendering options (scale, format, compression)
+            try:
+                render_options = get_render_options(data.get('render'))
+            except ValueError as e:
+                return jsonify_with_cors({'error': str(e)}), 400
+            
             logger.info(f"Visualizing raster: {file_path} (type: {layer_type})")
             
             # Construct the full file path (same logic as /raster/ endpoint)
@@ -289,7 +297,7 @@ def register_routes(app):
                     logger.warning(f"Failed to get polygon data: {str(e)}")
             
             # Process the raster file
-            base64_image_data = process_raster_file(full_path, layer_type, polygon_data)
+            base64_image_data = process_raster_file(full_path, layer_type, polygon_data, render_options)
             
             if base64_image_data is None:
                 return jsonify_with_cors({'error': f'Failed to process {layer_type} visualization'}), 500
@@ -299,7 +307,9 @@ def register_routes(app):
                 'status': 'success',
                 'image': base64_image_data,
                 'layer_type': layer_type,
-                'file_path': file_path
+                'file_path': file_path,
+                'scale': render_options['scale'],
+                'format': render_options['format']
             })
             
         except Exception as e:
@@ -435,12 +445,14 @@ def register_routes(app):
                 
                 # Make request with timeout and streaming
                 # Use a shorter timeout to fail fast if service is down
-                response = session.get(
-                    wms_url,
-                    timeout=(10, 30),  # 10s connect, 30s read timeout
-                    stream=True,
-                    allow_redirects=True
-                )
+                with upstream_call('wms') as call:
+                    response = session.get(
+                        wms_url,
+                        timeout=(10, 30),  # 10s connect, 30s read timeout
+                        stream=True,
+                        allow_redirects=True
+                    )
+                    call.status = response.status_code
                 
                 # Check response status
                 if response.status_code != 200:
@@ -8,10 +8,13 @@ import os
 from pathlib import Path
 from datetime import datetime
 
-from services.terrain import calculate_slopes, visualize_slope, generate_contours, calculate_geomorphons, visualize_geomorphons, calculate_hypsometrically_tinted_hillshade, visualize_hillshade, calculate_aspect, visualize_aspect, calculate_drainage_network, visualize_drainage_network
+from services.terrain import calculate_slopes, visualize_slope, calculate_geomorphons, visualize_geomorphons, calculate_hypsometrically_tinted_hillshade, visualize_hillshade, calculate_aspect, visualize_aspect, calculate_drainage_network, visualize_drainage_network
 from utils.config import SAVE_DIRECTORY
 from utils.file_io import get_most_recent_polygon
 from utils.cors import jsonify_with_cors
+from services.rendering import get_render_options
+from services.contour_cache import contours_for_interval
+from config.dem_sources import validate_dem_source
 
 logger = logging.getLogger(__name__)
 
@@ -37,6 +40,12 @@ def register_routes(app):
                 return jsonify_with_cors({'error': 'Missing polygon ID parameter'}), 400
                 
             polygon_id = data['id']
+            
+            # Preview rendering options (scale, format, compression)
+            try:
+                render_options = get_render_options(data.get('render'))
+            except ValueError as e:
+                return jsonify_with_cors({'error': str(e)}), 400
             logger.info(f"🔍 Processing slopes for polygon ID: {polygon_id}")
             
             # Construct the path to the polygon session folder
@@ -86,7 +95,7 @@ def register_routes(app):
             
             # Visualize slopes
             logger.info("🔍 Starting slope visualization...")
-            slope_viz = visualize_slope(slope_file, polygon_data)
+            slope_viz = visualize_slope(slope_file, polygon_data, render_options)
             
             if not slope_viz:
                 logger.error("❌ Failed to visualize slope data")
@@ -147,6 +156,7 @@ def register_routes(app):
                 
             polygon_id = data['id']
             interval = data.get('interval', 10)  # Default 10m interval
+            zoom = data.get('zoom')  # Optional map zoom for simplified lines
             logger.info(f"🔍 Generating contours for polygon ID: {polygon_id} with interval: {interval}m")
             
             # Construct the path to the polygon session folder
@@ -173,18 +183,27 @@ def register_routes(app):
             
             # Generate contours
             logger.info("🔍 Starting contour generation...")
-            success = generate_contours(input_file, contour_file, interval)
+            try:
+                interval = float(interval)
+                zoom = int(zoom) if zoom is not None else None
+            except (TypeError, ValueError):
+                return jsonify_with_cors({'error': 'interval must be a number and zoom an integer'}), 400
             
-            if not success:
+            # Multiples of a stored base interval are filtered from the cached contours;
+            # the base depends on the DEM source, inferred from the DEM when not given
+            data_source = data.get('data_source') if validate_dem_source(data.get('data_source')) else None
+            contour_result = contours_for_interval(input_file, interval, zoom=zoom, data_source=data_source)
+            
+            if not contour_result:
                 logger.error("❌ Failed to generate contours")
                 return jsonify_with_cors({'error': 'Failed to generate contours'}), 500
             
-            logger.info("✅ Contour generation completed successfully")
+            logger.info(f"✅ Contour generation completed successfully (from cache: {contour_result['from_cache']})")
             
-            # Read the generated GeoJSON file
             try:
-                with open(contour_file, 'r') as f:
-                    contour_data = json.load(f)
+                # Keep the full-detail contours of this interval on disk for later loads
+                with open(contour_file, 'w') as f:
+                    json.dump(contour_result['full_contours'], f)
                 
                 # Save contour analysis results to database
                 from services.database import DatabaseService
@@ -219,12 +238,15 @@ def register_routes(app):
                     'polygon_id': polygon_id,
                     'contour_file': contour_file,
                     'contour_path': relative_contour_path,  # Return relative path for consistency
-                    'contours': contour_data,
-                    'interval': interval
+                    'contours': contour_result['contours'],
+                    'interval': interval,
+                    'base_interval': contour_result['base_interval'],
+                    'zoom': zoom,  # Contours are simplified for this zoom when set
+                    'from_cache': contour_result['from_cache']
                 })
             except Exception as e:
-                logger.error(f"Error reading contour file: {str(e)}")
-                return jsonify_with_cors({'error': f'Failed to read contour file: {str(e)}'}), 500
+                logger.error(f"Error saving contour results: {str(e)}")
+                return jsonify_with_cors({'error': f'Failed to save contour results: {str(e)}'}), 500
                 
         except Exception as e:
             logger.error(f"Error generating contours: {str(e)}", exc_info=True)
@@ -242,6 +264,12 @@ def register_routes(app):
                 return jsonify_with_cors({'error': 'Missing polygon ID parameter'}), 400
                 
             polygon_id = data['id']
+            
+            # Preview rendering options (scale, format, compression)
+            try:
+                render_options = get_render_options(data.get('render'))
+            except ValueError as e:
+                return jsonify_with_cors({'error': str(e)}), 400
             logger.info(f"🔍 Processing geomorphons for polygon ID: {polygon_id}")
             
             # Get geomorphons parameters (optional with defaults)
@@ -298,7 +326,7 @@ def register_routes(app):
             
             # Visualize geomorphons
             logger.info("🔍 Starting geomorphons visualization...")
-            geomorphons_viz = visualize_geomorphons(geomorphons_file, polygon_data)
+            geomorphons_viz = visualize_geomorphons(geomorphons_file, polygon_data, render_options)
             
             if not geomorphons_viz:
                 logger.error("❌ Failed to visualize geomorphons data")
@@ -353,6 +381,12 @@ def register_routes(app):
                 return jsonify_with_cors({'error': 'Missing polygon ID parameter'}), 400
                 
             polygon_id = data['id']
+            
+            # Preview rendering options (scale, format, compression)
+            try:
+                render_options = get_render_options(data.get('render'))
+            except ValueError as e:
+                return jsonify_with_cors({'error': str(e)}), 400
             logger.info(f"🔍 Processing hillshade for polygon ID: {polygon_id}")
             
             # Get hillshade parameters (optional with defaults)
@@ -412,7 +446,7 @@ def register_routes(app):
             
             # Visualize hillshade
             logger.info("🔍 Starting hillshade visualization...")
-            hillshade_viz = visualize_hillshade(hillshade_file, polygon_data)
+            hillshade_viz = visualize_hillshade(hillshade_file, polygon_data, render_options)
             
             if not hillshade_viz:
                 logger.error("❌ Failed to visualize hillshade data")
@@ -467,6 +501,12 @@ def register_routes(app):
                 return jsonify_with_cors({'error': 'Missing polygon ID parameter'}), 400
                 
             polygon_id = data['id']
+            
+            # Preview rendering options (scale, format, compression)
+            try:
+                render_options = get_render_options(data.get('render'))
+            except ValueError as e:
+                return jsonify_with_cors({'error': str(e)}), 400
             logger.info(f"🔍 Processing aspect for polygon ID: {polygon_id}")
             
             # Get aspect parameters (optional with defaults)
@@ -523,7 +563,7 @@ def register_routes(app):
             
             # Visualize aspect
             logger.info("🔍 Starting aspect visualization...")
-            aspect_viz = visualize_aspect(aspect_file, polygon_data)
+            aspect_viz = visualize_aspect(aspect_file, polygon_data, render_options)
             
             if not aspect_viz:
                 logger.error("❌ Failed to visualize aspect data")
@@ -590,6 +630,12 @@ def register_routes(app):
                 return jsonify_with_cors({'error': 'Missing polygon ID parameter'}), 400
                 
             polygon_id = data['id']
+            
+            # Preview rendering options (scale, format, compression)
+            try:
+                render_options = get_render_options(data.get('render'))
+            except ValueError as e:
+                return jsonify_with_cors({'error': str(e)}), 400
             logger.info(f"🔍 Processing drainage network for polygon ID: {polygon_id}")
             
             # Construct the path to the polygon session folder
@@ -638,7 +684,7 @@ def register_routes(app):
             
             # Visualize drainage network
             logger.info("🔍 Starting drainage network visualization...")
-            drainage_viz = visualize_drainage_network(drainage_file, polygon_data)
+            drainage_viz = visualize_drainage_network(drainage_file, polygon_data, render_options)
             
             if not drainage_viz:
                 logger.error("❌ Failed to visualize drainage network data")
@@ -16,6 +16,7 @@ import os
 
 # Import the USGS DEM processor
 from services.usgs_dem_processor import process_usgs_dem
+from services.instrumentation import recording, current_recorder, stage
 
 logger = logging.getLogger(__name__)
 
@@ -112,68 +113,75 @@ def process_usgs_dem_analysis():
         logger.info(f"🚀 USGS DEM ROUTE CALLED - Processing USGS DEM for polygon {polygon_id}")
         logger.info(f"📊 USGS DEM Request data: {data}")
         
-        # PHASE 1: USGS DEM-specific preparation (download, merge, reproject, clip)
-        logger.info("PHASE 1: Starting USGS DEM data preparation (download, merge, reproject, clip)")
+        # Stage timings are stored with the analysis
+        with recording(polygon_id, 'usgs-dem'):
+            # PHASE 1: USGS DEM-specific preparation (download, merge, reproject, clip)
+            logger.info("PHASE 1: Starting USGS DEM data preparation (download, merge, reproject, clip)")
         
-        # Process USGS DEM
-        dem_path = process_usgs_dem(polygon_geometry, polygon_id)
+            # Process USGS DEM
+            dem_path = process_usgs_dem(polygon_geometry, polygon_id)
         
-        if not dem_path:
-            return jsonify_with_cors({
-                'status': 'error',
-                'message': 'USGS DEM preparation failed to produce a clipped DEM file'
-            }), 500
+            if not dem_path:
+                return jsonify_with_cors({
+                    'status': 'error',
+                    'message': 'USGS DEM preparation failed to produce a clipped DEM file'
+                }), 500
             
-        logger.info(f"PHASE 1: USGS DEM ready at {dem_path}. Proceeding to unified analysis.")
-        
-        # PHASE 2: Unified analysis & visualization (using proven SRTM logic)
-        logger.info("PHASE 2: Starting unified analysis & visualization (using SRTM logic)")
-        from services.dem_processor import process_dem_files
-        
-        # Use unified DEM pipeline with USGS DEM file
-        results = process_dem_files(
-            [dem_path],  # Pass as list to match DEM function signature
-            polygon_geometry,
-            f"/app/data/polygon_sessions/{polygon_id}",
-            'usgs-dem'  # Specify data source
-        )
-        
-        if not results or not results.get('image'):
-            return jsonify_with_cors({
-                'status': 'error',
-                'message': 'USGS DEM analysis failed to produce visualization'
-            }), 500
-        
-        # PHASE 3: Calculate statistics and save to database
-        logger.info("PHASE 3: Calculating statistics and saving USGS DEM analysis results to database")
-        from services.database import DatabaseService
-        from services.analysis_statistics import calculate_terrain_statistics
-        
-        db_service = DatabaseService()
-        
-        # Calculate statistics for USGS DEM data
-        logger.info("Calculating USGS DEM terrain statistics...")
-        statistics = calculate_terrain_statistics(
-            dem_path=dem_path,
-            slope_path=None,  # USGS DEM doesn't have slope/aspect files yet
-            aspect_path=None,
-            bounds=results.get('bounds', {}),
-            data_source='usgs-dem'  # Pass data source for appropriate NoData handling
-        )
-        logger.info(f"USGS DEM statistics calculated: {statistics}")
-        
-        # Prepare analysis data for database (following SRTM/LiDAR pattern)
-        analysis_data = {
-            'dem_path': dem_path,  # Store USGS DEM in dem_path field
-            'visualization_path': results.get('visualization_path'),
-            'data_source': 'usgs-dem'
-        }
+            logger.info(f"PHASE 1: USGS DEM ready at {dem_path}. Proceeding to unified analysis.")
+        
+            # PHASE 2: Unified analysis & visualization (using proven SRTM logic)
+            logger.info("PHASE 2: Starting unified analysis & visualization (using SRTM logic)")
+            from services.dem_processor import process_dem_files
+        
+            # Use unified DEM pipeline with USGS DEM file
+            results = process_dem_files(
+                [dem_path],  # Pass as list to match DEM function signature
+                polygon_geometry,
+                f"/app/data/polygon_sessions/{polygon_id}",
+                'usgs-dem'  # Specify data source
+            )
+        
+            if not results or not results.get('image'):
+                return jsonify_with_cors({
+                    'status': 'error',
+                    'message': 'USGS DEM analysis failed to produce visualization'
+                }), 500
+        
+            # PHASE 3: Calculate statistics and save to database
+            logger.info("PHASE 3: Calculating statistics and saving USGS DEM analysis results to database")
+            from services.database import DatabaseService
+            from services.analysis_statistics import calculate_terrain_statistics
+        
+            db_service = DatabaseService()
+        
+            # Calculate statistics for USGS DEM data
+            logger.info("Calculating USGS DEM terrain statistics...")
+            with stage('statistics'):
+                statistics = calculate_terrain_statistics(
+                    dem_path=dem_path,
+                    slope_path=None,  # USGS DEM doesn't have slope/aspect files yet
+                    aspect_path=None,
+                    bounds=results.get('bounds', {}),
+                    data_source='usgs-dem'  # Pass data source for appropriate NoData handling
+                )
+            logger.info(f"USGS DEM statistics calculated: {statistics}")
+        
+            # Prepare analysis data for database (following SRTM/LiDAR pattern)
+            analysis_data = {
+                'dem_path': dem_path,  # Store USGS DEM in dem_path field
+                'visualization_path': results.get('visualization_path'),
+                'data_source': 'usgs-dem'
+            }
         
-        # Add statistics at root level (not nested)
-        analysis_data.update(statistics)
+            # Add statistics at root level (not nested)
+            analysis_data.update(statistics)
+            analysis_data['processing_steps'] = current_recorder().processing_steps()
         
-        # Save analysis results to database with user_id
-        save_result = db_service.save_analysis_results(polygon_id, analysis_data, user_id)
+            # Save analysis results to database with user_id
+            with stage('db_save'):
+                save_result = db_service.save_analysis_results(polygon_id, analysis_data, user_id)
+            if save_result and save_result.get('status') == 'success':
+                db_service.update_processing_steps(polygon_id, current_recorder().processing_steps())
         
         if save_result and save_result.get('status') == 'success':
             logger.info(f"✅ USGS DEM analysis results saved successfully for {polygon_id}")
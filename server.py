@@ -141,6 +141,15 @@ except Exception as e:
     logger.error(f"Failed to register routes: {str(e)}")
     # Continue without modular routes - we have direct routes defined above
 
+# --- BACKGROUND JOBS ---
+# Every worker runs executor slots draining the persistent job queue, so jobs
+# queued by any worker (or left behind by a restarted one) get processed
+try:
+    from services.background_processor import start_job_executor
+    start_job_executor()
+except Exception as e:
+    logger.error(f"Failed to start background job executor: {str(e)}")
+
 # --- DEBUG: PRINT ALL REGISTERED ROUTES ---
 logger.info("=== FLASK ROUTE MAP ===")
 for rule in app.url_map.iter_rules():
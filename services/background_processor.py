@@ -1,21 +1,27 @@
 """
-Simple background processing without Celery
-Uses Python threading for immediate background processing
+Background terrain processing without Celery
+Jobs are stored in the persistent job queue, so any worker can report their
+status and queued work survives restarts; executor threads in every worker
+drain the queue. Jobs can be cancelled while queued or running, and each
+attempt runs under a time budget
 """
-import threading
+import hashlib
 import logging
 import time
+import uuid
 from typing import Dict, Any, Optional
 from services.srtm import get_srtm_data
-from services.dem_processor import process_dem_files
-from services.terrain import (
-    calculate_slopes, calculate_aspect, calculate_geomorphons,
-    calculate_hypsometrically_tinted_hillshade, calculate_drainage_network,
-    generate_contours
-)
+from services.dem_processor import process_dem_files, gradient_outputs
+from services.pipeline import run_terrain_pipeline
+from utils.config import SAVE_DIRECTORY
 from services.database import DatabaseService
 from services.analysis_statistics import calculate_terrain_statistics
-from concurrent.futures import ThreadPoolExecutor
+from services.job_queue import job_queue, job_executor, PermanentJobError
+from services.instrumentation import recording, current_recorder, stage
+from utils.priority import BULK
+from utils.cancellation import (
+    OperationCancelled, current_token, raise_if_cancelled, track_output, cancel as cancel_operation
+)
 import os
 import json
 
@@ -24,138 +30,222 @@ logger = logging.getLogger(__name__)
 # Initialize database service
 db_service = DatabaseService()
 
-# Global task status tracking
-task_status = {}
+# Job kind handled by this module
+TERRAIN_ANALYSIS_JOB = 'terrain_analysis'
+
+# Status message of tasks cancelled through the API
+CANCELLED_MESSAGE = 'Cancelled by user'
 
-def run_terrain_analysis(polygon_id: str, geojson_data: Dict[str, Any], data_source: str = 'srtm') -> str:
+def analysis_dedupe_key(polygon_id: str, geojson_data: Dict[str, Any], data_source: str, **params) -> str:
     """
-    Start background terrain processing
+    Identity of a polygon analysis for coalescing duplicate submissions
+    
+    The geometry is normalized (ring orientation and start vertex) before
+    hashing, so the same polygon re-sent by another tab maps to the same key.
     
     Args:
-        polygon_id: Unique identifier for the polygon
-        geojson_data: GeoJSON polygon data
+        polygon_id: Polygon identifier (outputs are written per polygon)
+        geojson_data: GeoJSON Feature or geometry
         data_source: 'srtm' or 'lidar'
+        **params: Any other parameters that change the result
         
     Returns:
-        str: Task ID for status tracking
+        str: Hex SHA-256 key
     """
-    task_id = f"task_{polygon_id}_{int(time.time())}"
+    from shapely.geometry import shape
     
-    # Initialize task status
-    task_status[task_id] = {
-        'status': 'PROGRESS',
-        'message': 'Starting terrain processing',
+    geometry = geojson_data.get('geometry', geojson_data) if geojson_data.get('type') == 'Feature' else geojson_data
+    geometry_hash = hashlib.sha256(shape(geometry).normalize().wkb).hexdigest()
+    identity = json.dumps({
         'polygon_id': polygon_id,
+        'geometry': geometry_hash,
         'data_source': data_source,
-        'progress': 0
-    }
+        'params': params
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+def run_terrain_analysis(polygon_id: str, geojson_data: Dict[str, Any], data_source: str = 'srtm',
+                         lane: str = BULK) -> str:
+    """
+    Queue background terrain processing
+    
+    A submission identical to a queued or running one (same polygon, geometry
+    and data source, from any worker) returns the existing task id.
     
-    # Start background thread
-    thread = threading.Thread(
-        target=_process_terrain_worker,
-        args=(task_id, polygon_id, geojson_data, data_source),
-        daemon=True
+    Args:
+        polygon_id: Unique identifier for the polygon
+        geojson_data: GeoJSON polygon data
+        data_source: 'srtm' or 'lidar'
+        lane: Priority lane of the job ('interactive' or 'bulk')
+        
+    Returns:
+        str: Task ID for status tracking
+    """
+    task_id = f"task_{polygon_id}_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+    
+    queued_id = job_queue.enqueue(
+        TERRAIN_ANALYSIS_JOB,
+        {'polygon_id': polygon_id, 'geojson_data': geojson_data, 'data_source': data_source},
+        job_id=task_id,
+        message='Queued for terrain processing',
+        dedupe_key=analysis_dedupe_key(polygon_id, geojson_data, data_source),
+        lane=lane
     )
-    thread.start()
+    if queued_id != task_id:
+        logger.info(f"🔗 {polygon_id} is already being processed, attached to task {queued_id}")
+        return queued_id
+    
+    # Make sure this worker drains the queue and wake an idle slot
+    start_job_executor()
+    job_executor.notify()
     
-    logger.info(f"🚀 Started background processing for {polygon_id} (task: {task_id})")
+    logger.info(f"🚀 Queued background processing for {polygon_id} (task: {task_id}, {lane} lane)")
     return task_id
 
-def _process_terrain_worker(task_id: str, polygon_id: str, geojson_data: Dict[str, Any], data_source: str):
+def start_job_executor():
+    """Register the terrain and batch handlers and start this worker's executor slots"""
+    from services.batch_processor import BATCH_ANALYSIS_JOB, process_batch_job
+    job_executor.register(TERRAIN_ANALYSIS_JOB, _process_terrain_job)
+    job_executor.register(BATCH_ANALYSIS_JOB, process_batch_job)
+    job_executor.start()
+
+def _set_progress(task_id: str, message: str, progress: int):
+    """
+    Record job progress in the queue so every worker can report it
+    
+    Progress updates double as cancellation checkpoints.
+    
+    Raises:
+        OperationCancelled: If the job has been cancelled or ran out of time
+    """
+    raise_if_cancelled()
+    job_queue.update(task_id, message=message, progress=progress)
+
+def _aborted_status() -> str:
+    """Polygon status after an aborted run ('cancelled' when the user stopped it)"""
+    token = current_token()
+    return 'cancelled' if token is not None and token.cancelled and not token.timed_out else 'error'
+
+def _process_terrain_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Job queue handler for terrain analysis jobs"""
+    payload = job['payload']
+    return _process_terrain_worker(job['id'], payload['polygon_id'], payload['geojson_data'], payload['data_source'])
+
+def _process_terrain_worker(task_id: str, polygon_id: str, geojson_data: Dict[str, Any], data_source: str) -> Dict[str, Any]:
     """
     Background worker function for terrain processing
+    
+    Returns:
+        dict: Job results; raises on failure so the queue can retry
     """
     try:
-        # Update task status
-        task_status[task_id]['status'] = 'PROGRESS'
-        task_status[task_id]['message'] = 'Updating database status'
-        task_status[task_id]['progress'] = 10
+        _set_progress(task_id, 'Updating database status', 10)
         
         # Update database status
         db_service.update_polygon_status(polygon_id, 'processing')
         
-        if data_source == 'srtm':
-            _process_srtm_terrain(task_id, polygon_id, geojson_data)
-        elif data_source == 'lidar':
-            _process_lidar_terrain(task_id, polygon_id, geojson_data)
-        else:
-            raise ValueError(f"Unknown data source: {data_source}")
+        # Stage timings of the attempt are stored with the analysis
+        with recording(polygon_id, data_source):
+            if data_source == 'srtm':
+                return _process_srtm_terrain(task_id, polygon_id, geojson_data)
+            elif data_source == 'lidar':
+                return _process_lidar_terrain(task_id, polygon_id, geojson_data)
+            else:
+                raise PermanentJobError(f"Unknown data source: {data_source}")
             
+    except OperationCancelled:
+        db_service.update_polygon_status(polygon_id, _aborted_status())
+        raise
     except Exception as e:
         logger.error(f"❌ Background processing failed for {polygon_id}: {str(e)}", exc_info=True)
-        task_status[task_id]['status'] = 'FAILURE'
-        task_status[task_id]['message'] = f'Processing failed: {str(e)}'
-        task_status[task_id]['progress'] = 0
-        db_service.update_polygon_status(polygon_id, 'error')
+        db_service.update_polygon_status(polygon_id, _aborted_status())
         raise
 
 def _process_srtm_terrain(task_id: str, polygon_id: str, geojson_data: Dict[str, Any]):
     """Process SRTM terrain data - CRITICAL: Always updates database status"""
     try:
         # Step 1: Fetch SRTM data
-        task_status[task_id]['message'] = 'Fetching SRTM data'
-        task_status[task_id]['progress'] = 20
+        _set_progress(task_id, 'Fetching SRTM data', 20)
         
         srtm_files = get_srtm_data(geojson_data)
         if not srtm_files:
             raise ValueError("No SRTM data available for the specified area")
         
         # Step 2: Process SRTM files (now returns partial data on visualization failure)
-        task_status[task_id]['message'] = 'Processing SRTM files'
-        task_status[task_id]['progress'] = 40
+        _set_progress(task_id, 'Processing SRTM files', 40)
         
-        srtm_results = process_dem_files(srtm_files, geojson_data, output_folder, 'srtm')
-        if not srtm_results:
+        output_dir = os.path.join(SAVE_DIRECTORY, "polygon_sessions", polygon_id)
+        os.makedirs(output_dir, exist_ok=True)
+        srtm_results = process_dem_files(srtm_files, geojson_data, output_dir, 'srtm')
+        if not srtm_results or 'clipped_dem_path' not in srtm_results:
             raise ValueError("Failed to process SRTM files")
+        # Slope and aspect come from the fused metrics pass on the clipped DEM
+        precomputed = gradient_outputs(srtm_results)
+        track_output(srtm_results['clipped_dem_path'], *precomputed.values())
         
-        # Step 3: Parallel terrain analysis
-        task_status[task_id]['message'] = 'Running terrain analysis'
-        task_status[task_id]['progress'] = 60
+        # Step 3: Terrain analysis and statistics, each stage starting as soon
+        # as its inputs exist
+        _set_progress(task_id, 'Running terrain analysis', 60)
         
-        terrain_results = _process_terrain_parallel(
-            srtm_results['clipped_srtm_path'], 
-            polygon_id
-        )
+        def on_stage(name, result, finished, total):
+            # Spread the terrain stages over 60-75% so streams see each one
+            # (not a checkpoint: the pipeline handles its own cancellation)
+            verb = 'completed' if result.success else result.status
+            job_queue.update(task_id, message=f"Terrain analysis: {name} {verb} ({finished}/{total})",
+                             progress=60 + (15 * finished) // total)
+        
+        with stage('terrain_pipeline'):
+            terrain_results = run_terrain_pipeline(
+                srtm_results['clipped_dem_path'],
+                output_dir,
+                polygon_id,
+                contour_interval=10,
+                statistics_bounds=srtm_results.get('bounds', {}),
+                on_stage=on_stage,
+                precomputed=precomputed
+            )
         
-        # Step 4: Calculate comprehensive statistics
-        task_status[task_id]['message'] = 'Calculating statistics'
-        task_status[task_id]['progress'] = 75
+        # Step 4: Statistics come from the pipeline; fall back to DEM-only
+        # statistics if slope or aspect failed
+        _set_progress(task_id, 'Calculating statistics', 75)
         
-        # Calculate terrain statistics using the statistics service
-        statistics = calculate_terrain_statistics(
-            srtm_path=srtm_results.get('clipped_srtm_path'),
-            slope_path=terrain_results.get('slope', {}).get('path'),
-            aspect_path=terrain_results.get('aspect', {}).get('path'),
-            bounds=srtm_results.get('bounds', {})
-        )
+        statistics = terrain_results.pop('statistics', None)
+        if statistics is None:
+            with stage('statistics'):
+                statistics = calculate_terrain_statistics(
+                    dem_path=srtm_results['clipped_dem_path'],
+                    slope_path=terrain_results.get('slope', {}).get('path'),
+                    aspect_path=terrain_results.get('aspect', {}).get('path'),
+                    bounds=srtm_results.get('bounds', {})
+                )
         
         # Prepare analysis data for database
         analysis_data = {
-            'srtm_path': srtm_results.get('clipped_srtm_path'),
+            'srtm_path': srtm_results.get('clipped_dem_path'),
             'visualization_path': srtm_results.get('visualization_path'),
             'slope_path': terrain_results.get('slope', {}).get('path'),
             'aspect_path': terrain_results.get('aspect', {}).get('path'),
             'contours_path': terrain_results.get('contours', {}).get('path'),
-            'statistics': statistics
+            'statistics': statistics,
+            'processing_steps': current_recorder().processing_steps()
         }
         
         # Step 5: Save analysis results to database
-        task_status[task_id]['message'] = 'Saving results'
-        task_status[task_id]['progress'] = 80
+        _set_progress(task_id, 'Saving results', 80)
         
         # Save analysis results to database
-        save_result = db_service.save_analysis_results(polygon_id, analysis_data)
+        with stage('db_save'):
+            save_result = db_service.save_analysis_results(polygon_id, analysis_data)
         
         if save_result and save_result.get('status') == 'success':
+            # Complete the stored timings with the save itself
+            db_service.update_processing_steps(polygon_id, current_recorder().processing_steps())
             # Set status to 'completed' only on successful save
             db_service.update_polygon_status(polygon_id, 'completed')
             logger.info(f"✅ Analysis results saved successfully for {polygon_id}")
             
-            # Update task status to success
-            task_status[task_id]['status'] = 'SUCCESS'
-            task_status[task_id]['message'] = 'Terrain analysis completed successfully'
-            task_status[task_id]['progress'] = 100
-            task_status[task_id]['results'] = {
+            # Results are stored with the job when the handler returns
+            return {
                 'srtm_results': srtm_results,
                 'terrain_results': terrain_results,
                 'analysis_saved': True
@@ -166,106 +256,101 @@ def _process_srtm_terrain(task_id: str, polygon_id: str, geojson_data: Dict[str,
             logger.error(f"❌ CRITICAL: FAILED to save analysis results for {polygon_id}: {error_message}")
             db_service.update_polygon_status(polygon_id, 'failed')  # Use 'failed' instead of 'analysis_save_failed'
             
-            task_status[task_id]['status'] = 'FAILURE'
-            task_status[task_id]['message'] = f'Database save failed: {error_message}'
-            task_status[task_id]['progress'] = 80
+            raise PermanentJobError(f'Database save failed: {error_message}')
         
+    except (PermanentJobError, OperationCancelled):
+        raise
     except Exception as e:
         logger.error(f"❌ SRTM processing failed for {polygon_id}: {str(e)}", exc_info=True)
-        db_service.update_polygon_status(polygon_id, 'error')
-        task_status[task_id]['status'] = 'FAILURE'
-        task_status[task_id]['message'] = f'SRTM processing failed: {str(e)}'
-        task_status[task_id]['progress'] = 0
-        raise
+        db_service.update_polygon_status(polygon_id, _aborted_status())
+        raise RuntimeError(f'SRTM processing failed: {str(e)}') from e
 
 def _process_lidar_terrain(task_id: str, polygon_id: str, geojson_data: Dict[str, Any]):
     """Process LiDAR terrain data"""
     # TODO: Implement LiDAR processing
     logger.warning("LiDAR processing not yet implemented")
-    task_status[task_id]['status'] = 'FAILURE'
-    task_status[task_id]['message'] = 'LiDAR processing not yet implemented'
-    task_status[task_id]['progress'] = 0
+    raise PermanentJobError('LiDAR processing not yet implemented')
 
-def _process_terrain_parallel(srtm_path: str, polygon_id: str) -> Dict[str, Any]:
-    """Process all terrain operations in parallel"""
-    output_dir = f"/app/data/polygon_sessions/{polygon_id}"
-    os.makedirs(output_dir, exist_ok=True)
+def get_task_status(task_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Get the status of a background task (from any worker)
     
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        # Submit all terrain operations concurrently
-        futures = {
-            'slope': executor.submit(
-                calculate_slopes, 
-                srtm_path, 
-                f"{output_dir}/slope.tif"
-            ),
-            'aspect': executor.submit(
-                calculate_aspect, 
-                srtm_path, 
-                f"{output_dir}/aspect.tif"
-            ),
-            'geomorphons': executor.submit(
-                calculate_geomorphons, 
-                srtm_path, 
-                f"{output_dir}/geomorphons.tif"
-            ),
-            'hillshade': executor.submit(
-                calculate_hypsometrically_tinted_hillshade, 
-                srtm_path, 
-                f"{output_dir}/hillshade.tif"
-            ),
-            'drainage': executor.submit(
-                calculate_drainage_network, 
-                srtm_path, 
-                f"{output_dir}/drainage.tif"
-            ),
-            'contours': executor.submit(
-                generate_contours, 
-                srtm_path, 
-                f"{output_dir}/contours.geojson",
-                10  # 10m contour interval
-            )
-        }
+    Args:
+        task_id: Task identifier
         
-        # Wait for all operations to complete
-        results = {}
-        for name, future in futures.items():
-            try:
-                success = future.result(timeout=300)  # 5-minute timeout per operation
-                results[name] = {
-                    'success': success,
-                    'path': f"{output_dir}/{name}.{'tif' if name != 'contours' else 'geojson'}"
-                }
-                logger.info(f"✅ {name} processing completed: {success}")
-            except Exception as e:
-                logger.error(f"❌ {name} processing failed: {str(e)}")
-                results[name] = {'success': False, 'error': str(e)}
-                
-        return results
+    Returns:
+        dict: Task status information or None if not found
+    """
+    job = job_queue.get(task_id)
+    if not job:
+        return None
+    
+    payload = job.get('payload') or {}
+    return {
+        'status': job['status'],
+        'message': job['message'],
+        'progress': job['progress'],
+        'polygon_id': payload.get('polygon_id'),
+        'data_source': payload.get('data_source'),
+        'attempts': job['attempts'],
+        'lane': job['lane'],
+        'queue_position': job_queue.queue_position(task_id) if job['status'] == 'QUEUED' else None,
+        'revision': job['revision'],
+        'results': job['result']
+    }
 
-def get_task_status(task_id: str) -> Optional[Dict[str, Any]]:
+def cancel_task(task_id: str) -> Optional[str]:
     """
-    Get the status of a background task
+    Cancel a background task, or a synchronous request started with this id,
+    from any worker
     
     Args:
         task_id: Task identifier
         
     Returns:
-        dict: Task status information or None if not found
+        str: 'cancelled' (it will not run), 'cancelling' (it is running and
+        stops shortly), 'finished' (already done) or None if unknown
     """
-    return task_status.get(task_id)
+    outcome = job_queue.request_cancel(task_id, CANCELLED_MESSAGE)
+    if outcome is None:
+        # Synchronous requests are not queued but run in a cancellation scope
+        return 'cancelling' if cancel_operation(task_id, CANCELLED_MESSAGE) else None
+    
+    if outcome == 'cancelling':
+        # Stops the job at once if it runs on this host; otherwise its
+        # executor picks up the flag on the next heartbeat
+        cancel_operation(task_id, CANCELLED_MESSAGE)
+    logger.info(f"🛑 Cancellation of task {task_id}: {outcome}")
+    return outcome
 
-def cleanup_completed_tasks():
-    """Clean up completed tasks older than 1 hour"""
-    current_time = time.time()
-    tasks_to_remove = []
+def get_task_revision(task_id: str) -> Optional[int]:
+    """
+    Get the revision counter of a task (bumped on every status change)
     
-    for task_id, status in task_status.items():
-        if status.get('status') in ['SUCCESS', 'FAILURE']:
-            # Check if task is older than 1 hour
-            if current_time - int(task_id.split('_')[-1]) > 3600:
-                tasks_to_remove.append(task_id)
+    Args:
+        task_id: Task identifier
+        
+    Returns:
+        int: Revision, or None if the task is unknown
+    """
+    return job_queue.get_revision(task_id)
+
+def wait_for_task_change(task_id: str, revision: int, timeout: float) -> Optional[int]:
+    """
+    Block until a task's status changes past the given revision
     
-    for task_id in tasks_to_remove:
-        del task_status[task_id]
-        logger.info(f"🧹 Cleaned up completed task: {task_id}")
+    Args:
+        task_id: Task identifier
+        revision: Last revision seen by the caller
+        timeout: Maximum seconds to wait
+        
+    Returns:
+        int: Current revision, or None if the task is unknown
+    """
+    return job_queue.wait_for_change(task_id, revision, timeout)
+
+def cleanup_completed_tasks():
+    """Clean up completed tasks older than 1 hour"""
+    removed = job_queue.cleanup(3600)
+    if removed:
+        logger.info(f"🧹 Cleaned up {removed} completed tasks")
@@ -0,0 +1,613 @@
+"""
+Batch polygon analysis
+
+A batch is a GeoJSON FeatureCollection analysed as one queued job. Features
+lying close together form a cluster, up to a maximum extent, that shares a
+single DEM mosaic cut to the union of their bounds plus a margin. All polygons of the cluster are
+burned into one label raster in a single pass, the terrain derivatives run
+once on the cluster mosaic, and every output is then clipped per polygon into
+the polygon's session folder. Each feature gets its own status, outputs,
+statistics and analysis record, so one failed polygon does not fail the batch.
+"""
+import os
+import re
+import json
+import shutil
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import rasterio
+from rasterio.merge import merge
+from rasterio.features import rasterize, geometry_mask
+from rasterio.windows import Window
+from shapely.geometry import shape, mapping, box
+
+from services.srtm import get_srtm_data, SRTM_CELL_DEGREES
+from services.pipeline import run_terrain_pipeline
+from services.analysis_statistics import calculate_terrain_statistics
+from services.job_queue import job_queue, job_executor, PermanentJobError
+from services.background_processor import db_service, start_job_executor
+from utils.config import (
+    SAVE_DIRECTORY, BATCH_CLUSTER_GAP_DEGREES, BATCH_MARGIN_CELLS, BATCH_MAX_FEATURES, BATCH_MAX_CLUSTER_DEGREES
+)
+from utils.file_io import save_geojson
+from utils.priority import BULK
+from utils.cancellation import OperationCancelled, raise_if_cancelled
+from services.instrumentation import recording, current_recorder, stage
+
+logger = logging.getLogger(__name__)
+
+# Job kind handled by this module
+BATCH_ANALYSIS_JOB = 'batch_analysis'
+
+# Data sources a batch can be computed from
+BATCH_DATA_SOURCES = ('srtm',)
+
+# Standard SRTM nodata value
+SRTM_NODATA = -32768
+
+# Same edge buffer as the single polygon clip in DEMProcessor
+CLIP_BUFFER = 0.0001
+
+# Feature ids become folder names
+FEATURE_ID_PATTERN = re.compile(r'^[A-Za-z0-9_.-]+$')
+
+# Clipped rasters written per feature: output name -> file name
+RASTER_OUTPUTS = {
+    'slope': 'slope.tif',
+    'aspect': 'aspect.tif',
+    'geomorphons': 'geomorphons.tif',
+    'hillshade': 'hillshade.tif',
+    'drainage': 'drainage.tif'
+}
+
+
+def parse_feature_collection(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Validate a batch and give every feature an id
+
+    Ids come from the feature 'id', then properties.id; features without one
+    get an id derived from their geometry.
+
+    Args:
+        data: GeoJSON FeatureCollection of Polygon or MultiPolygon features
+
+    Returns:
+        list: GeoJSON Features, each with a string 'id'
+
+    Raises:
+        ValueError: If the collection or one of its features is invalid
+    """
+    if not isinstance(data, dict) or data.get('type') != 'FeatureCollection':
+        raise ValueError('Expected a GeoJSON FeatureCollection')
+    features = data.get('features') or []
+    if not features:
+        raise ValueError('The FeatureCollection has no features')
+    if len(features) > BATCH_MAX_FEATURES:
+        raise ValueError(f"A batch takes at most {BATCH_MAX_FEATURES} features ({len(features)} given)")
+
+    parsed = []
+    seen = set()
+    for index, feature in enumerate(features):
+        geometry_data = feature.get('geometry') if isinstance(feature, dict) else None
+        if not geometry_data or geometry_data.get('type') not in ('Polygon', 'MultiPolygon'):
+            raise ValueError(f"Feature {index} is not a Polygon or MultiPolygon")
+        try:
+            geometry = shape(geometry_data)
+        except Exception as e:
+            raise ValueError(f"Feature {index} has an invalid geometry: {str(e)}")
+        if geometry.is_empty:
+            raise ValueError(f"Feature {index} has an empty geometry")
+
+        properties = feature.get('properties') or {}
+        feature_id = feature.get('id') or properties.get('id')
+        if feature_id is None:
+            digest = hashlib.sha256(geometry.normalize().wkb).hexdigest()
+            feature_id = f"batch_{digest[:12]}_{index}"
+        feature_id = str(feature_id)
+        if not FEATURE_ID_PATTERN.match(feature_id):
+            raise ValueError(f"Feature id '{feature_id}' may only contain letters, digits, '_', '-' and '.'")
+        if feature_id in seen:
+            raise ValueError(f"Duplicate feature id '{feature_id}'")
+        seen.add(feature_id)
+
+        parsed.append({'type': 'Feature', 'id': feature_id, 'properties': properties, 'geometry': geometry_data})
+    return parsed
+
+
+def cluster_features(features: List[Dict[str, Any]], gap: float = BATCH_CLUSTER_GAP_DEGREES,
+                     max_extent: float = BATCH_MAX_CLUSTER_DEGREES) -> List[List[int]]:
+    """
+    Group features whose bounding boxes lie within gap degrees of each other
+
+    Two groups are not merged when their union would be wider or higher than
+    max_extent, so a long chain of neighbours ends up in several clusters of
+    bounded mosaic size. A single feature larger than max_extent stays a
+    cluster of its own.
+
+    Args:
+        features: GeoJSON Features
+        gap: Largest distance (degrees) between bounding boxes of one cluster
+        max_extent: Largest width and height (degrees) of a cluster's bounds
+
+    Returns:
+        list: Clusters as lists of feature indices, in input order
+    """
+    bounds = [shape(feature['geometry']).bounds for feature in features]
+    boxes = [box(*b).buffer(gap / 2, join_style=2) for b in bounds]
+    parent = list(range(len(features)))
+    # Union of the bounds of each root's cluster
+    extent = list(bounds)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i in range(len(boxes)):
+        for j in range(i + 1, len(boxes)):
+            root_i, root_j = find(i), find(j)
+            if root_i == root_j or not boxes[i].intersects(boxes[j]):
+                continue
+            a, b = extent[root_i], extent[root_j]
+            merged = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+            if merged[2] - merged[0] > max_extent or merged[3] - merged[1] > max_extent:
+                continue
+            parent[root_j] = root_i
+            extent[root_i] = merged
+
+    clusters: Dict[int, List[int]] = {}
+    for i in range(len(features)):
+        clusters.setdefault(find(i), []).append(i)
+    return list(clusters.values())
+
+
+def batch_dedupe_key(features: List[Dict[str, Any]], data_source: str) -> str:
+    """
+    Identity of a batch for coalescing duplicate submissions
+
+    The job type is hashed in, keeping the key apart from other jobs' keys
+    while fitting the 64-character jobs.dedupe_key column.
+    """
+    identity = json.dumps({'job': BATCH_ANALYSIS_JOB, 'features': features, 'data_source': data_source},
+                          sort_keys=True, default=str)
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+
+def run_batch_analysis(features: List[Dict[str, Any]], data_source: str = 'srtm',
+                       user_id: Optional[str] = None, lane: str = BULK) -> str:
+    """
+    Queue a batch analysis
+
+    Args:
+        features: Features returned by parse_feature_collection
+        data_source: One of BATCH_DATA_SOURCES
+        user_id: Optional owner of the analysis records
+        lane: Priority lane of the job
+
+    Returns:
+        str: Task ID for status tracking (an identical queued or running
+        batch returns its own id)
+    """
+    task_id = job_queue.enqueue(
+        BATCH_ANALYSIS_JOB,
+        {'features': features, 'data_source': data_source, 'user_id': user_id},
+        message=f"Queued batch of {len(features)} polygons",
+        dedupe_key=batch_dedupe_key(features, data_source),
+        lane=lane
+    )
+
+    start_job_executor()
+    job_executor.notify()
+
+    logger.info(f"🚀 Queued batch analysis of {len(features)} polygons (task: {task_id}, {lane} lane)")
+    return task_id
+
+
+def get_batch_status(task_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Get the status of a batch with one entry per feature
+
+    Args:
+        task_id: Task identifier
+
+    Returns:
+        dict: Batch status, or None if there is no such batch
+    """
+    job = job_queue.get(task_id)
+    if not job or job['kind'] != BATCH_ANALYSIS_JOB:
+        return None
+
+    result = job['result'] or {}
+    features = result.get('features') or [
+        {'id': feature['id'], 'status': 'pending'} for feature in job['payload']['features']
+    ]
+    return {
+        'task_id': task_id,
+        'status': job['status'],
+        'message': job['message'],
+        'progress': job['progress'],
+        'attempts': job['attempts'],
+        'lane': job['lane'],
+        'queue_position': job_queue.queue_position(task_id) if job['status'] == 'QUEUED' else None,
+        'features': features
+    }
+
+
+def process_batch_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Job queue handler for batch analyses
+
+    Returns:
+        dict: 'features' (per-feature status, outputs and statistics) and the
+        completed/failed counts; raises if no feature succeeded so the queue
+        can retry
+    """
+    task_id = job['id']
+    payload = job['payload']
+    features = payload['features']
+    if payload.get('data_source', 'srtm') not in BATCH_DATA_SOURCES:
+        raise PermanentJobError(f"Unsupported batch data source: {payload.get('data_source')}")
+
+    statuses = [{'id': feature['id'], 'status': 'pending'} for feature in features]
+    clusters = cluster_features(features)
+    work_dir = os.path.join(SAVE_DIRECTORY, 'batch_runs', task_id)
+    logger.info(f"📦 Batch {task_id}: {len(features)} polygons in {len(clusters)} clusters")
+
+    try:
+        for number, members in enumerate(clusters):
+            raise_if_cancelled()
+            for index in members:
+                statuses[index]['status'] = 'processing'
+            job_queue.update(task_id, message=f"Processing cluster {number + 1}/{len(clusters)} ({len(members)} polygons)",
+                             progress=5 + (90 * number) // len(clusters), result={'features': statuses})
+
+            cluster_dir = os.path.join(work_dir, f"cluster_{number}")
+            try:
+                with recording(f"{task_id} cluster {number + 1}", 'srtm'):
+                    _process_cluster(task_id, features, members, statuses, cluster_dir, payload.get('user_id'))
+            except OperationCancelled:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Batch {task_id} cluster {number + 1} failed: {str(e)}", exc_info=True)
+                for index in members:
+                    if statuses[index]['status'] != 'completed':
+                        statuses[index].update({'status': 'failed', 'error': str(e)})
+            finally:
+                shutil.rmtree(cluster_dir, ignore_errors=True)
+    except OperationCancelled:
+        for index, status in enumerate(statuses):
+            if status['status'] in ('pending', 'processing'):
+                status['status'] = 'cancelled'
+                db_service.update_polygon_status(features[index]['id'], 'cancelled')
+        job_queue.update(task_id, result={'features': statuses})
+        raise
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    completed = sum(1 for status in statuses if status['status'] == 'completed')
+    failed = len(statuses) - completed
+    if not completed:
+        job_queue.update(task_id, result={'features': statuses})
+        raise RuntimeError(f"All {len(statuses)} polygons of the batch failed")
+
+    logger.info(f"✅ Batch {task_id}: {completed} polygons completed, {failed} failed")
+    return {'features': statuses, 'completed': completed, 'failed': failed}
+
+
+def _process_cluster(task_id: str, features: List[Dict[str, Any]], members: List[int],
+                     statuses: List[Dict[str, Any]], cluster_dir: str, user_id: Optional[str]) -> None:
+    """
+    Analyse one cluster: shared mosaic, one label pass, one pipeline run,
+    then per-feature clipping
+
+    Raises:
+        OperationCancelled: If the batch was cancelled
+        Exception: If the shared steps failed (the cluster's features fail)
+    """
+    os.makedirs(cluster_dir, exist_ok=True)
+    geometries = [shape(features[index]['geometry']) for index in members]
+
+    # Fetch the tiles of the whole cluster at once, margin included
+    west = min(geometry.bounds[0] for geometry in geometries)
+    south = min(geometry.bounds[1] for geometry in geometries)
+    east = max(geometry.bounds[2] for geometry in geometries)
+    north = max(geometry.bounds[3] for geometry in geometries)
+    margin = BATCH_MARGIN_CELLS * SRTM_CELL_DEGREES
+    srtm_files = get_srtm_data({
+        'type': 'Feature',
+        'geometry': mapping(box(west - margin, south - margin, east + margin, north + margin))
+    })
+    if not srtm_files:
+        raise ValueError('No SRTM data available for the cluster area')
+    raise_if_cancelled()
+
+    cluster_dem_path = os.path.join(cluster_dir, 'cluster_dem.tif')
+    with stage('merge', data_source='srtm', tiles=len(srtm_files)) as step:
+        transform, shape_2d = _write_cluster_mosaic(srtm_files, (west, south, east, north), cluster_dem_path)
+        step.annotate(width=shape_2d[1], height=shape_2d[0], dtype='float32')
+
+    # One pass labels every cell with the (1-based) member index covering it;
+    # features sharing cells with a neighbour are masked on their own below
+    clip_geometries = [geometry.buffer(CLIP_BUFFER) for geometry in geometries]
+    with stage('labels', features=len(members), width=shape_2d[1], height=shape_2d[0]):
+        labels = rasterize(
+            [(geometry, label + 1) for label, geometry in enumerate(clip_geometries)],
+            out_shape=shape_2d, transform=transform, fill=0, all_touched=True, dtype='int32'
+        )
+    shared = _features_sharing_cells(clip_geometries)
+    logger.info(f"🏷️ Labelled {len(members)} polygons on a {shape_2d[1]}x{shape_2d[0]} cluster grid "
+                f"({len(shared)} masked individually)")
+
+    # Derivatives once on the cluster mosaic (statistics are per feature)
+    def on_stage(name, result, finished, total):
+        verb = 'completed' if result.success else result.status
+        job_queue.update(task_id, message=f"Cluster analysis: {name} {verb} ({finished}/{total})")
+
+    with stage('terrain_pipeline'):
+        terrain_results = run_terrain_pipeline(cluster_dem_path, cluster_dir, f"{task_id} cluster", on_stage=on_stage)
+    raise_if_cancelled()
+
+    sources = {'dem': cluster_dem_path}
+    for name in RASTER_OUTPUTS:
+        if terrain_results.get(name, {}).get('success'):
+            sources[name] = terrain_results[name]['path']
+    contours_path = terrain_results.get('contours', {}).get('path') if terrain_results.get('contours', {}).get('success') else None
+    shared_stages = current_recorder().stages
+
+    for label, index in enumerate(members):
+        raise_if_cancelled()
+        feature = features[index]
+        try:
+            # Each feature records its own stages; the cluster stages are
+            # stored alongside as shared_stages
+            with recording(feature['id'], 'srtm'):
+                if label in shared:
+                    window, cell_mask = _feature_mask(clip_geometries[label], transform, shape_2d)
+                else:
+                    window, cell_mask = _label_mask(labels, label + 1)
+                if window is None:
+                    raise ValueError('The polygon does not cover any DEM cell')
+
+                outputs, statistics = _write_feature_outputs(
+                    feature, geometries[label], sources, contours_path, window, cell_mask,
+                    os.path.join(cluster_dir, f"feature_{label}")
+                )
+                statuses[index].update(_save_feature(
+                    feature, geometries[label], outputs, statistics, user_id,
+                    {'batch_task_id': task_id, 'cluster_features': len(members), 'shared_stages': shared_stages}
+                ))
+        except OperationCancelled:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Batch polygon {feature['id']} failed: {str(e)}", exc_info=True)
+            db_service.update_polygon_status(feature['id'], 'error')
+            statuses[index].update({'status': 'failed', 'error': str(e)})
+
+
+def _write_cluster_mosaic(srtm_files: List[str], bounds: Tuple[float, float, float, float],
+                          output_path: str) -> Tuple[Any, Tuple[int, int]]:
+    """
+    Mosaic the tiles over the cluster bounds plus BATCH_MARGIN_CELLS
+
+    Returns:
+        tuple: (transform, (height, width)) of the float32 mosaic written
+    """
+    sources = [rasterio.open(path) for path in srtm_files]
+    try:
+        x_res, y_res = sources[0].res
+        west, south, east, north = bounds
+        margin_x, margin_y = BATCH_MARGIN_CELLS * x_res, BATCH_MARGIN_CELLS * y_res
+        mosaic, transform = merge(
+            sources, bounds=(west - margin_x, south - margin_y, east + margin_x, north + margin_y),
+            nodata=SRTM_NODATA
+        )
+        crs = sources[0].crs
+    finally:
+        for src in sources:
+            src.close()
+
+    dem = mosaic[0].astype(np.float32)
+    dem[mosaic[0] == SRTM_NODATA] = np.nan
+    with rasterio.open(output_path, 'w', driver='GTiff', height=dem.shape[0], width=dem.shape[1],
+                       count=1, dtype='float32', crs=crs, transform=transform,
+                       nodata=np.nan, compress='lzw') as dst:
+        dst.write(dem, 1)
+
+    logger.info(f"Cluster mosaic of {len(srtm_files)} tiles: {dem.shape[1]}x{dem.shape[0]} cells")
+    return transform, dem.shape
+
+
+def _features_sharing_cells(geometries: List[Any]) -> set:
+    """Indices of geometries touching another one (their cells overlap)"""
+    shared = set()
+    for i in range(len(geometries)):
+        for j in range(i + 1, len(geometries)):
+            if geometries[i].intersects(geometries[j]):
+                shared.update((i, j))
+    return shared
+
+
+def _crop_to_mask(cell_mask: np.ndarray, row_offset: int = 0,
+                  col_offset: int = 0) -> Tuple[Optional[Window], Optional[np.ndarray]]:
+    """Window around the True cells of a mask, and the mask cropped to it"""
+    rows = np.flatnonzero(cell_mask.any(axis=1))
+    cols = np.flatnonzero(cell_mask.any(axis=0))
+    if rows.size == 0:
+        return None, None
+    cropped = cell_mask[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+    return Window(col_offset + cols[0], row_offset + rows[0], cropped.shape[1], cropped.shape[0]), cropped
+
+
+def _label_mask(labels: np.ndarray, label: int) -> Tuple[Optional[Window], Optional[np.ndarray]]:
+    """Window and cell mask of one label of the label raster"""
+    return _crop_to_mask(labels == label)
+
+
+def _feature_mask(geometry: Any, transform: Any,
+                  shape_2d: Tuple[int, int]) -> Tuple[Optional[Window], Optional[np.ndarray]]:
+    """Window and cell mask of a geometry rasterized on its own (within its bounds)"""
+    inverse = ~transform
+    minx, miny, maxx, maxy = geometry.bounds
+    col_start, row_start = inverse * (minx, maxy)
+    col_stop, row_stop = inverse * (maxx, miny)
+    row_start, col_start = max(0, int(np.floor(row_start)) - 1), max(0, int(np.floor(col_start)) - 1)
+    row_stop = min(shape_2d[0], int(np.ceil(row_stop)) + 1)
+    col_stop = min(shape_2d[1], int(np.ceil(col_stop)) + 1)
+    if row_stop <= row_start or col_stop <= col_start:
+        return None, None
+
+    window = Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+    cell_mask = geometry_mask([geometry], out_shape=(window.height, window.width),
+                              transform=rasterio.windows.transform(window, transform),
+                              all_touched=True, invert=True)
+    return _crop_to_mask(cell_mask, row_start, col_start)
+
+
+def _clip_raster(source_path: str, output_path: str, window: Window, cell_mask: np.ndarray) -> None:
+    """Write the window of a cluster raster with cells outside the polygon set to nodata"""
+    with rasterio.open(source_path) as src:
+        data = src.read(window=window)
+        if src.nodata is not None:
+            fill = src.nodata
+        else:
+            fill = np.nan if np.issubdtype(data.dtype, np.floating) else 0
+        data[:, ~cell_mask] = fill
+
+        profile = src.profile.copy()
+        for key in ('blockxsize', 'blockysize', 'tiled'):
+            profile.pop(key, None)
+        profile.update(driver='GTiff', height=data.shape[1], width=data.shape[2],
+                       transform=src.window_transform(window), nodata=fill, compress='lzw')
+
+    with rasterio.open(output_path, 'w', **profile) as dst:
+        dst.write(data)
+
+
+def _clip_contours(source_path: str, output_path: str, geometry: Any) -> None:
+    """Write the parts of the cluster contours lying inside the polygon"""
+    with open(source_path, 'r') as f:
+        collection = json.load(f)
+
+    features = []
+    for contour in collection.get('features', []):
+        clipped = shape(contour['geometry']).intersection(geometry)
+        if clipped.is_empty:
+            continue
+        features.append({'type': 'Feature', 'properties': contour.get('properties', {}), 'geometry': mapping(clipped)})
+
+    clipped_collection = {key: value for key, value in collection.items() if key != 'features'}
+    clipped_collection['features'] = features
+    with open(output_path, 'w') as f:
+        json.dump(clipped_collection, f)
+
+
+def _write_feature_outputs(feature: Dict[str, Any], geometry: Any, sources: Dict[str, str],
+                           contours_path: Optional[str], window: Window, cell_mask: np.ndarray,
+                           staging_dir: str) -> Tuple[Dict[str, str], Dict[str, Any]]:
+    """
+    Clip the cluster outputs to one feature and move them to its session folder
+
+    Files are staged next to the cluster outputs first, so a cancelled batch
+    leaves no half-written session folder behind.
+
+    Returns:
+        tuple: (output name -> path in the session folder, terrain statistics)
+    """
+    os.makedirs(staging_dir, exist_ok=True)
+    file_names = dict(RASTER_OUTPUTS, dem='clipped_dem.tif', contours='contours.geojson')
+
+    staged = {}
+    with stage('clip', data_source='srtm', width=int(window.width), height=int(window.height), layers=len(sources)):
+        for name, source_path in sources.items():
+            staged[name] = os.path.join(staging_dir, file_names[name])
+            _clip_raster(source_path, staged[name], window, cell_mask)
+        if contours_path:
+            staged['contours'] = os.path.join(staging_dir, file_names['contours'])
+            _clip_contours(contours_path, staged['contours'], geometry)
+
+    west, south, east, north = geometry.bounds
+    with stage('statistics'):
+        statistics = calculate_terrain_statistics(
+            dem_path=staged['dem'],
+            slope_path=staged.get('slope'),
+            aspect_path=staged.get('aspect'),
+            bounds={'west': west, 'south': south, 'east': east, 'north': north},
+            data_source='srtm'
+        )
+    raise_if_cancelled()
+
+    output_dir = os.path.join(SAVE_DIRECTORY, 'polygon_sessions', feature['id'])
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = {}
+    for name, path in staged.items():
+        outputs[name] = os.path.join(output_dir, file_names[name])
+        os.replace(path, outputs[name])
+    return outputs, statistics
+
+
+def _save_feature(feature: Dict[str, Any], geometry: Any, outputs: Dict[str, str],
+                  statistics: Dict[str, Any], user_id: Optional[str],
+                  batch_steps: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Save a feature's polygon and analysis records
+
+    Args:
+        batch_steps: Extra processing_steps fields (the shared cluster stages)
+
+    Returns:
+        dict: Status entry fields for the feature
+    """
+    polygon_id = feature['id']
+    filename = f"{polygon_id}.geojson"
+    geojson_path = save_geojson(feature, filename, SAVE_DIRECTORY, polygon_id)
+
+    min_lon, min_lat, max_lon, max_lat = geometry.bounds
+    db_service.save_polygon_metadata(
+        polygon_id=polygon_id,
+        filename=filename,
+        geojson_path=geojson_path,
+        bounds={'minLon': min_lon, 'minLat': min_lat, 'maxLon': max_lon, 'maxLat': max_lat},
+        geometry=feature['geometry'],
+        user_id=user_id
+    )
+    db_service.save_file_metadata(
+        polygon_id=polygon_id,
+        file_name=filename,
+        file_path=geojson_path,
+        file_type='geojson',
+        user_id=user_id
+    )
+
+    analysis_data = {
+        'dem_path': outputs.get('dem'),
+        'slope_path': outputs.get('slope'),
+        'aspect_path': outputs.get('aspect'),
+        'contours_path': outputs.get('contours'),
+        'hillshade_path': outputs.get('hillshade'),
+        'geomorphons_path': outputs.get('geomorphons'),
+        'drainage_path': outputs.get('drainage'),
+        'data_source': 'srtm',
+        'statistics': statistics,
+        'bounds': {'west': min_lon, 'south': min_lat, 'east': max_lon, 'north': max_lat},
+        'analysis_files': outputs,
+        'processing_steps': current_recorder().processing_steps(**batch_steps)
+    }
+    with stage('db_save'):
+        save_result = db_service.save_analysis_results(polygon_id, analysis_data, user_id) or {}
+    if save_result.get('status') == 'success':
+        db_service.update_processing_steps(polygon_id, current_recorder().processing_steps(**batch_steps))
+    entry = {'status': 'completed', 'outputs': outputs, 'statistics': statistics,
+             'analysis_saved': save_result.get('status') == 'success'}
+    if save_result.get('status') == 'error':
+        # Same outcome as a failed save of a single polygon analysis
+        logger.error(f"❌ Failed to save analysis results for batch polygon {polygon_id}: {save_result.get('message')}")
+        entry.update({'status': 'failed', 'error': f"Database save failed: {save_result.get('message')}"})
+    db_service.update_polygon_status(polygon_id, entry['status'])
+
+    if entry['status'] == 'completed':
+        logger.info(f"✅ Batch polygon {polygon_id} completed")
+    return entry
@@ -0,0 +1,315 @@
+"""
+Block-wise windowed raster processing
+
+Large DEMs are split into blocks that are read with a halo of extra cells on
+every side, processed in a pool of worker processes and written back into
+tiled GeoTIFFs as results arrive. Only a bounded number of blocks is in flight
+at once, so peak memory depends on the block size and worker count rather
+than on the raster size.
+
+With a halo at least as wide as the kernel's reach (1 cell for 3x3 gradient
+kernels, the search distance for geomorphons) every block sees the same
+neighbourhood as a whole-raster run, so the stitched output matches it.
+Blocks touching the raster edge are clipped there, which reproduces the
+kernels' own edge handling.
+
+The current operation's cancellation is checked between blocks; queued
+blocks are then dropped and the temporary outputs removed.
+
+Worker processes are spawned rather than forked: the request threads of a
+gunicorn worker hold locks and runner state (such as the WhiteboxTools
+waiter queue) that a forked child would inherit mid-use. The caller's
+priority lane is handed to every block explicitly.
+"""
+import os
+import time
+import shutil
+import logging
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from utils.config import BLOCK_SIZE, BLOCK_WORKERS, BLOCK_MIN_PIXELS
+from utils.cancellation import raise_if_cancelled, OperationCancelled
+from utils.priority import current_lane, lane_scope
+
+logger = logging.getLogger(__name__)
+
+# Internal tile size of the GeoTIFFs written block by block
+OUTPUT_TILE_SIZE = 256
+
+# WhiteboxTools writes geomorphons as int16 with this nodata value
+GEOMORPHONS_NODATA = -32768
+
+# Dataset opened once per worker process by _init_worker
+_worker_src = None
+
+
+def should_use_blocks(input_file_path: str) -> bool:
+    """
+    Check whether a raster is large enough to be processed block-wise
+
+    Args:
+        input_file_path: Path to the raster
+
+    Returns:
+        bool: True if the pixel count reaches BLOCK_MIN_PIXELS
+    """
+    with rasterio.open(input_file_path) as src:
+        return src.width * src.height >= BLOCK_MIN_PIXELS
+
+
+def iter_blocks(width: int, height: int, block_size: int, halo: int) -> Iterator[Tuple[Window, Window]]:
+    """
+    Split a raster into blocks with a halo
+
+    Args:
+        width: Raster width in cells
+        height: Raster height in cells
+        block_size: Block edge length in cells (before the halo)
+        halo: Extra cells read on every side
+
+    Yields:
+        tuple: (core window written to the output, read window including the
+        halo clipped to the raster)
+    """
+    for row_off in range(0, height, block_size):
+        for col_off in range(0, width, block_size):
+            core = Window(col_off, row_off, min(block_size, width - col_off), min(block_size, height - row_off))
+            read_col = max(col_off - halo, 0)
+            read_row = max(row_off - halo, 0)
+            read = Window(
+                read_col,
+                read_row,
+                min(col_off + core.width + halo, width) - read_col,
+                min(row_off + core.height + halo, height) - read_row
+            )
+            yield core, read
+
+
+def _init_worker(input_file_path: str) -> None:
+    """Open the source raster once per worker process"""
+    global _worker_src
+    _worker_src = rasterio.open(input_file_path)
+
+
+def _run_block(kernel: Callable, core: Window, read: Window, kernel_kwargs: Dict,
+               lane: str) -> Tuple[Window, Dict[str, np.ndarray]]:
+    """
+    Read one haloed block, run the kernel on it and crop the halo off
+
+    Args:
+        kernel: Module-level function (dem, transform, crs, profile, **kwargs) -> {name: array}
+        core: Window written to the output
+        read: Window read from the source (core plus halo)
+        kernel_kwargs: Extra keyword arguments for the kernel
+        lane: Priority lane of the caller (used for WhiteboxTools slots)
+
+    Returns:
+        tuple: (core window, output name -> array with the core window's shape)
+    """
+    src = _worker_src
+    dem = src.read(1, window=read).astype(np.float32)
+    if src.nodata is not None and not np.isnan(src.nodata):
+        dem[dem == src.nodata] = np.nan
+
+    with lane_scope(lane):
+        results = kernel(dem, src.window_transform(read), src.crs, src.profile, **kernel_kwargs)
+
+    row_start = core.row_off - read.row_off
+    col_start = core.col_off - read.col_off
+    cropped = {
+        name: array[row_start:row_start + core.height, col_start:col_start + core.width]
+        for name, array in results.items()
+    }
+    return core, cropped
+
+
+def process_raster_blocks(input_file_path: str, outputs: Dict[str, str], kernel: Callable, halo: int,
+                          kernel_kwargs: Optional[Dict] = None, dtype: str = 'float32', nodata=np.nan,
+                          block_size: Optional[int] = None, workers: Optional[int] = None) -> bool:
+    """
+    Run a kernel over a raster block by block in a process pool
+
+    Args:
+        input_file_path: Path to the input DEM
+        outputs: Output name returned by the kernel -> output GeoTIFF path
+        kernel: Module-level (picklable) function
+            (dem, transform, crs, profile, **kernel_kwargs) -> {name: array}
+        halo: Cells of overlap read around each block
+        kernel_kwargs: Extra keyword arguments for the kernel
+        dtype: Output data type
+        nodata: Output nodata value
+        block_size: Block edge length in cells (defaults to BLOCK_SIZE)
+        workers: Worker processes (defaults to BLOCK_WORKERS)
+
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    block_size = int(block_size or BLOCK_SIZE)
+    workers = max(1, int(workers or BLOCK_WORKERS))
+    kernel_kwargs = kernel_kwargs or {}
+    lane = current_lane()
+    start_time = time.time()
+    temp_paths = {}
+
+    try:
+        with rasterio.open(input_file_path) as src:
+            width, height = src.width, src.height
+            profile = src.profile.copy()
+        profile.update({
+            'driver': 'GTiff',
+            'count': 1,
+            'dtype': dtype,
+            'nodata': nodata,
+            'compress': 'lzw',
+            'tiled': True,
+            'blockxsize': OUTPUT_TILE_SIZE,
+            'blockysize': OUTPUT_TILE_SIZE,
+            'BIGTIFF': 'IF_SAFER'
+        })
+
+        blocks = iter_blocks(width, height, block_size, halo)
+        total_blocks = ((width + block_size - 1) // block_size) * ((height + block_size - 1) // block_size)
+        logger.info(f"Processing {input_file_path} ({width}x{height}) in {total_blocks} blocks of "
+                    f"{block_size} cells (halo {halo}) on {workers} workers")
+
+        # Write to temporary files next to the outputs and move them into place at the end
+        for name, output_file_path in outputs.items():
+            output_dir = os.path.dirname(os.path.abspath(output_file_path))
+            os.makedirs(output_dir, exist_ok=True)
+            fd, temp_paths[name] = tempfile.mkstemp(prefix=f".{name}.", suffix='.tif', dir=output_dir)
+            os.close(fd)
+
+        datasets = {}
+        try:
+            for name, temp_path in temp_paths.items():
+                datasets[name] = rasterio.open(temp_path, 'w', **profile)
+
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_init_worker, initargs=(input_file_path,)) as executor:
+                pending = set()
+                done_blocks = 0
+                try:
+                    for core, read in blocks:
+                        raise_if_cancelled()
+                        pending.add(executor.submit(_run_block, kernel, core, read, kernel_kwargs, lane))
+                        # Keep at most two blocks per worker in flight to bound memory
+                        if len(pending) >= workers * 2:
+                            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                            done_blocks += _write_blocks(finished, datasets, dtype)
+
+                    while pending:
+                        raise_if_cancelled()
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        done_blocks += _write_blocks(finished, datasets, dtype)
+                except OperationCancelled:
+                    # Drop the queued blocks instead of finishing them on the way out
+                    executor.shutdown(wait=True, cancel_futures=True)
+                    raise
+        finally:
+            for dataset in datasets.values():
+                dataset.close()
+
+        for name, output_file_path in outputs.items():
+            os.replace(temp_paths[name], output_file_path)
+
+        logger.info(f"✅ Block processing of {done_blocks} blocks complete in {time.time() - start_time:.1f}s")
+        return True
+
+    except Exception as e:
+        if isinstance(e, OperationCancelled):
+            logger.warning(f"🛑 Block processing of {input_file_path} cancelled: {str(e)}")
+        else:
+            logger.error(f"Error in block processing of {input_file_path}: {str(e)}", exc_info=True)
+        for temp_path in temp_paths.values():
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return False
+
+
+def _write_blocks(finished, datasets, dtype: str) -> int:
+    """Write completed blocks into the open output datasets"""
+    for future in finished:
+        core, results = future.result()
+        for name, dataset in datasets.items():
+            dataset.write(results[name].astype(dtype), 1, window=core)
+    return len(finished)
+
+
+def gradient_kernel(dem: np.ndarray, transform, crs, profile, derivatives=('slope',),
+                    aspect_options=None) -> Dict[str, np.ndarray]:
+    """
+    Block kernel for the in-process terrain engine (needs a halo of 1)
+
+    Args:
+        dem: Haloed DEM block with nodata as NaN
+        transform: Geotransform of the block
+        crs: Raster CRS
+        profile: Source raster profile
+        derivatives: TerrainEngine methods to run ('slope', 'aspect', 'hillshade', 'tri', 'tpi')
+        aspect_options: Optional keyword arguments for TerrainEngine.aspect
+
+    Returns:
+        dict: Derivative name -> array with the block's shape
+    """
+    from services.terrain_engine import TerrainEngine
+
+    engine = TerrainEngine(dem, transform, crs, profile)
+    options = {'aspect': aspect_options or {}}
+    return {name: getattr(engine, name)(**options.get(name, {})) for name in derivatives}
+
+
+def geomorphons_kernel(dem: np.ndarray, transform, crs, profile, search=50, threshold=0.0,
+                       forms=True) -> Dict[str, np.ndarray]:
+    """
+    Block kernel running WhiteboxTools geomorphons (needs a halo of `search`)
+
+    Args:
+        dem: Haloed DEM block with nodata as NaN
+        transform: Geotransform of the block
+        crs: Raster CRS
+        profile: Source raster profile
+        search: Look up distance (in cells)
+        threshold: Flatness threshold (in degrees)
+        forms: Classify into the 10 common landforms
+
+    Returns:
+        dict: {'geomorphons': int16 array with GEOMORPHONS_NODATA as nodata}
+    """
+    from services.whitebox_runner import whitebox_tools
+
+    block_dir = tempfile.mkdtemp(prefix='geomorphons_block.')
+    try:
+        block_path = os.path.join(block_dir, 'dem.tif')
+        output_path = os.path.join(block_dir, 'geomorphons.tif')
+        block_profile = dict(profile)
+        block_profile.update({
+            'driver': 'GTiff',
+            'height': dem.shape[0],
+            'width': dem.shape[1],
+            'count': 1,
+            'dtype': 'float32',
+            'nodata': GEOMORPHONS_NODATA,
+            'transform': transform,
+            'crs': crs
+        })
+        for option in ('tiled', 'blockxsize', 'blockysize', 'compress'):
+            block_profile.pop(option, None)
+        with rasterio.open(block_path, 'w', **block_profile) as dst:
+            # WhiteboxTools expects a finite nodata value
+            dst.write(np.where(np.isnan(dem), GEOMORPHONS_NODATA, dem).astype(np.float32), 1)
+
+        with whitebox_tools('geomorphons') as wbt:
+            wbt.geomorphons(dem=block_path, output=output_path, search=search,
+                            threshold=threshold, forms=forms)
+
+        with rasterio.open(output_path) as src:
+            return {'geomorphons': src.read(1)}
+    finally:
+        shutil.rmtree(block_dir, ignore_errors=True)
@@ -0,0 +1,311 @@
+"""
+Shared colormap service for raster visualizations
+
+Every ramp or class table is compiled once into an RGB lookup table and
+cached by name. Applying a colormap is then a single quantize-and-index step
+per pixel instead of one boolean mask per colour class:
+
+- ramps (linear or stepped) are sampled into a 256- or 4096-entry table and
+  indexed by the value quantized over [vmin, vmax]
+- class tables with explicit breaks are indexed with np.searchsorted
+- integer code tables (e.g. geomorphon landforms) are indexed by the code
+"""
+import logging
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RAMP = 'ramp'
+CLASSES = 'classes'
+CODES = 'codes'
+
+
+class ColorMap:
+    """A compiled RGB lookup table and the rule used to index it"""
+
+    def __init__(self, name: str, kind: str, lut: np.ndarray, breaks: Optional[np.ndarray] = None):
+        """
+        Args:
+            name: Registry name of the colormap
+            kind: RAMP, CLASSES or CODES
+            lut: (N, 3) uint8 lookup table
+            breaks: Lower class edges (CLASSES only)
+        """
+        self.name = name
+        self.kind = kind
+        self.lut = lut
+        self.breaks = breaks
+
+    def index(self, values: np.ndarray, vmin: float = 0.0, vmax: float = 1.0) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Map values to lookup table indices
+
+        Args:
+            values: Array of raster values
+            vmin: Value mapped to the first ramp entry (RAMP only)
+            vmax: Value mapped to the last ramp entry (RAMP only)
+
+        Returns:
+            tuple: (index array, boolean mask of values the colormap covers)
+        """
+        size = len(self.lut)
+
+        if self.kind == RAMP:
+            covered = ~np.isnan(values)
+            scale = (size - 1) / (vmax - vmin) if vmax > vmin else 0.0
+            with np.errstate(invalid='ignore'):
+                position = np.rint((np.where(covered, values, vmin) - vmin) * scale)
+            return np.clip(position, 0, size - 1).astype(np.intp), covered
+
+        if self.kind == CLASSES:
+            with np.errstate(invalid='ignore'):
+                index = np.searchsorted(self.breaks, values, side='right') - 1
+                covered = (index >= 0) & ~np.isnan(values)
+            return np.clip(index, 0, size - 1), covered
+
+        codes = np.asarray(values)
+        covered = (codes >= 0) & (codes < size)
+        return np.where(covered, codes, 0).astype(np.intp), covered
+
+    def apply(self, values: np.ndarray, valid_mask: Optional[np.ndarray] = None,
+              vmin: float = 0.0, vmax: float = 1.0) -> np.ndarray:
+        """
+        Colour a raster
+
+        Args:
+            values: 2D array of raster values
+            valid_mask: Optional mask of pixels to colour; pixels outside it or
+                outside the colormap are transparent
+            vmin: Value mapped to the first ramp entry (RAMP only)
+            vmax: Value mapped to the last ramp entry (RAMP only)
+
+        Returns:
+            np.ndarray: uint8 RGBA array
+        """
+        index, covered = self.index(values, vmin=vmin, vmax=vmax)
+        if valid_mask is not None:
+            covered &= valid_mask
+        return compose_rgba(values.shape, covered, self.lut[index[covered]])
+
+
+def compose_rgba(shape, valid_mask: np.ndarray, rgb) -> np.ndarray:
+    """
+    Build an RGBA image that is opaque only where data is valid
+
+    Args:
+        shape: (rows, cols) of the raster
+        valid_mask: Boolean mask of valid pixels
+        rgb: (N, 3) colours for the valid pixels in mask order, or one colour
+
+    Returns:
+        np.ndarray: uint8 RGBA array (transparent black outside the mask)
+    """
+    rgba = np.zeros((shape[0], shape[1], 4), dtype=np.uint8)
+    rgba[valid_mask, :3] = rgb
+    rgba[valid_mask, 3] = 255
+    return rgba
+
+
+def compile_ramp(name: str, stops: Sequence[Tuple[float, Sequence[int]]], size: int = 4096,
+                 interpolate: bool = True) -> ColorMap:
+    """
+    Sample a colour ramp into a lookup table over [0, 1]
+
+    Args:
+        name: Colormap name
+        stops: (position, (R, G, B)) pairs with increasing positions in [0, 1]
+        size: Number of table entries (256 or 4096)
+        interpolate: Blend linearly between stops; otherwise each stop's colour
+            holds until the next stop
+
+    Returns:
+        ColorMap: Compiled ramp
+    """
+    positions = np.array([position for position, _ in stops], dtype=np.float64)
+    colors = np.array([color for _, color in stops], dtype=np.float64)
+    samples = np.linspace(0.0, 1.0, size)
+
+    if interpolate:
+        lut = np.stack([np.interp(samples, positions, colors[:, band]) for band in range(3)], axis=1)
+    else:
+        lut = colors[np.clip(np.searchsorted(positions, samples, side='right') - 1, 0, len(stops) - 1)]
+
+    return ColorMap(name, RAMP, np.floor(lut).astype(np.uint8))
+
+
+def compile_classes(name: str, classes: Sequence[Tuple[float, Sequence[int]]]) -> ColorMap:
+    """
+    Build a class table from lower class edges
+
+    Args:
+        name: Colormap name
+        classes: (lower edge, (R, G, B)) pairs with increasing edges; each class
+            runs up to the next edge and the last one is unbounded
+
+    Returns:
+        ColorMap: Compiled class table
+    """
+    breaks = np.array([edge for edge, _ in classes], dtype=np.float64)
+    lut = np.array([color for _, color in classes], dtype=np.uint8)
+    return ColorMap(name, CLASSES, lut, breaks=breaks)
+
+
+def compile_codes(name: str, codes: Dict[int, Sequence[int]], size: int = 256) -> ColorMap:
+    """
+    Build a lookup table indexed directly by integer class codes
+
+    Args:
+        name: Colormap name
+        codes: Class code -> (R, G, B)
+        size: Table size (codes must be in [0, size))
+
+    Returns:
+        ColorMap: Compiled code table
+    """
+    lut = np.zeros((size, 3), dtype=np.uint8)
+    for code, color in codes.items():
+        lut[code] = color
+    return ColorMap(name, CODES, lut)
+
+
+# 50-colour elevation ramp used for DEM previews (stepped); values at the top
+# of the range are drawn white
+ELEVATION_STOPS = [
+    (0.0,      (16, 105, 40)),
+    (0.020408, (12, 130, 44)),
+    (0.040816, (8, 155, 48)),
+    (0.061224, (5, 181, 51)),
+    (0.081633, (5, 199, 59)),
+    (0.102041, (14, 203, 75)),
+    (0.122449, (22, 208, 91)),
+    (0.142857, (33, 212, 104)),
+    (0.163265, (50, 215, 108)),
+    (0.183673, (68, 219, 111)),
+    (0.204082, (86, 222, 114)),
+    (0.224490, (103, 225, 118)),
+    (0.244898, (121, 228, 122)),
+    (0.265306, (139, 231, 125)),
+    (0.285714, (157, 234, 129)),
+    (0.306122, (176, 238, 134)),
+    (0.326531, (195, 242, 139)),
+    (0.346939, (215, 246, 144)),
+    (0.367347, (226, 245, 146)),
+    (0.387755, (232, 240, 147)),
+    (0.408163, (238, 235, 147)),
+    (0.428571, (245, 229, 148)),
+    (0.448980, (233, 216, 140)),
+    (0.469388, (221, 202, 132)),
+    (0.489796, (209, 188, 124)),
+    (0.510204, (196, 173, 116)),
+    (0.530612, (185, 157, 109)),
+    (0.551020, (173, 141, 101)),
+    (0.571429, (162, 125, 94)),
+    (0.591837, (156, 118, 91)),
+    (0.612245, (151, 110, 89)),
+    (0.632653, (146, 103, 86)),
+    (0.653061, (145, 101, 88)),
+    (0.673469, (150, 108, 97)),
+    (0.693878, (155, 115, 105)),
+    (0.714286, (160, 123, 113)),
+    (0.734694, (166, 131, 121)),
+    (0.755102, (171, 138, 128)),
+    (0.775510, (177, 146, 137)),
+    (0.795918, (183, 153, 145)),
+    (0.816327, (189, 161, 153)),
+    (0.836735, (195, 169, 161)),
+    (0.857143, (201, 176, 169)),
+    (0.877551, (207, 184, 177)),
+    (0.897959, (213, 192, 185)),
+    (0.918367, (220, 200, 193)),
+    (0.938776, (226, 207, 201)),
+    (0.959184, (232, 215, 209)),
+    (0.979592, (238, 223, 217)),
+    (1.0,      (255, 255, 255))
+]
+
+# Green -> brown -> white elevation ramp used for SRTM previews
+SRTM_STOPS = [
+    (0.0, (0, 100, 0)),
+    (0.3, (139, 69, 19)),
+    (0.7, (255, 255, 255)),
+    (1.0, (255, 255, 255))
+]
+
+# ColorBrewer Blues (same stops as matplotlib's 'Blues')
+BLUES_STOPS = [
+    (0.0,   (247, 251, 255)),
+    (0.125, (222, 235, 247)),
+    (0.25,  (198, 219, 239)),
+    (0.375, (158, 202, 225)),
+    (0.5,   (107, 174, 214)),
+    (0.625, (66, 146, 198)),
+    (0.75,  (33, 113, 181)),
+    (0.875, (8, 81, 156)),
+    (1.0,   (8, 48, 107))
+]
+
+# Slope percentage classes (lower edge, colour)
+SLOPE_CLASSES = [
+    (0, (26, 150, 65)),      # 0-3 Green
+    (3, (166, 217, 106)),    # 3-5 Light green
+    (5, (255, 255, 191)),    # 5-8 Yellow
+    (8, (253, 174, 97)),     # 8-15 Light orange
+    (15, (215, 25, 28)),     # 15-25 Red
+    (25, (128, 0, 38)),      # 25-50 Dark red
+    (50, (0, 0, 0))          # 50+ Black
+]
+
+# Geomorphon landform codes (QML symbology)
+GEOMORPHON_CODES = {
+    1: (113, 113, 113),  # Flat - #717171
+    2: (83, 5, 14),      # Peak - #53050e
+    3: (186, 34, 49),    # Ridge - #ba2231
+    4: (212, 95, 32),    # Shoulder - #d45f20
+    5: (229, 204, 91),   # Spur (convex) - #e5cc5b
+    6: (233, 233, 152),  # Slope - #e9e998
+    7: (166, 186, 98),   # Hollow (concave) - #a6ba62
+    8: (17, 90, 21),     # Footslope - #115a15
+    9: (105, 129, 149),  # Valley - #698195
+    10: (0, 0, 0)        # Pit (depression) - #000000
+}
+
+# Registered colormap builders, compiled on first use
+COLORMAPS = {
+    'elevation': lambda: compile_ramp('elevation', ELEVATION_STOPS, size=4096, interpolate=False),
+    'srtm': lambda: compile_ramp('srtm', SRTM_STOPS, size=4096),
+    'blues': lambda: compile_ramp('blues', BLUES_STOPS, size=256),
+    'slope': lambda: compile_classes('slope', SLOPE_CLASSES),
+    'geomorphons': lambda: compile_codes('geomorphons', GEOMORPHON_CODES)
+}
+
+_compiled: Dict[str, ColorMap] = {}
+_compile_lock = threading.Lock()
+
+
+def get_colormap(name: str) -> ColorMap:
+    """
+    Get a compiled colormap by name, compiling it on first use
+
+    Args:
+        name: Registered colormap name
+
+    Returns:
+        ColorMap: The cached compiled colormap
+    """
+    colormap = _compiled.get(name)
+    if colormap is not None:
+        return colormap
+
+    if name not in COLORMAPS:
+        raise ValueError(f"Unknown colormap: {name}")
+
+    with _compile_lock:
+        colormap = _compiled.get(name)
+        if colormap is None:
+            colormap = COLORMAPS[name]()
+            _compiled[name] = colormap
+            logger.info(f"Compiled colormap '{name}' ({len(colormap.lut)} entries)")
+    return colormap
@@ -0,0 +1,399 @@
+"""
+Contour level-of-detail cache
+
+Contours are traced once per DEM at a base interval and stored next to the
+DEM together with an index of feature positions by elevation. Any interval
+that is a multiple of the base is answered by selecting the matching levels
+from the index instead of contouring the DEM again. The base depends on the
+DEM source (1m for LiDAR); an interval that no stored set can serve is traced
+once and stored as a set of its own. Douglas-Peucker simplified copies per map
+zoom level are derived on demand and memoized.
+"""
+import os
+import glob
+import json
+import logging
+import threading
+import rasterio
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+from config.dem_sources import DEM_CONFIG
+from utils.config import CONTOUR_BASE_INTERVAL
+from services.terrain import generate_contours
+
+logger = logging.getLogger(__name__)
+
+# Ground resolution of one 256px web map tile pixel at zoom 0
+METERS_PER_PIXEL_Z0 = 156543.03392
+DEGREES_PER_PIXEL_Z0 = 360.0 / 256
+
+# Number of contour sets kept in memory per worker
+MAX_CACHED_SETS = 8
+
+# Tolerance when testing whether an elevation lies on an interval
+LEVEL_TOLERANCE = 1e-6
+
+# Approximate length of one degree of latitude, for geographic DEM resolutions
+METERS_PER_DEGREE = 111320.0
+
+# (DEM path, base interval) -> (DEM signature, ContourSet), least recently used first
+_sets = OrderedDict()
+_sets_lock = threading.Lock()
+
+
+def _dem_signature(dem_path: str) -> List[float]:
+    """Identify a DEM version by modification time and size"""
+    stat = os.stat(dem_path)
+    return [stat.st_mtime, stat.st_size]
+
+
+def is_multiple(value: float, interval: float) -> bool:
+    """Check whether value is an integer multiple of interval"""
+    ratio = value / interval
+    return abs(ratio - round(ratio)) < LEVEL_TOLERANCE
+
+
+def simplify_tolerance(zoom: int, geographic: bool) -> float:
+    """
+    Douglas-Peucker tolerance of half a screen pixel at a web map zoom level
+
+    Args:
+        zoom: Web map zoom level
+        geographic: True if coordinates are degrees, False for metres
+
+    Returns:
+        float: Tolerance in coordinate units
+    """
+    per_pixel = DEGREES_PER_PIXEL_Z0 if geographic else METERS_PER_PIXEL_Z0
+    return 0.5 * per_pixel / (2 ** zoom)
+
+
+def is_geographic(collection: Dict[str, Any]) -> bool:
+    """Guess whether contour coordinates are degrees from the GeoJSON CRS member"""
+    crs_name = collection.get('crs', {}).get('properties', {}).get('name', '')
+    return crs_name == '' or crs_name.endswith(('EPSG::4326', 'CRS84'))
+
+
+def simplify_collection(collection: Dict[str, Any], zoom: int, geographic: bool) -> Dict[str, Any]:
+    """
+    Douglas-Peucker simplify every contour for a map zoom level
+
+    Args:
+        collection: GeoJSON FeatureCollection of contour lines
+        zoom: Web map zoom level
+        geographic: True if coordinates are degrees, False for metres
+
+    Returns:
+        dict: New FeatureCollection with simplified geometries
+    """
+    from shapely.geometry import shape, mapping
+
+    tolerance = simplify_tolerance(int(zoom), geographic)
+    features = []
+    for feature in collection['features']:
+        geometry = shape(feature['geometry']).simplify(tolerance, preserve_topology=False)
+        if geometry.is_empty:
+            continue
+        features.append({
+            'type': 'Feature',
+            'properties': feature.get('properties', {}),
+            'geometry': mapping(geometry)
+        })
+
+    simplified = {key: value for key, value in collection.items() if key != 'features'}
+    simplified['features'] = features
+    logger.info(f"Simplified contours for zoom {zoom} (tolerance {tolerance:.6g}): {len(features)} features")
+    return simplified
+
+
+class ContourSet:
+    """Base-interval contours of one DEM, indexed by elevation"""
+
+    def __init__(self, base_interval: float, collection: Dict[str, Any], index: Dict[float, List[int]]):
+        """
+        Args:
+            base_interval: Interval the contours were traced at
+            collection: GeoJSON FeatureCollection at the base interval
+            index: Elevation -> positions of its features in the collection
+        """
+        self.base_interval = base_interval
+        self.collection = collection
+        self.index = index
+        self.geographic = is_geographic(collection)
+        self._simplified: Dict[tuple, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def supports(self, interval: float) -> bool:
+        """Check whether an interval can be served from this set"""
+        return interval >= self.base_interval and is_multiple(interval, self.base_interval)
+
+    def for_interval(self, interval: float) -> Dict[str, Any]:
+        """
+        Select the contours of a coarser interval
+
+        Args:
+            interval: A multiple of the base interval
+
+        Returns:
+            dict: GeoJSON FeatureCollection
+        """
+        features = self.collection['features']
+        selected = [
+            features[position]
+            for elevation in sorted(self.index)
+            if is_multiple(elevation, interval)
+            for position in self.index[elevation]
+        ]
+        result = {key: value for key, value in self.collection.items() if key != 'features'}
+        result['features'] = selected
+        return result
+
+    def simplified(self, interval: float, zoom: int) -> Dict[str, Any]:
+        """
+        Contours of an interval simplified for a map zoom level (memoized)
+
+        Args:
+            interval: A multiple of the base interval
+            zoom: Web map zoom level
+
+        Returns:
+            dict: GeoJSON FeatureCollection with simplified geometries
+        """
+        key = (float(interval), int(zoom))
+        with self._lock:
+            if key in self._simplified:
+                return self._simplified[key]
+
+        collection = simplify_collection(self.for_interval(interval), zoom, self.geographic)
+        with self._lock:
+            self._simplified[key] = collection
+        return collection
+
+
+def base_interval_for(dem_path: str, data_source: Optional[str] = None) -> float:
+    """
+    Base contour interval for a DEM from its data source
+
+    When the source is not given it is inferred as the configured source whose
+    resolution is closest to the DEM cell size.
+
+    Args:
+        dem_path: Path to the DEM file
+        data_source: DEM data source ('srtm', 'lidar', 'usgs-dem'), if known
+
+    Returns:
+        float: Base interval in metres
+    """
+    if data_source in DEM_CONFIG:
+        return float(DEM_CONFIG[data_source]['contour_base_interval'])
+
+    try:
+        with rasterio.open(dem_path) as src:
+            cell_size = abs(src.res[0])
+            if src.crs is not None and src.crs.is_geographic:
+                cell_size *= METERS_PER_DEGREE
+    except Exception as e:
+        logger.warning(f"Could not read resolution of {dem_path}, using default contour base: {str(e)}")
+        return CONTOUR_BASE_INTERVAL
+
+    config = min(DEM_CONFIG.values(), key=lambda c: abs(c['resolution'] - cell_size))
+    return float(config['contour_base_interval'])
+
+
+def _cache_paths(dem_path: str, base_interval: float):
+    """Paths of the stored base contours and their elevation index"""
+    base = os.path.join(os.path.dirname(dem_path), f"contours_base_{base_interval:g}m")
+    return f"{base}.geojson", f"{base}.index.json"
+
+
+def _stored_base_intervals(dem_path: str) -> List[float]:
+    """Base intervals of the contour sets held in memory or on disk for a DEM"""
+    dem_key = os.path.abspath(dem_path)
+    with _sets_lock:
+        bases = {base for path, base in _sets if path == dem_key}
+
+    pattern = os.path.join(os.path.dirname(dem_path), "contours_base_*m.index.json")
+    for index_path in glob.glob(pattern):
+        name = os.path.basename(index_path)
+        try:
+            bases.add(float(name[len("contours_base_"):-len("m.index.json")]))
+        except ValueError:
+            continue
+    return sorted(bases)
+
+
+def _load_contour_set(dem_path: str, base_interval: float) -> Optional[ContourSet]:
+    """Load a stored contour set if it matches the current DEM"""
+    geojson_path, index_path = _cache_paths(dem_path, base_interval)
+    if not (os.path.exists(geojson_path) and os.path.exists(index_path)):
+        return None
+
+    try:
+        with open(index_path, 'r') as f:
+            index_data = json.load(f)
+        if index_data.get('dem_signature') != _dem_signature(dem_path):
+            logger.info(f"Stored contours are stale for {dem_path}, rebuilding")
+            return None
+
+        with open(geojson_path, 'r') as f:
+            collection = json.load(f)
+        index = {float(level): positions for level, positions in index_data['levels'].items()}
+        return ContourSet(base_interval, collection, index)
+    except Exception as e:
+        logger.warning(f"Failed to load stored contours from {geojson_path}: {str(e)}")
+        return None
+
+
+def _build_contour_set(dem_path: str, base_interval: float) -> Optional[ContourSet]:
+    """Trace base-interval contours and store them with an elevation index"""
+    geojson_path, index_path = _cache_paths(dem_path, base_interval)
+    tmp_geojson_path = f"{geojson_path}.{os.getpid()}.tmp.geojson"
+    tmp_index_path = f"{index_path}.{os.getpid()}.tmp"
+
+    logger.info(f"Building {base_interval:g}m base contours for {dem_path}")
+    collection = generate_contours(dem_path, tmp_geojson_path, base_interval)
+    if collection is None:
+        return None
+
+    index: Dict[float, List[int]] = {}
+    for position, feature in enumerate(collection.get('features', [])):
+        elevation = float(feature.get('properties', {}).get('elevation'))
+        index.setdefault(elevation, []).append(position)
+
+    try:
+        with open(tmp_index_path, 'w') as f:
+            json.dump({
+                'dem_signature': _dem_signature(dem_path),
+                'base_interval': base_interval,
+                'levels': {repr(level): positions for level, positions in index.items()}
+            }, f)
+        # Publish atomically so concurrent workers never read half-written files
+        os.replace(tmp_geojson_path, geojson_path)
+        os.replace(tmp_index_path, index_path)
+    except Exception as e:
+        logger.warning(f"Failed to store base contours for {dem_path}: {str(e)}")
+        for path in (tmp_geojson_path, tmp_index_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    logger.info(f"Stored {len(collection.get('features', []))} base contours at {len(index)} levels")
+    return ContourSet(base_interval, collection, index)
+
+
+def _get_contour_set(dem_path: str, base_interval: float):
+    """Get a contour set from memory, disk or a new trace; returns (set, was_traced)"""
+    key = (os.path.abspath(dem_path), base_interval)
+    signature = _dem_signature(dem_path)
+
+    with _sets_lock:
+        entry = _sets.get(key)
+        if entry is not None and entry[0] == signature:
+            _sets.move_to_end(key)
+            return entry[1], False
+
+    traced = False
+    contour_set = _load_contour_set(dem_path, base_interval)
+    if contour_set is None:
+        contour_set = _build_contour_set(dem_path, base_interval)
+        traced = True
+    if contour_set is None:
+        return None, traced
+
+    with _sets_lock:
+        _sets[key] = (signature, contour_set)
+        _sets.move_to_end(key)
+        while len(_sets) > MAX_CACHED_SETS:
+            _sets.popitem(last=False)
+    return contour_set, traced
+
+
+def get_contour_set(dem_path: str, base_interval: Optional[float] = None) -> Optional[ContourSet]:
+    """
+    Get the base-interval contour set of a DEM, building it on first use
+
+    Args:
+        dem_path: Path to the DEM file
+        base_interval: Base contour interval (defaults to the DEM source's base)
+
+    Returns:
+        ContourSet: The contour set, or None if contouring failed
+    """
+    base_interval = float(base_interval or base_interval_for(dem_path))
+    return _get_contour_set(dem_path, base_interval)[0]
+
+
+def contours_for_interval(dem_path: str, interval: float, zoom: Optional[int] = None,
+                          base_interval: Optional[float] = None,
+                          data_source: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Contours of a DEM at an interval, served from a stored set when possible
+
+    The coarsest stored set whose base divides the interval is used. Without
+    one, the source's base set is traced if the interval is a multiple of it;
+    otherwise a set is traced and stored at the requested interval itself, so
+    each request costs at most one trace.
+
+    Args:
+        dem_path: Path to the DEM file
+        interval: Requested contour interval in metres
+        zoom: Optional web map zoom level to simplify for
+        base_interval: Base contour interval (defaults to the DEM source's base)
+        data_source: DEM data source, inferred from the DEM resolution if omitted
+
+    Returns:
+        dict: {'contours', 'full_contours', 'base_interval', 'from_cache'} or
+        None if contouring failed
+    """
+    interval = float(interval)
+    stored = [base for base in _stored_base_intervals(dem_path)
+              if base <= interval + LEVEL_TOLERANCE and is_multiple(interval, base)]
+    if stored:
+        base = max(stored)
+    else:
+        base = float(base_interval or base_interval_for(dem_path, data_source))
+        if interval < base or not is_multiple(interval, base):
+            logger.info(f"Interval {interval:g}m is not a multiple of the {base:g}m base, storing it as its own set")
+            base = interval
+
+    contour_set, traced = _get_contour_set(dem_path, base)
+    if contour_set is None:
+        return None
+
+    full = contour_set.for_interval(interval)
+    contours = contour_set.simplified(interval, zoom) if zoom is not None else full
+    return {'contours': contours, 'full_contours': full,
+            'base_interval': contour_set.base_interval, 'from_cache': not traced}
+
+
+def write_contours(dem_path: str, output_file_path: str, interval: float,
+                   data_source: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Write the contours of one interval to a GeoJSON file via the cache
+
+    Drop-in replacement for generate_contours in batch pipelines: the base set
+    built here also serves later interactive interval changes.
+
+    Args:
+        dem_path: Path to the DEM file
+        output_file_path: Path to the output GeoJSON file
+        interval: Contour interval in metres
+        data_source: DEM data source, inferred from the DEM resolution if omitted
+
+    Returns:
+        dict: GeoJSON contour data if successful, None otherwise
+    """
+    try:
+        result = contours_for_interval(dem_path, interval, data_source=data_source)
+        if result is None:
+            return None
+
+        os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+        with open(output_file_path, 'w') as f:
+            json.dump(result['full_contours'], f)
+
+        logger.info(f"Wrote {len(result['full_contours']['features'])} contours ({interval:g}m) to {output_file_path}")
+        return result['full_contours']
+    except Exception as e:
+        logger.error(f"Error writing contours: {str(e)}", exc_info=True)
+        return None
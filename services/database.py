@@ -9,6 +9,8 @@ from datetime import datetime
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
+from utils.metrics import db_connection_wait
+
 logger = logging.getLogger(__name__)
 
 class DatabaseService:
@@ -40,7 +42,8 @@ class DatabaseService:
         if not self.enabled:
             return None
         try:
-            return psycopg2.connect(self.db_url, cursor_factory=RealDictCursor)
+            with db_connection_wait('postgres'):
+                return psycopg2.connect(self.db_url, cursor_factory=RealDictCursor)
         except Exception as e:
             logger.error(f"Failed to connect to database: {str(e)}")
             return None
@@ -215,7 +218,7 @@ class DatabaseService:
                 analysis_data.get('image'),
                 analysis_data.get('status', 'completed'),
                 json.dumps(analysis_data.get('analysis_files', {})),
-                json.dumps(analysis_data.get('processing_steps', {}))
+                json.dumps(analysis_data.get('processing_steps', {}), default=str)
             ))
             
             conn.commit()
@@ -374,6 +377,38 @@ class DatabaseService:
                 conn.close()
             return {'status': 'error', 'message': str(e)}
     
+    def update_processing_steps(self, polygon_id: str, processing_steps: Dict[str, Any]) -> Dict[str, Any]:
+        """Store the stage timings of a polygon's analysis"""
+        if not self.enabled:
+            return {'status': 'disabled'}
+        
+        conn = self._get_connection()
+        if not conn:
+            return {'status': 'error', 'message': 'Database connection failed'}
+        
+        try:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                UPDATE analyses SET
+                    processing_steps = %s,
+                    updated_at = NOW()
+                WHERE polygon_id = %s
+            """, (json.dumps(processing_steps, default=str), polygon_id))
+            
+            conn.commit()
+            cursor.close()
+            conn.close()
+            
+            logger.info(f"Updated processing steps for polygon: {polygon_id}")
+            return {'status': 'success', 'message': 'Processing steps updated'}
+        except Exception as e:
+            logger.error(f"Error updating processing steps: {str(e)}")
+            if conn:
+                conn.rollback()
+                conn.close()
+            return {'status': 'error', 'message': str(e)}
+    
     def save_file_metadata(self, polygon_id: str, file_name: str, file_path: str, 
                           file_type: str, file_size: Optional[int] = None, user_id: Optional[str] = None) -> Dict[str, Any]:
         """Save file metadata to database"""
@@ -16,6 +16,10 @@ from PIL import Image
 import time
 
 from config.dem_sources import get_dem_config, validate_dem_source
+from services.terrain_engine import TerrainEngine
+from utils.config import TERRAIN_ENGINE
+from services.colormap import get_colormap
+from services.instrumentation import stage as instrumentation_stage
 
 logger = logging.getLogger(__name__)
 
@@ -171,36 +175,38 @@ class DEMProcessor:
             
             logger.info(f"Clipping to exact polygon bounds: {polygon.bounds}")
             
-            # Open DEM files and log their bounds
-            src_files_to_mosaic = []
-            for file in dem_files:
-                try:
-                    src = rasterio.open(file)
-                    src_files_to_mosaic.append(src)
-                    logger.info(f"{data_source} file {file} bounds: {src.bounds}")
-                except Exception as e:
-                    logger.error(f"Error opening {file}: {str(e)}")
-                    raise
+            with instrumentation_stage('merge', data_source=data_source, tiles=len(dem_files)) as step:
+                # Open DEM files and log their bounds
+                src_files_to_mosaic = []
+                for file in dem_files:
+                    try:
+                        src = rasterio.open(file)
+                        src_files_to_mosaic.append(src)
+                        logger.info(f"{data_source} file {file} bounds: {src.bounds}")
+                    except Exception as e:
+                        logger.error(f"Error opening {file}: {str(e)}")
+                        raise
             
-            if not src_files_to_mosaic:
-                logger.error(f"No valid {data_source} files to process")
-                return None
+                if not src_files_to_mosaic:
+                    logger.error(f"No valid {data_source} files to process")
+                    return None
             
-            # Create mosaic of all DEM tiles
-            mosaic, out_trans = merge(src_files_to_mosaic)
-            logger.info(f"Mosaic shape: {mosaic.shape}")
+                # Create mosaic of all DEM tiles
+                mosaic, out_trans = merge(src_files_to_mosaic)
+                logger.info(f"Mosaic shape: {mosaic.shape}")
+                step.annotate(width=mosaic.shape[2], height=mosaic.shape[1], dtype=str(mosaic.dtype))
             
-            # Save mosaic to temporary file
-            with rasterio.open(temp_mosaic_path, 'w', driver='GTiff',
-                            height=mosaic.shape[1], width=mosaic.shape[2],
-                            count=1, dtype=mosaic.dtype,
-                            crs=src_files_to_mosaic[0].crs,
-                            transform=out_trans) as dst:
-                dst.write(mosaic[0], 1)
+                # Save mosaic to temporary file
+                with rasterio.open(temp_mosaic_path, 'w', driver='GTiff',
+                                height=mosaic.shape[1], width=mosaic.shape[2],
+                                count=1, dtype=mosaic.dtype,
+                                crs=src_files_to_mosaic[0].crs,
+                                transform=out_trans) as dst:
+                    dst.write(mosaic[0], 1)
             
-            # Close source files
-            for src in src_files_to_mosaic:
-                src.close()
+                # Close source files
+                for src in src_files_to_mosaic:
+                    src.close()
             
             # Mask to the exact polygon shape
             try:
@@ -216,43 +222,53 @@ class DEMProcessor:
                         # For other sources, use np.nan if they're float
                         nodata_value = np.nan
                     
-                    # Set crop=True to crop to the polygon bounds
-                    # all_touched=True to include all pixels that touch the polygon
-                    out_image, out_transform = mask(src, geometries, crop=True, all_touched=True, nodata=nodata_value)
+                    with instrumentation_stage('clip', data_source=data_source) as step:
+                        # Set crop=True to crop to the polygon bounds
+                        # all_touched=True to include all pixels that touch the polygon
+                        out_image, out_transform = mask(src, geometries, crop=True, all_touched=True, nodata=nodata_value)
                     
-                    # For SRTM data, convert to float to handle nodata properly
-                    if data_source == 'srtm':
-                        # Convert to float32 to allow nan values for processing
-                        out_image = out_image.astype(np.float32)
-                        # Set masked values to nan for consistent processing
-                        out_image = np.where(out_image == nodata_value, np.nan, out_image)
-                    else:
-                        # For other sources, set masked values to nan
-                        out_image = np.where(out_image == 0, np.nan, out_image)
+                        # For SRTM data, convert to float to handle nodata properly
+                        if data_source == 'srtm':
+                            # Convert to float32 to allow nan values for processing
+                            out_image = out_image.astype(np.float32)
+                            # Set masked values to nan for consistent processing
+                            out_image = np.where(out_image == nodata_value, np.nan, out_image)
+                        else:
+                            # For other sources, set masked values to nan
+                            out_image = np.where(out_image == 0, np.nan, out_image)
                     
-                    # Update metadata
-                    out_meta = src.meta.copy()
-                    out_meta.update({
-                        "driver": "GTiff",
-                        "height": out_image.shape[1],
-                        "width": out_image.shape[2],
-                        "transform": out_transform,
-                        "nodata": np.nan,  # Always use nan for output files
-                        "dtype": 'float32',  # Ensure float32 for nan support
-                        "compress": "lzw"
-                    })
+                        # Update metadata
+                        out_meta = src.meta.copy()
+                        out_meta.update({
+                            "driver": "GTiff",
+                            "height": out_image.shape[1],
+                            "width": out_image.shape[2],
+                            "transform": out_transform,
+                            "nodata": np.nan,  # Always use nan for output files
+                            "dtype": 'float32',  # Ensure float32 for nan support
+                            "compress": "lzw"
+                        })
                     
-                    # Write clipped file
-                    with rasterio.open(clipped_dem_path, "w", **out_meta) as dest:
-                        dest.write(out_image)
+                        # Write clipped file
+                        with rasterio.open(clipped_dem_path, "w", **out_meta) as dest:
+                            dest.write(out_image)
+                        step.annotate(width=out_image.shape[2], height=out_image.shape[1], dtype='float32')
                     
                     logger.info(f"Successfully clipped {data_source} DEM: {clipped_dem_path}")
                     
+                    # Derive slope, aspect, curvature, TRI and TPI from the DEM already in memory
+                    with instrumentation_stage('terrain_metrics'):
+                        terrain_metrics = self._derive_terrain_metrics(
+                            out_image[0], out_transform, src.crs, out_meta, output_folder
+                        )
+                    
                     # Generate visualization
-                    visualization_data = self._generate_visualization(clipped_dem_path, data_source)
+                    with instrumentation_stage('visualization'):
+                        visualization_data = self._generate_visualization(clipped_dem_path, data_source)
                     
                     # Calculate statistics
-                    statistics = self._calculate_statistics(clipped_dem_path, data_source)
+                    with instrumentation_stage('dem_statistics'):
+                        statistics = self._calculate_statistics(clipped_dem_path, data_source)
                     
                     return {
                         'clipped_dem_path': clipped_dem_path,
@@ -264,6 +280,7 @@ class DEMProcessor:
                         },
                         'image': visualization_data,
                         'statistics': statistics,
+                        'terrain_metrics': terrain_metrics,
                         'data_source': data_source
                     }
                     
@@ -280,6 +297,46 @@ class DEMProcessor:
             logger.error(f"Error in generic DEM processing: {str(e)}")
             raise
     
+    def _derive_terrain_metrics(self, dem: np.ndarray, transform, crs, profile: Dict[str, Any],
+                                output_folder: str) -> Dict[str, Any]:
+        """
+        Derive slope, aspect, profile/plan curvature, TRI and TPI in one 3x3
+        neighbourhood pass
+        
+        Metrics are computed from the clipped DEM array already in memory, so
+        no extra raster read is needed, and slope and aspect share one
+        gradient. They are handed to the terrain pipeline as precomputed
+        outputs (see gradient_outputs); with TERRAIN_ENGINE=whitebox the
+        pipeline computes them itself, so they are left out here. Failures
+        are logged and reported as an empty result rather than failing the
+        DEM processing.
+        
+        Returns:
+            dict: Metric name -> {'path', 'mean'}
+        """
+        try:
+            engine = TerrainEngine(dem, transform, crs, profile)
+            metrics = engine.fused_derivatives()
+            if TERRAIN_ENGINE != 'numpy':
+                metrics.pop('slope')
+                metrics.pop('aspect')
+            
+            results = {}
+            for name, array in metrics.items():
+                output_path = os.path.join(output_folder, f"{name}.tif")
+                engine.write(array, output_path)
+                valid = array[~np.isnan(array)]
+                results[name] = {
+                    'path': output_path,
+                    'mean': float(np.mean(valid)) if valid.size > 0 else None
+                }
+            
+            logger.info(f"Derived terrain metrics in a single pass: {list(results.keys())}")
+            return results
+        except Exception as e:
+            logger.error(f"Error deriving terrain metrics: {str(e)}")
+            return {}
+    
     def _generate_visualization(self, dem_path: str, data_source: str) -> str:
         """Generate base64 visualization for DEM data with proper color ramp and transparency"""
         try:
@@ -373,95 +430,17 @@ class DEMProcessor:
             return ""
     
     def _apply_elevation_colormap(self, normalized_data: np.ndarray) -> np.ndarray:
-        """Apply the exact 50-color elevation ramp with precise thresholds - VECTORIZED"""
-        # Create a 3D array for RGB values initialized to transparent (will be handled by alpha channel)
-        colored = np.zeros((*normalized_data.shape, 3), dtype=np.uint8)
-        
-        # Create mask for valid (non-NaN) data
+        """Apply the 50-color elevation ramp through the cached lookup table"""
         valid_mask = ~np.isnan(normalized_data)
         
         if not np.any(valid_mask):
             logger.warning("No valid data to colorize")
-            return colored
+            return np.zeros((*normalized_data.shape, 3), dtype=np.uint8)
         
         logger.info(f"Coloring {np.sum(valid_mask)} valid pixels out of {normalized_data.size} total")
         
-        # Define color thresholds and RGB values
-        # Format: (threshold, (R, G, B))
-        color_stops = [
-            (0.0,      (16, 105, 40)),
-            (0.020408, (12, 130, 44)),
-            (0.040816, (8, 155, 48)),
-            (0.061224, (5, 181, 51)),
-            (0.081633, (5, 199, 59)),
-            (0.102041, (14, 203, 75)),
-            (0.122449, (22, 208, 91)),
-            (0.142857, (33, 212, 104)),
-            (0.163265, (50, 215, 108)),
-            (0.183673, (68, 219, 111)),
-            (0.204082, (86, 222, 114)),
-            (0.224490, (103, 225, 118)),
-            (0.244898, (121, 228, 122)),
-            (0.265306, (139, 231, 125)),
-            (0.285714, (157, 234, 129)),
-            (0.306122, (176, 238, 134)),
-            (0.326531, (195, 242, 139)),
-            (0.346939, (215, 246, 144)),
-            (0.367347, (226, 245, 146)),
-            (0.387755, (232, 240, 147)),
-            (0.408163, (238, 235, 147)),
-            (0.428571, (245, 229, 148)),
-            (0.448980, (233, 216, 140)),
-            (0.469388, (221, 202, 132)),
-            (0.489796, (209, 188, 124)),
-            (0.510204, (196, 173, 116)),
-            (0.530612, (185, 157, 109)),
-            (0.551020, (173, 141, 101)),
-            (0.571429, (162, 125, 94)),
-            (0.591837, (156, 118, 91)),
-            (0.612245, (151, 110, 89)),
-            (0.632653, (146, 103, 86)),
-            (0.653061, (145, 101, 88)),
-            (0.673469, (150, 108, 97)),
-            (0.693878, (155, 115, 105)),
-            (0.714286, (160, 123, 113)),
-            (0.734694, (166, 131, 121)),
-            (0.755102, (171, 138, 128)),
-            (0.775510, (177, 146, 137)),
-            (0.795918, (183, 153, 145)),
-            (0.816327, (189, 161, 153)),
-            (0.836735, (195, 169, 161)),
-            (0.857143, (201, 176, 169)),
-            (0.877551, (207, 184, 177)),
-            (0.897959, (213, 192, 185)),
-            (0.918367, (220, 200, 193)),
-            (0.938776, (226, 207, 201)),
-            (0.959184, (232, 215, 209)),
-            (0.979592, (238, 223, 217)),
-            (1.0,      (244, 231, 225)),
-            (float('inf'), (255, 255, 255))  # Above 1.0
-        ]
-        
-        # ✅ VECTORIZED COLOR ASSIGNMENT - Process all pixels at once
-        for i in range(len(color_stops) - 1):
-            threshold_low = color_stops[i][0]
-            threshold_high = color_stops[i + 1][0]
-            color = color_stops[i][1]  # ✅ Use the current threshold's color (not next!)
-            
-            # Create mask for pixels in this threshold range
-            mask = valid_mask & (normalized_data >= threshold_low) & (normalized_data < threshold_high)
-            
-            # Assign color to all pixels in this range at once
-            colored[mask, 0] = color[0]  # R
-            colored[mask, 1] = color[1]  # G
-            colored[mask, 2] = color[2]  # B
-        
-        # Handle edge case for exactly 1.0 and above
-        exact_one_or_above = valid_mask & (normalized_data >= 1.0)
-        if np.any(exact_one_or_above):
-            colored[exact_one_or_above, 0] = 255
-            colored[exact_one_or_above, 1] = 255
-            colored[exact_one_or_above, 2] = 255
+        # ✅ Single quantize-and-index step over the compiled 4096-entry ramp
+        colored = get_colormap('elevation').apply(normalized_data, valid_mask)[:, :, :3]
         
         logger.info(f"Color mapping complete. Non-zero pixels: {np.sum(np.any(colored > 0, axis=2))}")
         
@@ -522,6 +501,23 @@ def process_dem_files(dem_files: List[str], geojson_data: Dict[str, Any],
     return dem_processor.process_dem_files(dem_files, geojson_data, output_folder, data_source)
 
 
+def gradient_outputs(processed: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Slope and aspect written by the fused metrics pass of process_dem_files
+    
+    Args:
+        processed: Result of process_dem_files
+        
+    Returns:
+        dict: 'slope'/'aspect' -> path, for run_terrain_pipeline(precomputed=...);
+        empty if the pass did not produce them
+    """
+    metrics = processed.get('terrain_metrics') or {}
+    if 'slope' not in metrics or 'aspect' not in metrics:
+        return {}
+    return {name: metrics[name]['path'] for name in ('slope', 'aspect')}
+
+
 # Legacy compatibility - keep old function name for now
 def process_srtm_files(srtm_files, geojson_data, output_folder=None):
     """
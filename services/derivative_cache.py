@@ -0,0 +1,217 @@
+"""
+Content-addressed cache for terrain derivatives
+
+Outputs of the terrain calculate_* functions are stored under
+SAVE_DIRECTORY/derivative_cache, keyed by the SHA-256 of the input DEM bytes,
+the operation name and its parameters. A repeated request on an unchanged DEM
+copies the stored raster to the requested output path instead of running the
+tool again. Entries are evicted least recently used first (by file mtime,
+refreshed on every hit) once the cache exceeds DERIVATIVE_CACHE_MAX_MB.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import inspect
+import logging
+import tempfile
+import threading
+from functools import wraps
+from typing import Any, Dict, Optional
+
+from utils.config import SAVE_DIRECTORY, TERRAIN_ENGINE, DERIVATIVE_CACHE_MAX_MB
+from utils.file_io import file_sha256
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_CACHE_DIR = os.path.join(str(SAVE_DIRECTORY), "derivative_cache")
+
+# Bump to invalidate every stored derivative after changing how they are computed
+CACHE_VERSION = 1
+
+
+class DerivativeCache:
+    """Disk cache of derivative rasters with an LRU size quota"""
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        """
+        Args:
+            cache_dir: Directory holding the cached rasters
+            max_bytes: Total size the cache is trimmed to after each store
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._evict_lock = threading.Lock()
+
+    @staticmethod
+    def make_key(dem_hash: str, operation: str, params: Dict[str, Any]) -> str:
+        """
+        Build the cache key of one derivative
+
+        Args:
+            dem_hash: SHA-256 of the input DEM
+            operation: Operation name (e.g. 'slope')
+            params: Operation parameters (JSON serializable)
+
+        Returns:
+            str: Hex digest identifying the derivative
+        """
+        payload = json.dumps({
+            'version': CACHE_VERSION,
+            'dem': dem_hash,
+            'operation': operation,
+            'params': params
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def path_for(self, operation: str, key: str, extension: str = '.tif') -> str:
+        """Path of a cache entry"""
+        return os.path.join(self.cache_dir, f"{operation}-{key[:32]}{extension}")
+
+    def fetch(self, cached_path: str, output_file_path: str) -> bool:
+        """
+        Copy a cached derivative to the output path if it exists
+
+        Args:
+            cached_path: Path of the cache entry
+            output_file_path: Where the caller expects the output
+
+        Returns:
+            bool: True on a hit, False if the entry is missing
+        """
+        try:
+            output_dir = os.path.dirname(os.path.abspath(output_file_path))
+            os.makedirs(output_dir, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(prefix='.cached.', suffix=os.path.splitext(output_file_path)[1], dir=output_dir)
+            os.close(fd)
+            try:
+                shutil.copyfile(cached_path, temp_path)
+                os.replace(temp_path, output_file_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        except FileNotFoundError:
+            # Missing, or evicted by another worker between lookup and copy
+            return False
+
+        # Refresh the entry's position in the LRU order
+        try:
+            os.utime(cached_path, None)
+        except OSError:
+            pass
+        return True
+
+    def store(self, cached_path: str, output_file_path: str) -> None:
+        """
+        Publish a freshly computed output as a cache entry
+
+        Args:
+            cached_path: Path of the cache entry
+            output_file_path: The computed output to copy in
+        """
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(prefix='.store.', dir=self.cache_dir)
+            os.close(fd)
+            try:
+                shutil.copyfile(output_file_path, temp_path)
+                os.replace(temp_path, cached_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        except Exception as e:
+            logger.warning(f"Failed to store {output_file_path} in the derivative cache: {str(e)}")
+            return
+
+        self.evict()
+
+    def evict(self) -> int:
+        """
+        Delete least recently used entries until the cache fits its quota
+
+        Returns:
+            int: Number of entries removed
+        """
+        with self._evict_lock:
+            entries = []
+            total = 0
+            try:
+                with os.scandir(self.cache_dir) as it:
+                    for entry in it:
+                        if not entry.is_file() or entry.name.startswith('.'):
+                            continue
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                        total += stat.st_size
+            except FileNotFoundError:
+                return 0
+
+            if total <= self.max_bytes:
+                return 0
+
+            removed = 0
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                    removed += 1
+                except FileNotFoundError:
+                    total -= size
+
+            logger.info(f"🧹 Evicted {removed} derivative cache entries ({total / 1e6:.1f}MB remaining)")
+            return removed
+
+
+# Shared cache for this worker; entries on disk are shared by every worker
+derivative_cache = DerivativeCache(DERIVATIVE_CACHE_DIR, DERIVATIVE_CACHE_MAX_MB * 1024 * 1024)
+
+
+def cached_derivative(operation: str):
+    """
+    Decorate a calculate_*(input_file_path, output_file_path, ...) function so
+    its output is served from the derivative cache
+
+    The key covers the DEM content, the operation, every bound parameter
+    (defaults included) and the configured terrain engine.
+
+    Args:
+        operation: Operation name used in the key and the cache file name
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(input_file_path, output_file_path, *args, **kwargs):
+            cached_path: Optional[str] = None
+            try:
+                bound = signature.bind(input_file_path, output_file_path, *args, **kwargs)
+                bound.apply_defaults()
+                params = dict(bound.arguments)
+                params.pop('input_file_path', None)
+                params.pop('output_file_path', None)
+                params['engine'] = TERRAIN_ENGINE
+
+                key = derivative_cache.make_key(file_sha256(input_file_path), operation, params)
+                cached_path = derivative_cache.path_for(operation, key, os.path.splitext(output_file_path)[1] or '.tif')
+                if derivative_cache.fetch(cached_path, output_file_path):
+                    logger.info(f"♻️ Reusing cached {operation} for {input_file_path} ({key[:12]})")
+                    return True
+            except Exception as e:
+                logger.warning(f"Derivative cache lookup failed for {operation}: {str(e)}")
+                cached_path = None
+
+            start_time = time.time()
+            success = func(input_file_path, output_file_path, *args, **kwargs)
+            if success and cached_path and os.path.exists(output_file_path):
+                derivative_cache.store(cached_path, output_file_path)
+                logger.info(f"Cached {operation} for {input_file_path} after {time.time() - start_time:.1f}s")
+            return success
+
+        return wrapper
+    return decorator
@@ -0,0 +1,220 @@
+"""
+Per-DEM hydrology cache
+
+Depression filling, the D8 flow pointer and D8 flow accumulation are computed
+once per DEM content (SHA-256) and kept under SAVE_DIRECTORY/hydrology_cache.
+The drainage network and watershed delineation read the cached rasters
+instead of redoing the preprocessing in every session folder. The GRASS
+water accumulation (services.water_accumulation) runs its own r.watershed
+and does not use this cache.
+
+Each build runs in its own uniquely named temporary directory and is published
+with an atomic rename, so concurrent jobs never overwrite each other's files.
+
+Entries are evicted least recently used first (by the mtime of their metadata
+file, refreshed on every hit) once the cache exceeds HYDROLOGY_CACHE_MAX_MB.
+Entries used within the last EVICTION_GRACE_SECONDS are kept, since a running
+analysis may still read them.
+"""
+import os
+import json
+import shutil
+import logging
+import tempfile
+import time
+import threading
+from typing import Dict, Optional
+
+from utils.config import SAVE_DIRECTORY, HYDROLOGY_CACHE_MAX_MB
+from utils.file_io import file_sha256
+from services.whitebox_runner import whitebox_tools
+
+logger = logging.getLogger(__name__)
+
+HYDROLOGY_CACHE_DIR = os.path.join(str(SAVE_DIRECTORY), "hydrology_cache")
+
+# Cached products and their file names
+FILLED_DEM = 'filled_dem'
+D8_POINTER = 'd8_pointer'
+FLOW_ACCUMULATION = 'flow_accumulation'
+PRODUCTS = {
+    FILLED_DEM: 'filled_dem.tif',
+    D8_POINTER: 'd8_pointer.tif',
+    FLOW_ACCUMULATION: 'flow_accumulation.tif'
+}
+METADATA_FILE = 'hydrology.json'
+
+# Entries used more recently than this are never evicted
+EVICTION_GRACE_SECONDS = 600
+
+_evict_lock = threading.Lock()
+
+
+def _product_paths(directory: str) -> Dict[str, str]:
+    """Map product names to their paths inside a cache directory"""
+    return {name: os.path.join(directory, file_name) for name, file_name in PRODUCTS.items()}
+
+
+def _is_complete(directory: str) -> bool:
+    """Check whether a cache directory holds every product"""
+    return (os.path.exists(os.path.join(directory, METADATA_FILE)) and
+            all(os.path.exists(path) for path in _product_paths(directory).values()))
+
+
+def _build_products(dem_path: str, build_dir: str) -> None:
+    """
+    Run the WhiteboxTools hydrology preprocessing into build_dir
+
+    Args:
+        dem_path: Path to the input DEM
+        build_dir: Private directory for this build
+    """
+    paths = _product_paths(build_dir)
+
+    # Step 1: Fill depressions to remove sinks
+    with whitebox_tools('fill_depressions') as wbt:
+        wbt.fill_depressions(dem=os.path.abspath(dem_path), output=paths[FILLED_DEM])
+    if not os.path.exists(paths[FILLED_DEM]):
+        raise RuntimeError("Failed to fill depressions - filled DEM not created")
+
+    # Step 2: D8 flow pointer on the filled DEM
+    with whitebox_tools('d8_pointer') as wbt:
+        wbt.d8_pointer(dem=paths[FILLED_DEM], output=paths[D8_POINTER])
+    if not os.path.exists(paths[D8_POINTER]):
+        raise RuntimeError("Failed to calculate D8 pointer - output not created")
+
+    # Step 3: D8 flow accumulation (cells) from the pointer, no second pointer pass
+    with whitebox_tools('d8_flow_accumulation') as wbt:
+        wbt.d8_flow_accumulation(i=paths[D8_POINTER], output=paths[FLOW_ACCUMULATION], pntr=True)
+    if not os.path.exists(paths[FLOW_ACCUMULATION]):
+        raise RuntimeError("Failed to calculate flow accumulation - output not created")
+
+
+def get_hydrology_products(dem_path: str) -> Optional[Dict[str, str]]:
+    """
+    Get the cached hydrology rasters of a DEM, building them on first use
+
+    Args:
+        dem_path: Path to the DEM file
+
+    Returns:
+        dict: 'dem_hash', 'directory' and the 'filled_dem', 'd8_pointer' and
+        'flow_accumulation' paths, or None if preprocessing failed
+    """
+    try:
+        dem_hash = file_sha256(dem_path)
+        cache_dir = os.path.join(HYDROLOGY_CACHE_DIR, dem_hash)
+
+        if _is_complete(cache_dir):
+            logger.info(f"♻️ Reusing cached hydrology for {dem_path} ({dem_hash[:12]})")
+            _touch(cache_dir)
+        else:
+            os.makedirs(HYDROLOGY_CACHE_DIR, exist_ok=True)
+            build_dir = tempfile.mkdtemp(prefix=f".{dem_hash[:12]}.", dir=HYDROLOGY_CACHE_DIR)
+            try:
+                start_time = time.time()
+                logger.info(f"Building hydrology cache for {dem_path} ({dem_hash[:12]})...")
+                _build_products(dem_path, build_dir)
+
+                with open(os.path.join(build_dir, METADATA_FILE), 'w') as f:
+                    json.dump({
+                        'dem_hash': dem_hash,
+                        'source_dem': os.path.abspath(dem_path),
+                        'created_at': time.time()
+                    }, f)
+
+                try:
+                    os.rename(build_dir, cache_dir)
+                    logger.info(f"✅ Hydrology cache built in {time.time() - start_time:.1f}s: {cache_dir}")
+                except OSError:
+                    # Another job published the same DEM first; keep its copy
+                    if not _is_complete(cache_dir):
+                        raise
+                    logger.info(f"Hydrology cache for {dem_hash[:12]} was published concurrently, discarding duplicate")
+            finally:
+                shutil.rmtree(build_dir, ignore_errors=True)
+            evict_hydrology_cache()
+
+        products = _product_paths(cache_dir)
+        products['dem_hash'] = dem_hash
+        products['directory'] = cache_dir
+        return products
+
+    except Exception as e:
+        logger.error(f"Error preparing hydrology cache for {dem_path}: {str(e)}", exc_info=True)
+        return None
+
+
+def _touch(directory: str) -> None:
+    """Mark a cache entry as used now"""
+    try:
+        os.utime(os.path.join(directory, METADATA_FILE))
+    except OSError:
+        pass
+
+
+def _directory_size(directory: str) -> int:
+    """Total size in bytes of the files in a cache entry"""
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def evict_hydrology_cache(max_bytes: int = HYDROLOGY_CACHE_MAX_MB * 1024 * 1024) -> int:
+    """
+    Delete least recently used entries until the cache fits its quota
+
+    An entry is first renamed to a hidden name, so lookups never see it half
+    deleted (they rebuild it instead).
+
+    Args:
+        max_bytes: Cache quota in bytes
+
+    Returns:
+        int: Number of entries removed
+    """
+    with _evict_lock:
+        entries = []
+        total = 0
+        try:
+            with os.scandir(HYDROLOGY_CACHE_DIR) as it:
+                for entry in it:
+                    if not entry.is_dir() or entry.name.startswith('.'):
+                        continue
+                    try:
+                        last_used = os.path.getmtime(os.path.join(entry.path, METADATA_FILE))
+                    except OSError:
+                        continue
+                    size = _directory_size(entry.path)
+                    entries.append((last_used, size, entry.path))
+                    total += size
+        except FileNotFoundError:
+            return 0
+
+        if total <= max_bytes:
+            return 0
+
+        removed = 0
+        now = time.time()
+        for last_used, size, path in sorted(entries):
+            if total <= max_bytes or now - last_used < EVICTION_GRACE_SECONDS:
+                break
+            doomed = os.path.join(HYDROLOGY_CACHE_DIR, f".evicted.{os.path.basename(path)}.{os.getpid()}")
+            try:
+                os.rename(path, doomed)
+            except OSError:
+                # Evicted by another worker meanwhile
+                total -= size
+                continue
+            shutil.rmtree(doomed, ignore_errors=True)
+            total -= size
+            removed += 1
+
+        logger.info(f"🧹 Evicted {removed} hydrology cache entries ({total / 1e6:.1f}MB remaining)")
+        return removed
+
@@ -0,0 +1,284 @@
+"""
+Per-stage timing and resource instrumentation
+
+An analysis runs inside a recording() scope; every stage within it (fetch,
+merge, clip, each terrain derivative, visualization, statistics, DB save) is
+wrapped in stage() or decorated with @instrumented. Each stage records its
+wall time, CPU time, peak RSS growth, bytes read and written and the size of
+the rasters it worked on. The recording is stored in the analysis'
+processing_steps column, so slow stages can be compared across SRTM, LiDAR
+and USGS analyses in production.
+
+The recorder travels in a context variable (like the cancellation token), so
+stages running in pipeline threads report to the analysis that started them.
+CPU time and I/O are measured for the stage's own thread; work done by
+subprocesses (WhiteboxTools) shows up as wall time only. Every stage also
+feeds the stage latency histogram of /metrics, even outside a recording()
+scope.
+"""
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.metrics import observe_stage
+
+try:
+    import resource
+except ImportError:  # Not available on Windows: peak RSS is not recorded
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Version of the processing_steps document layout
+PROCESSING_STEPS_VERSION = 1
+
+
+def _io_counters() -> Optional[Dict[str, int]]:
+    """Bytes read and written by the calling thread so far (Linux only)"""
+    for path in ('/proc/thread-self/io', f"/proc/self/task/{threading.get_native_id()}/io"):
+        try:
+            with open(path, 'r') as f:
+                fields = dict(line.split(':', 1) for line in f if ':' in line)
+            return {'read': int(fields['rchar']), 'written': int(fields['wchar'])}
+        except (OSError, KeyError, ValueError):
+            continue
+    return None
+
+
+def _peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process in MB"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak / (1024 * 1024) if os.uname().sysname == 'Darwin' else peak / 1024
+
+
+def describe_raster(path: str) -> Dict[str, Any]:
+    """
+    Dimensions of a raster file
+
+    Returns:
+        dict: 'width', 'height', 'bands' and 'dtype', or an empty dict if the
+        file cannot be read
+    """
+    try:
+        import rasterio
+        with rasterio.open(path) as src:
+            return {'width': src.width, 'height': src.height, 'bands': src.count, 'dtype': src.dtypes[0]}
+    except Exception:
+        return {}
+
+
+def _failure_status(error: BaseException) -> str:
+    """Stage status for an exception ('cancelled' for cancellations)"""
+    return 'cancelled' if type(error).__name__ in ('OperationCancelled', 'TimeBudgetExceeded') else 'error'
+
+
+class StageStep:
+    """Measurements of one running stage; stages may annotate it"""
+
+    def __init__(self, name: str, parent: Optional[str], attrs: Dict[str, Any]):
+        self.name = name
+        self.parent = parent
+        self.attrs = dict(attrs)
+
+    def annotate(self, **attrs) -> None:
+        """Attach extra fields (tile counts, cell counts, ...) to the record"""
+        self.attrs.update(attrs)
+
+    def raster(self, path: Optional[str], prefix: str = '') -> None:
+        """
+        Record the dimensions of a raster the stage read or wrote
+
+        Args:
+            path: Raster file (ignored when None)
+            prefix: Optional field prefix, e.g. 'input_'
+        """
+        if path:
+            for key, value in describe_raster(path).items():
+                self.attrs[f"{prefix}{key}"] = value
+
+
+class _NullStep(StageStep):
+    """Step handed out outside a recording() scope; ignores annotations"""
+
+    def annotate(self, **attrs) -> None:
+        pass
+
+    def raster(self, path: Optional[str], prefix: str = '') -> None:
+        pass
+
+
+class StageRecorder:
+    """Collects the stage records of one analysis"""
+
+    def __init__(self, label: str, data_source: Optional[str] = None):
+        """
+        Args:
+            label: Analysis being recorded (polygon or task id), for logging
+            data_source: 'srtm', 'lidar', 'usgs-dem', ...
+        """
+        self.label = label
+        self.data_source = data_source
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._stages: List[Dict[str, Any]] = []
+
+    def add(self, record: Dict[str, Any]) -> None:
+        """Append a finished stage record"""
+        with self._lock:
+            self._stages.append(record)
+
+    @property
+    def stages(self) -> List[Dict[str, Any]]:
+        """Finished stage records in completion order"""
+        with self._lock:
+            return list(self._stages)
+
+    def processing_steps(self, **extra) -> Dict[str, Any]:
+        """
+        The recording as stored in analyses.processing_steps
+
+        Args:
+            **extra: Additional top-level fields
+
+        Returns:
+            dict: 'version', 'data_source', 'started_at', 'total_wall_seconds',
+            'stages' (in start order) and any extra fields
+        """
+        steps = {
+            'version': PROCESSING_STEPS_VERSION,
+            'data_source': self.data_source,
+            'started_at': self.started_at.isoformat(),
+            'total_wall_seconds': round(time.perf_counter() - self._start, 3),
+            'stages': sorted(self.stages, key=lambda record: record['start_offset_seconds'])
+        }
+        steps.update(extra)
+        return steps
+
+    def summary(self) -> str:
+        """One-line summary of the top-level stages, slowest first"""
+        top = [record for record in self.stages if record.get('parent') is None]
+        top.sort(key=lambda record: record['wall_seconds'], reverse=True)
+        return ', '.join(f"{record['name']} {record['wall_seconds']:.2f}s" for record in top)
+
+
+_current_recorder: ContextVar[Optional[StageRecorder]] = ContextVar('stage_recorder', default=None)
+_current_stage: ContextVar[Optional[str]] = ContextVar('current_stage', default=None)
+
+
+@contextmanager
+def recording(label: str, data_source: Optional[str] = None):
+    """
+    Record the stages of the enclosed analysis
+
+    Args:
+        label: Analysis being recorded (polygon or task id), for logging
+        data_source: Data source of the analysis
+
+    Yields:
+        StageRecorder: The recorder, also returned by current_recorder()
+    """
+    recorder = StageRecorder(label, data_source)
+    context_token = _current_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current_recorder.reset(context_token)
+        logger.info(f"⏱️ Stage timings for {label}: {recorder.summary()}")
+
+
+def current_recorder() -> Optional[StageRecorder]:
+    """Recorder of the analysis running in this context, if any"""
+    return _current_recorder.get()
+
+
+@contextmanager
+def stage(name: str, **attrs):
+    """
+    Measure the enclosed block as one stage of the current analysis
+
+    Stages nest: a stage started inside another (in the same or a pipeline
+    thread) records the outer one as its parent.
+
+    Args:
+        name: Stage name ('fetch', 'merge', 'slope', 'db_save', ...)
+        **attrs: Fields stored with the record (e.g. tiles=4)
+
+    Yields:
+        StageStep: Handle for annotate() and raster()
+    """
+    recorder = _current_recorder.get()
+    if recorder is None:
+        start = time.perf_counter()
+        status = 'ok'
+        try:
+            yield _NullStep(name, None, attrs)
+        except BaseException as e:
+            status = _failure_status(e)
+            raise
+        finally:
+            observe_stage(name, attrs.get('data_source'), status, time.perf_counter() - start)
+        return
+
+    step = StageStep(name, _current_stage.get(), attrs)
+    stage_token = _current_stage.set(name)
+    io_before = _io_counters()
+    rss_before = _peak_rss_mb()
+    cpu_before = time.thread_time()
+    start = time.perf_counter()
+    status = 'ok'
+    try:
+        yield step
+    except BaseException as e:
+        status = _failure_status(e)
+        step.annotate(error=str(e)[:200])
+        raise
+    finally:
+        wall = time.perf_counter() - start
+        cpu = time.thread_time() - cpu_before
+        _current_stage.reset(stage_token)
+        observe_stage(name, step.attrs.get('data_source') or recorder.data_source, status, wall)
+
+        record = {
+            'name': name,
+            'parent': step.parent,
+            'status': status,
+            'thread': threading.current_thread().name,
+            'start_offset_seconds': round(start - recorder._start, 3),
+            'wall_seconds': round(wall, 3),
+            'cpu_seconds': round(cpu, 3)
+        }
+        rss_after = _peak_rss_mb()
+        if rss_before is not None and rss_after is not None:
+            record['peak_rss_delta_mb'] = round(rss_after - rss_before, 1)
+        io_after = _io_counters()
+        if io_before is not None and io_after is not None:
+            record['bytes_read'] = io_after['read'] - io_before['read']
+            record['bytes_written'] = io_after['written'] - io_before['written']
+        record.update(step.attrs)
+        recorder.add(record)
+
+
+def instrumented(name: str) -> Callable:
+    """
+    Decorator recording every call of a function as a stage
+
+    Args:
+        name: Stage name
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,798 @@
+"""
+Persistent job queue shared by all gunicorn workers
+
+Jobs live in a `jobs` table in the existing Postgres database (DATABASE_URL)
+or, without one, in a local SQLite file, so any worker can report a job's
+status and queued work survives restarts. Executor threads in every worker
+claim queued jobs atomically, refresh a heartbeat while running them, and a
+job whose heartbeat goes stale (its worker died) is claimed again until it
+runs out of attempts. Failed jobs are retried with a backoff.
+
+Every visible change bumps the job's revision, so status streams can wait for
+the revision to move instead of re-sending the whole status on a timer.
+
+Jobs may carry a dedupe key: while a job with that key is queued or running,
+enqueueing the same key returns the existing job instead of a new one (a
+partial unique index makes this hold across workers).
+
+Queued jobs can be cancelled outright; running jobs get a cancel_requested
+flag that the executor owning them picks up on its next heartbeat (at once
+when it runs on this host) and stops the job through its cancellation token.
+Each attempt also runs under a time budget.
+
+Jobs belong to a priority lane. Claims take higher-priority lanes first,
+and besides the slots serving every lane, each worker keeps slots that only
+take interactive jobs, so those never wait behind multi-minute bulk runs.
+
+A job queued by a profiled request carries its profile id and is profiled
+into the same profile when it runs.
+
+Updates made while running a job only apply while the executor slot still
+holds it: once its lease expired and another slot re-claimed it, or the job
+was cancelled, a late progress update or result from the old attempt is
+dropped.
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import threading
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils.config import (
+    DATABASE_URL, JOB_QUEUE_PATH, JOB_EXECUTOR_SLOTS, JOB_HEARTBEAT_SECONDS,
+    JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, JOB_RETRY_BACKOFF_SECONDS, JOB_TIME_BUDGET_SECONDS,
+    JOB_INTERACTIVE_SLOTS
+)
+from utils.cancellation import CancellationToken, cancellation_scope
+from utils.priority import LANES, INTERACTIVE, BULK, lane_rank, lane_scope, resolve_lane
+from utils.metrics import db_connection_wait
+from utils.profiling import profiling, current_profile_id
+
+logger = logging.getLogger(__name__)
+
+# Job states (the names the status route already understands)
+QUEUED = 'QUEUED'
+PROGRESS = 'PROGRESS'
+SUCCESS = 'SUCCESS'
+FAILURE = 'FAILURE'
+CANCELLED = 'CANCELLED'
+
+# Seconds an idle executor slot waits before polling the queue again (each
+# slot polls on its own connection; abandoned jobs are swept once per lease)
+POLL_INTERVAL = 1.0
+
+JOBS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id VARCHAR(255) PRIMARY KEY,
+        kind VARCHAR(50) NOT NULL,
+        payload TEXT,
+        status VARCHAR(20) NOT NULL DEFAULT 'QUEUED',
+        message TEXT,
+        progress INTEGER DEFAULT 0,
+        result TEXT,
+        attempts INTEGER DEFAULT 0,
+        max_attempts INTEGER DEFAULT 3,
+        worker_id VARCHAR(255),
+        available_at DOUBLE PRECISION,
+        heartbeat_at DOUBLE PRECISION,
+        created_at DOUBLE PRECISION,
+        updated_at DOUBLE PRECISION,
+        revision INTEGER DEFAULT 0,
+        dedupe_key VARCHAR(64),
+        cancel_requested INTEGER DEFAULT 0,
+        lane VARCHAR(20) DEFAULT 'bulk',
+        profile_id VARCHAR(64)
+    );
+"""
+
+# Columns added after the table was first released -> their definition, added
+# to existing tables by ensure_schema
+ADDED_COLUMNS = {
+    'revision': 'INTEGER DEFAULT 0',
+    'dedupe_key': 'VARCHAR(64)',
+    'cancel_requested': 'INTEGER DEFAULT 0',
+    'lane': "VARCHAR(20) DEFAULT 'bulk'",
+    'profile_id': 'VARCHAR(64)'
+}
+
+# A dedupe key is unique among active jobs only
+ACTIVE_JOB_CONDITION = "status IN ('QUEUED', 'PROGRESS')"
+
+JOBS_INDEXES_SQL = [
+    "CREATE INDEX IF NOT EXISTS idx_jobs_status_available ON jobs(status, available_at);",
+    f"CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_dedupe ON jobs(dedupe_key) WHERE {ACTIVE_JOB_CONDITION};"
+]
+
+JOB_COLUMNS = ('id', 'kind', 'payload', 'status', 'message', 'progress', 'result', 'attempts',
+               'max_attempts', 'worker_id', 'available_at', 'heartbeat_at', 'created_at', 'updated_at',
+               'revision', 'dedupe_key', 'cancel_requested', 'lane', 'profile_id')
+
+# Seconds between revision checks while waiting for a job owned by another
+# worker; about the rate clients polled /status at before status streams
+CHANGE_POLL_INTERVAL = 2.0
+
+# Executor slot running the job of the current context (set while a handler runs)
+_current_worker: ContextVar[Optional[str]] = ContextVar('job_worker', default=None)
+
+# Sort key putting higher-priority lanes first
+LANE_ORDER_SQL = "CASE lane " + " ".join(f"WHEN '{lane}' THEN {rank}" for rank, lane in enumerate(LANES)) + f" ELSE {len(LANES)} END"
+
+
+class PermanentJobError(Exception):
+    """Raised by a job handler for failures that retrying cannot fix"""
+
+
+class JobQueue:
+    """Durable job table with claim, heartbeat and retry"""
+
+    def __init__(self, database_url: Optional[str] = None, sqlite_path: Optional[str] = None,
+                 lease_seconds: float = JOB_LEASE_SECONDS, max_attempts: int = JOB_MAX_ATTEMPTS):
+        """
+        Args:
+            database_url: Postgres URL; when empty the SQLite file is used
+            sqlite_path: SQLite database path
+            lease_seconds: Heartbeat age after which a running job counts as abandoned
+            max_attempts: Default number of attempts per job
+        """
+        self.database_url = database_url
+        self.sqlite_path = sqlite_path
+        self.backend = 'postgres' if database_url else 'sqlite'
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+        self._changed = threading.Condition()
+        self._local = threading.local()
+        self._last_sweep = 0.0
+        self._sweep_lock = threading.Lock()
+
+    def _connect(self):
+        """Open a connection to the queue database"""
+        with db_connection_wait('job_queue'):
+            if self.backend == 'postgres':
+                import psycopg2
+                return psycopg2.connect(self.database_url)
+
+            os.makedirs(os.path.dirname(os.path.abspath(self.sqlite_path)), exist_ok=True)
+            conn = sqlite3.connect(self.sqlite_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            return conn
+
+    def _connection(self):
+        """This thread's connection, opened on first use and kept for later statements"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _discard_connection(self) -> None:
+        """Close this thread's connection after an error (the next statement reconnects)"""
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _sql(self, query: str) -> str:
+        """Adapt '?' placeholders to the backend's parameter style"""
+        return query.replace('?', '%s') if self.backend == 'postgres' else query
+
+    def _execute(self, query: str, params: tuple = (), fetch: bool = False):
+        """
+        Run one statement in its own transaction
+
+        Returns:
+            list of rows if fetch is set, otherwise the affected row count
+        """
+        self.ensure_schema()
+        conn = self._connection()
+        try:
+            cursor = conn.cursor()
+            if self.backend == 'sqlite':
+                cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute(self._sql(query), params)
+            result = cursor.fetchall() if fetch else cursor.rowcount
+            conn.commit()
+            return result
+        except Exception:
+            self._discard_connection()
+            raise
+
+    def ensure_schema(self) -> None:
+        """Create the jobs table (and add any missing columns) on first use"""
+        if self._schema_ready:
+            return
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            conn = self._connect()
+            try:
+                cursor = conn.cursor()
+                cursor.execute(JOBS_TABLE_SQL)
+                if self.backend == 'postgres':
+                    cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_name = 'jobs'")
+                    existing = {row[0] for row in cursor.fetchall()}
+                else:
+                    cursor.execute("PRAGMA table_info(jobs)")
+                    existing = {row[1] for row in cursor.fetchall()}
+                for column, definition in ADDED_COLUMNS.items():
+                    if column not in existing:
+                        cursor.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+                        logger.info(f"Added column jobs.{column}")
+                for index_sql in JOBS_INDEXES_SQL:
+                    cursor.execute(index_sql)
+                conn.commit()
+            finally:
+                conn.close()
+            self._schema_ready = True
+            logger.info(f"Job queue ready ({self.backend})")
+
+    @staticmethod
+    def _row_to_job(row) -> Dict[str, Any]:
+        """Convert a table row to a job dict with decoded payload and result"""
+        job = dict(zip(JOB_COLUMNS, row))
+        for key in ('payload', 'result'):
+            job[key] = json.loads(job[key]) if job[key] else None
+        return job
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], job_id: Optional[str] = None,
+                message: str = 'Queued', max_attempts: Optional[int] = None,
+                dedupe_key: Optional[str] = None, lane: str = BULK, profile_id: Optional[str] = None) -> str:
+        """
+        Add a job to the queue
+
+        Args:
+            kind: Handler name the job is dispatched to
+            payload: JSON-serializable job arguments
+            job_id: Optional job identifier (a UUID by default)
+            message: Initial status message
+            max_attempts: Attempts before the job fails for good
+            dedupe_key: Optional key; while a job with the same key is queued
+                or running, its id is returned and nothing is inserted
+            lane: Priority lane (one of utils.priority.LANES)
+            profile_id: Profile the job is sampled into (default: the profile
+                of the request queueing it, if it is being profiled)
+
+        Raises:
+            ValueError: If the lane is unknown
+
+        Returns:
+            str: The id of the new job, or of the active job it was coalesced into
+        """
+        job_id = job_id or uuid.uuid4().hex
+        lane = resolve_lane(lane, BULK)
+        profile_id = profile_id or current_profile_id()
+        insert = (f"INSERT INTO jobs ({', '.join(JOB_COLUMNS)}) VALUES ({', '.join('?' * len(JOB_COLUMNS))}) "
+                  f"ON CONFLICT (dedupe_key) WHERE {ACTIVE_JOB_CONDITION} DO NOTHING")
+
+        # The active job may finish between a conflicting insert and the lookup;
+        # the next insert then succeeds
+        for _ in range(3):
+            now = time.time()
+            inserted = self._execute(insert, (
+                job_id, kind, json.dumps(payload, default=str), QUEUED, message, 0, None, 0,
+                max_attempts or self.max_attempts, None, now, None, now, now, 0, dedupe_key, 0, lane, profile_id
+            ))
+            if inserted:
+                return job_id
+
+            rows = self._execute(f"SELECT id FROM jobs WHERE dedupe_key = ? AND {ACTIVE_JOB_CONDITION}",
+                                 (dedupe_key,), fetch=True)
+            if rows:
+                logger.info(f"🔗 Coalesced duplicate {kind} job into active job {rows[0][0]}")
+                return rows[0][0]
+
+        raise RuntimeError(f"Could not enqueue {kind} job {job_id}")
+
+    def claim(self, worker_id: str, lanes: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Atomically take the next runnable job: highest-priority lane first,
+        then oldest
+
+        Runnable jobs are queued jobs whose retry delay has passed and running
+        jobs whose heartbeat is older than the lease (their worker died).
+
+        Args:
+            worker_id: Identifier of the claiming executor slot
+            lanes: Lanes the slot serves (default: all)
+
+        Returns:
+            dict: The claimed job, or None if nothing is runnable
+        """
+        now = time.time()
+        stale_before = now - self.lease_seconds
+        self._sweep_abandoned(now)
+
+        lanes = list(lanes or LANES)
+        runnable = (f"((status = ? AND available_at <= ?) OR "
+                    f"(status = ? AND heartbeat_at < ? AND attempts < max_attempts AND cancel_requested = 0)) "
+                    f"AND lane IN ({', '.join('?' * len(lanes))})")
+        params = (QUEUED, now, PROGRESS, stale_before) + tuple(lanes)
+        order = f"ORDER BY {LANE_ORDER_SQL}, created_at"
+        update = ("UPDATE jobs SET status = ?, worker_id = ?, attempts = attempts + 1, "
+                  "heartbeat_at = ?, updated_at = ?, message = ?, revision = revision + 1")
+        update_params = (PROGRESS, worker_id, now, now, 'Starting')
+
+        if self.backend == 'postgres':
+            rows = self._execute(
+                f"{update} WHERE id = (SELECT id FROM jobs WHERE {runnable} "
+                f"{order} LIMIT 1 FOR UPDATE SKIP LOCKED) RETURNING {', '.join(JOB_COLUMNS)}",
+                update_params + params, fetch=True
+            )
+            return self._row_to_job(rows[0]) if rows else None
+
+        self.ensure_schema()
+        conn = self._connection()
+        try:
+            cursor = conn.cursor()
+            # Look without the write lock first: idle polls find nothing
+            cursor.execute(f"SELECT 1 FROM jobs WHERE {runnable} LIMIT 1", params)
+            if cursor.fetchone() is None:
+                return None
+
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute(f"SELECT id FROM jobs WHERE {runnable} {order} LIMIT 1", params)
+            row = cursor.fetchone()
+            if row is None:
+                conn.commit()
+                return None
+            cursor.execute(f"{update} WHERE id = ?", update_params + (row[0],))
+            cursor.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (row[0],))
+            job = self._row_to_job(cursor.fetchone())
+            conn.commit()
+            return job
+        except Exception:
+            self._discard_connection()
+            raise
+
+    def _sweep_abandoned(self, now: float) -> None:
+        """
+        Settle abandoned jobs that must not be claimed again, at most once
+        per lease interval in this worker
+
+        Args:
+            now: Current time
+        """
+        with self._sweep_lock:
+            if now - self._last_sweep < self.lease_seconds:
+                return
+            self._last_sweep = now
+        stale_before = now - self.lease_seconds
+
+        # Abandoned jobs that were being cancelled stay cancelled
+        self._execute(
+            "UPDATE jobs SET status = ?, message = ?, updated_at = ?, revision = revision + 1 "
+            "WHERE status = ? AND heartbeat_at < ? AND cancel_requested = 1",
+            (CANCELLED, 'Cancelled', now, PROGRESS, stale_before)
+        )
+
+        # Abandoned jobs that used up their attempts fail instead of running again
+        self._execute(
+            "UPDATE jobs SET status = ?, message = ?, updated_at = ?, revision = revision + 1 "
+            "WHERE status = ? AND heartbeat_at < ? AND attempts >= max_attempts",
+            (FAILURE, 'Job abandoned by its worker too many times', now, PROGRESS, stale_before)
+        )
+
+    def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        """
+        Refresh a running job's lease
+
+        Returns:
+            bool: False if the job is no longer held by this worker
+        """
+        now = time.time()
+        return self._execute(
+            "UPDATE jobs SET heartbeat_at = ?, updated_at = ? WHERE id = ? AND worker_id = ? AND status = ?",
+            (now, now, job_id, worker_id, PROGRESS)
+        ) > 0
+
+    @staticmethod
+    def _held_by(worker_id: Optional[str]) -> Tuple[str, tuple]:
+        """
+        Condition limiting an update to a job still running in a slot
+
+        Args:
+            worker_id: Executor slot (default: the slot running the current
+                context's job; without one the update is not limited)
+
+        Returns:
+            tuple: (SQL suffix for the WHERE clause, its parameters)
+        """
+        worker_id = worker_id or _current_worker.get()
+        if worker_id is None:
+            return "", ()
+        return " AND worker_id = ? AND status = ?", (worker_id, PROGRESS)
+
+    def update(self, job_id: str, message: Optional[str] = None, progress: Optional[int] = None,
+               result: Any = None, worker_id: Optional[str] = None) -> bool:
+        """
+        Record progress of a running job (also refreshes its heartbeat)
+
+        Args:
+            job_id: Job identifier
+            message: Optional status message
+            progress: Optional progress percentage
+            result: Optional partial result, replaced by the final one on completion
+            worker_id: Slot running the job (default: the current context's)
+
+        Returns:
+            bool: False if the job is no longer held by the slot
+        """
+        now = time.time()
+        partial = json.dumps(result, default=str) if result is not None else None
+        held, held_params = self._held_by(worker_id)
+        updated = self._execute(
+            "UPDATE jobs SET message = COALESCE(?, message), progress = COALESCE(?, progress), "
+            "result = COALESCE(?, result), heartbeat_at = ?, updated_at = ?, revision = revision + 1 WHERE id = ?" + held,
+            (message, progress, partial, now, now, job_id) + held_params
+        )
+        self._notify_changed()
+        return updated > 0
+
+    def complete(self, job_id: str, result: Any = None, message: str = 'Completed',
+                 worker_id: Optional[str] = None) -> bool:
+        """
+        Mark a job successful and store its result
+
+        Returns:
+            bool: False if the job is no longer held by the slot (the result is dropped)
+        """
+        held, held_params = self._held_by(worker_id)
+        updated = self._execute(
+            "UPDATE jobs SET status = ?, message = ?, progress = 100, result = ?, updated_at = ?, "
+            "revision = revision + 1 WHERE id = ?" + held,
+            (SUCCESS, message, json.dumps(result, default=str), time.time(), job_id) + held_params
+        )
+        self._notify_changed()
+        return updated > 0
+
+    def fail(self, job_id: str, error: str, retry: bool = True, progress: Optional[int] = None,
+             worker_id: Optional[str] = None) -> bool:
+        """
+        Record a failed attempt, requeueing the job while attempts remain
+
+        Args:
+            job_id: Job identifier
+            error: Error message
+            retry: False to fail the job for good
+            progress: Optional progress percentage to keep
+            worker_id: Slot running the job (default: the current context's)
+
+        Returns:
+            bool: True if the job was requeued
+        """
+        job = self.get(job_id)
+        if job is None:
+            return False
+
+        if job['cancel_requested']:
+            self.mark_cancelled(job_id, f"Cancelled (last error: {error})", worker_id=worker_id)
+            return False
+
+        now = time.time()
+        held, held_params = self._held_by(worker_id)
+        if retry and job['attempts'] < job['max_attempts']:
+            delay = JOB_RETRY_BACKOFF_SECONDS * (2 ** (job['attempts'] - 1))
+            if self._execute(
+                "UPDATE jobs SET status = ?, message = ?, progress = 0, worker_id = NULL, "
+                "available_at = ?, updated_at = ?, revision = revision + 1 WHERE id = ?" + held,
+                (QUEUED, f"Retrying after error: {error}", now + delay, now, job_id) + held_params
+            ):
+                self._notify_changed()
+                logger.warning(f"🔁 Job {job_id} attempt {job['attempts']}/{job['max_attempts']} failed, retrying in {delay:.0f}s")
+                return True
+            logger.warning(f"Dropped failure of job {job_id}: it is no longer held by this worker")
+            return False
+
+        if not self._execute(
+            "UPDATE jobs SET status = ?, message = ?, progress = COALESCE(?, 0), updated_at = ?, "
+            "revision = revision + 1 WHERE id = ?" + held,
+            (FAILURE, error, progress, now, job_id) + held_params
+        ):
+            logger.warning(f"Dropped failure of job {job_id}: it is no longer held by this worker")
+        self._notify_changed()
+        return False
+
+    def request_cancel(self, job_id: str, message: str = 'Cancelled by user') -> Optional[str]:
+        """
+        Cancel a job from any worker
+
+        A queued job is cancelled at once; a running job is flagged and stopped
+        by the executor that owns it.
+
+        Args:
+            job_id: Job identifier
+            message: Status message of the cancelled job
+
+        Returns:
+            str: 'cancelled' (it will not run), 'cancelling' (it is running and
+            will stop), 'finished' (already done) or None if the job is unknown
+        """
+        now = time.time()
+        if self._execute(
+            "UPDATE jobs SET status = ?, message = ?, cancel_requested = 1, updated_at = ?, "
+            "revision = revision + 1 WHERE id = ? AND status = ?",
+            (CANCELLED, message, now, job_id, QUEUED)
+        ):
+            self._notify_changed()
+            return 'cancelled'
+
+        if self._execute(
+            "UPDATE jobs SET message = ?, cancel_requested = 1, updated_at = ?, revision = revision + 1 "
+            "WHERE id = ? AND status = ?",
+            ('Cancelling', now, job_id, PROGRESS)
+        ):
+            self._notify_changed()
+            return 'cancelling'
+
+        return 'finished' if self.get(job_id) else None
+
+    def queue_position(self, job_id: str) -> Optional[int]:
+        """
+        Position of a queued job in claim order (1 = next to run)
+
+        Counts the runnable queued jobs that would be claimed before it:
+        those in higher-priority lanes and older ones in its own lane.
+
+        Returns:
+            int: The position, or None if the job is not queued
+        """
+        rows = self._execute(
+            f"SELECT {LANE_ORDER_SQL}, created_at FROM jobs WHERE id = ? AND status = ?",
+            (job_id, QUEUED), fetch=True
+        )
+        if not rows:
+            return None
+        rank, created_at = rows[0]
+        ahead = self._execute(
+            f"SELECT COUNT(*) FROM jobs WHERE status = ? AND available_at <= ? AND id != ? "
+            f"AND ({LANE_ORDER_SQL} < ? OR ({LANE_ORDER_SQL} = ? AND created_at < ?))",
+            (QUEUED, time.time(), job_id, rank, rank, created_at), fetch=True
+        )
+        return ahead[0][0] + 1
+
+    def is_cancel_requested(self, job_id: str) -> bool:
+        """Check whether cancellation of a job has been requested"""
+        rows = self._execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,), fetch=True)
+        return bool(rows and rows[0][0])
+
+    def mark_cancelled(self, job_id: str, message: str = 'Cancelled', worker_id: Optional[str] = None) -> None:
+        """Record that a running job stopped because it was cancelled"""
+        held, held_params = self._held_by(worker_id)
+        self._execute(
+            "UPDATE jobs SET status = ?, message = ?, updated_at = ?, revision = revision + 1 WHERE id = ?" + held,
+            (CANCELLED, message, time.time(), job_id) + held_params
+        )
+        self._notify_changed()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a job from any worker
+
+        Returns:
+            dict: The job, or None if unknown
+        """
+        rows = self._execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,), fetch=True)
+        return self._row_to_job(rows[0]) if rows else None
+
+    def get_revision(self, job_id: str) -> Optional[int]:
+        """
+        Cheap lookup of a job's revision counter
+
+        Returns:
+            int: The revision, or None if the job is unknown
+        """
+        rows = self._execute("SELECT revision FROM jobs WHERE id = ?", (job_id,), fetch=True)
+        return (rows[0][0] or 0) if rows else None
+
+    def wait_for_change(self, job_id: str, revision: int, timeout: float) -> Optional[int]:
+        """
+        Block until a job's revision differs from the given one
+
+        Changes made in this worker wake the waiter immediately; changes made
+        by other workers are picked up by polling the revision every
+        CHANGE_POLL_INTERVAL seconds. That trades up to one interval of latency
+        for a query load no higher than the client polling the streams replace,
+        without a cross-worker notification channel to operate.
+
+        Args:
+            job_id: Job identifier
+            revision: Last revision the caller has seen
+            timeout: Maximum seconds to wait
+
+        Returns:
+            int: The current revision (equal to the given one on timeout), or
+            None if the job disappeared
+        """
+        deadline = time.time() + timeout
+        while True:
+            current = self.get_revision(job_id)
+            remaining = deadline - time.time()
+            if current is None or current != revision or remaining <= 0:
+                return current
+            with self._changed:
+                self._changed.wait(min(CHANGE_POLL_INTERVAL, remaining))
+
+    def _notify_changed(self) -> None:
+        """Wake status streams waiting in this worker"""
+        with self._changed:
+            self._changed.notify_all()
+
+    def cleanup(self, older_than_seconds: float = 3600) -> int:
+        """
+        Delete finished jobs last updated more than older_than_seconds ago
+
+        Returns:
+            int: Number of jobs removed
+        """
+        return self._execute(
+            "DELETE FROM jobs WHERE status IN (?, ?, ?) AND updated_at < ?",
+            (SUCCESS, FAILURE, CANCELLED, time.time() - older_than_seconds)
+        )
+
+
+class JobExecutor:
+    """Executor slots draining the queue inside one worker process"""
+
+    def __init__(self, queue: JobQueue, slots: int = JOB_EXECUTOR_SLOTS,
+                 heartbeat_seconds: float = JOB_HEARTBEAT_SECONDS,
+                 lane_slots: Optional[Dict[str, int]] = None):
+        """
+        Args:
+            queue: Queue to drain
+            slots: Slots serving every lane (higher-priority lanes first)
+            heartbeat_seconds: Interval between lease refreshes
+            lane_slots: Additional slots per lane, each serving that lane and
+                the lanes above it (e.g. {'interactive': 1})
+        """
+        self.queue = queue
+        self.slots = max(1, int(slots))
+        self.lane_slots = {lane: max(0, int(count)) for lane, count in (lane_slots or {}).items()}
+        self.heartbeat_seconds = heartbeat_seconds
+        self.handlers: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+        self.time_budgets: Dict[str, Optional[float]] = {}
+        self._running: Dict[str, str] = {}
+        self._tokens: Dict[str, CancellationToken] = {}
+        self._running_lock = threading.Lock()
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._process_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    def register(self, kind: str, handler: Callable[[Dict[str, Any]], Any],
+                 time_budget: Optional[float] = JOB_TIME_BUDGET_SECONDS) -> None:
+        """
+        Register the handler of a job kind
+
+        Args:
+            kind: Job kind
+            handler: Called with the claimed job; returns the job result or
+                raises (PermanentJobError to skip retries). It runs inside a
+                cancellation scope named after the job id
+            time_budget: Seconds one attempt may run before it is cancelled
+                (None for no limit)
+        """
+        self.handlers[kind] = handler
+        self.time_budgets[kind] = time_budget
+
+    def start(self) -> None:
+        """Start the executor slots and the heartbeat thread (idempotent)"""
+        with self._start_lock:
+            if self._started:
+                return
+            slot_lanes = [list(LANES)] * self.slots
+            for lane, count in self.lane_slots.items():
+                slot_lanes += [list(LANES[:lane_rank(lane) + 1])] * count
+            for slot, lanes in enumerate(slot_lanes):
+                threading.Thread(target=self._slot_loop, args=(f"{self._process_id}:{slot}", lanes),
+                                 name=f"job-slot-{slot}", daemon=True).start()
+            threading.Thread(target=self._heartbeat_loop, name='job-heartbeat', daemon=True).start()
+            self._started = True
+            logger.info(f"🚀 Job executor started with {len(slot_lanes)} slots "
+                        f"({self.slots} for every lane, reserved: {self.lane_slots}) ({self._process_id})")
+
+    def notify(self) -> None:
+        """Wake idle slots after a job was enqueued in this process"""
+        self._wakeup.set()
+
+    def _slot_loop(self, worker_id: str, lanes: List[str]) -> None:
+        """Claim and run jobs of the given lanes forever"""
+        while True:
+            try:
+                job = self.queue.claim(worker_id, lanes)
+            except Exception as e:
+                logger.error(f"Job claim failed: {str(e)}", exc_info=True)
+                job = None
+
+            if job is None:
+                self._wakeup.wait(POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+
+            self._run(job, worker_id)
+
+    def _run(self, job: Dict[str, Any], worker_id: str) -> None:
+        """Run one claimed job and record the outcome"""
+        job_id = job['id']
+        handler = self.handlers.get(job['kind'])
+        if handler is None:
+            self.queue.fail(job_id, f"No handler for job kind '{job['kind']}'", retry=False, worker_id=worker_id)
+            return
+
+        logger.info(f"▶️ Running job {job_id} ({job['kind']}, {job['lane']} lane, "
+                    f"attempt {job['attempts']}/{job['max_attempts']})")
+        with cancellation_scope(job_id, self.time_budgets.get(job['kind'])) as token, lane_scope(job['lane'] or BULK), \
+                profiling(job['profile_id'], f"job-{job_id}-{job['attempts']}", job_id=job_id, kind=job['kind'],
+                          lane=job['lane'], attempt=job['attempts']):
+            with self._running_lock:
+                self._running[job_id] = worker_id
+                self._tokens[job_id] = token
+            worker_token = _current_worker.set(worker_id)
+            if job['cancel_requested']:
+                token.cancel('Cancelled by user')
+            try:
+                token.raise_if_cancelled()
+                result = handler(job)
+                if self.queue.complete(job_id, result, worker_id=worker_id):
+                    logger.info(f"✅ Job {job_id} completed")
+                else:
+                    logger.warning(f"Dropped result of job {job_id}: it was re-claimed or cancelled meanwhile")
+            except Exception as e:
+                if token.cancelled:
+                    # Whatever the handler raised, the job was stopped on purpose
+                    self._finish_cancelled(job_id, token, worker_id)
+                elif isinstance(e, PermanentJobError):
+                    logger.error(f"❌ Job {job_id} failed: {str(e)}")
+                    self.queue.fail(job_id, str(e), retry=False, progress=self._current_progress(job_id),
+                                    worker_id=worker_id)
+                else:
+                    logger.error(f"❌ Job {job_id} failed: {str(e)}", exc_info=True)
+                    self.queue.fail(job_id, str(e), worker_id=worker_id)
+            finally:
+                _current_worker.reset(worker_token)
+                with self._running_lock:
+                    self._running.pop(job_id, None)
+                    self._tokens.pop(job_id, None)
+
+    def _finish_cancelled(self, job_id: str, token: CancellationToken, worker_id: str) -> None:
+        """Record a job stopped by its token and delete its partial outputs"""
+        removed = token.discard_outputs()
+        if token.timed_out:
+            logger.error(f"⏱️ Job {job_id} stopped: {token.reason} ({removed} partial outputs removed)")
+            self.queue.fail(job_id, token.reason, retry=False, progress=self._current_progress(job_id),
+                            worker_id=worker_id)
+        else:
+            logger.warning(f"🛑 Job {job_id} cancelled ({removed} partial outputs removed)")
+            self.queue.mark_cancelled(job_id, token.reason, worker_id=worker_id)
+
+    def _current_progress(self, job_id: str) -> Optional[int]:
+        """Last recorded progress of a job"""
+        job = self.queue.get(job_id)
+        return job['progress'] if job else None
+
+    def _heartbeat_loop(self) -> None:
+        """Refresh the lease of every job running in this process and pass on cancellations"""
+        while True:
+            time.sleep(self.heartbeat_seconds)
+            with self._running_lock:
+                running = [(job_id, worker_id, self._tokens.get(job_id)) for job_id, worker_id in self._running.items()]
+            for job_id, worker_id, token in running:
+                try:
+                    if not self.queue.heartbeat(job_id, worker_id):
+                        logger.warning(f"Lost the lease on job {job_id}")
+                    if token is not None and not token.cancelled and self.queue.is_cancel_requested(job_id):
+                        token.cancel('Cancelled by user')
+                except Exception as e:
+                    logger.error(f"Heartbeat failed for job {job_id}: {str(e)}")
+
+
+# Shared queue and executor for this worker
+job_queue = JobQueue(DATABASE_URL, JOB_QUEUE_PATH)
+job_executor = JobExecutor(job_queue, lane_slots={INTERACTIVE: JOB_INTERACTIVE_SLOTS})
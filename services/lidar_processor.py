@@ -35,6 +35,10 @@ import threading
 import boto3
 from botocore.exceptions import ClientError
 
+from services.instrumentation import instrumented
+from utils.metrics import upstream_call
+from utils.locks import fill_cache_once
+
 logger = logging.getLogger(__name__)
 
 class LidarProcessor:
@@ -265,20 +269,16 @@ class LidarProcessor:
             local_filename = os.path.basename(s3_key)
             local_path = os.path.join(cache_dir, local_filename)
             
-            # Check if file exists and is recent (7 days old)
-            if os.path.exists(local_path):
-                import time
-                file_age = time.time() - os.path.getmtime(local_path)
-                if file_age < 7 * 24 * 3600:  # 7 days
-                    logger.info(f"Using cached tile: {local_path}")
-                    return local_path
-            
-            # Download from S3
-            logger.info(f"Downloading tile from S3: {s3_key}")
-            self.s3_client.download_file(self.s3_bucket, s3_key, local_path)
-            logger.info(f"Downloaded tile from S3: {s3_key} -> {local_path}")
+            def fill(temp_path):
+                logger.info(f"Downloading tile from S3: {s3_key}")
+                with upstream_call('s3'):
+                    self.s3_client.download_file(self.s3_bucket, s3_key, temp_path)
+                logger.info(f"Downloaded tile from S3: {s3_key} -> {local_path}")
+                return True
             
-            return local_path
+            # Cached tiles are reused for 7 days; concurrent requests for the
+            # same tile share one download
+            return fill_cache_once(local_path, fill, 'lidar', max_age=7 * 24 * 3600)
             
         except Exception as e:
             logger.error(f"Error downloading tile from S3: {str(e)}")
@@ -512,6 +512,7 @@ class LidarProcessor:
 lidar_processor = LidarProcessor()
 
 
+@instrumented('prepare')
 def process_lidar_dem(polygon_geometry: Dict[str, Any], polygon_id: str) -> str:
     """
     Main function to process LIDAR DEM with CRS transformation
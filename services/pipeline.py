@@ -0,0 +1,381 @@
+"""
+Dependency-aware stage scheduler for the terrain analysis pipeline
+
+Stages declare the artifacts they consume and produce and a relative cost.
+A stage is submitted to the thread pool as soon as all of its inputs exist,
+so downstream work starts the moment its last dependency finishes. When
+several stages are ready at once, the one heading the most expensive
+remaining chain (its critical path) goes first. Shared intermediates such as
+the gradient or the hydrology rasters are their own stages and run once.
+
+Stages run in the caller's context, so they see its cancellation token,
+report their timings to its stage recorder and are sampled by its profile.
+Once the operation is cancelled no further stage starts; the running ones
+are stopped by their tools and the rest are reported as cancelled.
+"""
+import os
+import time
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from utils.config import TERRAIN_ENGINE
+from utils.cancellation import current_token, track_output
+from utils.profiling import profile_thread
+from services.instrumentation import stage as instrumentation_stage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Stage:
+    """One unit of work in a pipeline"""
+    name: str
+    func: Callable[[Dict[str, Any]], Any]
+    inputs: List[str] = field(default_factory=list)
+    outputs: List[str] = field(default_factory=list)
+    cost: float = 1.0
+    description: str = ''
+
+
+@dataclass
+class StageResult:
+    """Outcome of one stage run"""
+    success: bool
+    status: str
+    elapsed: float = 0.0
+    error: Optional[str] = None
+
+
+class Pipeline:
+    """A DAG of stages connected through named artifacts"""
+
+    def __init__(self, stages: List[Stage]):
+        """
+        Args:
+            stages: Stages of the pipeline; artifacts not produced by any stage
+                must be supplied to run()
+
+        Raises:
+            ValueError: If two stages produce the same artifact or the graph has a cycle
+        """
+        self.stages = {stage.name: stage for stage in stages}
+        self.producers: Dict[str, str] = {}
+        for stage in stages:
+            for artifact in stage.outputs:
+                if artifact in self.producers:
+                    raise ValueError(f"Artifact '{artifact}' is produced by both "
+                                     f"'{self.producers[artifact]}' and '{stage.name}'")
+                self.producers[artifact] = stage.name
+
+        self.upstream = {
+            name: {self.producers[artifact] for artifact in stage.inputs if artifact in self.producers}
+            for name, stage in self.stages.items()
+        }
+        self.downstream: Dict[str, set] = {name: set() for name in self.stages}
+        for name, parents in self.upstream.items():
+            for parent in parents:
+                self.downstream[parent].add(name)
+
+        self.critical_path = self._critical_paths()
+
+    def _critical_paths(self) -> Dict[str, float]:
+        """
+        Cost of the most expensive chain starting at each stage
+
+        Raises:
+            ValueError: If the stages form a cycle
+        """
+        paths: Dict[str, float] = {}
+        visiting = set()
+
+        def visit(name):
+            if name in paths:
+                return paths[name]
+            if name in visiting:
+                raise ValueError(f"Pipeline has a dependency cycle through '{name}'")
+            visiting.add(name)
+            tail = max((visit(child) for child in self.downstream[name]), default=0.0)
+            visiting.discard(name)
+            paths[name] = self.stages[name].cost + tail
+            return paths[name]
+
+        for name in self.stages:
+            visit(name)
+        return paths
+
+    def run(self, artifacts: Dict[str, Any], max_workers: int = 4,
+            on_stage: Optional[Callable[[str, StageResult, int, int], None]] = None) -> Dict[str, StageResult]:
+        """
+        Run every stage, each as soon as its inputs are available
+
+        A stage whose function raises or returns a falsy value fails, and every
+        stage depending on it is skipped. If the current operation is
+        cancelled, stages not yet started are marked cancelled.
+
+        Args:
+            artifacts: Initial artifacts (e.g. {'dem': path}); updated in place
+                with each stage's outputs
+            max_workers: Threads running stages concurrently
+            on_stage: Optional callback (stage name, result, finished stages,
+                total stages) called after each stage finishes or is skipped
+
+        Returns:
+            dict: Stage name -> StageResult
+        """
+        missing = {artifact for stage in self.stages.values() for artifact in stage.inputs
+                   if artifact not in self.producers and artifact not in artifacts}
+        if missing:
+            raise ValueError(f"Pipeline inputs not supplied: {sorted(missing)}")
+
+        results: Dict[str, StageResult] = {}
+        remaining = {name: len(parents) for name, parents in self.upstream.items()}
+        ready = [name for name, count in remaining.items() if count == 0]
+        start_time = time.time()
+        token = current_token()
+
+        def run_stage(stage):
+            stage_start = time.time()
+            with profile_thread(), instrumentation_stage(stage.name) as step:
+                value = stage.func(artifacts)
+                if not value:
+                    step.annotate(failed=True)
+                step.raster(artifacts.get('dem'))
+            return value, time.time() - stage_start
+
+        def report(name):
+            if on_stage is None:
+                return
+            try:
+                on_stage(name, results[name], len(results), len(self.stages))
+            except Exception as e:
+                logger.warning(f"Stage callback failed for {name}: {str(e)}")
+
+        def skip_downstream(name):
+            for child in self.downstream[name]:
+                if child not in results:
+                    results[child] = StageResult(False, 'skipped', error=f"Upstream stage '{name}' failed")
+                    logger.warning(f"⏭️ Skipping {child}: upstream stage '{name}' failed")
+                    report(child)
+                    skip_downstream(child)
+
+        def cancel_pending(running):
+            active = set(running.values())
+            for name in self.stages:
+                if name not in results and name not in active:
+                    results[name] = StageResult(False, 'cancelled', error=token.reason)
+                    report(name)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            running = {}
+            while ready or running:
+                if token is not None and token.cancelled:
+                    cancel_pending(running)
+                    ready = []
+                    if not running:
+                        break
+
+                # Start the longest remaining chains first
+                ready.sort(key=lambda name: self.critical_path[name], reverse=True)
+                for name in ready:
+                    # Each stage runs in a copy of this context (cancellation token included)
+                    context = contextvars.copy_context()
+                    running[executor.submit(context.run, run_stage, self.stages[name])] = name
+                ready = []
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    stage = self.stages[name]
+                    try:
+                        value, elapsed = future.result()
+                        success = bool(value)
+                        results[name] = StageResult(success, 'completed' if success else 'failed', elapsed)
+                    except Exception as e:
+                        if token is not None and token.cancelled:
+                            logger.warning(f"🛑 {stage.description or name} stopped: {token.reason}")
+                        else:
+                            logger.error(f"❌ {stage.description or name} failed: {str(e)}", exc_info=True)
+                        results[name] = StageResult(False, 'failed', error=str(e))
+
+                    if not results[name].success and token is not None and token.cancelled:
+                        results[name] = StageResult(False, 'cancelled', results[name].elapsed, token.reason)
+
+                    report(name)
+                    if not results[name].success:
+                        if results[name].status == 'cancelled':
+                            continue
+                        if results[name].error is None:
+                            logger.error(f"❌ {stage.description or name} failed")
+                        skip_downstream(name)
+                        continue
+
+                    logger.info(f"✅ {stage.description or name} completed in {results[name].elapsed:.1f}s "
+                                f"({len(results)}/{len(self.stages)})")
+                    for child in self.downstream[name]:
+                        remaining[child] -= 1
+                        if remaining[child] == 0 and child not in results:
+                            ready.append(child)
+
+            if token is not None and token.cancelled:
+                cancel_pending(running)
+
+        succeeded = sum(1 for result in results.values() if result.success)
+        if token is not None and token.cancelled:
+            logger.warning(f"🛑 Pipeline cancelled after {time.time() - start_time:.1f}s: "
+                           f"{succeeded}/{len(self.stages)} stages had completed")
+        else:
+            logger.info(f"Pipeline finished in {time.time() - start_time:.1f}s: {succeeded}/{len(self.stages)} stages successful")
+        return results
+
+
+def build_terrain_pipeline(output_dir: str, contour_interval: float = 10,
+                           statistics_bounds: Optional[Dict[str, float]] = None,
+                           data_source: str = 'srtm', precomputed: Iterable[str] = ()) -> Pipeline:
+    """
+    Build the full polygon terrain analysis pipeline
+
+    Expects the 'dem' artifact (path to the clipped DEM) when run. Slope and
+    aspect come from one shared gradient stage on the NumPy engine, drainage
+    waits for the cached hydrology rasters, and statistics (when bounds are
+    given) start as soon as slope and aspect exist.
+
+    Args:
+        output_dir: Directory receiving the outputs
+        contour_interval: Contour interval in metres
+        statistics_bounds: Bounds for calculate_terrain_statistics; None
+            leaves the statistics stage out
+        data_source: Data source passed to the statistics stage
+        precomputed: Artifacts supplied to run() instead of being computed;
+            stages producing only these are left out
+
+    Returns:
+        Pipeline: The terrain pipeline
+    """
+    from services.terrain import (
+        calculate_slopes, calculate_aspect, calculate_geomorphons,
+        calculate_hypsometrically_tinted_hillshade, calculate_drainage_network,
+        calculate_gradient_derivatives
+    )
+    from services.hydrology import get_hydrology_products
+    from services.contour_cache import write_contours
+
+    paths = {
+        'slope': os.path.join(output_dir, 'slope.tif'),
+        'aspect': os.path.join(output_dir, 'aspect.tif'),
+        'geomorphons': os.path.join(output_dir, 'geomorphons.tif'),
+        'hillshade': os.path.join(output_dir, 'hillshade.tif'),
+        'drainage': os.path.join(output_dir, 'drainage.tif'),
+        'contours': os.path.join(output_dir, 'contours.geojson')
+    }
+
+    def produce(name, func, *args):
+        """Stage function writing one output file and publishing its path"""
+        def run(artifacts):
+            track_output(paths[name])
+            if not func(artifacts['dem'], paths[name], *args):
+                return False
+            artifacts[name] = paths[name]
+            return True
+        return run
+
+    def gradient(artifacts):
+        track_output(paths['slope'], paths['aspect'])
+        if not calculate_gradient_derivatives(artifacts['dem'], paths['slope'], paths['aspect']):
+            return False
+        artifacts['slope'] = paths['slope']
+        artifacts['aspect'] = paths['aspect']
+        return True
+
+    def hydrology(artifacts):
+        products = get_hydrology_products(artifacts['dem'])
+        if not products:
+            return False
+        artifacts['flow_accumulation'] = products['flow_accumulation']
+        return True
+
+    def statistics(artifacts):
+        from services.analysis_statistics import calculate_terrain_statistics
+        artifacts['statistics'] = calculate_terrain_statistics(
+            dem_path=artifacts['dem'],
+            slope_path=artifacts.get('slope'),
+            aspect_path=artifacts.get('aspect'),
+            bounds=statistics_bounds,
+            data_source=data_source
+        )
+        return True
+
+    stages = []
+    if TERRAIN_ENGINE == 'numpy':
+        stages.append(Stage('gradient', gradient, ['dem'], ['slope', 'aspect'], cost=1, description='Slope and aspect calculation'))
+    else:
+        stages.append(Stage('slope', produce('slope', calculate_slopes), ['dem'], ['slope'], cost=2, description='Slope calculation'))
+        stages.append(Stage('aspect', produce('aspect', calculate_aspect), ['dem'], ['aspect'], cost=2, description='Aspect calculation'))
+
+    stages.extend([
+        Stage('geomorphons', produce('geomorphons', calculate_geomorphons), ['dem'], ['geomorphons'], cost=4, description='Geomorphons analysis'),
+        Stage('hillshade', produce('hillshade', calculate_hypsometrically_tinted_hillshade), ['dem'], ['hillshade'], cost=2, description='Hillshade generation'),
+        Stage('hydrology', hydrology, ['dem'], ['flow_accumulation'], cost=3, description='Depression filling and D8 flow'),
+        Stage('drainage', produce('drainage', calculate_drainage_network), ['dem', 'flow_accumulation'], ['drainage'], cost=0.5, description='Drainage network analysis'),
+        Stage('contours', produce('contours', write_contours, contour_interval, data_source), ['dem'], ['contours'], cost=1, description='Contour generation')
+    ])
+    if statistics_bounds is not None:
+        stages.append(Stage('statistics', statistics, ['dem', 'slope', 'aspect'], ['statistics'], cost=1, description='Terrain statistics'))
+
+    precomputed = set(precomputed)
+    return Pipeline([stage for stage in stages if not set(stage.outputs) <= precomputed])
+
+
+def run_terrain_pipeline(dem_path: str, output_dir: str, polygon_id: str, contour_interval: float = 10,
+                         statistics_bounds: Optional[Dict[str, float]] = None,
+                         data_source: str = 'srtm', max_workers: int = 4,
+                         on_stage: Optional[Callable[[str, StageResult, int, int], None]] = None,
+                         precomputed: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """
+    Run the terrain pipeline for one polygon
+
+    Args:
+        dem_path: Path to the clipped DEM
+        output_dir: Directory receiving the outputs
+        polygon_id: Polygon identifier for logging
+        contour_interval: Contour interval in metres
+        statistics_bounds: Bounds for the statistics stage (None skips it)
+        data_source: Data source passed to the statistics stage
+        max_workers: Threads running stages concurrently
+        on_stage: Optional per-stage progress callback (see Pipeline.run)
+        precomputed: Optional output name -> path of outputs already written
+            (e.g. slope and aspect from DEMProcessor's fused pass)
+
+    Returns:
+        dict: Output name ('slope', 'aspect', ..., 'contours') ->
+        {'success', 'path', 'status'[, 'error']}, plus 'statistics' when computed
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    logger.info(f"Starting terrain pipeline for polygon {polygon_id}")
+
+    precomputed = precomputed or {}
+    pipeline = build_terrain_pipeline(output_dir, contour_interval, statistics_bounds, data_source, precomputed)
+    artifacts = {'dem': dem_path, **precomputed}
+    stage_results = pipeline.run(artifacts, max_workers=max_workers, on_stage=on_stage)
+
+    results: Dict[str, Any] = {name: {'success': True, 'path': path, 'status': 'precomputed'}
+                               for name, path in precomputed.items()}
+    for name, stage in pipeline.stages.items():
+        result = stage_results[name]
+        for output in stage.outputs:
+            if output in ('flow_accumulation', 'statistics'):
+                continue
+            entry = {
+                'success': result.success,
+                'path': artifacts.get(output),
+                'status': result.status
+            }
+            if result.error:
+                entry['error'] = result.error
+            results[output] = entry
+
+    if 'statistics' in artifacts:
+        results['statistics'] = artifacts['statistics']
+    return results
@@ -5,22 +5,23 @@ import os
 import logging
 import numpy as np
 import rasterio
-from PIL import Image
-import base64
-import io
+
+from services.colormap import get_colormap
+from services.rendering import render_rgba
 
 logger = logging.getLogger(__name__)
 
-def visualize_srtm(srtm_file_path, polygon_data=None):
+def visualize_srtm(srtm_file_path, polygon_data=None, render_options=None):
     """
     Visualize SRTM elevation data as a colored image with elevation-based color mapping
     
     Args:
         srtm_file_path: Path to the SRTM raster file
         polygon_data: Optional GeoJSON polygon data for masking
+        render_options: Optional render options (scale, format, compression)
         
     Returns:
-        str: Base64 encoded PNG image
+        str: Base64 encoded PNG (or WebP) image
     """
     try:
         # Read the SRTM raster
@@ -114,40 +115,15 @@ def visualize_srtm(srtm_file_path, polygon_data=None):
                 # Normalize elevation to 0-1
                 normalized_elevation = (elevation_data - elevation_min) / elevation_range
                 
-                # Create RGBA array
-                rgba = np.zeros((elevation_data.shape[0], elevation_data.shape[1], 4), dtype=np.uint8)
+                # Only color valid elevation data (not NaN, not 0, within reasonable range)
+                with np.errstate(invalid='ignore'):
+                    color_mask = (~np.isnan(elevation_data) &
+                                  (elevation_data != 0) &
+                                  (elevation_data >= -1000) & (elevation_data <= 10000))
                 
-                # Apply elevation-based color mapping
-                colored_pixels = 0
-                for i in range(elevation_data.shape[0]):
-                    for j in range(elevation_data.shape[1]):
-                        # Only process valid elevation data (not NaN, not 0, within reasonable range)
-                        if (not np.isnan(elevation_data[i, j]) and 
-                            elevation_data[i, j] != 0 and 
-                            -1000 <= elevation_data[i, j] <= 10000):
-                            val = normalized_elevation[i, j]
-                            
-                            # Create elevation color scheme:
-                            # Low elevation: green (0, 100, 0)
-                            # Mid elevation: brown (139, 69, 19) 
-                            # High elevation: white (255, 255, 255)
-                            if val < 0.3:  # Low elevation - green
-                                rgba[i, j, 0] = int(0 + val * 139 / 0.3)      # R: 0 to 139
-                                rgba[i, j, 1] = int(100 + val * (69 - 100) / 0.3)  # G: 100 to 69
-                                rgba[i, j, 2] = int(0 + val * 19 / 0.3)      # B: 0 to 19
-                            elif val < 0.7:  # Mid elevation - brown
-                                rgba[i, j, 0] = int(139 + (val - 0.3) * (255 - 139) / 0.4)  # R: 139 to 255
-                                rgba[i, j, 1] = int(69 + (val - 0.3) * (255 - 69) / 0.4)     # G: 69 to 255
-                                rgba[i, j, 2] = int(19 + (val - 0.3) * (255 - 19) / 0.4)    # B: 19 to 255
-                            else:  # High elevation - white
-                                rgba[i, j, 0] = 255  # R
-                                rgba[i, j, 1] = 255   # G
-                                rgba[i, j, 2] = 255   # B
-                            
-                            rgba[i, j, 3] = 255  # Alpha (fully opaque for valid data)
-                            colored_pixels += 1
-                        else:
-                            rgba[i, j, 3] = 0  # Alpha (transparent for nodata)
+                # Apply the green -> brown -> white elevation ramp in one lookup
+                rgba = get_colormap('srtm').apply(normalized_elevation, color_mask)
+                colored_pixels = int(np.sum(color_mask))
                 
                 logger.info(f"Applied color mapping to {colored_pixels} pixels")
             else:
@@ -158,25 +134,14 @@ def visualize_srtm(srtm_file_path, polygon_data=None):
                 rgba[:, :, 2] = 0    # B
                 rgba[:, :, 3] = 255  # Alpha
         
-        # Convert to PIL Image and upscale for higher resolution
-        img = Image.fromarray(rgba)
-        
-        # Upscale the image for better quality (4x resolution for much sharper images)
-        original_size = img.size
-        upscaled_size = (original_size[0] * 4, original_size[1] * 4)
-        img_upscaled = img.resize(upscaled_size, Image.Resampling.NEAREST)
-        
-        buffered = io.BytesIO()
-        img_upscaled.save(buffered, format="PNG", optimize=True)
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-        
-        return img_str
+        # Encode the preview (native resolution or nearest-neighbour upscale)
+        return render_rgba(rgba, render_options)['image']
         
     except Exception as e:
         logger.error(f"Error visualizing SRTM data: {str(e)}")
         raise
 
-def process_raster_file(file_path, layer_type, polygon_data=None):
+def process_raster_file(file_path, layer_type, polygon_data=None, render_options=None):
     """
     Process a raster file and return a Base64 PNG based on the layer type
     
@@ -184,9 +149,10 @@ def process_raster_file(file_path, layer_type, polygon_data=None):
         file_path: Path to the raster file
         layer_type: Type of layer (srtm, slope, aspect, etc.)
         polygon_data: Optional polygon data for masking
+        render_options: Optional render options (scale, format, compression)
         
     Returns:
-        str: Base64 encoded PNG image
+        str: Base64 encoded PNG (or WebP) image
     """
     try:
         # Import visualization functions from terrain service
@@ -223,7 +189,7 @@ def process_raster_file(file_path, layer_type, polygon_data=None):
         logger.info(f"Processing {layer_type} raster file: {file_path}")
         
         # Call the visualization function with polygon data
-        result = processor_function(file_path, polygon_data)
+        result = processor_function(file_path, polygon_data, render_options)
         
         # Handle different return types from visualization functions
         if isinstance(result, dict) and 'image' in result:
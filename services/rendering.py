@@ -0,0 +1,157 @@
+"""
+Image encoding for raster previews
+
+Visualizers hand an RGBA array to render_rgba, which optionally upscales it
+with nearest-neighbour resampling and encodes it as PNG or lossless WebP.
+Scale 1 encodes at the raster's native resolution and leaves smoothing to
+the map client, which keeps encode time and payload size proportional to
+the number of raster cells.
+"""
+import base64
+import io
+import logging
+from typing import Any, Dict, Optional
+
+import numpy as np
+from PIL import Image
+
+from utils.config import RENDER_SCALE, RENDER_FORMAT, RENDER_COMPRESSION
+
+logger = logging.getLogger(__name__)
+
+MAX_RENDER_SCALE = 8
+
+# Format -> (MIME type, valid compression range)
+RENDER_FORMATS = {
+    'png': ('image/png', (0, 9)),
+    'webp': ('image/webp', (0, 6))
+}
+
+
+def _as_int(value: Any, name: str) -> int:
+    """
+    Parse an integer render option without truncating fractions
+
+    Raises:
+        ValueError: If the value is not a whole number
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"Render {name} must be an integer, got {value!r}")
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value.strip().lstrip('+-').isdigit():
+        return int(value.strip())
+    raise ValueError(f"Render {name} must be an integer, got {value!r}")
+
+
+def _configured_compression() -> Dict[str, Optional[int]]:
+    """
+    RENDER_COMPRESSION checked against each format's range
+
+    A value a format cannot use falls back to that encoder's default (with a
+    warning at startup) instead of failing every preview request.
+
+    Returns:
+        dict: Format -> default compression (None for the encoder default)
+    """
+    defaults = {image_format: None for image_format in RENDER_FORMATS}
+    if RENDER_COMPRESSION is None:
+        return defaults
+    try:
+        compression = _as_int(RENDER_COMPRESSION, 'compression')
+    except ValueError as e:
+        logger.warning(f"⚠️ Ignoring RENDER_COMPRESSION: {str(e)}")
+        return defaults
+
+    for image_format, (_, (low, high)) in RENDER_FORMATS.items():
+        if low <= compression <= high:
+            defaults[image_format] = compression
+        else:
+            logger.warning(f"⚠️ RENDER_COMPRESSION={compression} is outside the {image_format.upper()} range "
+                           f"{low}-{high}; {image_format.upper()} previews use the encoder default")
+    return defaults
+
+
+# Default compression per format, validated once at import
+DEFAULT_COMPRESSION = _configured_compression()
+
+
+def get_render_options(options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Merge requested render options with the configured defaults
+
+    Args:
+        options: Optional dict with 'scale', 'format' and 'compression' keys
+            (e.g. the 'render' object of a request body)
+
+    Returns:
+        dict: Validated options with 'scale', 'format' and 'compression'
+    """
+    options = options or {}
+    if not isinstance(options, dict):
+        raise ValueError("Render options must be an object with 'scale', 'format' and 'compression'")
+
+    scale = _as_int(options['scale'] if options.get('scale') is not None else RENDER_SCALE, 'scale')
+    if not 1 <= scale <= MAX_RENDER_SCALE:
+        raise ValueError(f"Render scale must be between 1 and {MAX_RENDER_SCALE}, got {scale}")
+
+    image_format = str(options.get('format') or RENDER_FORMAT).lower()
+    if image_format not in RENDER_FORMATS:
+        raise ValueError(f"Unsupported render format: {image_format} (use {', '.join(RENDER_FORMATS)})")
+
+    compression = options.get('compression')
+    if compression is not None and compression != '':
+        compression = _as_int(compression, 'compression')
+        low, high = RENDER_FORMATS[image_format][1]
+        if not low <= compression <= high:
+            raise ValueError(f"{image_format.upper()} compression must be between {low} and {high}, got {compression}")
+    else:
+        compression = DEFAULT_COMPRESSION[image_format]
+
+    return {'scale': scale, 'format': image_format, 'compression': compression}
+
+
+def render_rgba(rgba: np.ndarray, render_options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Encode an RGBA array as a base64 preview image
+
+    Args:
+        rgba: uint8 array of shape (rows, cols, 4)
+        render_options: Options from get_render_options (defaults if None)
+
+    Returns:
+        dict: 'image' (base64), 'width', 'height', 'scale', 'format' and 'mime_type'
+    """
+    options = get_render_options(render_options)
+    scale = options['scale']
+    image_format = options['format']
+    compression = options['compression']
+
+    img = Image.fromarray(rgba)
+    if scale > 1:
+        img = img.resize((img.size[0] * scale, img.size[1] * scale), Image.Resampling.NEAREST)
+
+    buffered = io.BytesIO()
+    if image_format == 'webp':
+        save_kwargs = {'lossless': True}
+        if compression is not None:
+            save_kwargs['method'] = compression
+        img.save(buffered, format="WEBP", **save_kwargs)
+    elif compression is not None:
+        img.save(buffered, format="PNG", compress_level=compression)
+    else:
+        img.save(buffered, format="PNG", optimize=True)
+
+    logger.debug(f"Encoded {image_format.upper()} preview {img.size[0]}x{img.size[1]} "
+                 f"(scale {scale}x, {buffered.tell()} bytes)")
+
+    return {
+        'image': base64.b64encode(buffered.getvalue()).decode(),
+        'width': img.size[0],
+        'height': img.size[1],
+        'scale': scale,
+        'format': image_format,
+        'mime_type': RENDER_FORMATS[image_format][0]
+    }
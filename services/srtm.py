@@ -2,16 +2,25 @@
 Services for downloading and processing SRTM elevation data
 """
 import os
+import shutil
 import zipfile
 import logging
+import tempfile
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 import rasterio
 from rasterio.mask import mask
-from shapely.geometry import shape
+from shapely.geometry import shape, box
 from pathlib import Path
 
-from utils.config import EARTHDATA_USERNAME, EARTHDATA_PASSWORD, SAVE_DIRECTORY
+from utils.config import EARTHDATA_USERNAME, EARTHDATA_PASSWORD, SAVE_DIRECTORY, SRTM_DOWNLOAD_WORKERS
+from utils.cancellation import OperationCancelled, raise_if_cancelled
+from services.instrumentation import instrumented, stage as instrumentation_stage
+from utils.metrics import upstream_call
+from utils.locks import fill_cache_once
 
 logger = logging.getLogger(__name__)
 
@@ -38,14 +47,71 @@ class SessionWithHeaderRedirection(requests.Session):
 
         return
 
-# Create a session
+# SRTM tiles are 1x1 degree with 1 arc-second cells
+SRTM_CELL_DEGREES = 1.0 / 3600
+
+# (connect, read) timeouts of one tile download in seconds
+DOWNLOAD_TIMEOUT = (15, 120)
+
+# Create a session; its connection pool is shared by the download threads
 session = SessionWithHeaderRedirection(EARTHDATA_USERNAME, EARTHDATA_PASSWORD)
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(SRTM_DOWNLOAD_WORKERS, 1))
+session.mount("https://", _adapter)
+session.mount("http://", _adapter)
+
+
+def srtm_tile_name(lat, lon):
+    """
+    Name of the SRTM tile with the given southwest corner
+
+    SRTM tile naming convention:
+    - N/S prefix for latitude (N for >= 0, S for < 0)
+    - E/W prefix for longitude (E for >= 0, W for < 0)
+    - 2-digit absolute latitude
+    - 3-digit absolute longitude
+
+    Returns:
+        str: e.g. 'N40W008'
+    """
+    ns = 'S' if lat < 0 else 'N'
+    ew = 'W' if lon < 0 else 'E'
+    return f"{ns}{abs(int(lat)):02d}{ew}{abs(int(lon)):03d}"
+
+
+def tiles_for_geometry(geometry):
+    """
+    SRTM tiles that intersect a geometry
+
+    The geometry is grown by one cell first, so the cells the clip touches
+    along a tile edge (all_touched) are covered by the tile beyond it.
 
+    Args:
+        geometry: Shapely geometry in WGS84
+
+    Returns:
+        list: (lat, lon, tile name) of every intersecting tile, southwest corner first
+    """
+    grown = geometry.buffer(SRTM_CELL_DEGREES)
+    min_lon, min_lat, max_lon, max_lat = grown.bounds
+
+    tiles = []
+    for lat in range(int(np.floor(min_lat)), int(np.floor(max_lat)) + 1):
+        for lon in range(int(np.floor(min_lon)), int(np.floor(max_lon)) + 1):
+            if grown.intersects(box(lon, lat, lon + 1, lat + 1)):
+                tiles.append((lat, lon, srtm_tile_name(lat, lon)))
+    return tiles
+
+
+@instrumented('fetch')
 def get_srtm_data(geojson_data, output_folder=None):
     """
     Determines which SRTM tiles intersect with the given polygon and downloads them.
     SRTM tiles are always stored in the SAVE_DIRECTORY/srtms folder for reuse across projects.
     
+    Tiles missing from the cache are downloaded concurrently by up to
+    SRTM_DOWNLOAD_WORKERS threads, so a polygon across a tile corner waits for
+    the slowest download rather than for four in a row.
+    
     Args:
         geojson_data: A GeoJSON object containing a polygon geometry
         output_folder: Optional folder where to save processing outputs (not SRTM tiles)
@@ -53,57 +119,27 @@ def get_srtm_data(geojson_data, output_folder=None):
     Returns:
         List of paths to SRTM files (stored in the central SRTM directory)
     """
-    coordinates = geojson_data['geometry']['coordinates'][0]
-    lats = [coord[1] for coord in coordinates]
-    lons = [coord[0] for coord in coordinates]
+    geometry = shape(geojson_data['geometry'])
+    logger.info(f"Polygon bounds: {geometry.bounds}")
     
-    # Calculate bounds of the polygon
-    min_lat, max_lat = min(lats), max(lats)
-    min_lon, max_lon = min(lons), max(lons)
-    
-    logger.info(f"Polygon bounds: lat {min_lat} to {max_lat}, lon {min_lon} to {max_lon}")
-    
-    # Add a small buffer
-    buffer = 0.1  # About 10km
-    min_lat -= buffer
-    max_lat += buffer
-    min_lon -= buffer
-    max_lon += buffer
-    
-    # SRTM tiles are named by their southwest corner
-    # Calculate which 1-degree tiles we need
-    # Floor for minimum (southwest corner)
-    min_lat_tile = int(np.floor(min_lat))
-    min_lon_tile = int(np.floor(min_lon))
-    
-    # Ceil for maximum (to include all tiles that intersect)
-    max_lat_tile = int(np.ceil(max_lat)) - 1
-    max_lon_tile = int(np.ceil(max_lon)) - 1
-    
-    logger.info(f"Tile bounds: lat {min_lat_tile} to {max_lat_tile}, lon {min_lon_tile} to {max_lon_tile}")
-    
-    # Generate list of required tiles
-    lat_tiles = range(min_lat_tile, max_lat_tile + 1)
-    lon_tiles = range(min_lon_tile, max_lon_tile + 1)
+    tiles_to_download = tiles_for_geometry(geometry)
+    logger.info(f"Tiles to download: {[t[2] for t in tiles_to_download]}")
     
-    tiles_to_download = []
-    for lat in lat_tiles:
-        for lon in lon_tiles:
-            # SRTM naming convention uses N/S and E/W prefixes
-            ns = 'S' if lat < 0 else 'N'
-            ew = 'W' if lon < 0 else 'E'
-            lat_str = f"{abs(lat):02d}"
-            lon_str = f"{abs(lon):03d}"
-            tile_name = f"{ns}{lat_str}{ew}{lon_str}"
-            tiles_to_download.append((lat, lon, tile_name))
+    def fetch(tile):
+        lat, lon, tile_name = tile
+        with instrumentation_stage('download_tile', tile=tile_name):
+            # output_folder is ignored for SRTM tiles - they always go to SAVE_DIRECTORY/srtms
+            return download_srtm(lat, lon, output_folder=None)
     
-    logger.info(f"Tiles to download: {[t[2] for t in tiles_to_download]}")
+    # Download the identified tiles (stored in central SRTM directory); each
+    # thread runs in a copy of this context (cancellation token, stage recorder)
+    workers = max(1, min(SRTM_DOWNLOAD_WORKERS, len(tiles_to_download)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='srtm-download') as executor:
+        futures = [executor.submit(contextvars.copy_context().run, fetch, tile) for tile in tiles_to_download]
+        results = [future.result() for future in futures]
     
-    # Download the identified tiles (stored in central SRTM directory)
     srtm_files = []
-    for lat, lon, tile_name in tiles_to_download:
-        # output_folder is ignored for SRTM tiles - they always go to SAVE_DIRECTORY/srtms
-        srtm_file = download_srtm(lat, lon, output_folder=None)
+    for (lat, lon, tile_name), srtm_file in zip(tiles_to_download, results):
         if srtm_file:
             srtm_files.append(srtm_file)
             logger.info(f"Successfully downloaded or found {tile_name}")
@@ -112,10 +148,56 @@ def get_srtm_data(geojson_data, output_folder=None):
     
     return srtm_files
 
+def _remove_quietly(path):
+    """Delete a temporary file if it exists"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Could not remove temporary file {path}: {str(e)}")
+
+def _download_and_extract(url, filename, srtm_dir, target_hgt):
+    """
+    Download one SRTM zip and extract its .hgt to target_hgt
+
+    The zip is written under a unique temporary name in the SRTM directory
+    and removed afterwards.
+
+    Raises:
+        Exception: If the download or the extraction failed
+    """
+    fd, temp_zip = tempfile.mkstemp(prefix=f".{filename}.", suffix='.part', dir=srtm_dir)
+    os.close(fd)
+    try:
+        with upstream_call('earthdata' if 'usgs.gov' in url else 'cgiar') as call:
+            response = session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT)
+            call.status = response.status_code
+        with response:
+            response.raise_for_status()
+            with open(temp_zip, 'wb') as zip_file:
+                for chunk in response.iter_content(chunk_size=1024*1024):
+                    raise_if_cancelled()
+                    zip_file.write(chunk)
+        
+        # Extract the HGT file from the ZIP
+        with zipfile.ZipFile(temp_zip, 'r') as zip_ref:
+            hgt_file = next((f for f in zip_ref.namelist() if f.endswith('.hgt')), None)
+            if not hgt_file:
+                raise ValueError(f"No .hgt file found in the zip archive {filename}")
+            
+            with open(target_hgt, 'wb') as target, zip_ref.open(hgt_file) as source:
+                shutil.copyfileobj(source, target, 1024*1024)
+    finally:
+        _remove_quietly(temp_zip)
+
 def download_srtm(lat, lon, output_folder=None):
     """
     Downloads an SRTM tile for the given lat/lon coordinates.
     
+    Concurrent requests for the same tile (from any worker) share a single
+    download: the first one fetches it, the others wait for the file.
+    
     Args:
         lat: Latitude of the southwest corner of the tile
         lon: Longitude of the southwest corner of the tile
@@ -124,80 +206,38 @@ def download_srtm(lat, lon, output_folder=None):
     Returns:
         Path to the downloaded .hgt file or None if download failed
     """
-    # SRTM tile naming convention: 
-    # - N/S prefix for latitude (N for >= 0, S for < 0)
-    # - E/W prefix for longitude (E for >= 0, W for < 0)
-    # - 2-digit absolute latitude
-    # - 3-digit absolute longitude
-    ns = 'S' if lat < 0 else 'N'
-    ew = 'W' if lon < 0 else 'E'
-    lat_str = f"{abs(int(lat)):02d}"
-    lon_str = f"{abs(int(lon)):03d}"
-    
-    filename = f"{ns}{lat_str}{ew}{lon_str}.SRTMGL1.hgt.zip"
-    hgt_filename = f"{ns}{lat_str}{ew}{lon_str}.SRTMGL1.hgt"
+    tile_name = srtm_tile_name(lat, lon)
+    filename = f"{tile_name}.SRTMGL1.hgt.zip"
+    hgt_filename = f"{tile_name}.SRTMGL1.hgt"
     logger.info(f"Looking for SRTM tile: {hgt_filename}")
     
     # Define SRTM directory - this is where all SRTM tiles are stored
     srtm_dir = os.path.join(SAVE_DIRECTORY, "srtms")
     os.makedirs(srtm_dir, exist_ok=True)
     
-    # Define paths for the SRTM file
-    local_zip = os.path.join(srtm_dir, filename)
+    # Define path for the SRTM file
     local_hgt = os.path.join(srtm_dir, hgt_filename)
     
-    # Check if file already exists in the SRTM directory
-    if os.path.exists(local_hgt):
-        logger.info(f"File {local_hgt} already exists in SRTM directory. Using existing file.")
-        return str(local_hgt)
-    
-    # If file doesn't exist, download it
-    logger.info(f"SRTM tile not found in cache. Downloading: {hgt_filename}")
-    
     urls = [
         f"https://e4ftl01.cr.usgs.gov/MEASURES/SRTMGL1.003/2000.02.11/{filename}",
         f"https://srtm.csi.cgiar.org/wp-content/uploads/files/srtm_5x5/TIFF/{filename}"
     ]
     
-    for url in urls:
-        try:
-            logger.info(f"Attempting to download: {url}")
-            response = session.get(url, stream=True)
-            response.raise_for_status()
-            
-            with open(local_zip, 'wb') as fd:
-                for chunk in response.iter_content(chunk_size=1024*1024):
-                    fd.write(chunk)
-            
-            # Extract the HGT file from the ZIP
-            with zipfile.ZipFile(local_zip, 'r') as zip_ref:
-                zip_contents = zip_ref.namelist()
-                hgt_file = next((f for f in zip_contents if f.endswith('.hgt')), None)
-                if hgt_file:
-                    # Always extract to the SRTM directory
-                    zip_ref.extract(hgt_file, srtm_dir)
-                    
-                    # Make sure the extracted file has the correct name
-                    hgt_path = os.path.join(srtm_dir, hgt_file)
-                    if os.path.basename(hgt_path) != os.path.basename(local_hgt):
-                        os.rename(hgt_path, local_hgt)
-                else:
-                    raise ValueError(f"No .hgt file found in the zip archive {filename}")
-            
-            # Clean up the zip file
-            os.remove(local_zip)
-            
-            if os.path.exists(local_hgt):
+    def fill(target_hgt):
+        logger.info(f"SRTM tile not found in cache. Downloading: {hgt_filename}")
+        for url in urls:
+            try:
+                logger.info(f"Attempting to download: {url}")
+                _download_and_extract(url, filename, srtm_dir, target_hgt)
                 logger.info(f"Downloaded and extracted {filename} to {local_hgt}")
-                return str(local_hgt)
-            else:
-                logger.error(f"File {local_hgt} not found after extraction")
-        except Exception as e:
-            logger.error(f"Error downloading {filename} from {url}: {str(e)}")
-            if os.path.exists(local_zip):
-                os.remove(local_zip)
+                return True
+            except OperationCancelled:
+                raise
+            except Exception as e:
+                logger.error(f"Error downloading {filename} from {url}: {str(e)}")
+        return False
     
-    return None
+    return fill_cache_once(str(local_hgt), fill, 'srtm')
 
 def process_srtm_files(srtm_files, geojson_data, output_folder=None):
     """
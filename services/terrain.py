@@ -6,37 +6,25 @@ import logging
 import numpy as np
 import rasterio
 from pathlib import Path
-import base64
-import io
 import threading
-from PIL import Image
-from whitebox import WhiteboxTools
 
-from utils.config import SAVE_DIRECTORY
+# GDAL Python bindings are optional: without them contours fall back to the
+# gdal_contour / ogr2ogr command line tools
+try:
+    from osgeo import gdal, ogr, osr
+    HAS_GDAL_BINDINGS = True
+except ImportError:
+    HAS_GDAL_BINDINGS = False
 
-logger = logging.getLogger(__name__)
-
-# Initialize WhiteboxTools lazily to avoid worker conflicts
-wbt = None
-_wbt_lock = threading.Lock()
+from utils.config import SAVE_DIRECTORY, TERRAIN_ENGINE
+from services.terrain_engine import TerrainEngine
+from services.colormap import get_colormap, compose_rgba, SLOPE_CLASSES
+from services.rendering import render_rgba
+from services.whitebox_runner import whitebox_tools
+from services.derivative_cache import cached_derivative
+from services.block_processor import should_use_blocks, process_raster_blocks, gradient_kernel, geomorphons_kernel, GEOMORPHONS_NODATA
 
-def get_whitebox_tools():
-    """Get WhiteboxTools instance, initializing lazily to avoid worker conflicts"""
-    global wbt
-    if wbt is None:
-        with _wbt_lock:
-            if wbt is None:  # Double-check locking pattern
-                try:
-                    logger.info("Initializing WhiteboxTools...")
-                    wbt = WhiteboxTools()
-                    wbt.verbose = False
-                    # Set working directory to avoid conflicts
-                    wbt.set_working_dir("/tmp")
-                    logger.info("WhiteboxTools initialized successfully")
-                except Exception as e:
-                    logger.error(f"Failed to initialize WhiteboxTools: {str(e)}")
-                    raise
-    return wbt
+logger = logging.getLogger(__name__)
 
 def get_nodata_value(src):
     """
@@ -63,6 +51,83 @@ def get_nodata_value(src):
         logger.debug(f"Inferred nodata=np.nan for float dtype: {dtype}")
         return np.nan  # For float DEMs (LIDAR, USGS)
 
+# Aspect direction classes using QGIS symbology colors
+# Based on the provided QML file with 8 directional categories
+ASPECT_COLORS = np.array([
+    [176, 176, 176],  # Flat (-1) - #b0b0b0
+    [255, 0, 0],      # North (0-22.5) - #ff0000
+    [255, 166, 0],    # Northeast (22.5-67.5) - #ffa600
+    [255, 255, 0],    # East (67.5-112.5) - #ffff00
+    [0, 255, 0],      # Southeast (112.5-157.5) - #00ff00
+    [0, 255, 255],    # South (157.5-202.5) - #00ffff
+    [0, 166, 255],    # Southwest (202.5-247.5) - #00a6ff
+    [0, 0, 255],      # West (247.5-292.5) - #0000ff
+    [255, 0, 255]     # Northwest (292.5-337.5) - #ff00ff
+], dtype=np.uint8)
+
+# Upper (inclusive) class edges between North and Northwest
+ASPECT_CLASS_EDGES = np.array([22.5, 67.5, 112.5, 157.5, 202.5, 247.5, 292.5])
+
+def colorize_aspect(aspect_data, valid_mask):
+    """
+    Color aspect values by compass direction with a class lookup table
+    
+    Args:
+        aspect_data: 2D aspect array in degrees (negative = flat)
+        valid_mask: Boolean mask of pixels to color
+        
+    Returns:
+        np.ndarray: uint8 RGBA array
+    """
+    values = aspect_data[valid_mask]
+    
+    # Class 1..8 = North..Northwest by upper edge, then wrap and flat overrides
+    class_index = np.digitize(values, ASPECT_CLASS_EDGES, right=True) + 1
+    class_index[values >= 337.5] = 1
+    class_index[values < 0] = 0
+    
+    return compose_rgba(aspect_data.shape, valid_mask, ASPECT_COLORS[class_index])
+
+def colorize_drainage(drainage_data):
+    """
+    Color flow accumulation with a logarithmic light-to-dark blue ramp
+    
+    Args:
+        drainage_data: 2D flow accumulation array
+        
+    Returns:
+        tuple: (uint8 RGBA array, boolean valid mask)
+    """
+    # Handle nodata values
+    valid_mask = ~np.isnan(drainage_data) & (drainage_data > 0)
+    
+    if not np.any(valid_mask):
+        # No valid data - all transparent
+        return compose_rgba(drainage_data.shape, valid_mask, np.zeros((0, 3), dtype=np.uint8)), valid_mask
+    
+    # Use logarithmic scaling for better visualization
+    log_data = np.log1p(drainage_data[valid_mask])  # log(1 + x) to handle zeros
+    log_min = np.min(log_data)
+    log_max = np.max(log_data)
+    
+    if log_max > log_min:
+        # Normalize to 0-1, kept at float32 precision and evaluated in float64
+        # so the truncation matches the original per-pixel ramp exactly
+        normalized = ((log_data - log_min) / (log_max - log_min)).astype(np.float32)
+        val = normalized.astype(np.float64)
+        
+        # Blue color scheme: light blue (low) to dark blue (high)
+        rgb = np.empty((val.size, 3), dtype=np.uint8)
+        rgb[:, 0] = (255 * (1 - val * 0.7)).astype(np.uint8)  # R: 255 to 77
+        rgb[:, 1] = (255 * (1 - val * 0.5)).astype(np.uint8)  # G: 255 to 128
+        rgb[:, 2] = 255  # B: always 255 (blue)
+    else:
+        # All values are the same
+        rgb = np.array([77, 128, 255], dtype=np.uint8)
+    
+    return compose_rgba(drainage_data.shape, valid_mask, rgb), valid_mask
+
+@cached_derivative('slope')
 def calculate_slopes(input_file_path, output_file_path):
     """
     Calculate slope from a DEM raster
@@ -75,17 +140,17 @@ def calculate_slopes(input_file_path, output_file_path):
         bool: True if successful, False otherwise
     """
     try:
-        # Set the working directory for WhiteboxTools
-        wbt = get_whitebox_tools()
-        wbt.set_working_dir(os.path.dirname(output_file_path))
+        if TERRAIN_ENGINE == 'numpy':
+            return calculate_gradient_derivatives(input_file_path, slope_file_path=output_file_path)
         
         # Calculate slope in percent (not degrees)
         logger.info(f"Calculating slope from {input_file_path} in percent...")
-        wbt.slope(
-            dem=str(input_file_path), 
-            output=str(output_file_path), 
-            units="percent"  # Percentage slope is more intuitive for users
-        )
+        with whitebox_tools('slope') as wbt:
+            wbt.slope(
+                dem=os.path.abspath(input_file_path), 
+                output=os.path.abspath(output_file_path), 
+                units="percent"  # Percentage slope is more intuitive for users
+            )
         
         if not os.path.exists(output_file_path):
             logger.error(f"Failed to calculate slope - output file not created")
@@ -97,13 +162,62 @@ def calculate_slopes(input_file_path, output_file_path):
         logger.error(f"Error calculating slope: {str(e)}", exc_info=True)
         return False
 
-def visualize_slope(slope_file_path, polygon_data=None):
+def calculate_gradient_derivatives(input_file_path, slope_file_path=None, aspect_file_path=None, hillshade_file_path=None,
+                                   aspect_options=None):
+    """
+    Calculate slope (percent), aspect and hillshade in-process from one Horn gradient
+    
+    The DEM is read once and only the requested outputs are written, so running
+    several derivatives costs one raster read instead of one WhiteboxTools run each.
+    
+    Args:
+        input_file_path: Path to the input DEM file
+        slope_file_path: Optional path to the output slope file
+        aspect_file_path: Optional path to the output aspect file
+        hillshade_file_path: Optional path to the output (greyscale) hillshade file
+        aspect_options: Optional keyword arguments for TerrainEngine.aspect
+            (convention, gradient_alg, zero_for_flat)
+        
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    try:
+        if should_use_blocks(input_file_path):
+            requested = {name: path for name, path in (
+                ('slope', slope_file_path),
+                ('aspect', aspect_file_path),
+                ('hillshade', hillshade_file_path)
+            ) if path}
+            logger.info(f"Calculating gradient derivatives block-wise from {input_file_path}...")
+            return process_raster_blocks(input_file_path, requested, gradient_kernel, halo=1,
+                                         kernel_kwargs={'derivatives': tuple(requested), 'aspect_options': aspect_options})
+        
+        logger.info(f"Calculating gradient derivatives in-process from {input_file_path}...")
+        engine = TerrainEngine.from_file(input_file_path)
+        
+        outputs = {
+            'slope': (slope_file_path, engine.slope),
+            'aspect': (aspect_file_path, lambda: engine.aspect(**(aspect_options or {}))),
+            'hillshade': (hillshade_file_path, engine.hillshade)
+        }
+        for name, (output_file_path, derive) in outputs.items():
+            if output_file_path:
+                engine.write(derive(), output_file_path)
+        
+        logger.info(f"Gradient derivatives complete for {input_file_path}")
+        return True
+    except Exception as e:
+        logger.error(f"Error calculating gradient derivatives: {str(e)}", exc_info=True)
+        return False
+
+def visualize_slope(slope_file_path, polygon_data=None, render_options=None):
     """
     Visualize slope data as a colored image with optional polygon masking
     
     Args:
         slope_file_path: Path to the slope raster file
         polygon_data: Optional GeoJSON polygon data for masking
+        render_options: Optional render options (scale, format, compression)
         
     Returns:
         dict: Visualization data including base64 image and metadata
@@ -140,46 +254,12 @@ def visualize_slope(slope_file_path, polygon_data=None):
                 logger.error(f"Error masking slope with polygon: {str(e)}")
                 # If masking fails, continue with the original data
         
-        # Define slope percentage classes
-        slope_classes = [
-            (0, 3, [26, 150, 65]),     # Green
-            (3, 5, [166, 217, 106]),   # Light green
-            (5, 8, [255, 255, 191]),   # Yellow
-            (8, 15, [253, 174, 97]),   # Light orange
-            (15, 25, [215, 25, 28]),   # Red
-            (25, 50, [128, 0, 38]),    # Dark red
-            (50, float('inf'), [0, 0, 0])  # Black
-        ]
-        
-        # Create a colormapped image with class-based colors
-        # First create the colormap
-        rgba = np.zeros((slope_data.shape[0], slope_data.shape[1], 4), dtype=np.uint8)
-        
-        # Initialize alpha to transparent everywhere
-        rgba[:,:,3] = 0
-        
-        # Apply each class color where the slope falls within the class range
-        for i, (min_slope, max_slope, color) in enumerate(slope_classes):
-            mask = np.logical_and(slope_data >= min_slope, slope_data < max_slope)
-            rgba[mask, 0] = color[0]  # R
-            rgba[mask, 1] = color[1]  # G
-            rgba[mask, 2] = color[2]  # B
-            rgba[mask, 3] = 255       # Alpha (fully opaque for valid data)
-        
-        # Set alpha channel - transparent for NaN values
-        rgba[np.isnan(slope_data), 3] = 0
-        
-        # Convert to PIL Image and upscale for higher resolution
-        img = Image.fromarray(rgba)
-        
-        # Upscale the image for better quality (4x resolution for much sharper images)
-        original_size = img.size
-        upscaled_size = (original_size[0] * 4, original_size[1] * 4)
-        img_upscaled = img.resize(upscaled_size, Image.Resampling.NEAREST)
+        # Apply the slope percentage classes with one lookup (NaN and
+        # negative nodata values fall outside the classes and stay transparent)
+        rgba = get_colormap('slope').apply(slope_data)
         
-        buffered = io.BytesIO()
-        img_upscaled.save(buffered, format="PNG", optimize=True)
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+        # Encode the preview (native resolution or nearest-neighbour upscale)
+        rendered = render_rgba(rgba, render_options)
         
         # Calculate min/max for display
         valid_data = slope_data[~np.isnan(slope_data)]
@@ -187,14 +267,18 @@ def visualize_slope(slope_file_path, polygon_data=None):
         slope_max = np.max(valid_data) if valid_data.size > 0 else 100
         
         # Build the legend labels
-        legend_labels = [f"{min_p}-{max_p if max_p != float('inf') else '+'}" for min_p, max_p, _ in slope_classes]
+        class_edges = [edge for edge, _ in SLOPE_CLASSES] + [float('inf')]
+        legend_labels = [f"{min_p}-{max_p if max_p != float('inf') else '+'}" for min_p, max_p in zip(class_edges, class_edges[1:])]
         
         return {
-            'image': img_str,
+            'image': rendered['image'],
             'min_slope': float(slope_min),
             'max_slope': float(slope_max),
-            'width': upscaled_size[0],  # Use upscaled dimensions
-            'height': upscaled_size[1],  # Use upscaled dimensions
+            'width': rendered['width'],  # Encoded image dimensions
+            'height': rendered['height'],
+            'scale': rendered['scale'],  # Encoded pixels per raster cell
+            'format': rendered['format'],
+            'mime_type': rendered['mime_type'],
             'bounds': {
                 'north': bounds.top,
                 'south': bounds.bottom,
@@ -211,6 +295,125 @@ def generate_contours(input_file_path, output_file_path, interval):
     """
     Generate contour lines from a DEM raster
     
+    Contours are traced in-process with gdal.ContourGenerate into an in-memory
+    layer and written once to the output file (GeoJSON, or FlatGeobuf for a
+    .fgb path). Without the GDAL Python bindings this falls back to the
+    gdal_contour / ogr2ogr command line tools.
+    
+    Args:
+        input_file_path: Path to the input DEM file
+        output_file_path: Path to the output contour GeoJSON (or .fgb) file
+        interval: Contour interval in meters
+        
+    Returns:
+        dict: GeoJSON contour data if successful, None otherwise
+    """
+    if not HAS_GDAL_BINDINGS:
+        logger.warning("GDAL Python bindings not available, using gdal_contour/ogr2ogr subprocesses")
+        return _generate_contours_subprocess(input_file_path, output_file_path, interval)
+    
+    try:
+        import json
+        
+        # Ensure output directory exists
+        output_dir = os.path.dirname(output_file_path)
+        os.makedirs(output_dir, exist_ok=True)
+        
+        logger.info(f"Generating contours from {input_file_path} with interval {interval}m using GDAL bindings...")
+        
+        raster = gdal.Open(str(input_file_path))
+        if raster is None:
+            raise Exception(f"GDAL could not open DEM: {input_file_path}")
+        band = raster.GetRasterBand(1)
+        nodata = band.GetNoDataValue()
+        
+        srs = None
+        if raster.GetProjection():
+            srs = osr.SpatialReference(wkt=raster.GetProjection())
+            srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        
+        # Trace contours into an in-memory layer (same fields as gdal_contour -a elevation)
+        memory_driver = ogr.GetDriverByName('Memory') or ogr.GetDriverByName('MEM')
+        memory_source = memory_driver.CreateDataSource('contours')
+        layer = memory_source.CreateLayer('contours', srs=srs, geom_type=ogr.wkbLineString)
+        layer.CreateField(ogr.FieldDefn('ID', ogr.OFTInteger))
+        layer.CreateField(ogr.FieldDefn('elevation', ogr.OFTReal))
+        
+        error = gdal.ContourGenerate(
+            band,
+            float(interval),             # Contour interval
+            0.0,                         # Base elevation
+            [],                          # No fixed levels
+            1 if nodata is not None else 0,
+            nodata if nodata is not None else 0.0,
+            layer,
+            0,                           # ID field index
+            1                            # Elevation field index
+        )
+        if error != 0:
+            raise Exception(f"gdal.ContourGenerate failed with error code {error}")
+        
+        contours_geojson = _contour_layer_to_geojson(layer, srs, os.path.splitext(os.path.basename(output_file_path))[0])
+        feature_count = len(contours_geojson['features'])
+        logger.info(f"Generated {feature_count} contour features")
+        
+        if feature_count > 0:
+            # Log the first feature's properties for debugging
+            logger.info(f"First contour feature properties: {contours_geojson['features'][0].get('properties', {})}")
+        else:
+            logger.warning("No contour features were generated")
+        
+        # Write the output once, straight from memory
+        if str(output_file_path).lower().endswith('.fgb'):
+            fgb_driver = ogr.GetDriverByName('FlatGeobuf')
+            if os.path.exists(output_file_path):
+                fgb_driver.DeleteDataSource(str(output_file_path))
+            fgb_source = fgb_driver.CreateDataSource(str(output_file_path))
+            fgb_source.CopyLayer(layer, 'contours')
+            fgb_source = None  # Flush and close
+        else:
+            with open(output_file_path, 'w') as f:
+                json.dump(contours_geojson, f)
+        
+        memory_source = None
+        raster = None
+        
+        logger.info(f"Contour file written to {output_file_path}")
+        return contours_geojson
+    
+    except Exception as e:
+        logger.error(f"Error generating contours: {str(e)}", exc_info=True)
+        return None
+
+def _contour_layer_to_geojson(layer, srs, name):
+    """
+    Convert an OGR contour layer into a GeoJSON FeatureCollection dict
+    
+    Args:
+        layer: OGR layer with ID and elevation fields
+        srs: Layer spatial reference (or None)
+        name: Collection name (matches what ogr2ogr writes)
+        
+    Returns:
+        dict: GeoJSON FeatureCollection
+    """
+    features = []
+    layer.ResetReading()
+    for feature in layer:
+        features.append(feature.ExportToJson(as_object=True))
+    
+    contours_geojson = {'type': 'FeatureCollection', 'name': name}
+    if srs is not None and srs.GetAuthorityCode(None):
+        epsg_code = srs.GetAuthorityCode(None)
+        contours_geojson['crs'] = {'type': 'name', 'properties': {'name': f"urn:ogc:def:crs:EPSG::{epsg_code}"}}
+    contours_geojson['features'] = features
+    return contours_geojson
+
+def _generate_contours_subprocess(input_file_path, output_file_path, interval):
+    """
+    Generate contour lines with the gdal_contour and ogr2ogr command line tools
+    (fallback when the GDAL Python bindings are not installed)
+    
     Args:
         input_file_path: Path to the input DEM file
         output_file_path: Path to the output contour GeoJSON file
@@ -220,9 +423,9 @@ def generate_contours(input_file_path, output_file_path, interval):
         dict: GeoJSON contour data if successful, None otherwise
     """
     try:
-        import subprocess
         import json
         from pathlib import Path
+        from utils.cancellation import run_subprocess
         
         # Ensure output directory exists
         output_dir = os.path.dirname(output_file_path)
@@ -251,10 +454,10 @@ def generate_contours(input_file_path, output_file_path, interval):
             str(output_shp)       # Output shapefile
         ]
         
-        # Run the command
+        # Run the command (killed if the analysis is cancelled)
         logger.info(f"Running command: {' '.join(cmd)}")
         
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        result = run_subprocess(cmd, check=True, capture_output=True, text=True)
         
         # Log the output for debugging
         if result.stdout:
@@ -285,7 +488,7 @@ def generate_contours(input_file_path, output_file_path, interval):
         # Run the ogr2ogr command
         logger.info(f"Running command: {' '.join(ogr_cmd)}")
         
-        ogr_result = subprocess.run(ogr_cmd, check=True, capture_output=True, text=True)
+        ogr_result = run_subprocess(ogr_cmd, check=True, capture_output=True, text=True)
         
         # Log the output for debugging
         if ogr_result.stdout:
@@ -340,6 +543,7 @@ def generate_contours(input_file_path, output_file_path, interval):
         logger.error(f"Error generating contours: {str(e)}", exc_info=True)
         return None
 
+@cached_derivative('geomorphons')
 def calculate_geomorphons(input_file_path, output_file_path, search=50, threshold=0.0, forms=True):
     """
     Calculate geomorphons from a DEM raster using WhiteboxTools
@@ -355,19 +559,25 @@ def calculate_geomorphons(input_file_path, output_file_path, search=50, threshol
         bool: True if successful, False otherwise
     """
     try:
-        # Set the working directory for WhiteboxTools
-        wbt = get_whitebox_tools()
-        wbt.set_working_dir(os.path.dirname(output_file_path))
+        if should_use_blocks(input_file_path):
+            # Each block carries a halo of the search distance so landforms at
+            # block seams see the same neighbourhood as a whole-raster run
+            logger.info(f"Calculating geomorphons block-wise from {input_file_path}...")
+            return process_raster_blocks(
+                input_file_path, {'geomorphons': output_file_path}, geomorphons_kernel, halo=int(search),
+                kernel_kwargs={'search': search, 'threshold': threshold, 'forms': forms},
+                dtype='int16', nodata=GEOMORPHONS_NODATA
+            )
         
         logger.info(f"Calculating geomorphons from {input_file_path}...")
-        wbt = get_whitebox_tools()
-        wbt.geomorphons(
-            dem=str(input_file_path), 
-            output=str(output_file_path),
-            search=search,
-            threshold=threshold,
-            forms=forms
-        )
+        with whitebox_tools('geomorphons') as wbt:
+            wbt.geomorphons(
+                dem=os.path.abspath(input_file_path), 
+                output=os.path.abspath(output_file_path),
+                search=search,
+                threshold=threshold,
+                forms=forms
+            )
         
         if not os.path.exists(output_file_path):
             logger.error(f"Failed to calculate geomorphons - output file not created")
@@ -379,13 +589,14 @@ def calculate_geomorphons(input_file_path, output_file_path, search=50, threshol
         logger.error(f"Error calculating geomorphons: {str(e)}", exc_info=True)
         return False
 
-def visualize_geomorphons(geomorphons_file_path, polygon_data=None):
+def visualize_geomorphons(geomorphons_file_path, polygon_data=None, render_options=None):
     """
     Visualize geomorphons data as a colored image with optional polygon masking
     
     Args:
         geomorphons_file_path: Path to the geomorphons raster file
         polygon_data: Optional GeoJSON polygon data for masking
+        render_options: Optional render options (scale, format, compression)
         
     Returns:
         dict: Visualization data including base64 image and metadata
@@ -435,24 +646,6 @@ def visualize_geomorphons(geomorphons_file_path, polygon_data=None):
                 logger.error(f"Error masking geomorphons with polygon: {str(e)}")
                 # If masking fails, continue with the original data
         
-        # Define geomorphons landform types and their colors
-        # Based on the QML symbology file provided
-        landform_colors = {
-            1: [113, 113, 113],  # Flat - #717171
-            2: [83, 5, 14],      # Peak - #53050e
-            3: [186, 34, 49],    # Ridge - #ba2231
-            4: [212, 95, 32],    # Shoulder - #d45f20
-            5: [229, 204, 91],   # Spur (convex) - #e5cc5b
-            6: [233, 233, 152],  # Slope - #e9e998
-            7: [166, 186, 98],   # Hollow (concave) - #a6ba62
-            8: [17, 90, 21],     # Footslope - #115a15
-            9: [105, 129, 149],  # Valley - #698195
-            10: [0, 0, 0]        # Pit (depression) - #000000
-        }
-        
-        # Create a colormapped image
-        rgba = np.zeros((geomorphons_data.shape[0], geomorphons_data.shape[1], 4), dtype=np.uint8)
-        
         # ✅ BUILD COMPREHENSIVE VALID DATA MASK FOR int16 DATA
         valid_mask = np.ones(geomorphons_data.shape, dtype=bool)
         
@@ -475,39 +668,20 @@ def visualize_geomorphons(geomorphons_file_path, polygon_data=None):
         # 4. Log final statistics
         logger.info(f"Geomorphons: {np.sum(valid_mask)} valid pixels out of {geomorphons_data.size} total")
         if np.sum(valid_mask) > 0:
-            unique_values = np.unique(geomorphons_data[valid_mask])
+            unique_values, counts = np.unique(geomorphons_data[valid_mask], return_counts=True)
             logger.info(f"Unique geomorphon values present: {unique_values}")
             
             # Count pixels per landform type
-            for landform_type in landform_colors.keys():
-                count = np.sum(geomorphons_data[valid_mask] == landform_type)
-                if count > 0:
-                    logger.info(f"  Landform {landform_type}: {count} pixels")
+            for landform_type, count in zip(unique_values, counts):
+                logger.info(f"  Landform {landform_type}: {count} pixels")
         else:
             logger.warning("No valid geomorphon data found!")
         
-        # ✅ APPLY COLORS ONLY TO VALID PIXELS
-        for landform_type, color in landform_colors.items():
-            landform_mask = valid_mask & (geomorphons_data == landform_type)
-            rgba[landform_mask, 0] = color[0]  # R
-            rgba[landform_mask, 1] = color[1]  # G
-            rgba[landform_mask, 2] = color[2]  # B
-            rgba[landform_mask, 3] = 255       # Alpha (opaque)
-        
-        # ✅ MAKE INVALID PIXELS TRANSPARENT
-        rgba[~valid_mask, 3] = 0
-        
-        # Convert to PIL Image and upscale for higher resolution
-        img = Image.fromarray(rgba)
-        
-        # Upscale the image for better quality (4x resolution for much sharper images)
-        original_size = img.size
-        upscaled_size = (original_size[0] * 4, original_size[1] * 4)
-        img_upscaled = img.resize(upscaled_size, Image.Resampling.NEAREST)
+        # ✅ APPLY COLORS ONLY TO VALID PIXELS (invalid pixels stay transparent)
+        rgba = get_colormap('geomorphons').apply(geomorphons_data, valid_mask)
         
-        buffered = io.BytesIO()
-        img_upscaled.save(buffered, format="PNG", optimize=True)
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+        # Encode the preview (native resolution or nearest-neighbour upscale)
+        rendered = render_rgba(rgba, render_options)
         
         # Calculate min/max using valid mask
         valid_data = geomorphons_data[valid_mask]
@@ -531,11 +705,14 @@ def visualize_geomorphons(geomorphons_file_path, polygon_data=None):
         legend_labels = [landform_names.get(i, f"Type {i}") for i in range(1, 11)]
         
         return {
-            'image': img_str,
+            'image': rendered['image'],
             'min_geomorphons': float(geomorphons_min),
             'max_geomorphons': float(geomorphons_max),
-            'width': upscaled_size[0],  # Use upscaled dimensions
-            'height': upscaled_size[1],  # Use upscaled dimensions
+            'width': rendered['width'],  # Encoded image dimensions
+            'height': rendered['height'],
+            'scale': rendered['scale'],  # Encoded pixels per raster cell
+            'format': rendered['format'],
+            'mime_type': rendered['mime_type'],
             'bounds': {
                 'north': bounds.top,
                 'south': bounds.bottom,
@@ -548,6 +725,7 @@ def visualize_geomorphons(geomorphons_file_path, polygon_data=None):
         logger.error(f"Error visualizing geomorphons: {str(e)}", exc_info=True)
         return None
 
+@cached_derivative('hillshade')
 def calculate_hypsometrically_tinted_hillshade(input_file_path, output_file_path, altitude=45.0, hs_weight=0.5, brightness=0.5, atmospheric=0.0, palette="atlas", zfactor=None):
     """
     Calculate hypsometrically tinted hillshade from a DEM raster using WhiteboxTools
@@ -566,22 +744,18 @@ def calculate_hypsometrically_tinted_hillshade(input_file_path, output_file_path
         bool: True if successful, False otherwise
     """
     try:
-        # Set the working directory for WhiteboxTools
-        wbt = get_whitebox_tools()
-        wbt.set_working_dir(os.path.dirname(output_file_path))
-        
         logger.info(f"Calculating hypsometrically tinted hillshade from {input_file_path}...")
-        wbt = get_whitebox_tools()
-        wbt.hypsometrically_tinted_hillshade(
-            dem=str(input_file_path), 
-            output=str(output_file_path),
-            altitude=altitude,
-            hs_weight=hs_weight,
-            brightness=brightness,
-            atmospheric=atmospheric,
-            palette=palette,
-            zfactor=zfactor
-        )
+        with whitebox_tools('hypsometrically_tinted_hillshade') as wbt:
+            wbt.hypsometrically_tinted_hillshade(
+                dem=os.path.abspath(input_file_path), 
+                output=os.path.abspath(output_file_path),
+                altitude=altitude,
+                hs_weight=hs_weight,
+                brightness=brightness,
+                atmospheric=atmospheric,
+                palette=palette,
+                zfactor=zfactor
+            )
         
         if not os.path.exists(output_file_path):
             logger.error(f"Failed to calculate hillshade - output file not created")
@@ -593,13 +767,14 @@ def calculate_hypsometrically_tinted_hillshade(input_file_path, output_file_path
         logger.error(f"Error calculating hypsometrically tinted hillshade: {str(e)}", exc_info=True)
         return False
 
-def visualize_hillshade(hillshade_file_path, polygon_data=None):
+def visualize_hillshade(hillshade_file_path, polygon_data=None, render_options=None):
     """
     Visualize hillshade data as a colored image with optional polygon masking
     
     Args:
         hillshade_file_path: Path to the hillshade raster file
         polygon_data: Optional GeoJSON polygon data for masking
+        render_options: Optional render options (scale, format, compression)
         
     Returns:
         dict: Visualization data including base64 image and metadata
@@ -688,17 +863,8 @@ def visualize_hillshade(hillshade_file_path, polygon_data=None):
             black_mask = (rgba[:,:,0] == 0) & (rgba[:,:,1] == 0) & (rgba[:,:,2] == 0)
             rgba[black_mask, 3] = 0  # Make pure black pixels transparent
         
-        # Convert to PIL Image and upscale for higher resolution
-        img = Image.fromarray(rgba)
-        
-        # Upscale the image for better quality (4x resolution for much sharper images)
-        original_size = img.size
-        upscaled_size = (original_size[0] * 4, original_size[1] * 4)
-        img_upscaled = img.resize(upscaled_size, Image.Resampling.NEAREST)
-        
-        buffered = io.BytesIO()
-        img_upscaled.save(buffered, format="PNG", optimize=True)
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+        # Encode the preview (native resolution or nearest-neighbour upscale)
+        rendered = render_rgba(rgba, render_options)
         
         # Calculate min/max for display - handle both single and multi-band data
         if len(hillshade_data.shape) == 3:
@@ -712,11 +878,14 @@ def visualize_hillshade(hillshade_file_path, polygon_data=None):
         hillshade_max = np.max(valid_data) if valid_data.size > 0 else 255
         
         return {
-            'image': img_str,
+            'image': rendered['image'],
             'min_hillshade': float(hillshade_min),
             'max_hillshade': float(hillshade_max),
-            'width': upscaled_size[0],  # Use upscaled dimensions
-            'height': upscaled_size[1],  # Use upscaled dimensions
+            'width': rendered['width'],  # Encoded image dimensions
+            'height': rendered['height'],
+            'scale': rendered['scale'],  # Encoded pixels per raster cell
+            'format': rendered['format'],
+            'mime_type': rendered['mime_type'],
             'bounds': {
                 'north': bounds.top,
                 'south': bounds.bottom,
@@ -730,7 +899,10 @@ def visualize_hillshade(hillshade_file_path, polygon_data=None):
 
 def calculate_drainage_network(input_file_path, output_file_path):
     """
-    Calculate drainage network using WhiteboxTools (fill depressions + D8 flow accumulation)
+    Calculate drainage network (D8 flow accumulation of the depression-filled DEM)
+    
+    The filled DEM, D8 pointer and flow accumulation come from the per-DEM
+    hydrology cache, so repeated runs on the same DEM skip WhiteboxTools.
     
     Args:
         input_file_path: Path to the input DEM file
@@ -740,36 +912,23 @@ def calculate_drainage_network(input_file_path, output_file_path):
         bool: True if successful, False otherwise
     """
     try:
-        # Set the working directory for WhiteboxTools
-        wbt = get_whitebox_tools()
-        wbt.set_working_dir(os.path.dirname(output_file_path))
+        import shutil
+        from services.hydrology import get_hydrology_products
         
         logger.info(f"Calculating drainage network from {input_file_path}...")
         
-        # Step 1: Fill depressions to remove sinks
-        filled_dem_path = os.path.join(os.path.dirname(output_file_path), "filled_dem.tif")
-        wbt = get_whitebox_tools()
-        wbt.fill_depressions(
-            dem=str(input_file_path), 
-            output=str(filled_dem_path)
-        )
-        
-        if not os.path.exists(filled_dem_path):
-            logger.error(f"Failed to fill depressions - intermediate file not created")
+        products = get_hydrology_products(input_file_path)
+        if not products:
+            logger.error(f"Failed to prepare hydrology intermediates for {input_file_path}")
             return False
         
-        # Step 2: Calculate D8 flow accumulation
-        wbt = get_whitebox_tools()
-        wbt.d8_flow_accumulation(
-            i=str(filled_dem_path), 
-            output=str(output_file_path)
-        )
-        
-        # Clean up intermediate file
-        try:
-            os.remove(filled_dem_path)
-        except:
-            pass  # Ignore cleanup errors
+        # Copy the cached accumulation into the session folder under a unique
+        # temporary name, then move it into place
+        output_dir = os.path.dirname(output_file_path)
+        os.makedirs(output_dir, exist_ok=True)
+        temp_output_path = f"{output_file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(products['flow_accumulation'], temp_output_path)
+        os.replace(temp_output_path, output_file_path)
         
         if not os.path.exists(output_file_path):
             logger.error(f"Failed to calculate drainage network - output file not created")
@@ -782,10 +941,15 @@ def calculate_drainage_network(input_file_path, output_file_path):
         logger.error(f"Error calculating drainage network: {str(e)}", exc_info=True)
         return False
 
+@cached_derivative('aspect')
 def calculate_aspect(input_file_path, output_file_path, convention="azimuth", gradient_alg="Horn", zero_for_flat=False):
     """
     Calculate aspect from a DEM raster using WhiteboxTools
     
+    WhiteboxTools' aspect only produces Horn azimuths with -1 for flat cells,
+    so any other convention, gradient algorithm or flat value is computed by
+    the in-process engine whatever TERRAIN_ENGINE says.
+    
     Args:
         input_file_path: Path to the input DEM file
         output_file_path: Path to the output aspect file
@@ -797,18 +961,21 @@ def calculate_aspect(input_file_path, output_file_path, convention="azimuth", gr
         bool: True if successful, False otherwise
     """
     try:
-        # Set the working directory for WhiteboxTools
-        wbt = get_whitebox_tools()
-        wbt.set_working_dir(os.path.dirname(output_file_path))
+        aspect_options = {'convention': convention, 'gradient_alg': gradient_alg, 'zero_for_flat': bool(zero_for_flat)}
+        whitebox_defaults = (convention.lower() == 'azimuth' and gradient_alg.lower() == 'horn'
+                             and not aspect_options['zero_for_flat'])
+        if TERRAIN_ENGINE == 'numpy' or not whitebox_defaults:
+            return calculate_gradient_derivatives(input_file_path, aspect_file_path=output_file_path,
+                                                  aspect_options=aspect_options)
         
         logger.info(f"Calculating aspect from {input_file_path}...")
         
         # Use WhiteboxTools aspect function
-        wbt = get_whitebox_tools()
-        wbt.aspect(
-            dem=str(input_file_path), 
-            output=str(output_file_path)
-        )
+        with whitebox_tools('aspect') as wbt:
+            wbt.aspect(
+                dem=os.path.abspath(input_file_path), 
+                output=os.path.abspath(output_file_path)
+            )
         
         if not os.path.exists(output_file_path):
             logger.error(f"Failed to calculate aspect - output file not created")
@@ -821,13 +988,14 @@ def calculate_aspect(input_file_path, output_file_path, convention="azimuth", gr
         logger.error(f"Error calculating aspect: {str(e)}", exc_info=True)
         return False
 
-def visualize_aspect(aspect_file_path, polygon_data=None):
+def visualize_aspect(aspect_file_path, polygon_data=None, render_options=None):
     """
     Visualize aspect data as a colored image with optional polygon masking
     
     Args:
         aspect_file_path: Path to the aspect raster file
         polygon_data: Optional GeoJSON polygon data for masking
+        render_options: Optional render options (scale, format, compression)
         
     Returns:
         dict: Visualization data including base64 image and metadata
@@ -864,25 +1032,6 @@ def visualize_aspect(aspect_file_path, polygon_data=None):
                 logger.error(f"Error masking aspect with polygon: {str(e)}")
                 # If masking fails, continue with the original data
         
-        # Create aspect color mapping using QGIS symbology colors
-        # Based on the provided QML file with 8 directional categories
-        aspect_colors = {
-            'flat': [176, 176, 176],      # Flat (-1) - #b0b0b0
-            'north': [255, 0, 0],          # North (0-22.5) - #ff0000
-            'northeast': [255, 166, 0],    # Northeast (22.5-67.5) - #ffa600
-            'east': [255, 255, 0],         # East (67.5-112.5) - #ffff00
-            'southeast': [0, 255, 0],      # Southeast (112.5-157.5) - #00ff00
-            'south': [0, 255, 255],        # South (157.5-202.5) - #00ffff
-            'southwest': [0, 166, 255],    # Southwest (202.5-247.5) - #00a6ff
-            'west': [0, 0, 255],           # West (247.5-292.5) - #0000ff
-            'northwest': [255, 0, 255]     # Northwest (292.5-337.5) - #ff00ff
-        }
-        
-        rgba = np.zeros((aspect_data.shape[0], aspect_data.shape[1], 4), dtype=np.uint8)
-        
-        # Initialize alpha to transparent everywhere
-        rgba[:,:,3] = 0
-        
         # Create mask for valid data (not NoData)
         valid_mask = ~np.isnan(aspect_data)
         
@@ -895,54 +1044,11 @@ def visualize_aspect(aspect_file_path, polygon_data=None):
                 # For integer nodata values (like -9999, -32768)
                 valid_mask = valid_mask & (aspect_data != nodata_value)
         
-        # Apply colors based on aspect direction
-        for i in range(aspect_data.shape[0]):
-            for j in range(aspect_data.shape[1]):
-                # Skip NoData pixels
-                if not valid_mask[i, j]:
-                    continue
-                    
-                aspect_val = aspect_data[i, j]
-                
-                # Determine direction and assign color
-                if aspect_val < 0 or aspect_val == -9999:  # Flat areas
-                    color = aspect_colors['flat']
-                elif aspect_val <= 22.5 or aspect_val >= 337.5:  # North
-                    color = aspect_colors['north']
-                elif aspect_val <= 67.5:  # Northeast
-                    color = aspect_colors['northeast']
-                elif aspect_val <= 112.5:  # East
-                    color = aspect_colors['east']
-                elif aspect_val <= 157.5:  # Southeast
-                    color = aspect_colors['southeast']
-                elif aspect_val <= 202.5:  # South
-                    color = aspect_colors['south']
-                elif aspect_val <= 247.5:  # Southwest
-                    color = aspect_colors['southwest']
-                elif aspect_val <= 292.5:  # West
-                    color = aspect_colors['west']
-                else:  # Northwest
-                    color = aspect_colors['northwest']
-                
-                rgba[i, j, 0] = color[0]  # R
-                rgba[i, j, 1] = color[1]  # G
-                rgba[i, j, 2] = color[2]  # B
-                rgba[i, j, 3] = 255       # Alpha
-        
-        # Set alpha channel - transparent for NoData values
-        rgba[~valid_mask, 3] = 0
-        
-        # Convert to PIL Image and upscale for higher resolution
-        img = Image.fromarray(rgba)
+        # Apply colors based on aspect direction (vectorized lookup)
+        rgba = colorize_aspect(aspect_data, valid_mask)
         
-        # Upscale the image for better quality (4x resolution for much sharper images)
-        original_size = img.size
-        upscaled_size = (original_size[0] * 4, original_size[1] * 4)
-        img_upscaled = img.resize(upscaled_size, Image.Resampling.NEAREST)
-        
-        buffered = io.BytesIO()
-        img_upscaled.save(buffered, format="PNG", optimize=True)
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+        # Encode the preview (native resolution or nearest-neighbour upscale)
+        rendered = render_rgba(rgba, render_options)
         
         # Calculate min/max for display using the same valid mask
         valid_data = aspect_data[valid_mask]
@@ -950,11 +1056,14 @@ def visualize_aspect(aspect_file_path, polygon_data=None):
         aspect_max = np.max(valid_data) if valid_data.size > 0 else 360
         
         return {
-            'image': img_str,
+            'image': rendered['image'],
             'min_aspect': float(aspect_min),
             'max_aspect': float(aspect_max),
-            'width': upscaled_size[0],  # Use upscaled dimensions
-            'height': upscaled_size[1],  # Use upscaled dimensions
+            'width': rendered['width'],  # Encoded image dimensions
+            'height': rendered['height'],
+            'scale': rendered['scale'],  # Encoded pixels per raster cell
+            'format': rendered['format'],
+            'mime_type': rendered['mime_type'],
             'bounds': {
                 'north': bounds.top,
                 'south': bounds.bottom,
@@ -966,13 +1075,14 @@ def visualize_aspect(aspect_file_path, polygon_data=None):
         logger.error(f"Error visualizing aspect: {str(e)}", exc_info=True)
         return None
 
-def visualize_drainage_network(drainage_file_path, polygon_data=None):
+def visualize_drainage_network(drainage_file_path, polygon_data=None, render_options=None):
     """
     Visualize drainage network data as a colored image with optional polygon masking
     
     Args:
         drainage_file_path: Path to the drainage network raster file
         polygon_data: Optional GeoJSON polygon data for masking
+        render_options: Optional render options (scale, format, compression)
         
     Returns:
         dict: Visualization data including base64 image and metadata
@@ -1016,62 +1126,11 @@ def visualize_drainage_network(drainage_file_path, polygon_data=None):
             drainage_data = drainage_data[0]  # Take first band if multi-dimensional
         
         # Create drainage network color mapping
-        # Use a blue color scheme for flow accumulation
-        rgba = np.zeros((drainage_data.shape[0], drainage_data.shape[1], 4), dtype=np.uint8)
-        
-        # Handle nodata values
-        valid_mask = ~np.isnan(drainage_data) & (drainage_data > 0)
-        
-        if np.any(valid_mask):
-            # Get valid data for color mapping
-            valid_data = drainage_data[valid_mask]
-            
-            # Use logarithmic scaling for better visualization
-            log_data = np.log1p(valid_data)  # log(1 + x) to handle zeros
-            log_min = np.min(log_data)
-            log_max = np.max(log_data)
-            
-            if log_max > log_min:
-                # Normalize to 0-1
-                normalized = (log_data - log_min) / (log_max - log_min)
-                
-                # Create a normalized array for the full raster
-                normalized_full = np.zeros_like(drainage_data, dtype=np.float32)
-                normalized_full[valid_mask] = normalized
-                
-                # Apply blue color scheme (light blue to dark blue)
-                for i in range(drainage_data.shape[0]):
-                    for j in range(drainage_data.shape[1]):
-                        if valid_mask[i, j]:
-                            val = normalized_full[i, j]
-                            # Blue color scheme: light blue (low) to dark blue (high)
-                            rgba[i, j, 0] = int(255 * (1 - val * 0.7))  # R: 255 to 77
-                            rgba[i, j, 1] = int(255 * (1 - val * 0.5))  # G: 255 to 128
-                            rgba[i, j, 2] = 255  # B: always 255 (blue)
-                            rgba[i, j, 3] = 255  # Alpha: opaque
-                        else:
-                            rgba[i, j, 3] = 0  # Alpha: transparent for nodata
-            else:
-                # All values are the same
-                rgba[valid_mask, 0] = 77   # R
-                rgba[valid_mask, 1] = 128 # G
-                rgba[valid_mask, 2] = 255  # B
-                rgba[valid_mask, 3] = 255  # Alpha
-        else:
-            # No valid data
-            rgba[:, :, 3] = 0  # All transparent
-        
-        # Convert to PIL Image and upscale for higher resolution
-        img = Image.fromarray(rgba)
-        
-        # Upscale the image for better quality (4x resolution for much sharper images)
-        original_size = img.size
-        upscaled_size = (original_size[0] * 4, original_size[1] * 4)
-        img_upscaled = img.resize(upscaled_size, Image.Resampling.NEAREST)
+        # Use a blue color scheme for flow accumulation (vectorized)
+        rgba, valid_mask = colorize_drainage(drainage_data)
         
-        buffered = io.BytesIO()
-        img_upscaled.save(buffered, format="PNG", optimize=True)
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+        # Encode the preview (native resolution or nearest-neighbour upscale)
+        rendered = render_rgba(rgba, render_options)
         
         # Calculate min/max for display
         if np.any(valid_mask):
@@ -1082,11 +1141,14 @@ def visualize_drainage_network(drainage_file_path, polygon_data=None):
             drainage_max = 1
         
         return {
-            'image': img_str,
+            'image': rendered['image'],
             'min_drainage': float(drainage_min),
             'max_drainage': float(drainage_max),
-            'width': upscaled_size[0],  # Use upscaled dimensions
-            'height': upscaled_size[1],  # Use upscaled dimensions
+            'width': rendered['width'],  # Encoded image dimensions
+            'height': rendered['height'],
+            'scale': rendered['scale'],  # Encoded pixels per raster cell
+            'format': rendered['format'],
+            'mime_type': rendered['mime_type'],
             'bounds': {
                 'north': bounds.top,
                 'south': bounds.bottom,
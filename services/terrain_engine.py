@@ -0,0 +1,342 @@
+"""
+In-process terrain derivative engine
+
+Reads a DEM once, computes the Horn (1981) gradient with vectorized NumPy
+window arithmetic and derives slope, aspect and hillshade from that single
+gradient (aspect can also use the Zevenbergen-Thorne (1987) gradient).
+Curvature, TRI and TPI reuse the same 3x3 neighbourhood. Outputs are returned
+as arrays and only written to disk on request, which avoids one WhiteboxTools
+subprocess and one GeoTIFF round-trip per layer. calculate_gradient_derivatives
+in services.terrain is the file-based entry point.
+"""
+import logging
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+import rasterio
+
+logger = logging.getLogger(__name__)
+
+# Approximate length of one degree of latitude in metres (same constant used
+# by the statistics service for geographic rasters)
+METERS_PER_DEGREE = 111320.0
+
+# The 8 neighbours of the centre cell "e" in a 3x3 window
+NEIGHBOURS = ('a', 'b', 'c', 'd', 'f', 'g', 'h', 'i')
+
+# Aspect value written for flat cells (matches the WhiteboxTools convention
+# that visualize_aspect already treats as "flat")
+FLAT_ASPECT = -1.0
+
+# Gradient algorithms and aspect angle conventions (the names the aspect
+# route accepts)
+HORN = 'horn'
+ZEVENBERGEN_THORNE = 'zevenbergenthorne'
+GRADIENT_ALGORITHMS = (HORN, ZEVENBERGEN_THORNE)
+AZIMUTH = 'azimuth'
+TRIGONOMETRIC_ANGLE = 'trigonometric-angle'
+ASPECT_CONVENTIONS = (AZIMUTH, TRIGONOMETRIC_ANGLE)
+
+
+class TerrainEngine:
+    """Compute terrain derivatives from a DEM held in memory"""
+
+    def __init__(self, dem: np.ndarray, transform, crs=None, profile: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            dem: 2D elevation array (nodata must already be NaN)
+            transform: Affine geotransform of the array
+            crs: Raster CRS (geographic CRSs get metre cell sizes per row)
+            profile: Optional rasterio profile used as a template when writing
+        """
+        self.dem = np.asarray(dem, dtype=np.float32)
+        self.transform = transform
+        self.crs = crs
+        self.profile = profile
+        self.nodata_mask = np.isnan(self.dem)
+        self._window = None
+        self._gradients = {}
+
+    @classmethod
+    def from_file(cls, dem_path: str) -> 'TerrainEngine':
+        """
+        Read a DEM from disk once and build an engine for it
+
+        Args:
+            dem_path: Path to the DEM GeoTIFF
+
+        Returns:
+            TerrainEngine: Engine holding the DEM in memory
+        """
+        with rasterio.open(dem_path) as src:
+            dem = src.read(1).astype(np.float32)
+            if src.nodata is not None and not np.isnan(src.nodata):
+                dem[dem == src.nodata] = np.nan
+            logger.info(f"Loaded DEM for terrain engine: {dem_path} ({dem.shape[1]}x{dem.shape[0]})")
+            return cls(dem, src.transform, src.crs, src.profile.copy())
+
+    def cell_size(self) -> Tuple[np.ndarray, float]:
+        """
+        Get the cell size in metres
+
+        Returns:
+            tuple: (dx per row as a column vector, dy) in metres. For geographic
+            rasters dx shrinks with the cosine of each row's latitude.
+        """
+        res_x = abs(self.transform.a)
+        res_y = abs(self.transform.e)
+        rows = self.dem.shape[0]
+
+        if self.crs is not None and getattr(self.crs, 'is_geographic', False):
+            row_lat = self.transform.f + (np.arange(rows) + 0.5) * self.transform.e
+            dx = res_x * METERS_PER_DEGREE * np.cos(np.radians(row_lat))
+            dy = res_y * METERS_PER_DEGREE
+        else:
+            dx = np.full(rows, res_x)
+            dy = res_y
+
+        return dx.reshape(-1, 1).astype(np.float32), np.float32(dy)
+
+    def neighbourhood(self) -> Dict[str, np.ndarray]:
+        """
+        Build the 3x3 neighbourhood views of the DEM
+
+        Neighbours are named a..i row by row (a = north-west, e = centre,
+        i = south-east). Raster edges are replicated and NaN neighbours take the
+        centre value so that valid cells next to nodata still get a result.
+
+        Returns:
+            dict: Neighbour name -> array with the shape of the DEM
+        """
+        if self._window is not None:
+            return self._window
+
+        padded = np.pad(self.dem, 1, mode='edge')
+        rows, cols = self.dem.shape
+        centre = self.dem
+
+        names = ('a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'i')
+        window = {}
+        for index, name in enumerate(names):
+            dr, dc = divmod(index, 3)
+            view = padded[dr:dr + rows, dc:dc + cols]
+            if name != 'e':
+                view = np.where(np.isnan(view), centre, view)
+            window[name] = view
+
+        self._window = window
+        return window
+
+    def gradient(self, algorithm: str = HORN) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Compute a gradient once per algorithm and cache it
+
+        Args:
+            algorithm: 'Horn' (3x3 weighted) or 'ZevenbergenThorne' (4-neighbour
+                central differences), case-insensitive
+
+        Returns:
+            tuple: (dz/dx towards east, dz/dy towards north) in metres per metre
+
+        Raises:
+            ValueError: If the algorithm is unknown
+        """
+        algorithm = algorithm.lower()
+        if algorithm not in GRADIENT_ALGORITHMS:
+            raise ValueError(f"Unknown gradient algorithm '{algorithm}' (expected Horn or ZevenbergenThorne)")
+
+        if algorithm not in self._gradients:
+            w = self.neighbourhood()
+            dx, dy = self.cell_size()
+            if algorithm == HORN:
+                dzdx = ((w['c'] + 2 * w['f'] + w['i']) - (w['a'] + 2 * w['d'] + w['g'])) / (8 * dx)
+                dzdy = ((w['a'] + 2 * w['b'] + w['c']) - (w['g'] + 2 * w['h'] + w['i'])) / (8 * dy)
+            else:
+                dzdx = (w['f'] - w['d']) / (2 * dx)
+                dzdy = (w['b'] - w['h']) / (2 * dy)
+            self._gradients[algorithm] = (dzdx.astype(np.float32), dzdy.astype(np.float32))
+        return self._gradients[algorithm]
+
+    def slope(self) -> np.ndarray:
+        """
+        Slope in percent
+
+        Returns:
+            np.ndarray: float32 slope with NaN where the DEM has no data
+        """
+        dzdx, dzdy = self.gradient()
+        slope = 100.0 * np.hypot(dzdx, dzdy)
+        slope[self.nodata_mask] = np.nan
+        return slope.astype(np.float32)
+
+    def aspect(self, convention: str = AZIMUTH, gradient_alg: str = HORN,
+               zero_for_flat: bool = False) -> np.ndarray:
+        """
+        Aspect of the downslope direction in degrees (0-360)
+
+        Args:
+            convention: 'azimuth' (clockwise from north) or 'trigonometric-angle'
+                (counterclockwise from east)
+            gradient_alg: 'Horn' or 'ZevenbergenThorne'
+            zero_for_flat: Write 0 instead of -1 for flat cells
+
+        Returns:
+            np.ndarray: float32 aspect with NaN where the DEM has no data
+
+        Raises:
+            ValueError: If the convention or gradient algorithm is unknown
+        """
+        convention = convention.lower()
+        if convention not in ASPECT_CONVENTIONS:
+            raise ValueError(f"Unknown aspect convention '{convention}' (expected {' or '.join(ASPECT_CONVENTIONS)})")
+
+        dzdx, dzdy = self.gradient(gradient_alg)
+        aspect = np.degrees(np.arctan2(-dzdx, -dzdy)) % 360.0
+        if convention == TRIGONOMETRIC_ANGLE:
+            aspect = (90.0 - aspect) % 360.0
+        aspect[(dzdx == 0) & (dzdy == 0)] = 0.0 if zero_for_flat else FLAT_ASPECT
+        aspect[self.nodata_mask] = np.nan
+        return aspect.astype(np.float32)
+
+    def hillshade(self, azimuth: float = 315.0, altitude: float = 45.0) -> np.ndarray:
+        """
+        Lambertian hillshade
+
+        Args:
+            azimuth: Illumination azimuth in degrees (clockwise from north)
+            altitude: Illumination altitude in degrees above the horizon
+
+        Returns:
+            np.ndarray: float32 shading in 0-255 with NaN where the DEM has no data
+        """
+        dzdx, dzdy = self.gradient()
+        zenith = np.radians(90.0 - altitude)
+        light = np.radians(azimuth)
+
+        slope_rad = np.arctan(np.hypot(dzdx, dzdy))
+        aspect_rad = np.arctan2(-dzdx, -dzdy)
+
+        shade = (np.cos(zenith) * np.cos(slope_rad) +
+                 np.sin(zenith) * np.sin(slope_rad) * np.cos(light - aspect_rad))
+        shade = np.clip(shade, 0.0, 1.0) * 255.0
+        shade[self.nodata_mask] = np.nan
+        return shade.astype(np.float32)
+
+    def curvature(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Profile and plan curvature (Evans-Young second-order finite differences)
+
+        Profile curvature is measured along the slope line, plan curvature across
+        it; both are in 1/m, positive on convex profiles and divergent plan forms,
+        and 0 on flat cells.
+
+        Returns:
+            tuple: (profile curvature, plan curvature) as float32 arrays
+        """
+        w = self.neighbourhood()
+        dx, dy = self.cell_size()
+
+        p = (w['f'] - w['d']) / (2 * dx)
+        q = (w['b'] - w['h']) / (2 * dy)
+        r = (w['d'] - 2 * w['e'] + w['f']) / (dx * dx)
+        t = (w['b'] - 2 * w['e'] + w['h']) / (dy * dy)
+        s = ((w['c'] - w['a']) - (w['i'] - w['g'])) / (4 * dx * dy)
+
+        p2, q2 = p * p, q * q
+        grad2 = p2 + q2
+        flat = grad2 == 0
+        safe_grad2 = np.where(flat, 1.0, grad2)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            profile = -(r * p2 + 2 * s * p * q + t * q2) / (safe_grad2 * np.power(1 + grad2, 1.5))
+            plan = -(r * q2 - 2 * s * p * q + t * p2) / np.power(safe_grad2, 1.5)
+
+        for array in (profile, plan):
+            array[flat] = 0.0
+            array[self.nodata_mask] = np.nan
+        return profile.astype(np.float32), plan.astype(np.float32)
+
+    def tri(self) -> np.ndarray:
+        """
+        Terrain Ruggedness Index (Riley et al. 1999): square root of the summed
+        squared elevation differences between a cell and its 8 neighbours
+
+        Returns:
+            np.ndarray: float32 TRI in elevation units
+        """
+        w = self.neighbourhood()
+        centre = w['e']
+        total = np.zeros_like(centre)
+        for name in NEIGHBOURS:
+            diff = w[name] - centre
+            total += diff * diff
+        tri = np.sqrt(total)
+        tri[self.nodata_mask] = np.nan
+        return tri.astype(np.float32)
+
+    def tpi(self) -> np.ndarray:
+        """
+        Topographic Position Index: cell elevation minus the mean of its 8
+        neighbours (positive on ridges, negative in valleys)
+
+        Returns:
+            np.ndarray: float32 TPI in elevation units
+        """
+        w = self.neighbourhood()
+        neighbour_sum = np.zeros_like(w['e'])
+        for name in NEIGHBOURS:
+            neighbour_sum += w[name]
+        tpi = w['e'] - neighbour_sum / len(NEIGHBOURS)
+        tpi[self.nodata_mask] = np.nan
+        return tpi.astype(np.float32)
+
+    def fused_derivatives(self) -> Dict[str, np.ndarray]:
+        """
+        Derive every metric from a single 3x3 neighbourhood pass
+
+        The neighbourhood and the gradient are built once and shared, so each
+        extra metric costs a few array operations instead of another raster
+        read and write.
+
+        Returns:
+            dict: Metric name -> float32 array ('slope', 'aspect',
+            'profile_curvature', 'plan_curvature', 'tri', 'tpi')
+        """
+        profile, plan = self.curvature()
+        return {
+            'slope': self.slope(),
+            'aspect': self.aspect(),
+            'profile_curvature': profile,
+            'plan_curvature': plan,
+            'tri': self.tri(),
+            'tpi': self.tpi()
+        }
+
+    def write(self, array: np.ndarray, output_file_path: str) -> str:
+        """
+        Write a single-band derivative as a float32 GeoTIFF
+
+        Args:
+            array: 2D array with the shape of the DEM
+            output_file_path: Destination path
+
+        Returns:
+            str: The output path
+        """
+        profile = dict(self.profile or {})
+        profile.update({
+            'driver': 'GTiff',
+            'height': array.shape[0],
+            'width': array.shape[1],
+            'count': 1,
+            'dtype': 'float32',
+            'nodata': np.nan,
+            'transform': self.transform,
+            'crs': self.crs,
+            'compress': 'lzw'
+        })
+        with rasterio.open(output_file_path, 'w', **profile) as dst:
+            dst.write(array.astype(np.float32), 1)
+        logger.info(f"Wrote terrain derivative: {output_file_path}")
+        return output_file_path
+
@@ -4,104 +4,30 @@ This can be integrated into the current service without async complexity
 """
 import logging
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from services.terrain import (
-    calculate_slopes, calculate_aspect, calculate_geomorphons,
-    calculate_hypsometrically_tinted_hillshade, calculate_drainage_network,
-    generate_contours
-)
+from services.pipeline import run_terrain_pipeline
 
 logger = logging.getLogger(__name__)
 
-def process_terrain_parallel(srtm_path, output_dir, polygon_id):
+def process_terrain_parallel(srtm_path, output_dir, polygon_id, precomputed=None):
     """
-    Process all terrain operations in parallel for immediate 3x speed improvement
+    Process all terrain operations through the dependency-aware pipeline
     
     Args:
         srtm_path: Path to the clipped SRTM file
         output_dir: Directory to save results
         polygon_id: Polygon identifier for logging
+        precomputed: Optional output name -> path of outputs already written
         
     Returns:
         dict: Results of all terrain operations
     """
     try:
-        # Ensure output directory exists
-        os.makedirs(output_dir, exist_ok=True)
-        
-        logger.info(f"Starting parallel terrain processing for polygon {polygon_id}")
-        
-        # Define all terrain operations to run in parallel
-        operations = {
-            'slope': {
-                'function': calculate_slopes,
-                'args': (srtm_path, f"{output_dir}/slope.tif"),
-                'description': 'Slope calculation'
-            },
-            'aspect': {
-                'function': calculate_aspect,
-                'args': (srtm_path, f"{output_dir}/aspect.tif"),
-                'description': 'Aspect calculation'
-            },
-            'geomorphons': {
-                'function': calculate_geomorphons,
-                'args': (srtm_path, f"{output_dir}/geomorphons.tif"),
-                'description': 'Geomorphons analysis'
-            },
-            'hillshade': {
-                'function': calculate_hypsometrically_tinted_hillshade,
-                'args': (srtm_path, f"{output_dir}/hillshade.tif"),
-                'description': 'Hillshade generation'
-            },
-            'drainage': {
-                'function': calculate_drainage_network,
-                'args': (srtm_path, f"{output_dir}/drainage.tif"),
-                'description': 'Drainage network analysis'
-            },
-            'contours': {
-                'function': generate_contours,
-                'args': (srtm_path, f"{output_dir}/contours.geojson", 10),
-                'description': 'Contour generation'
-            }
-        }
-        
-        # Execute all operations in parallel
-        results = {}
-        completed_count = 0
-        total_operations = len(operations)
-        
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            # Submit all tasks
-            future_to_operation = {}
-            for name, operation in operations.items():
-                future = executor.submit(operation['function'], *operation['args'])
-                future_to_operation[future] = name
-            
-            # Process completed tasks
-            for future in as_completed(future_to_operation):
-                operation_name = future_to_operation[future]
-                completed_count += 1
-                
-                try:
-                    success = future.result(timeout=300)  # 5-minute timeout per operation
-                    results[operation_name] = {
-                        'success': success,
-                        'path': f"{output_dir}/{operation_name}.{'tif' if operation_name != 'contours' else 'geojson'}",
-                        'status': 'completed'
-                    }
-                    logger.info(f"✅ {operations[operation_name]['description']} completed ({completed_count}/{total_operations})")
-                    
-                except Exception as e:
-                    logger.error(f"❌ {operations[operation_name]['description']} failed: {str(e)}")
-                    results[operation_name] = {
-                        'success': False,
-                        'error': str(e),
-                        'status': 'failed'
-                    }
+        results = run_terrain_pipeline(srtm_path, output_dir, polygon_id, contour_interval=10,
+                                       precomputed=precomputed)
         
         # Log summary
         successful_operations = sum(1 for r in results.values() if r.get('success', False))
-        logger.info(f"Parallel processing completed: {successful_operations}/{total_operations} operations successful")
+        logger.info(f"Parallel processing completed: {successful_operations}/{len(results)} outputs successful")
         
         return results
         
@@ -24,6 +24,10 @@ import geopandas as gpd
 from shapely.geometry import shape
 import numpy as np
 
+from services.instrumentation import instrumented
+from utils.metrics import upstream_call
+from utils.locks import fill_cache_once
+
 logger = logging.getLogger(__name__)
 
 class USGSDEMProcessor:
@@ -178,13 +182,6 @@ class USGSDEMProcessor:
             cache_filename = f"usgs_3dep_{bbox_key}_{size_pixels}.tif"
             local_path = os.path.join(self.cache_directory, cache_filename)
             
-            # Check if file exists and is recent (30 days for USGS data)
-            if os.path.exists(local_path):
-                file_age = time.time() - os.path.getmtime(local_path)
-                if file_age < 30 * 24 * 3600:  # 30 days
-                    logger.info(f"Using cached USGS 3DEP DEM: {local_path}")
-                    return local_path
-            
             # Build ArcGIS Image Server export request
             export_params = {
                 'bbox': f"{min_lon},{min_lat},{max_lon},{max_lat}",
@@ -198,49 +195,56 @@ class USGSDEMProcessor:
                 'f': 'image'
             }
             
-            logger.info(f"Requesting USGS 3DEP DEM from ArcGIS Image Server")
-            logger.info(f"Parameters: {export_params}")
-            
-            # Make request to ArcGIS Image Server
-            response = requests.get(self.export_url, params=export_params, timeout=300)
-            response.raise_for_status()
-            
-            # Check if we got a valid image response
-            content_type = response.headers.get('content-type', '')
-            if 'image' not in content_type and 'application/octet-stream' not in content_type:
-                logger.error(f"Unexpected content type: {content_type}")
-                logger.error(f"Response: {response.text[:500]}")
-                return None
-            
-            # Save to local file
-            with open(local_path, 'wb') as f:
-                f.write(response.content)
-            
-            logger.info(f"Downloaded USGS 3DEP DEM: {local_path} ({len(response.content)} bytes)")
-            
-            # ✅ VALIDATE the downloaded file
-            try:
-                with rasterio.open(local_path) as src:
-                    data = src.read(1)
-                    valid_pixels = np.sum(~np.isnan(data))
-                    total_pixels = data.size
-                    
-                    logger.info(f"✅ DEM validation:")
-                    logger.info(f"   Resolution: {src.res}")
-                    logger.info(f"   Shape: {src.shape}")
-                    logger.info(f"   Valid pixels: {valid_pixels}/{total_pixels} ({valid_pixels/total_pixels*100:.1f}%)")
-                    
-                    if valid_pixels == 0:
-                        logger.error("❌ Downloaded DEM has NO valid pixels!")
-                        return None
+            def fill(temp_path):
+                logger.info(f"Requesting USGS 3DEP DEM from ArcGIS Image Server")
+                logger.info(f"Parameters: {export_params}")
+                
+                # Make request to ArcGIS Image Server
+                with upstream_call('arcgis') as call:
+                    response = requests.get(self.export_url, params=export_params, timeout=300)
+                    call.status = response.status_code
+                response.raise_for_status()
+                
+                # Check if we got a valid image response
+                content_type = response.headers.get('content-type', '')
+                if 'image' not in content_type and 'application/octet-stream' not in content_type:
+                    logger.error(f"Unexpected content type: {content_type}")
+                    logger.error(f"Response: {response.text[:500]}")
+                    return False
+                
+                # Save to a temporary file, published to the cache only once validated
+                with open(temp_path, 'wb') as f:
+                    f.write(response.content)
+                
+                logger.info(f"Downloaded USGS 3DEP DEM: {local_path} ({len(response.content)} bytes)")
+                
+                # ✅ VALIDATE the downloaded file
+                try:
+                    with rasterio.open(temp_path) as src:
+                        data = src.read(1)
+                        valid_pixels = np.sum(~np.isnan(data))
+                        total_pixels = data.size
                         
-                    logger.info(f"   Elevation range: {np.nanmin(data):.2f} to {np.nanmax(data):.2f}m")
-                    
-            except Exception as e:
-                logger.error(f"Error validating downloaded DEM: {str(e)}")
-                return None
+                        logger.info(f"✅ DEM validation:")
+                        logger.info(f"   Resolution: {src.res}")
+                        logger.info(f"   Shape: {src.shape}")
+                        logger.info(f"   Valid pixels: {valid_pixels}/{total_pixels} ({valid_pixels/total_pixels*100:.1f}%)")
+                        
+                        if valid_pixels == 0:
+                            logger.error("❌ Downloaded DEM has NO valid pixels!")
+                            return False
+                            
+                        logger.info(f"   Elevation range: {np.nanmin(data):.2f} to {np.nanmax(data):.2f}m")
+                        
+                except Exception as e:
+                    logger.error(f"Error validating downloaded DEM: {str(e)}")
+                    return False
+                
+                return True
             
-            return local_path
+            # Cached DEMs are reused for 30 days; concurrent requests for the
+            # same bbox share one export
+            return fill_cache_once(local_path, fill, 'usgs', max_age=30 * 24 * 3600)
             
         except Exception as e:
             logger.error(f"Error downloading USGS 3DEP DEM: {str(e)}")
@@ -390,6 +394,7 @@ class USGSDEMProcessor:
 usgs_dem_processor = USGSDEMProcessor()
 
 
+@instrumented('prepare')
 def process_usgs_dem(polygon_geometry: Dict[str, Any], polygon_id: str) -> str:
     """
     Main function to process USGS 3DEP DEM using ArcGIS Image Server
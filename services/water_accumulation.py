@@ -43,7 +43,7 @@ def calculate_water_accumulation(dem_file_path, polygon_id=None):
     try:
         import rasterio
         import numpy as np
-        import matplotlib.pyplot as plt
+        from services.colormap import get_colormap
         
         # Create output directories
         output_dir = Path('/app/data')
@@ -188,22 +188,21 @@ def calculate_water_accumulation(dem_file_path, polygon_id=None):
             accumulation_data = src.read(1)
             bounds = src.bounds
             
-            # Create a logarithmic color scale for better visualization
-            accumulation_data = np.ma.masked_where(accumulation_data <= 0, accumulation_data)
+            # Mask cells without accumulation
+            valid_mask = accumulation_data > 0
             
-            # Visualize flow accumulation
-            plt.figure(figsize=(10, 10))
-            plt.imshow(accumulation_data, cmap='Blues')
-            plt.axis('off')
-            plt.tight_layout(pad=0)
-            
-            # Save to BytesIO
-            buf = io.BytesIO()
-            plt.savefig(buf, format='png', bbox_inches='tight', pad_inches=0, transparent=True)
-            plt.close()
+            # Visualize flow accumulation with the cached Blues lookup table
+            blues = get_colormap('blues')
+            if np.any(valid_mask):
+                vmin = float(accumulation_data[valid_mask].min())
+                vmax = float(accumulation_data[valid_mask].max())
+            else:
+                vmin, vmax = 0.0, 1.0
+            rgba = blues.apply(accumulation_data, valid_mask, vmin=vmin, vmax=vmax)
             
             # Convert to base64
-            buf.seek(0)
+            buf = io.BytesIO()
+            Image.fromarray(rgba).save(buf, format='PNG', optimize=True)
             img_str = base64.b64encode(buf.getvalue()).decode()
             logger.info("Created water accumulation visualization")
         
@@ -211,19 +210,12 @@ def calculate_water_accumulation(dem_file_path, polygon_id=None):
         with rasterio.open(streams_path) as src:
             streams_data = src.read(1)
             
-            # Visualize streams
-            plt.figure(figsize=(10, 10))
-            plt.imshow(streams_data > 0, cmap='Blues')
-            plt.axis('off')
-            plt.tight_layout(pad=0)
-            
-            # Save to BytesIO
-            stream_buf = io.BytesIO()
-            plt.savefig(stream_buf, format='png', bbox_inches='tight', pad_inches=0, transparent=True)
-            plt.close()
+            # Visualize streams (stream cells dark blue on the lightest Blues shade)
+            stream_rgba = blues.apply((streams_data > 0).astype(np.float32), vmin=0.0, vmax=1.0)
             
             # Convert to base64
-            stream_buf.seek(0)
+            stream_buf = io.BytesIO()
+            Image.fromarray(stream_rgba).save(stream_buf, format='PNG', optimize=True)
             stream_img_str = base64.b64encode(stream_buf.getvalue()).decode()
             logger.info("Created stream network visualization")
         
@@ -9,6 +9,8 @@ from datetime import datetime
 from shapely.geometry import shape
 from pyproj import Geod
 
+from utils.metrics import upstream_call
+
 logger = logging.getLogger(__name__)
 
 
@@ -215,7 +217,9 @@ class WaterHarvestingService:
                 "timezone": "auto"
             }
             
-            response = requests.get(url, params=params, timeout=15)
+            with upstream_call('open-meteo') as call:
+                response = requests.get(url, params=params, timeout=15)
+                call.status = response.status_code
             response.raise_for_status()
             data = response.json()
             
@@ -252,7 +256,9 @@ class WaterHarvestingService:
                 "format": "JSON"
             }
             
-            response = requests.get(url, params=params, timeout=15)
+            with upstream_call('nasa-power') as call:
+                response = requests.get(url, params=params, timeout=15)
+                call.status = response.status_code
             response.raise_for_status()
             data = response.json()
             
@@ -344,7 +350,9 @@ class WaterHarvestingService:
                     "value": "mean"
                 }
                 
-                response = requests.get(url, params=params, timeout=15)
+                with upstream_call('soilgrids') as call:
+                    response = requests.get(url, params=params, timeout=15)
+                    call.status = response.status_code
                 
                 if response.status_code != 200:
                     continue
@@ -403,7 +411,9 @@ class WaterHarvestingService:
                 "number_classes": 1  # Just get the most probable class
             }
             
-            response = requests.get(url, params=params, timeout=15)
+            with upstream_call('soilgrids') as call:
+                response = requests.get(url, params=params, timeout=15)
+                call.status = response.status_code
             response.raise_for_status()
             
             data = response.json()
@@ -0,0 +1,257 @@
+"""
+Watershed delineation on the cached D8 flow pointer
+
+The D8 pointer and flow accumulation come from the hydrology cache and are
+held in memory per DEM hash, so delineating a catchment only costs an
+upstream walk over the pointer grid plus polygonising the result. The walk
+is a vectorized breadth-first search: each step finds, for the whole current
+frontier at once, the neighbours whose pointer flows into it.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+import rasterio
+
+from services.hydrology import get_hydrology_products, D8_POINTER, FLOW_ACCUMULATION
+from services.terrain_engine import METERS_PER_DEGREE
+
+logger = logging.getLogger(__name__)
+
+# WhiteboxTools D8 pointer codes -> (row offset, col offset) of the receiving cell
+#   64 128   1
+#   32   0   2
+#   16   8   4
+D8_DIRECTIONS = {
+    1: (-1, 1),
+    2: (0, 1),
+    4: (1, 1),
+    8: (1, 0),
+    16: (1, -1),
+    32: (0, -1),
+    64: (-1, -1),
+    128: (-1, 0)
+}
+
+# Default search radius (cells) for snapping a pour point to the stream
+DEFAULT_SNAP_CELLS = 3
+
+# Flow grids kept in memory per worker
+MAX_CACHED_GRIDS = 4
+
+_grids = OrderedDict()
+_grids_lock = threading.Lock()
+
+
+class FlowGrid:
+    """D8 pointer and flow accumulation of one DEM, ready for upstream walks"""
+
+    def __init__(self, pointer: np.ndarray, accumulation: np.ndarray, transform, crs):
+        """
+        Args:
+            pointer: WhiteboxTools D8 pointer codes (0 = no outflow)
+            accumulation: D8 flow accumulation in cells
+            transform: Affine geotransform of both rasters
+            crs: Raster CRS
+        """
+        self.shape = pointer.shape
+        self.transform = transform
+        self.crs = crs
+        self.accumulation = accumulation
+
+        # Pad by one cell so neighbour offsets never leave the array
+        self.padded_cols = self.shape[1] + 2
+        self.pointer = np.pad(pointer.astype(np.uint8), 1, mode='constant', constant_values=0).ravel()
+
+        # For each neighbour offset: the flat index step to it and the pointer
+        # code that neighbour must hold to drain into the centre cell
+        self.upstream_steps = [
+            (-dr * self.padded_cols - dc, np.uint8(code))
+            for code, (dr, dc) in D8_DIRECTIONS.items()
+        ]
+
+    def upstream_mask(self, row: int, col: int) -> np.ndarray:
+        """
+        Find every cell draining through (row, col)
+
+        Args:
+            row: Outlet row
+            col: Outlet column
+
+        Returns:
+            np.ndarray: Boolean catchment mask with the raster's shape
+        """
+        visited = np.zeros(self.pointer.shape, dtype=bool)
+        frontier = np.array([(row + 1) * self.padded_cols + (col + 1)], dtype=np.intp)
+        visited[frontier] = True
+
+        while frontier.size:
+            inflows = []
+            for step, code in self.upstream_steps:
+                neighbours = frontier + step
+                draining = neighbours[(self.pointer[neighbours] == code) & ~visited[neighbours]]
+                if draining.size:
+                    inflows.append(draining)
+            if not inflows:
+                break
+            frontier = np.unique(np.concatenate(inflows))
+            visited[frontier] = True
+
+        return visited.reshape(self.shape[0] + 2, self.padded_cols)[1:-1, 1:-1]
+
+    def cell_areas(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Cell area in square metres for the given rows
+
+        Args:
+            rows: Row indices
+
+        Returns:
+            np.ndarray: Area of one cell in each row
+        """
+        res_x = abs(self.transform.a)
+        res_y = abs(self.transform.e)
+        if self.crs is not None and self.crs.is_geographic:
+            row_lat = self.transform.f + (rows + 0.5) * self.transform.e
+            return (res_x * METERS_PER_DEGREE * np.cos(np.radians(row_lat))) * (res_y * METERS_PER_DEGREE)
+        return np.full(rows.shape, res_x * res_y)
+
+    def snap(self, row: int, col: int, radius: int) -> Tuple[int, int]:
+        """
+        Move a pour point to the highest flow accumulation cell nearby
+
+        Args:
+            row: Requested row
+            col: Requested column
+            radius: Search radius in cells (0 disables snapping)
+
+        Returns:
+            tuple: (row, col) of the snapped outlet
+        """
+        if radius <= 0:
+            return row, col
+        r0, r1 = max(row - radius, 0), min(row + radius + 1, self.shape[0])
+        c0, c1 = max(col - radius, 0), min(col + radius + 1, self.shape[1])
+        window = np.nan_to_num(self.accumulation[r0:r1, c0:c1], nan=-1.0)
+        best_row, best_col = np.unravel_index(np.argmax(window), window.shape)
+        return r0 + int(best_row), c0 + int(best_col)
+
+
+def get_flow_grid(dem_path: str) -> Optional[FlowGrid]:
+    """
+    Load the cached D8 pointer and accumulation of a DEM (memoized per hash)
+
+    Args:
+        dem_path: Path to the DEM file
+
+    Returns:
+        FlowGrid: In-memory flow grid, or None if hydrology is unavailable
+    """
+    products = get_hydrology_products(dem_path)
+    if not products:
+        return None
+
+    key = products['dem_hash']
+    with _grids_lock:
+        if key in _grids:
+            _grids.move_to_end(key)
+            return _grids[key]
+
+    with rasterio.open(products[D8_POINTER]) as src:
+        pointer = src.read(1)
+        if src.nodata is not None:
+            pointer = np.where(pointer == src.nodata, 0, pointer)
+        transform, crs = src.transform, src.crs
+    with rasterio.open(products[FLOW_ACCUMULATION]) as src:
+        accumulation = src.read(1).astype(np.float64)
+        if src.nodata is not None:
+            accumulation[accumulation == src.nodata] = np.nan
+
+    grid = FlowGrid(pointer, accumulation, transform, crs)
+    with _grids_lock:
+        _grids[key] = grid
+        while len(_grids) > MAX_CACHED_GRIDS:
+            _grids.popitem(last=False)
+    return grid
+
+
+def delineate_watershed(dem_path: str, lon: float, lat: float,
+                        snap_cells: int = DEFAULT_SNAP_CELLS) -> Optional[Dict[str, Any]]:
+    """
+    Delineate the upslope catchment of a pour point
+
+    Args:
+        dem_path: Path to the DEM file
+        lon: Pour point longitude (WGS84)
+        lat: Pour point latitude (WGS84)
+        snap_cells: Radius in cells to snap the point to the highest flow
+            accumulation (0 uses the point as given)
+
+    Returns:
+        dict: GeoJSON Feature of the catchment (WGS84) with area and outlet
+        details, or None if the point is outside the DEM or hydrology failed
+    """
+    from rasterio.features import shapes
+    from rasterio.transform import rowcol, xy
+    from rasterio.warp import transform as transform_coords, transform_geom
+    from shapely.geometry import shape, mapping
+    from shapely.ops import unary_union
+
+    start_time = time.time()
+    grid = get_flow_grid(dem_path)
+    if grid is None:
+        return None
+
+    # Pour point into raster coordinates
+    x, y = lon, lat
+    if grid.crs is not None and not grid.crs.is_geographic:
+        xs, ys = transform_coords('EPSG:4326', grid.crs, [lon], [lat])
+        x, y = xs[0], ys[0]
+    row, col = rowcol(grid.transform, x, y)
+    if not (0 <= row < grid.shape[0] and 0 <= col < grid.shape[1]):
+        logger.warning(f"Pour point ({lon}, {lat}) is outside the DEM extent")
+        return None
+
+    row, col = grid.snap(row, col, snap_cells)
+    mask = grid.upstream_mask(row, col)
+
+    # Polygonise only the catchment's bounding window
+    rows, cols = np.nonzero(mask)
+    r0, r1, c0, c1 = rows.min(), rows.max() + 1, cols.min(), cols.max() + 1
+    window_mask = mask[r0:r1, c0:c1].astype(np.uint8)
+    window_transform = grid.transform * grid.transform.translation(c0, r0)
+    polygons = [shape(geometry) for geometry, _ in shapes(window_mask, mask=window_mask.astype(bool), transform=window_transform)]
+    geometry = mapping(unary_union(polygons))
+
+    outlet_x, outlet_y = xy(grid.transform, row, col)
+    if grid.crs is not None and not grid.crs.is_geographic:
+        geometry = transform_geom(grid.crs, 'EPSG:4326', geometry)
+        xs, ys = transform_coords(grid.crs, 'EPSG:4326', [outlet_x], [outlet_y])
+        outlet_x, outlet_y = xs[0], ys[0]
+
+    area_m2 = float(grid.cell_areas(rows).sum())
+    elapsed_ms = (time.time() - start_time) * 1000
+    logger.info(f"Delineated watershed of {rows.size} cells ({area_m2 / 10000:.2f} ha) in {elapsed_ms:.1f}ms")
+
+    return {
+        'type': 'Feature',
+        'geometry': geometry,
+        'properties': {
+            'area_m2': area_m2,
+            'area_hectares': area_m2 / 10000,
+            'area_km2': area_m2 / 1e6,
+            'cell_count': int(rows.size),
+            'pour_point': {'lon': lon, 'lat': lat},
+            'outlet': {
+                'lon': float(outlet_x),
+                'lat': float(outlet_y),
+                'row': int(row),
+                'col': int(col),
+                'flow_accumulation': float(np.nan_to_num(grid.accumulation[row, col]))
+            },
+            'elapsed_ms': round(elapsed_ms, 1)
+        }
+    }
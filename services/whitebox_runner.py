@@ -0,0 +1,239 @@
+"""
+WhiteboxTools runner pool
+
+Every WhiteboxTools invocation gets its own tool instance and a private
+temporary working directory, so concurrent jobs never race on a shared
+working directory. Invocations are admitted through a machine-wide budget of
+slots backed by lock files (shared by every gunicorn worker on the host),
+and each tool's thread count is capped so the total CPU use stays within the
+budget.
+
+Waiters inside a worker are served by priority lane, then first-in
+first-out, and bulk work may only take the first WBT_BULK_MAX_CONCURRENT
+slots, so interactive requests never queue behind a full analysis.
+
+When the current operation is cancelled, the running tool process is
+terminated (it is found by its private working directory) and the with
+block raises OperationCancelled.
+"""
+import os
+import time
+import heapq
+import signal
+import shutil
+import logging
+import tempfile
+import itertools
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from whitebox import WhiteboxTools
+
+from utils.config import WBT_MAX_CONCURRENT, WBT_THREADS_PER_TOOL, WBT_LOCK_DIR, WBT_BULK_MAX_CONCURRENT
+from utils.cancellation import current_token
+from utils.priority import INTERACTIVE, BULK, current_lane, lane_rank
+from utils.metrics import WBT_QUEUE_DEPTH, WBT_SLOTS_IN_USE, WBT_WAIT_SECONDS
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows: fall back to a per-process limit
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Seconds between attempts to grab a machine-wide slot
+SLOT_POLL_INTERVAL = 0.05
+
+# Held slot when running without fcntl (slots are then counted per process)
+_LOCAL_SLOT = object()
+
+
+class WhiteboxRunner:
+    """Admit WhiteboxTools invocations under a shared concurrency budget"""
+
+    def __init__(self, max_concurrent: int, threads_per_tool: int, lock_dir: str,
+                 lane_limits: Optional[Dict[str, int]] = None):
+        """
+        Args:
+            max_concurrent: Machine-wide number of simultaneous tool runs
+            threads_per_tool: Thread limit passed to each tool (--max_procs)
+            lock_dir: Directory holding the slot lock files and working dirs
+            lane_limits: Lane -> number of slots it may use (default: all)
+        """
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.threads_per_tool = max(1, int(threads_per_tool))
+        self.lock_dir = lock_dir
+        self.lane_limits = {lane: max(1, min(int(limit), self.max_concurrent))
+                            for lane, limit in (lane_limits or {}).items()}
+        self._waiters = []
+        self._waiters_cond = threading.Condition()
+        self._arrivals = itertools.count()
+        self._local_in_use = 0
+        os.makedirs(self.lock_dir, exist_ok=True)
+
+    def _try_slot(self, limit: int):
+        """
+        Try the first `limit` slots once
+
+        Slots are tried from the highest down, so interactive work prefers
+        the slots bulk work cannot take.
+
+        Returns:
+            The held slot (lock file or _LOCAL_SLOT), or None
+        """
+        if fcntl is None:
+            with self._waiters_cond:
+                if self._local_in_use < limit:
+                    self._local_in_use += 1
+                    return _LOCAL_SLOT
+            return None
+
+        for slot in reversed(range(limit)):
+            handle = open(os.path.join(self.lock_dir, f"slot-{slot}.lock"), 'a+')
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return handle
+            except BlockingIOError:
+                handle.close()
+        return None
+
+    def _acquire(self, lane: str):
+        """
+        Wait for a slot; this worker's waiters are served by lane priority,
+        then in arrival order
+
+        Args:
+            lane: Priority lane of the caller
+
+        Returns:
+            The held slot
+        """
+        limit = self.lane_limits.get(lane, self.max_concurrent)
+        entry = [lane_rank(lane), next(self._arrivals)]
+        with self._waiters_cond:
+            heapq.heappush(self._waiters, entry)
+        WBT_QUEUE_DEPTH.labels(lane).inc()
+
+        try:
+            while True:
+                # Only the first waiter polls; a higher-priority arrival takes over
+                with self._waiters_cond:
+                    while self._waiters[0] is not entry:
+                        self._waiters_cond.wait()
+                handle = self._try_slot(limit)
+                if handle is not None:
+                    return handle
+                time.sleep(SLOT_POLL_INTERVAL)
+        finally:
+            WBT_QUEUE_DEPTH.labels(lane).dec()
+            with self._waiters_cond:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._waiters_cond.notify_all()
+
+    def _release(self, handle):
+        """Give a slot back"""
+        if handle is _LOCAL_SLOT:
+            with self._waiters_cond:
+                self._local_in_use -= 1
+            return
+        fcntl.flock(handle, fcntl.LOCK_UN)
+        handle.close()
+
+    @staticmethod
+    def _terminate_tool(wbt, working_dir: str) -> int:
+        """
+        Stop the tool process started by an instance
+
+        WhiteboxTools checks cancel_op only when the tool prints a line, so the
+        process (run with --wd pointing at the instance's unique working
+        directory) is also terminated directly where /proc is available.
+
+        Returns:
+            int: Number of processes signalled
+        """
+        wbt.cancel_op = True
+        marker = working_dir.encode('utf-8')
+        signalled = 0
+        try:
+            pids = [int(entry) for entry in os.listdir('/proc') if entry.isdigit()]
+        except OSError:
+            return 0
+        for pid in pids:
+            try:
+                with open(f"/proc/{pid}/cmdline", 'rb') as f:
+                    if marker not in f.read():
+                        continue
+                os.kill(pid, signal.SIGTERM)
+                signalled += 1
+            except OSError:
+                continue
+        return signalled
+
+    @contextmanager
+    def tools(self, label: str = 'whitebox'):
+        """
+        Run WhiteboxTools inside a slot with an isolated instance
+
+        Args:
+            label: Name used in log messages
+
+        Yields:
+            WhiteboxTools: Fresh instance with a private working directory
+
+        Raises:
+            OperationCancelled: If the current operation is cancelled
+        """
+        token = current_token()
+        if token is not None:
+            token.raise_if_cancelled()
+
+        lane = current_lane()
+        wait_start = time.time()
+        handle = self._acquire(lane)
+        waited = time.time() - wait_start
+        WBT_WAIT_SECONDS.labels(lane).observe(waited)
+        WBT_SLOTS_IN_USE.labels(lane).inc()
+        if waited > 1:
+            logger.info(f"⏳ {label} ({lane}) waited {waited:.1f}s for a WhiteboxTools slot")
+
+        working_dir = tempfile.mkdtemp(prefix=f"{label}.", dir=self.lock_dir)
+        run_start = time.time()
+        unregister = None
+        try:
+            if token is not None:
+                # Cancelled while waiting for the slot
+                token.raise_if_cancelled()
+            wbt = WhiteboxTools()
+            wbt.verbose = False
+            wbt.set_working_dir(working_dir)
+            wbt.set_max_procs(self.threads_per_tool)
+            if token is not None:
+                unregister = token.on_cancel(lambda: self._terminate_tool(wbt, working_dir))
+            yield wbt
+            if token is not None:
+                token.raise_if_cancelled()
+        finally:
+            if unregister is not None:
+                unregister()
+            shutil.rmtree(working_dir, ignore_errors=True)
+            self._release(handle)
+            WBT_SLOTS_IN_USE.labels(lane).dec()
+            logger.debug(f"{label} held a WhiteboxTools slot for {time.time() - run_start:.1f}s")
+
+
+# Shared runner for this worker; the slot budget is shared machine-wide
+whitebox_runner = WhiteboxRunner(WBT_MAX_CONCURRENT, WBT_THREADS_PER_TOOL, WBT_LOCK_DIR,
+                                 {INTERACTIVE: WBT_MAX_CONCURRENT, BULK: WBT_BULK_MAX_CONCURRENT})
+
+
+def whitebox_tools(label: str = 'whitebox'):
+    """
+    Context manager yielding an isolated WhiteboxTools instance within the
+    machine-wide concurrency budget
+
+    Args:
+        label: Name used in log messages (usually the tool name)
+    """
+    return whitebox_runner.tools(label)
@@ -0,0 +1,44 @@
+"""
+Batch clustering tests
+"""
+import pytest
+
+pytest.importorskip('shapely')
+pytest.importorskip('rasterio')
+
+from services.batch_processor import cluster_features
+
+
+def square(west, south, size=0.01):
+    """GeoJSON Feature of a square polygon"""
+    east, north = west + size, south + size
+    return {
+        'type': 'Feature',
+        'geometry': {
+            'type': 'Polygon',
+            'coordinates': [[[west, south], [east, south], [east, north], [west, north], [west, south]]]
+        }
+    }
+
+
+def test_nearby_features_share_a_cluster():
+    features = [square(0, 0), square(0.02, 0), square(1, 1)]
+    assert cluster_features(features, gap=0.05, max_extent=0.5) == [[0, 1], [2]]
+
+
+def test_chain_of_features_is_split_at_the_extent_cap():
+    # 100 squares 0.02° apart form one chain 2° long
+    features = [square(0.02 * i, 0) for i in range(100)]
+    clusters = cluster_features(features, gap=0.05, max_extent=0.5)
+
+    assert sorted(index for cluster in clusters for index in cluster) == list(range(100))
+    assert len(clusters) >= 4
+    for cluster in clusters:
+        west = min(0.02 * i for i in cluster)
+        east = max(0.02 * i + 0.01 for i in cluster)
+        assert east - west <= 0.5
+
+
+def test_feature_larger_than_the_cap_is_its_own_cluster():
+    features = [square(0, 0, size=1), square(1.01, 0)]
+    assert cluster_features(features, gap=0.05, max_extent=0.5) == [[0], [1]]
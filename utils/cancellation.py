@@ -0,0 +1,336 @@
+"""
+Cooperative cancellation and time budgets
+
+Long-running work (a queued job or a synchronous request) runs inside a
+cancellation scope. Its CancellationToken travels in a context variable, so
+it follows the work into pipeline threads; long operations call
+raise_if_cancelled() between steps, and subprocess runners register a
+callback that kills their process as soon as the token is cancelled.
+
+A watchdog thread cancels tokens whose time budget ran out, and picks up
+cancellation markers written by cancel() in any worker on this host (the
+files live under LOCK_DIR next to the other cross-worker locks).
+"""
+import os
+import time
+import hashlib
+import logging
+import subprocess
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional
+
+from utils.config import LOCK_DIR
+
+logger = logging.getLogger(__name__)
+
+CANCEL_DIR = os.path.join(LOCK_DIR, 'cancellation')
+
+# Seconds between watchdog checks of budgets and cancellation markers
+WATCH_INTERVAL = 0.5
+
+# Markers nobody picked up are removed after this long
+STALE_MARKER_SECONDS = 3600
+
+
+class OperationCancelled(Exception):
+    """Raised when the running job or request has been cancelled"""
+
+
+class TimeBudgetExceeded(OperationCancelled):
+    """Raised when the running job or request ran past its time budget"""
+
+
+class CancellationToken:
+    """Cancellation state of one job or request"""
+
+    def __init__(self, name: str, time_budget: Optional[float] = None):
+        """
+        Args:
+            name: Identifier used to cancel the operation (job or task id)
+            time_budget: Seconds the operation may run (None for no limit)
+        """
+        self.name = name
+        self.time_budget = time_budget
+        self.started_at = time.time()
+        self.deadline = self.started_at + time_budget if time_budget else None
+        self.reason: Optional[str] = None
+        self.timed_out = False
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: Dict[int, Callable[[], None]] = {}
+        self._next_callback = 0
+        self._outputs: List[str] = []
+
+    @property
+    def cancelled(self) -> bool:
+        """True once the operation has been cancelled"""
+        return self._event.is_set()
+
+    def cancel(self, reason: str = 'Cancelled', timed_out: bool = False) -> bool:
+        """
+        Cancel the operation and run the registered kill callbacks
+
+        Args:
+            reason: Message reported for the cancellation
+            timed_out: True when the time budget ran out
+
+        Returns:
+            bool: False if it was already cancelled
+        """
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self.timed_out = timed_out
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+
+        logger.warning(f"🛑 Cancelling {self.name}: {reason}")
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Cancellation callback failed for {self.name}: {str(e)}")
+        return True
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        Register a callback run when the token is cancelled (at once if it
+        already is)
+
+        Returns:
+            callable: Function removing the callback again
+        """
+        with self._lock:
+            if not self._event.is_set():
+                callback_id = self._next_callback
+                self._next_callback += 1
+                self._callbacks[callback_id] = callback
+                return lambda: self._callbacks.pop(callback_id, None)
+        callback()
+        return lambda: None
+
+    def raise_if_cancelled(self) -> None:
+        """
+        Raises:
+            TimeBudgetExceeded: If the time budget ran out
+            OperationCancelled: If the operation was cancelled
+        """
+        if self._event.is_set():
+            raise (TimeBudgetExceeded if self.timed_out else OperationCancelled)(self.reason)
+
+    def track_output(self, path: str) -> None:
+        """Remember a file this operation writes, for discard_outputs()"""
+        with self._lock:
+            self._outputs.append(path)
+
+    def discard_outputs(self) -> int:
+        """
+        Delete the files written by the operation (after it was cancelled)
+
+        Returns:
+            int: Number of files removed
+        """
+        with self._lock:
+            outputs, self._outputs = self._outputs, []
+        removed = 0
+        for path in outputs:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+
+_current_token: ContextVar[Optional[CancellationToken]] = ContextVar('cancellation_token', default=None)
+
+# Tokens of the operations running in this process, by name (a request
+# waiting for an identical run shares that run's name)
+_active: Dict[str, List[CancellationToken]] = {}
+_active_lock = threading.Lock()
+_watchdog_started = False
+
+
+def _marker_path(name: str, kind: str) -> str:
+    """Path of the 'active' or 'cancel' marker of an operation"""
+    digest = hashlib.sha256(name.encode('utf-8')).hexdigest()[:40]
+    return os.path.join(CANCEL_DIR, f"{digest}.{kind}")
+
+
+def _remove(path: str) -> None:
+    """Delete a file if it exists"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+@contextmanager
+def cancellation_scope(name: str, time_budget: Optional[float] = None):
+    """
+    Run the enclosed work as a cancellable operation
+
+    Args:
+        name: Identifier passed to cancel() to stop the operation
+        time_budget: Seconds after which the operation is cancelled (None for no limit)
+
+    Yields:
+        CancellationToken: The operation's token, also returned by current_token()
+    """
+    token = CancellationToken(name, time_budget)
+    with _active_lock:
+        _active.setdefault(name, []).append(token)
+    try:
+        os.makedirs(CANCEL_DIR, exist_ok=True)
+        open(_marker_path(name, 'active'), 'w').close()
+    except OSError as e:
+        logger.warning(f"Could not publish operation {name}: {str(e)}")
+    _start_watchdog()
+
+    context_token = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(context_token)
+        with _active_lock:
+            tokens = _active.get(name, [])
+            if token in tokens:
+                tokens.remove(token)
+            last = not tokens
+            if last:
+                _active.pop(name, None)
+        if last:
+            _remove(_marker_path(name, 'active'))
+            _remove(_marker_path(name, 'cancel'))
+
+
+def current_token() -> Optional[CancellationToken]:
+    """Token of the operation running in this context, if any"""
+    return _current_token.get()
+
+
+def raise_if_cancelled() -> None:
+    """Raise OperationCancelled if the current operation has been cancelled"""
+    token = _current_token.get()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+def track_output(*paths: str) -> None:
+    """Register files written by the current operation, removed if it is cancelled"""
+    token = _current_token.get()
+    if token is not None:
+        for path in paths:
+            if path:
+                token.track_output(path)
+
+
+def cancel(name: str, reason: str = 'Cancelled by user') -> bool:
+    """
+    Cancel a running operation in any worker on this host
+
+    Args:
+        name: Operation identifier
+        reason: Message reported for the cancellation
+
+    Returns:
+        bool: True if the operation is running on this host
+    """
+    with _active_lock:
+        tokens = list(_active.get(name, []))
+    if tokens:
+        for token in tokens:
+            token.cancel(reason)
+        return True
+
+    if not os.path.exists(_marker_path(name, 'active')):
+        return False
+    try:
+        with open(_marker_path(name, 'cancel'), 'w') as f:
+            f.write(reason)
+    except OSError as e:
+        logger.warning(f"Could not request cancellation of {name}: {str(e)}")
+        return False
+    return True
+
+
+def run_subprocess(cmd: List[str], check: bool = False, capture_output: bool = False,
+                   text: bool = False) -> subprocess.CompletedProcess:
+    """
+    subprocess.run() that kills the process when the current operation is cancelled
+
+    Raises:
+        OperationCancelled: If the operation was cancelled while the process ran
+        subprocess.CalledProcessError: If check is set and the process failed
+    """
+    raise_if_cancelled()
+    pipe = subprocess.PIPE if capture_output else None
+    process = subprocess.Popen(cmd, stdout=pipe, stderr=pipe, text=text)
+
+    token = _current_token.get()
+    unregister = token.on_cancel(process.kill) if token is not None else None
+    try:
+        stdout, stderr = process.communicate()
+    finally:
+        if unregister is not None:
+            unregister()
+
+    raise_if_cancelled()
+    if check and process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stdout, stderr)
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+
+def _start_watchdog() -> None:
+    """Start the watchdog thread of this process (idempotent)"""
+    global _watchdog_started
+    with _active_lock:
+        if _watchdog_started:
+            return
+        _watchdog_started = True
+    threading.Thread(target=_watch_loop, name='cancellation-watchdog', daemon=True).start()
+
+
+def _watch_loop() -> None:
+    """Enforce time budgets and pick up cancellation markers"""
+    last_sweep = 0.0
+    while True:
+        time.sleep(WATCH_INTERVAL)
+        now = time.time()
+        with _active_lock:
+            tokens = [token for named in _active.values() for token in named]
+
+        for token in tokens:
+            if token.cancelled:
+                continue
+            if token.deadline is not None and now >= token.deadline:
+                token.cancel(f"Time budget of {token.time_budget:g}s exceeded", timed_out=True)
+                continue
+            marker = _marker_path(token.name, 'cancel')
+            try:
+                if os.path.getmtime(marker) >= token.started_at:
+                    with open(marker, 'r') as f:
+                        token.cancel(f.read() or 'Cancelled')
+            except OSError:
+                pass
+
+        if now - last_sweep > STALE_MARKER_SECONDS:
+            last_sweep = now
+            _sweep_stale_markers(now)
+
+
+def _sweep_stale_markers(now: float) -> None:
+    """Remove markers left behind by operations that ended without cleanup"""
+    try:
+        with os.scandir(CANCEL_DIR) as it:
+            for entry in it:
+                try:
+                    if now - entry.stat().st_mtime > STALE_MARKER_SECONDS and entry.name.endswith('.cancel'):
+                        _remove(entry.path)
+                except OSError:
+                    pass
+    except OSError:
+        pass
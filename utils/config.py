@@ -3,6 +3,7 @@ Configuration settings for the Earthbenders application
 """
 import os
 import logging
+import tempfile
 from pathlib import Path
 
 # Configure logging
@@ -53,4 +54,129 @@ logger.info(f"Server port set to: {PORT}")
 
 # Debug mode
 DEBUG = os.environ.get('DEBUG', 'true').lower() == 'true'
-logger.info(f"Debug mode: {DEBUG}") 
\ No newline at end of file
+logger.info(f"Debug mode: {DEBUG}") 
+
+# Terrain derivative engine: 'numpy' computes slope/aspect in-process,
+# 'whitebox' keeps the original WhiteboxTools subprocess per layer
+TERRAIN_ENGINE = os.environ.get('TERRAIN_ENGINE', 'numpy').lower()
+logger.info(f"Terrain engine: {TERRAIN_ENGINE}")
+
+# Raster preview rendering: 1 encodes at native resolution and leaves smoothing
+# to the map client; 4 keeps the original 4x nearest-neighbour upscale.
+# Formats: 'png' or 'webp' (lossless). RENDER_COMPRESSION is the PNG zlib
+# level (0-9) or the WebP method (0-6); empty keeps the encoder defaults.
+RENDER_SCALE = int(os.environ.get('RENDER_SCALE', 4))
+RENDER_FORMAT = os.environ.get('RENDER_FORMAT', 'png').lower()
+RENDER_COMPRESSION = os.environ.get('RENDER_COMPRESSION') or None
+logger.info(f"Render defaults: scale={RENDER_SCALE}, format={RENDER_FORMAT}, compression={RENDER_COMPRESSION}")
+
+# Contours are traced once per DEM at a base interval (metres); any multiple of
+# it is served by filtering the stored lines instead of contouring again. Each
+# DEM source sets its own base in config/dem_sources.py (1m for LiDAR); this one
+# applies when the source of a DEM cannot be determined
+CONTOUR_BASE_INTERVAL = float(os.environ.get('CONTOUR_BASE_INTERVAL', 10))
+logger.info(f"Contour base interval: {CONTOUR_BASE_INTERVAL}m")
+
+# WhiteboxTools runner: machine-wide number of concurrent tool runs (shared by
+# all gunicorn workers through lock files in WBT_LOCK_DIR) and threads per run
+WBT_THREADS_PER_TOOL = int(os.environ.get('WBT_THREADS_PER_TOOL', 2))
+WBT_MAX_CONCURRENT = int(os.environ.get('WBT_MAX_CONCURRENT', max(1, (os.cpu_count() or 1) // WBT_THREADS_PER_TOOL)))
+WBT_LOCK_DIR = os.environ.get('WBT_LOCK_DIR', os.path.join(tempfile.gettempdir(), 'whitebox_runner'))
+# Bulk work may hold at most WBT_BULK_MAX_CONCURRENT of the slots; the rest are
+# kept free for interactive requests
+WBT_BULK_MAX_CONCURRENT = int(os.environ.get('WBT_BULK_MAX_CONCURRENT', max(1, WBT_MAX_CONCURRENT - 1)))
+logger.info(f"WhiteboxTools runner: {WBT_MAX_CONCURRENT} slots x {WBT_THREADS_PER_TOOL} threads, "
+            f"{WBT_BULK_MAX_CONCURRENT} for bulk work ({WBT_LOCK_DIR})")
+
+# Derivative cache: slope/aspect/hillshade/geomorphons outputs keyed by DEM hash
+# and parameters, trimmed least recently used first to this size
+DERIVATIVE_CACHE_MAX_MB = int(os.environ.get('DERIVATIVE_CACHE_MAX_MB', 2048))
+logger.info(f"Derivative cache quota: {DERIVATIVE_CACHE_MAX_MB}MB")
+
+# Hydrology cache: filled DEM, D8 pointer and flow accumulation per DEM hash,
+# trimmed least recently used first to this size
+HYDROLOGY_CACHE_MAX_MB = int(os.environ.get('HYDROLOGY_CACHE_MAX_MB', 4096))
+logger.info(f"Hydrology cache quota: {HYDROLOGY_CACHE_MAX_MB}MB")
+
+# Block-wise processing of large DEMs: rasters with at least BLOCK_MIN_PIXELS
+# cells are split into BLOCK_SIZE blocks (plus a halo) run on BLOCK_WORKERS processes
+BLOCK_SIZE = int(os.environ.get('BLOCK_SIZE', 1024))
+BLOCK_WORKERS = int(os.environ.get('BLOCK_WORKERS', os.cpu_count() or 1))
+BLOCK_MIN_PIXELS = int(os.environ.get('BLOCK_MIN_PIXELS', 4096 * 4096))
+logger.info(f"Block processing: {BLOCK_SIZE}px blocks on {BLOCK_WORKERS} workers for rasters >= {BLOCK_MIN_PIXELS} cells")
+
+# Persistent job queue: the Postgres database in DATABASE_URL when set, otherwise
+# a SQLite file. Each gunicorn worker runs JOB_EXECUTOR_SLOTS jobs of any lane
+# plus JOB_INTERACTIVE_SLOTS reserved for interactive jobs;
+# a running job whose heartbeat is older than JOB_LEASE_SECONDS is reclaimed.
+DATABASE_URL = os.environ.get('DATABASE_URL') or None
+JOB_QUEUE_PATH = os.environ.get('JOB_QUEUE_PATH', str(SAVE_DIRECTORY / 'jobs.sqlite3'))
+JOB_EXECUTOR_SLOTS = int(os.environ.get('JOB_EXECUTOR_SLOTS', 1))
+JOB_INTERACTIVE_SLOTS = int(os.environ.get('JOB_INTERACTIVE_SLOTS', 1))
+JOB_HEARTBEAT_SECONDS = float(os.environ.get('JOB_HEARTBEAT_SECONDS', 10))
+JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', 60))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+JOB_RETRY_BACKOFF_SECONDS = float(os.environ.get('JOB_RETRY_BACKOFF_SECONDS', 30))
+logger.info(f"Job queue: {'postgres' if DATABASE_URL else JOB_QUEUE_PATH}, {JOB_EXECUTOR_SLOTS}+{JOB_INTERACTIVE_SLOTS} slots per worker, "
+            f"lease {JOB_LEASE_SECONDS:g}s, {JOB_MAX_ATTEMPTS} attempts")
+
+# Cross-process locks (shared by all workers on the host) and how long a
+# coalesced result is handed to duplicate requests after it finished
+LOCK_DIR = os.environ.get('LOCK_DIR', str(SAVE_DIRECTORY / 'locks'))
+SINGLE_FLIGHT_RESULT_TTL = float(os.environ.get('SINGLE_FLIGHT_RESULT_TTL', 30))
+logger.info(f"Locks: {LOCK_DIR} (shared results kept {SINGLE_FLIGHT_RESULT_TTL:g}s)")
+
+# How long a request waits for another worker filling the same SRTM, LiDAR or
+# USGS cache file before it downloads the file itself
+CACHE_FILL_WAIT_SECONDS = float(os.environ.get('CACHE_FILL_WAIT_SECONDS', 900))
+logger.info(f"Cache fills: waiting up to {CACHE_FILL_WAIT_SECONDS:g}s for concurrent downloads")
+
+# Time budgets after which a running analysis is cancelled: per attempt of a
+# queued job, and for a synchronous /process_polygon request (keep that one
+# below the gunicorn timeout)
+JOB_TIME_BUDGET_SECONDS = float(os.environ.get('JOB_TIME_BUDGET_SECONDS', 1800))
+SYNC_TIME_BUDGET_SECONDS = float(os.environ.get('SYNC_TIME_BUDGET_SECONDS', 270))
+logger.info(f"Time budgets: {JOB_TIME_BUDGET_SECONDS:g}s per job attempt, {SYNC_TIME_BUDGET_SECONDS:g}s per synchronous request")
+
+# Each open /status/<task_id>/stream holds a request thread of its worker for
+# up to 4 minutes; streams beyond this many per worker get a 503
+STATUS_STREAM_MAX_CONCURRENT = int(os.environ.get('STATUS_STREAM_MAX_CONCURRENT', 3))
+logger.info(f"Status streams: up to {STATUS_STREAM_MAX_CONCURRENT} per worker")
+
+# Batch polygon analysis: features whose bounding boxes lie within
+# BATCH_CLUSTER_GAP_DEGREES of each other share one mosaic and one derivative
+# run, computed BATCH_MARGIN_CELLS beyond their union so edge cells have real
+# neighbours; BATCH_MAX_FEATURES caps one request. A cluster grows to at most
+# BATCH_MAX_CLUSTER_DEGREES wide and high (0.5° is 1800x1800 SRTM cells), so a
+# chain of nearby features is split instead of mosaicked into memory at once
+BATCH_CLUSTER_GAP_DEGREES = float(os.environ.get('BATCH_CLUSTER_GAP_DEGREES', 0.05))
+BATCH_MARGIN_CELLS = int(os.environ.get('BATCH_MARGIN_CELLS', 16))
+BATCH_MAX_FEATURES = int(os.environ.get('BATCH_MAX_FEATURES', 200))
+BATCH_MAX_CLUSTER_DEGREES = float(os.environ.get('BATCH_MAX_CLUSTER_DEGREES', 0.5))
+logger.info(f"Batch analysis: clusters within {BATCH_CLUSTER_GAP_DEGREES:g}° up to {BATCH_MAX_CLUSTER_DEGREES:g}° across, "
+            f"{BATCH_MARGIN_CELLS}-cell margin, up to {BATCH_MAX_FEATURES} features")
+
+# Prometheus metrics: gunicorn.conf.py points PROMETHEUS_MULTIPROC_DIR at a
+# directory shared by the workers so /metrics aggregates all of them; unset,
+# each process serves its own metrics
+METRICS_MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+logger.info(f"Metrics: {'multiprocess in ' + METRICS_MULTIPROC_DIR if METRICS_MULTIPROC_DIR else 'single process'}")
+
+# Opt-in request profiling: a request sent with 'X-Profile: 1' (or ?profile=1)
+# and PROFILE_ADMIN_TOKEN in the X-Admin-Token header is sampled every
+# PROFILE_INTERVAL_MS, together with the background jobs it queues, and the
+# profile is written to PROFILE_DIRECTORY/<profile id>. Without a token
+# profiling and the admin endpoints are disabled. Sampling of one request or
+# job stops after PROFILE_MAX_SECONDS; the newest PROFILE_MAX_COUNT profiles are kept.
+PROFILE_ADMIN_TOKEN = os.environ.get('PROFILE_ADMIN_TOKEN') or None
+PROFILE_DIRECTORY = os.environ.get('PROFILE_DIRECTORY', str(SAVE_DIRECTORY / 'profiles'))
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 1800))
+PROFILE_MAX_COUNT = int(os.environ.get('PROFILE_MAX_COUNT', 200))
+logger.info(f"Profiling: {'enabled' if PROFILE_ADMIN_TOKEN else 'disabled (no PROFILE_ADMIN_TOKEN)'}, "
+            f"{PROFILE_INTERVAL_MS:g}ms samples, {PROFILE_DIRECTORY}")
+
+# SRTM tiles missing from the cache are downloaded by up to
+# SRTM_DOWNLOAD_WORKERS threads at once (sharing one connection pool)
+SRTM_DOWNLOAD_WORKERS = int(os.environ.get('SRTM_DOWNLOAD_WORKERS', 4))
+logger.info(f"SRTM downloads: {SRTM_DOWNLOAD_WORKERS} concurrent")
@@ -3,11 +3,18 @@ File I/O utilities for handling GeoJSON, raster files, and other data
 """
 import os
 import json
+import hashlib
 import logging
+import threading
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
+# Content hashes memoized by path and (mtime, size) so unchanged files are
+# only hashed once per process
+_hash_cache = {}
+_hash_cache_lock = threading.Lock()
+
 def save_geojson(data, filename, directory, polygon_id=None):
     """
     Save GeoJSON data to a file
@@ -94,4 +101,35 @@ def get_most_recent_polygon(directory):
             return None
     except Exception as e:
         logger.exception(f"Error getting most recent polygon from {directory}")
-        return None 
\ No newline at end of file
+        return None 
+
+def file_sha256(file_path):
+    """
+    Get the SHA-256 content hash of a file
+    
+    Args:
+        file_path: The path to the file
+        
+    Returns:
+        str: Hex digest of the file content
+    """
+    abs_path = os.path.abspath(file_path)
+    stat = os.stat(abs_path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    
+    with _hash_cache_lock:
+        cached = _hash_cache.get(abs_path)
+        if cached and cached[0] == signature:
+            return cached[1]
+    
+    digest = hashlib.sha256()
+    with open(abs_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    content_hash = digest.hexdigest()
+    
+    with _hash_cache_lock:
+        _hash_cache[abs_path] = (signature, content_hash)
+    
+    logger.debug(f"Hashed {abs_path}: {content_hash}")
+    return content_hash
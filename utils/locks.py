@@ -0,0 +1,246 @@
+"""
+Cross-process locks and single-flight execution
+
+Locks are flock()ed files under LOCK_DIR, so they hold across every gunicorn
+worker on the host (and across threads, since each acquisition opens its own
+file description). Where fcntl is unavailable they fall back to per-process
+locks.
+
+fill_cache_once puts the same lock in front of a download cache: the first
+requester of a missing file fetches it, the others wait and read the result.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from contextlib import ExitStack, contextmanager
+from typing import Any, Callable, Optional
+
+from utils.config import LOCK_DIR, SINGLE_FLIGHT_RESULT_TTL, CACHE_FILL_WAIT_SECONDS
+from utils.cancellation import raise_if_cancelled
+from utils.metrics import record_cache
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows: fall back to per-process locks
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Per-process fallback locks by name (used when fcntl is unavailable)
+_process_locks = {}
+_process_locks_guard = threading.Lock()
+
+
+def _lock_name(key: str) -> str:
+    """File-system safe name of a lock key"""
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:40]
+
+
+@contextmanager
+def file_lock(key: str, timeout: Optional[float] = None, poll_interval: float = 0.1):
+    """
+    Hold an exclusive lock shared by all processes on this host
+
+    Args:
+        key: Lock name (any string)
+        timeout: Seconds to wait before raising TimeoutError (None waits forever)
+        poll_interval: Seconds between attempts while waiting with a timeout
+
+    Raises:
+        TimeoutError: If the lock was not acquired within the timeout
+    """
+    name = _lock_name(key)
+
+    if fcntl is None:
+        with _process_locks_guard:
+            lock = _process_locks.setdefault(name, threading.Lock())
+        if not lock.acquire(timeout=-1 if timeout is None else timeout):
+            raise TimeoutError(f"Timed out waiting for lock {key}")
+        try:
+            yield
+        finally:
+            lock.release()
+        return
+
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    handle = open(os.path.join(LOCK_DIR, f"{name}.lock"), 'a+')
+    try:
+        if timeout is None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        else:
+            deadline = time.time() + timeout
+            while True:
+                try:
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.time() >= deadline:
+                        raise TimeoutError(f"Timed out waiting for lock {key}")
+                    time.sleep(poll_interval)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+    finally:
+        handle.close()
+
+
+def _shared_result(result_path: str, result_ttl: float):
+    """
+    Result stored by a recent single_flight leader
+
+    Returns:
+        tuple: (True, value) if a result younger than result_ttl exists, else (False, None)
+    """
+    try:
+        if time.time() - os.path.getmtime(result_path) <= result_ttl:
+            with open(result_path, 'r') as f:
+                return True, json.load(f)
+    except (OSError, ValueError):
+        pass
+    return False, None
+
+
+def single_flight(key: str, func: Callable[[], Any], result_ttl: float = SINGLE_FLIGHT_RESULT_TTL,
+                  share_result: Optional[Callable[[Any], bool]] = None) -> Any:
+    """
+    Run func once for concurrent callers with the same key
+
+    The first caller runs func while holding the key's lock; callers arriving
+    meanwhile wait and receive its result, which is kept for result_ttl
+    seconds. If the first caller fails (raises or its result is not shared),
+    the next waiter runs func itself.
+
+    Waiters poll in short slices: they pick up the shared result as soon as
+    it is stored, and stop with OperationCancelled when the current
+    operation is cancelled or its time budget runs out, so the wait counts
+    towards the caller's budget.
+
+    Args:
+        key: Identity of the work
+        func: Work to run; its result must be JSON serializable
+        result_ttl: Seconds a finished result is handed to later callers
+        share_result: Optional predicate deciding whether a result may be shared
+
+    Returns:
+        The result of func (JSON round-tripped for callers that did not run it)
+
+    Raises:
+        OperationCancelled: If the caller was cancelled while waiting
+    """
+    result_path = os.path.join(LOCK_DIR, f"{_lock_name(key)}.result.json")
+    wait_start = time.time()
+
+    with ExitStack() as stack:
+        while True:
+            try:
+                stack.enter_context(file_lock(key, timeout=1.0))
+                break
+            except TimeoutError:
+                raise_if_cancelled()
+                # Results only count once this caller started waiting
+                if os.path.exists(result_path) and os.path.getmtime(result_path) >= wait_start:
+                    found, value = _shared_result(result_path, result_ttl)
+                    if found:
+                        logger.info(f"🔗 Coalesced duplicate request into in-flight result for {key}")
+                        return value
+
+        raise_if_cancelled()
+        found, value = _shared_result(result_path, result_ttl)
+        if found:
+            logger.info(f"🔗 Coalesced duplicate request into in-flight result for {key}")
+            return value
+
+        value = func()
+
+        if share_result is None or share_result(value):
+            try:
+                os.makedirs(LOCK_DIR, exist_ok=True)
+                fd, temp_path = tempfile.mkstemp(prefix='.result.', dir=LOCK_DIR)
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(value, f, default=str)
+                os.replace(temp_path, result_path)
+            except Exception as e:
+                logger.warning(f"Failed to store shared result for {key}: {str(e)}")
+        return value
+
+
+def _is_fresh(path: str, max_age: Optional[float]) -> bool:
+    """Whether a cache file exists and is younger than max_age seconds"""
+    try:
+        age = time.time() - os.path.getmtime(path)
+    except OSError:
+        return False
+    return max_age is None or age < max_age
+
+
+def fill_cache_once(path: str, fill: Callable[[str], bool], cache: str, max_age: Optional[float] = None,
+                    wait_seconds: float = CACHE_FILL_WAIT_SECONDS) -> Optional[str]:
+    """
+    Return a cache file, downloading it once for concurrent requesters
+
+    A missing or stale file is filled under a lock keyed by its path: the
+    first requester runs fill, every other thread or worker waits and then
+    uses the finished file. fill writes to a temporary path in the cache
+    directory that is renamed into place on success, so readers never see a
+    partial file. A waiter that gives up after wait_seconds fills the file
+    itself.
+
+    Args:
+        path: Cache file
+        fill: Writes the file to the temporary path it is given; returns True on success
+        cache: Cache name for the hit/miss metrics ('srtm', 'lidar', 'usgs')
+        max_age: Seconds after which a cached file is downloaded again (None keeps it forever)
+        wait_seconds: Seconds to wait for a concurrent fill of the same file
+
+    Returns:
+        str: path, or None if fill failed
+    """
+    if _is_fresh(path, max_age):
+        logger.info(f"♻️ Using cached {cache} file: {path}")
+        record_cache(cache, hit=True)
+        return path
+
+    key = f"cache_fill:{os.path.abspath(path)}"
+    deadline = time.time() + wait_seconds
+    with ExitStack() as stack:
+        # Wait in short slices so a cancelled request stops waiting and a file
+        # published by the current holder is picked up without the lock
+        while True:
+            try:
+                stack.enter_context(file_lock(key, timeout=1.0))
+                break
+            except TimeoutError:
+                raise_if_cancelled()
+                if _is_fresh(path, max_age):
+                    break
+                if time.time() >= deadline:
+                    logger.warning(f"⏳ Waited {wait_seconds:g}s for a concurrent download of {path}, fetching it here")
+                    break
+
+        if _is_fresh(path, max_age):
+            logger.info(f"🔗 Using {cache} file downloaded by a concurrent request: {path}")
+            record_cache(cache, hit=True)
+            return path
+
+        record_cache(cache, hit=False)
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix='.part', dir=directory)
+        os.close(fd)
+        try:
+            if not fill(temp_path):
+                return None
+            os.replace(temp_path, path)
+            temp_path = None
+            return path
+        finally:
+            if temp_path:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
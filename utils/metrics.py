@@ -0,0 +1,218 @@
+"""
+Prometheus metrics
+
+Request and pipeline stage latencies, DEM cache hits and misses,
+WhiteboxTools queueing, database connection waits and the latency of the
+external services we call, exposed in Prometheus text format at /metrics.
+
+Under gunicorn every worker writes its samples to PROMETHEUS_MULTIPROC_DIR
+(set up by gunicorn.conf.py) and /metrics aggregates all workers, whichever
+one serves the scrape. Without the directory (python server.py) the
+process' own registry is served. If prometheus_client is not installed the
+metrics are no-ops and /metrics answers 503.
+"""
+import time
+import logging
+from contextlib import contextmanager
+from typing import Optional
+
+from utils.config import METRICS_MULTIPROC_DIR
+
+try:
+    from prometheus_client import (
+        CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, REGISTRY, generate_latest, multiprocess
+    )
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets (seconds) spanning tile requests to full analyses
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+class _NullMetric:
+    """Stand-in used when prometheus_client is missing"""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+
+def _histogram(name: str, documentation: str, labels, buckets=LATENCY_BUCKETS):
+    if not PROMETHEUS_AVAILABLE:
+        return _NullMetric()
+    return Histogram(name, documentation, labels, buckets=buckets)
+
+
+def _counter(name: str, documentation: str, labels):
+    if not PROMETHEUS_AVAILABLE:
+        return _NullMetric()
+    return Counter(name, documentation, labels)
+
+
+def _gauge(name: str, documentation: str, labels):
+    if not PROMETHEUS_AVAILABLE:
+        return _NullMetric()
+    # Live workers' values are summed; exited workers drop out
+    return Gauge(name, documentation, labels, multiprocess_mode='livesum')
+
+
+HTTP_REQUEST_SECONDS = _histogram(
+    'earthbenders_http_request_duration_seconds', 'Time to build the response of a route',
+    ['method', 'endpoint', 'status']
+)
+STAGE_SECONDS = _histogram(
+    'earthbenders_stage_duration_seconds', 'Duration of analysis stages (fetch, merge, clip, derivatives, ...)',
+    ['stage', 'data_source', 'status']
+)
+CACHE_REQUESTS = _counter(
+    'earthbenders_cache_requests_total', 'DEM cache lookups by cache and result (hit or miss)',
+    ['cache', 'result']
+)
+WBT_QUEUE_DEPTH = _gauge(
+    'earthbenders_wbt_queue_depth', 'WhiteboxTools invocations waiting for a slot',
+    ['lane']
+)
+WBT_SLOTS_IN_USE = _gauge(
+    'earthbenders_wbt_slots_in_use', 'WhiteboxTools slots held',
+    ['lane']
+)
+WBT_WAIT_SECONDS = _histogram(
+    'earthbenders_wbt_wait_seconds', 'Time spent waiting for a WhiteboxTools slot',
+    ['lane']
+)
+DB_CONNECT_SECONDS = _histogram(
+    'earthbenders_db_connection_wait_seconds', 'Time to obtain a database connection',
+    ['database', 'status']
+)
+UPSTREAM_SECONDS = _histogram(
+    'earthbenders_upstream_request_duration_seconds', 'Latency of outbound HTTP calls by upstream service',
+    ['upstream', 'status']
+)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    """
+    Count a DEM cache lookup
+
+    Args:
+        cache: 'srtm', 'lidar' or 'usgs'
+        hit: True if the data was served from the cache
+    """
+    CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def observe_stage(stage: str, data_source: Optional[str], status: str, seconds: float) -> None:
+    """Record the duration of an analysis stage"""
+    STAGE_SECONDS.labels(stage, data_source or 'none', status).observe(seconds)
+
+
+class UpstreamCall:
+    """Outcome of an outbound call; set status to the HTTP status code"""
+
+    def __init__(self):
+        self.status = None
+
+
+@contextmanager
+def upstream_call(upstream: str):
+    """
+    Time an outbound HTTP call
+
+    Args:
+        upstream: Service name ('open-meteo', 'soilgrids', 'arcgis', 'wms', ...)
+
+    Yields:
+        UpstreamCall: Set its status to the response status code
+    """
+    call = UpstreamCall()
+    start = time.perf_counter()
+    try:
+        yield call
+    except Exception:
+        call.status = 'error'
+        raise
+    finally:
+        if isinstance(call.status, int):
+            status = f"{call.status // 100}xx"
+        else:
+            status = call.status or 'ok'
+        UPSTREAM_SECONDS.labels(upstream, status).observe(time.perf_counter() - start)
+
+
+@contextmanager
+def db_connection_wait(database: str):
+    """
+    Time the opening of a database connection
+
+    Args:
+        database: 'postgres' (application database) or 'job_queue'
+    """
+    start = time.perf_counter()
+    status = 'ok'
+    try:
+        yield
+    except Exception:
+        status = 'error'
+        raise
+    finally:
+        DB_CONNECT_SECONDS.labels(database, status).observe(time.perf_counter() - start)
+
+
+def _registry():
+    """Registry aggregating all workers, or this process' registry"""
+    if METRICS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def register_metrics(app) -> None:
+    """
+    Time every request and serve GET /metrics
+
+    Args:
+        app: Flask application instance
+    """
+    from flask import Response, g, request
+    from utils.cors import jsonify_with_cors
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None and request.path != '/metrics':
+            # The route pattern, not the raw path, keeps the label set bounded
+            endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            HTTP_REQUEST_SECONDS.labels(request.method, endpoint, str(response.status_code)).observe(
+                time.perf_counter() - start
+            )
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Prometheus scrape endpoint (all gunicorn workers aggregated)"""
+        if not PROMETHEUS_AVAILABLE:
+            return jsonify_with_cors({'error': 'prometheus_client is not installed'}), 503
+        try:
+            return Response(generate_latest(_registry()), mimetype=CONTENT_TYPE_LATEST)
+        except Exception as e:
+            logger.error(f"Error collecting metrics: {str(e)}", exc_info=True)
+            return jsonify_with_cors({'error': str(e)}), 500
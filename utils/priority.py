@@ -0,0 +1,108 @@
+"""
+Priority lanes
+
+Work is tagged with a lane: 'interactive' for single-layer recomputes a user
+is waiting on, 'bulk' for full multi-layer analyses and LiDAR/USGS merges.
+Lanes are listed from highest to lowest priority. The current lane travels
+in a context variable (like the cancellation token), so pipeline threads and
+WhiteboxTools calls see the lane of the request or job they serve.
+
+Requests declare their lane with a 'lane' field in the JSON body; otherwise
+the multi-layer endpoints in BULK_ENDPOINTS run as bulk and everything else
+as interactive.
+"""
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+
+# Highest priority first
+LANES = (INTERACTIVE, BULK)
+
+# Request paths that run as bulk unless the request declares a lane
+BULK_ENDPOINTS = {'/process_polygon', '/api/lidar/process', '/api/usgs-dem/process', '/api/batch/process'}
+
+_current_lane: ContextVar[str] = ContextVar('priority_lane', default=INTERACTIVE)
+
+
+def lane_rank(lane: str) -> int:
+    """Position of a lane in priority order (0 is served first)"""
+    return LANES.index(lane)
+
+
+def resolve_lane(requested: Optional[str], default: str) -> str:
+    """
+    Validate a declared lane
+
+    Args:
+        requested: Lane named by the caller (None or empty for the default)
+        default: Lane used when none is declared
+
+    Returns:
+        str: The lane
+
+    Raises:
+        ValueError: If the lane is unknown
+    """
+    if not requested:
+        return default
+    lane = str(requested).strip().lower()
+    if lane not in LANES:
+        raise ValueError(f"Unknown lane '{requested}' (expected one of: {', '.join(LANES)})")
+    return lane
+
+
+def current_lane() -> str:
+    """Lane of the request or job running in this context"""
+    return _current_lane.get()
+
+
+@contextmanager
+def lane_scope(lane: str):
+    """
+    Run the enclosed work in a lane
+
+    Args:
+        lane: One of LANES
+    """
+    token = _current_lane.set(resolve_lane(lane, INTERACTIVE))
+    try:
+        yield lane
+    finally:
+        _current_lane.reset(token)
+
+
+def register_request_lanes(app) -> None:
+    """
+    Run every request in the lane it declares (or its endpoint's default)
+
+    Args:
+        app: Flask application instance
+    """
+    from flask import g, request
+    from utils.cors import jsonify_with_cors
+
+    @app.before_request
+    def enter_request_lane():
+        data = request.get_json(silent=True) if request.is_json else None
+        default = BULK if request.path in BULK_ENDPOINTS else INTERACTIVE
+        try:
+            lane = resolve_lane(data.get('lane') if isinstance(data, dict) else None, default)
+        except ValueError as e:
+            return jsonify_with_cors({'error': str(e)}), 400
+        g.priority_lane_token = _current_lane.set(lane)
+
+    @app.teardown_request
+    def leave_request_lane(exc=None):
+        token = g.pop('priority_lane_token', None)
+        if token is not None:
+            try:
+                _current_lane.reset(token)
+            except ValueError:
+                # Reset from another context (e.g. a streamed response)
+                _current_lane.set(INTERACTIVE)
@@ -0,0 +1,500 @@
+"""
+Opt-in sampling profiler for single requests and the jobs they queue
+
+A request sent with 'X-Profile: 1' (or ?profile=1) and the admin token is
+profiled: a sampler thread reads the Python stack of every thread taking
+part in the request every PROFILE_INTERVAL_MS, and when the request ends
+the samples are written to PROFILE_DIRECTORY/<profile id> as speedscope JSON
+(open in https://www.speedscope.app) and as collapsed stacks (for
+flamegraph.pl). The profile id is returned in the X-Profile-Id header.
+
+The profile session travels in a context variable like the cancellation
+token: pipeline stage threads join it through profile_thread(), and jobs
+queued while it is active carry its id, so the executor profiles them into
+the same directory ('job-<id>' parts next to the 'request' part). Samples
+are wall-clock: a thread waiting on WhiteboxTools or a lock shows where it
+waits; work inside subprocesses is not sampled.
+
+Nothing runs unless a request asks for it: without an active session the
+hooks only check a header or a context variable, and the sampler thread
+exits as soon as no thread is attached.
+"""
+import os
+import sys
+import hmac
+import json
+import time
+import uuid
+import shutil
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.config import (
+    PROFILE_ADMIN_TOKEN, PROFILE_DIRECTORY, PROFILE_INTERVAL_MS, PROFILE_MAX_SECONDS, PROFILE_MAX_COUNT
+)
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+ADMIN_TOKEN_HEADER = 'X-Admin-Token'
+
+# Deepest stack recorded per sample
+MAX_STACK_DEPTH = 256
+
+# Profile ids and part names as written to disk
+_SAFE_CHARS = set('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_.')
+
+
+def is_safe_name(name: str) -> bool:
+    """Whether a profile id or file name can be used as a path component"""
+    return bool(name) and not name.startswith('.') and set(name) <= _SAFE_CHARS
+
+
+def new_profile_id() -> str:
+    """Sortable unique profile id, e.g. 20240501-120000-1a2b3c4d"""
+    return f"{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+def _atomic_write(path: str, content: str) -> None:
+    """Write a text file through a temporary file in the same directory"""
+    directory = os.path.dirname(path)
+    fd, temp_path = tempfile.mkstemp(prefix='.profile.', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class ProfileSession:
+    """Samples of one profiled request or job"""
+
+    def __init__(self, profile_id: str, part: str, meta: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            profile_id: Directory the profile is written to
+            part: File name prefix inside it ('request', 'job-<id>-<attempt>')
+            meta: Fields stored in the part's metadata (path, job kind, ...)
+        """
+        self.profile_id = profile_id
+        self.part = ''.join(char if char in _SAFE_CHARS else '_' for char in part)
+        self.meta = dict(meta or {})
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        # Frame (name, file, line) -> index in self._frames
+        self._frame_index: Dict[Tuple[str, str, int], int] = {}
+        self._frames: List[Tuple[str, str, int]] = []
+        # Thread id -> time-ordered [stack, seconds] runs of identical samples
+        self._samples: Dict[int, List[list]] = {}
+        self._thread_names: Dict[int, str] = {}
+        self.sample_count = 0
+        self.truncated = False
+
+    def name_thread(self, ident: int, name: str) -> None:
+        """Remember the name of a thread taking part in the session"""
+        with self._lock:
+            self._thread_names.setdefault(ident, name)
+
+    def add_sample(self, ident: int, frame, seconds: float) -> None:
+        """
+        Record the stack of a thread
+
+        Args:
+            ident: Thread identifier
+            frame: Innermost frame of the thread
+            seconds: Time the sample stands for (the sampling interval)
+        """
+        if time.perf_counter() - self._start > PROFILE_MAX_SECONDS:
+            self.truncated = True
+            return
+
+        with self._lock:
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                key = (code.co_name, code.co_filename, code.co_firstlineno)
+                index = self._frame_index.get(key)
+                if index is None:
+                    index = self._frame_index[key] = len(self._frames)
+                    self._frames.append(key)
+                stack.append(index)
+                frame = frame.f_back
+            stack.reverse()
+            stack = tuple(stack)
+
+            runs = self._samples.setdefault(ident, [])
+            if runs and runs[-1][0] == stack:
+                runs[-1][1] += seconds
+            else:
+                runs.append([stack, seconds])
+            self.sample_count += 1
+
+    def _thread_label(self, ident: int) -> str:
+        return f"{self._thread_names.get(ident, 'thread')} ({ident})"
+
+    def speedscope(self) -> Dict[str, Any]:
+        """The samples as a speedscope file (one sampled profile per thread)"""
+        with self._lock:
+            samples = {ident: [list(run) for run in runs] for ident, runs in self._samples.items()}
+            frames = list(self._frames)
+
+        profiles = []
+        for ident, runs in samples.items():
+            total = sum(seconds for _, seconds in runs)
+            profiles.append({
+                'type': 'sampled',
+                'name': self._thread_label(ident),
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': round(total, 6),
+                'samples': [list(stack) for stack, _ in runs],
+                'weights': [round(seconds, 6) for _, seconds in runs]
+            })
+
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': f"{self.profile_id} {self.part}",
+            'exporter': 'earthbenders',
+            'activeProfileIndex': 0,
+            'shared': {'frames': [{'name': name, 'file': file, 'line': line} for name, file, line in frames]},
+            'profiles': profiles
+        }
+
+    def collapsed(self) -> str:
+        """The samples as collapsed stacks ('thread;outer;inner <milliseconds>' per line)"""
+        with self._lock:
+            samples = {ident: [list(run) for run in runs] for ident, runs in self._samples.items()}
+            frames = list(self._frames)
+
+        labels = [f"{name} ({os.path.basename(file)}:{line})".replace(';', ':') for name, file, line in frames]
+        totals: Dict[str, float] = {}
+        for ident, runs in samples.items():
+            thread = self._thread_label(ident).replace(';', ':').replace(' ', '_')
+            for stack, seconds in runs:
+                line = ';'.join([thread] + [labels[index] for index in stack])
+                totals[line] = totals.get(line, 0.0) + seconds
+        return ''.join(f"{line} {max(1, round(seconds * 1000))}\n" for line, seconds in sorted(totals.items()))
+
+    def write(self) -> Optional[str]:
+        """
+        Write the part's speedscope, collapsed stacks and metadata files
+
+        Returns:
+            str: The profile directory, or None if writing failed
+        """
+        directory = os.path.join(PROFILE_DIRECTORY, self.profile_id)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            meta = dict(self.meta)
+            meta.update({
+                'profile_id': self.profile_id,
+                'part': self.part,
+                'started_at': self.started_at.isoformat(),
+                'wall_seconds': round(time.perf_counter() - self._start, 3),
+                'interval_ms': PROFILE_INTERVAL_MS,
+                'samples': self.sample_count,
+                'threads': len(self._samples),
+                'truncated': self.truncated,
+                'pid': os.getpid()
+            })
+            _atomic_write(os.path.join(directory, f"{self.part}.speedscope.json"), json.dumps(self.speedscope()))
+            _atomic_write(os.path.join(directory, f"{self.part}.collapsed"), self.collapsed())
+            _atomic_write(os.path.join(directory, f"{self.part}.meta.json"), json.dumps(meta, indent=2, default=str))
+            logger.info(f"🔬 Profile {self.profile_id}/{self.part} written: {self.sample_count} samples "
+                        f"over {meta['wall_seconds']:.1f}s")
+            prune_profiles()
+            return directory
+        except Exception as e:
+            logger.error(f"Failed to write profile {self.profile_id}/{self.part}: {str(e)}", exc_info=True)
+            return None
+
+
+class Sampler:
+    """Background thread sampling the stacks of attached threads"""
+
+    def __init__(self, interval_seconds: float):
+        """
+        Args:
+            interval_seconds: Time between samples
+        """
+        self.interval = interval_seconds
+        self._lock = threading.Lock()
+        # Thread id -> [session, attach count]
+        self._attached: Dict[int, list] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def attach(self, session: ProfileSession) -> None:
+        """Sample the calling thread into a session until detach()"""
+        ident = threading.get_ident()
+        session.name_thread(ident, threading.current_thread().name)
+        with self._lock:
+            entry = self._attached.get(ident)
+            if entry is not None and entry[0] is session:
+                entry[1] += 1
+            else:
+                self._attached[ident] = [session, 1]
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='profile-sampler', daemon=True)
+                self._thread.start()
+
+    def detach(self, session: ProfileSession) -> None:
+        """Stop sampling the calling thread (after the matching attach)"""
+        ident = threading.get_ident()
+        with self._lock:
+            entry = self._attached.get(ident)
+            if entry is None or entry[0] is not session:
+                return
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._attached[ident]
+
+    def _loop(self) -> None:
+        last = time.perf_counter()
+        while True:
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            with self._lock:
+                if not self._attached:
+                    self._thread = None
+                    return
+                attached = [(ident, entry[0]) for ident, entry in self._attached.items()]
+
+            frames = sys._current_frames()
+            for ident, session in attached:
+                frame = frames.get(ident)
+                if frame is not None:
+                    try:
+                        session.add_sample(ident, frame, elapsed)
+                    except Exception as e:
+                        logger.debug(f"Profile sample failed: {str(e)}")
+            del frames
+
+
+# One sampler per worker process
+sampler = Sampler(PROFILE_INTERVAL_MS / 1000.0)
+
+_current_session: ContextVar[Optional[ProfileSession]] = ContextVar('profile_session', default=None)
+
+
+def current_profile_id() -> Optional[str]:
+    """Id of the profile the current request or job is recorded into, if any"""
+    session = _current_session.get()
+    return session.profile_id if session is not None else None
+
+
+def start_session(profile_id: str, part: str, **meta) -> Tuple[ProfileSession, Any]:
+    """
+    Start profiling the calling thread (see profiling() for a with block)
+
+    Returns:
+        tuple: (session, context token for finish_session)
+    """
+    session = ProfileSession(profile_id, part, meta)
+    token = _current_session.set(session)
+    sampler.attach(session)
+    return session, token
+
+
+def finish_session(session: ProfileSession, token: Any = None, error: Optional[BaseException] = None) -> None:
+    """Stop sampling the calling thread and write the session's files"""
+    sampler.detach(session)
+    if token is not None:
+        try:
+            _current_session.reset(token)
+        except ValueError:
+            # Reset from another context (e.g. a streamed response)
+            _current_session.set(None)
+    if error is not None:
+        session.meta['error'] = str(error)[:500]
+    session.write()
+
+
+@contextmanager
+def profiling(profile_id: Optional[str], part: str, **meta):
+    """
+    Profile the enclosed block into PROFILE_DIRECTORY/<profile_id>
+
+    Args:
+        profile_id: Profile to record into; when empty nothing is profiled
+        part: File name prefix of this block's samples
+        **meta: Fields stored in the part's metadata
+
+    Yields:
+        ProfileSession: The session, or None when not profiling
+    """
+    if not profile_id:
+        yield None
+        return
+
+    session, token = start_session(profile_id, part, **meta)
+    error = None
+    try:
+        yield session
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        finish_session(session, token, error)
+
+
+@contextmanager
+def profile_thread():
+    """Include the calling thread in the current context's profile, if any"""
+    session = _current_session.get()
+    if session is None:
+        yield
+        return
+
+    sampler.attach(session)
+    try:
+        yield
+    finally:
+        sampler.detach(session)
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """
+    Stored profiles, newest first
+
+    Returns:
+        list: Per profile its 'profile_id', 'parts' (metadata of each part)
+        and 'files'
+    """
+    profiles = []
+    try:
+        names = sorted(os.listdir(PROFILE_DIRECTORY), reverse=True)
+    except FileNotFoundError:
+        return profiles
+
+    for name in names:
+        profile = get_profile(name)
+        if profile is not None:
+            profiles.append(profile)
+    return profiles
+
+
+def get_profile(profile_id: str) -> Optional[Dict[str, Any]]:
+    """Metadata and file names of one profile, or None if it does not exist"""
+    if not is_safe_name(profile_id):
+        return None
+    directory = os.path.join(PROFILE_DIRECTORY, profile_id)
+    if not os.path.isdir(directory):
+        return None
+
+    parts = []
+    files = []
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.startswith('.'):
+            continue
+        files.append(file_name)
+        if file_name.endswith('.meta.json'):
+            try:
+                with open(os.path.join(directory, file_name), 'r') as f:
+                    parts.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return {'profile_id': profile_id, 'parts': parts, 'files': files}
+
+
+def profile_file_path(profile_id: str, file_name: str) -> Optional[str]:
+    """Path of a file of a stored profile, or None if the names are invalid or missing"""
+    if not is_safe_name(profile_id) or not is_safe_name(file_name):
+        return None
+    path = os.path.join(PROFILE_DIRECTORY, profile_id, file_name)
+    return path if os.path.isfile(path) else None
+
+
+def delete_profile(profile_id: str) -> bool:
+    """Delete a stored profile; returns False if it does not exist"""
+    if get_profile(profile_id) is None:
+        return False
+    shutil.rmtree(os.path.join(PROFILE_DIRECTORY, profile_id), ignore_errors=True)
+    return True
+
+
+def prune_profiles() -> int:
+    """
+    Delete the oldest profiles beyond PROFILE_MAX_COUNT
+
+    Returns:
+        int: Number of profiles removed
+    """
+    try:
+        names = sorted(name for name in os.listdir(PROFILE_DIRECTORY) if is_safe_name(name))
+    except FileNotFoundError:
+        return 0
+
+    excess = names[:max(0, len(names) - PROFILE_MAX_COUNT)]
+    for name in excess:
+        shutil.rmtree(os.path.join(PROFILE_DIRECTORY, name), ignore_errors=True)
+    return len(excess)
+
+
+def is_admin(request) -> bool:
+    """
+    Whether a request carries the profiling admin token
+
+    Only the X-Admin-Token header is accepted: a query parameter would end
+    up in the access and proxy logs.
+    """
+    if not PROFILE_ADMIN_TOKEN:
+        return False
+    supplied = request.headers.get(ADMIN_TOKEN_HEADER) or ''
+    return hmac.compare_digest(supplied.encode('utf-8'), PROFILE_ADMIN_TOKEN.encode('utf-8'))
+
+
+def _profile_requested(request) -> bool:
+    flag = request.headers.get(PROFILE_HEADER) or request.args.get('profile')
+    return bool(flag) and flag.strip().lower() not in ('0', 'false', 'no', 'off')
+
+
+def register_profiling(app) -> None:
+    """
+    Profile requests that ask for it
+
+    Args:
+        app: Flask application instance
+    """
+    from flask import g, request
+    from utils.cors import jsonify_with_cors
+
+    @app.before_request
+    def start_request_profile():
+        if not _profile_requested(request):
+            return None
+        if not PROFILE_ADMIN_TOKEN:
+            logger.warning(f"Ignoring profile request for {request.path}: PROFILE_ADMIN_TOKEN is not set")
+            return None
+        if not is_admin(request):
+            return jsonify_with_cors({'error': 'Profiling requires a valid admin token'}), 403
+
+        profile_id = new_profile_id()
+        g.profile_session, g.profile_token = start_session(
+            profile_id, 'request', method=request.method, path=request.path,
+            endpoint=request.url_rule.rule if request.url_rule is not None else None
+        )
+        logger.info(f"🔬 Profiling {request.method} {request.path} as {profile_id}")
+
+    @app.after_request
+    def add_profile_header(response):
+        session = g.get('profile_session')
+        if session is not None:
+            session.meta['status_code'] = response.status_code
+            response.headers[PROFILE_ID_HEADER] = session.profile_id
+        return response
+
+    @app.teardown_request
+    def finish_request_profile(exc=None):
+        session = g.pop('profile_session', None)
+        if session is not None:
+            finish_session(session, g.pop('profile_token', None), exc)